@@ -49,6 +49,9 @@ from twisted.internet import protocol, task
 from twisted.protocols import amp
 
 from twistedcaldav.config import config
+from twistedcaldav.util import LRUCache
+
+from txdav.common.datastore.sql import SQLStatementStats
 
 log = Logger()
 
@@ -69,6 +72,8 @@ class CommonAccessLoggingObserverExtensions(BaseCommonAccessLoggingObserver):
     A base class for our extension to the L{BaseCommonAccessLoggingObserver}
     """
 
+    systemStats = None
+
     def emit(self, eventDict):
 
         format = None
@@ -230,8 +235,165 @@ class CommonAccessLoggingObserverExtensions(BaseCommonAccessLoggingObserver):
 
             formatArgs["type"] = "access-log"
             formatArgs["log-format"] = format
+
+            # Send this process's in-memory cache activity along with the request stats
+            if config.Stats.EnableUnixStatsSocket or config.Stats.EnableTCPStatsSocket:
+                caches = LRUCache.countsSinceLastReport()
+                if caches:
+                    formatArgs["caches"] = caches
+                statements = SQLStatementStats.countsSinceLastReport(config.Stats.SQLStatementsReported)
+                if statements:
+                    formatArgs["sql"] = statements
             self.logStats(formatArgs)
 
+    def cpuUse(self):
+        """
+        The current system CPU use, or zero in processes that do not run a
+        L{SystemMonitor}.
+
+        @rtype: C{float}
+        """
+        return self.systemStats.items["cpu use"] if self.systemStats is not None else 0.0
+
+    def initStats(self):
+
+        def initTimeHistogram():
+            return {
+                "<10ms": 0,
+                "10ms<->100ms": 0,
+                "100ms<->1s": 0,
+                "1s<->10s": 0,
+                "10s<->30s": 0,
+                "30s<->60s": 0,
+                ">60s": 0,
+                "Over 1s": 0,
+                "Over 10s": 0,
+            }
+
+        return {
+            "requests": 0,
+            "method": collections.defaultdict(int),
+            "method-t": collections.defaultdict(float),
+            "500": 0,
+            "401": 0,
+            "t": 0.0,
+            "t-resp-wr": 0.0,
+            "slots": 0,
+            "max-slots": 0,
+            "T": initTimeHistogram(),
+            "T-RESP-WR": initTimeHistogram(),
+            "T-MAX": 0.0,
+            "cpu": self.cpuUse(),
+            "caches": collections.defaultdict(lambda: collections.defaultdict(int)),
+            "sql": {},
+        }
+
+    def updateStats(self, current, stats):
+        # Gather specific information and aggregate into our persistent stats
+        adjustedMethod = getAdjustedMethodName(stats)
+
+        if current["requests"] == 0:
+            current["cpu"] = 0.0
+        current["requests"] += 1
+        current["method"][adjustedMethod] += 1
+        current["method-t"][adjustedMethod] += stats.get("t", 0.0)
+        if stats["statusCode"] >= 500:
+            current["500"] += 1
+        elif stats["statusCode"] == 401:
+            current["401"] += 1
+        current["t"] += stats.get("t", 0.0)
+        current["t-resp-wr"] += stats.get("t-resp-wr", 0.0)
+        current["slots"] += stats.get("outstandingRequests", 0)
+        current["max-slots"] = max(current["max-slots"], self.limiter.maxOutstandingRequests if hasattr(self, "limiter") else 0)
+        current["cpu"] += self.cpuUse()
+        for name, counts in stats.get("caches", {}).items():
+            for count, value in counts.items():
+                if count == "memory":
+                    # Memory in use is a level, not a count - keep the highest seen
+                    current["caches"][name][count] = max(current["caches"][name][count], value)
+                else:
+                    current["caches"][name][count] += value
+        SQLStatementStats.merge(current["sql"], stats.get("sql", {}))
+
+        def histogramUpdate(t, key):
+            if t >= 60000.0:
+                current[key][">60s"] += 1
+            elif t >= 30000.0:
+                current[key]["30s<->60s"] += 1
+            elif t >= 10000.0:
+                current[key]["10s<->30s"] += 1
+            elif t >= 1000.0:
+                current[key]["1s<->10s"] += 1
+            elif t >= 100.0:
+                current[key]["100ms<->1s"] += 1
+            elif t >= 10.0:
+                current[key]["10ms<->100ms"] += 1
+            else:
+                current[key]["<10ms"] += 1
+            if t >= 1000.0:
+                current[key]["Over 1s"] += 1
+            elif t >= 10000.0:
+                current[key]["Over 10s"] += 1
+
+        t = stats.get("t", None)
+        if t is not None:
+            histogramUpdate(t, "T")
+        current["T-MAX"] = max(current["T-MAX"], t)
+        t = stats.get("t-resp-wr", None)
+        if t is not None:
+            histogramUpdate(t, "T-RESP-WR")
+
+    def mergeStats(self, current, stats):
+        # Gather specific information and aggregate into our persistent stats
+        if current["requests"] == 0:
+            current["cpu"] = 0.0
+        current["requests"] += stats["requests"]
+        for method in stats["method"].keys():
+            current["method"][method] += stats["method"][method]
+        for method in stats["method-t"].keys():
+            current["method-t"][method] += stats["method-t"][method]
+        current["500"] += stats["500"]
+        current["401"] += stats["401"]
+        current["t"] += stats["t"]
+        current["t-resp-wr"] += stats["t-resp-wr"]
+        current["slots"] += stats["slots"]
+        current["max-slots"] = max(current["max-slots"], stats["max-slots"])
+        current["cpu"] += stats["cpu"]
+        for name, counts in stats["caches"].items():
+            for count, value in counts.items():
+                if count == "memory":
+                    # Memory in use is a level, not a count - keep the highest seen
+                    current["caches"][name][count] = max(current["caches"][name][count], value)
+                else:
+                    current["caches"][name][count] += value
+        SQLStatementStats.merge(current["sql"], stats.get("sql", {}))
+
+        def histogramUpdate(t, key):
+            if t >= 60000.0:
+                current[key][">60s"] += 1
+            elif t >= 30000.0:
+                current[key]["30s<->60s"] += 1
+            elif t >= 10000.0:
+                current[key]["10s<->30s"] += 1
+            elif t >= 1000.0:
+                current[key]["1s<->10s"] += 1
+            elif t >= 100.0:
+                current[key]["100ms<->1s"] += 1
+            elif t >= 10.0:
+                current[key]["10ms<->100ms"] += 1
+            else:
+                current[key]["<10ms"] += 1
+            if t >= 1000.0:
+                current[key]["Over 1s"] += 1
+            elif t >= 10000.0:
+                current[key]["Over 10s"] += 1
+
+        for bin in stats["T"].keys():
+            current["T"][bin] += stats["T"][bin]
+        current["T-MAX"] = max(current["T-MAX"], stats["T-MAX"])
+        for bin in stats["T-RESP-WR"].keys():
+            current["T-RESP-WR"][bin] += stats["T-RESP-WR"][bin]
+
 
 class RotatingFileAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
     """
@@ -383,6 +545,35 @@ class RotatingFileAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
         if stats["type"] == "access-log":
             self.accessLog(stats["log-format"] % stats)
 
+    def logStatsBatch(self, stats, lines):
+        """
+        Merge stats aggregated by a worker into the current stats, and write
+        the worker's access log lines.
+
+        @param stats: the aggregated stats, or C{None} if the worker did not
+            collect any
+        @type stats: C{dict}
+        @param lines: the access log lines
+        @type lines: C{list} of C{str}
+        """
+
+        if config.Stats.EnableUnixStatsSocket or config.Stats.EnableTCPStatsSocket:
+
+            # Initialize a L{SystemMonitor} on the first call
+            if self.systemStats is None:
+                self.systemStats = SystemMonitor()
+
+            if stats is not None and stats["requests"]:
+                # The worker has no system monitor or limiter, so account for
+                # those here as L{updateStats} would have for each request
+                stats["cpu"] = self.cpuUse() * stats["requests"]
+                if hasattr(self, "limiter"):
+                    stats["max-slots"] = max(stats["max-slots"], self.limiter.maxOutstandingRequests)
+                self.mergeStats(self.ensureSequentialStats(), stats)
+
+        for line in lines:
+            self.accessLog(line)
+
     def getStats(self):
         """
         Return the stats
@@ -467,127 +658,6 @@ class RotatingFileAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
 
         return self.statsByMinute[-1][1]
 
-    def initStats(self):
-
-        def initTimeHistogram():
-            return {
-                "<10ms": 0,
-                "10ms<->100ms": 0,
-                "100ms<->1s": 0,
-                "1s<->10s": 0,
-                "10s<->30s": 0,
-                "30s<->60s": 0,
-                ">60s": 0,
-                "Over 1s": 0,
-                "Over 10s": 0,
-            }
-
-        return {
-            "requests": 0,
-            "method": collections.defaultdict(int),
-            "method-t": collections.defaultdict(float),
-            "500": 0,
-            "401": 0,
-            "t": 0.0,
-            "t-resp-wr": 0.0,
-            "slots": 0,
-            "max-slots": 0,
-            "T": initTimeHistogram(),
-            "T-RESP-WR": initTimeHistogram(),
-            "T-MAX": 0.0,
-            "cpu": self.systemStats.items["cpu use"],
-        }
-
-    def updateStats(self, current, stats):
-        # Gather specific information and aggregate into our persistent stats
-        adjustedMethod = getAdjustedMethodName(stats)
-
-        if current["requests"] == 0:
-            current["cpu"] = 0.0
-        current["requests"] += 1
-        current["method"][adjustedMethod] += 1
-        current["method-t"][adjustedMethod] += stats.get("t", 0.0)
-        if stats["statusCode"] >= 500:
-            current["500"] += 1
-        elif stats["statusCode"] == 401:
-            current["401"] += 1
-        current["t"] += stats.get("t", 0.0)
-        current["t-resp-wr"] += stats.get("t-resp-wr", 0.0)
-        current["slots"] += stats.get("outstandingRequests", 0)
-        current["max-slots"] = max(current["max-slots"], self.limiter.maxOutstandingRequests if hasattr(self, "limiter") else 0)
-        current["cpu"] += self.systemStats.items["cpu use"]
-
-        def histogramUpdate(t, key):
-            if t >= 60000.0:
-                current[key][">60s"] += 1
-            elif t >= 30000.0:
-                current[key]["30s<->60s"] += 1
-            elif t >= 10000.0:
-                current[key]["10s<->30s"] += 1
-            elif t >= 1000.0:
-                current[key]["1s<->10s"] += 1
-            elif t >= 100.0:
-                current[key]["100ms<->1s"] += 1
-            elif t >= 10.0:
-                current[key]["10ms<->100ms"] += 1
-            else:
-                current[key]["<10ms"] += 1
-            if t >= 1000.0:
-                current[key]["Over 1s"] += 1
-            elif t >= 10000.0:
-                current[key]["Over 10s"] += 1
-
-        t = stats.get("t", None)
-        if t is not None:
-            histogramUpdate(t, "T")
-        current["T-MAX"] = max(current["T-MAX"], t)
-        t = stats.get("t-resp-wr", None)
-        if t is not None:
-            histogramUpdate(t, "T-RESP-WR")
-
-    def mergeStats(self, current, stats):
-        # Gather specific information and aggregate into our persistent stats
-        if current["requests"] == 0:
-            current["cpu"] = 0.0
-        current["requests"] += stats["requests"]
-        for method in stats["method"].keys():
-            current["method"][method] += stats["method"][method]
-        for method in stats["method-t"].keys():
-            current["method-t"][method] += stats["method-t"][method]
-        current["500"] += stats["500"]
-        current["401"] += stats["401"]
-        current["t"] += stats["t"]
-        current["t-resp-wr"] += stats["t-resp-wr"]
-        current["slots"] += stats["slots"]
-        current["max-slots"] = max(current["max-slots"], stats["max-slots"])
-        current["cpu"] += stats["cpu"]
-
-        def histogramUpdate(t, key):
-            if t >= 60000.0:
-                current[key][">60s"] += 1
-            elif t >= 30000.0:
-                current[key]["30s<->60s"] += 1
-            elif t >= 10000.0:
-                current[key]["10s<->30s"] += 1
-            elif t >= 1000.0:
-                current[key]["1s<->10s"] += 1
-            elif t >= 100.0:
-                current[key]["100ms<->1s"] += 1
-            elif t >= 10.0:
-                current[key]["10ms<->100ms"] += 1
-            else:
-                current[key]["<10ms"] += 1
-            if t >= 1000.0:
-                current[key]["Over 1s"] += 1
-            elif t >= 10000.0:
-                current[key]["Over 10s"] += 1
-
-        for bin in stats["T"].keys():
-            current["T"][bin] += stats["T"][bin]
-        current["T-MAX"] = max(current["T-MAX"], stats["T-MAX"])
-        for bin in stats["T-RESP-WR"].keys():
-            current["T-RESP-WR"][bin] += stats["T-RESP-WR"][bin]
-
 
 class SystemMonitor(object):
     """
@@ -644,15 +714,61 @@ class LogStats(amp.Command):
     arguments = [("message", amp.String())]
 
 
+class LogStatsBatch(amp.Command):
+    """
+    Stats pre-aggregated by a worker over a batch interval, in the structure
+    defined by L{CommonAccessLoggingObserverExtensions.initStats}, along with
+    the access log lines for the requests in the batch.
+    """
+    arguments = [
+        ("stats", amp.String(optional=True)),
+        ("lines", amp.ListOf(amp.String())),
+    ]
+
+
 class AMPCommonAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
+    """
+    Sends access log lines and stats from a worker to the master. When a batch
+    interval is configured, stats are aggregated in the worker and sent along
+    with the log lines in one L{LogStatsBatch} call per interval, rather than
+    one L{LogStats} call per request.
+    """
 
-    def __init__(self):
+    # Keep each batch of lines well inside the AMP value size limit, allowing
+    # for the two byte length prefix of each line
+    maxBatchBytes = 60000
+
+    def __init__(self, batchInterval=None, reactor=None):
+        """
+        @param batchInterval: seconds to aggregate stats and log lines for
+            before sending them, or zero to send each request as it completes.
+            Defaults to the configured value.
+        @type batchInterval: C{float}
+        @param reactor: the reactor used to schedule sending a batch
+        @type reactor: L{IReactorTime}
+        """
         self.protocol = None
         self._buffer = []
 
+        self.batchInterval = batchInterval if batchInterval is not None else config.Stats.AccessLogBatchSeconds
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self._batchStats = None
+        self._batchLines = []
+        self._batchCall = None
+
+    def stop(self):
+        super(AMPCommonAccessLoggingObserver, self).stop()
+        if self._batchCall is not None:
+            self._batchCall.cancel()
+        self.flushBatch()
+
     def flushBuffer(self):
         if self._buffer:
-            for msg in self._buffer:
+            buffer = self._buffer
+            self._buffer = []
+            for msg in buffer:
                 self.logStats(msg)
 
     def addClient(self, connectedClient):
@@ -661,13 +777,16 @@ class AMPCommonAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
         """
         self.protocol = connectedClient
         self.flushBuffer()
+        self.flushBatch()
 
     def logStats(self, message):
         """
         Log server stats via the remote AMP Protocol
         """
 
-        if self.protocol is not None:
+        if self.batchInterval > 0:
+            self._addToBatch(message)
+        elif self.protocol is not None:
             message = json.dumps(message)
             if isinstance(message, unicode):
                 message = message.encode("utf-8")
@@ -676,6 +795,68 @@ class AMPCommonAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
         else:
             self._buffer.append(message)
 
+    def _addToBatch(self, message):
+        """
+        Aggregate the stats for one request into the current batch and
+        schedule the batch to be sent if it is not already.
+
+        @param message: the request stats
+        @type message: C{dict}
+        """
+
+        # The master only records stats and log lines for access log events
+        if message.get("type") != "access-log":
+            return
+
+        if config.Stats.EnableUnixStatsSocket or config.Stats.EnableTCPStatsSocket:
+            if self._batchStats is None:
+                self._batchStats = self.initStats()
+            self.updateStats(self._batchStats, message)
+
+        line = message["log-format"] % message
+        if isinstance(line, unicode):
+            line = line.encode("utf-8")
+        self._batchLines.append(line[:self.maxBatchBytes])
+
+        if self._batchCall is None:
+            self._batchCall = self.reactor.callLater(self.batchInterval, self.flushBatch)
+
+    def flushBatch(self):
+        """
+        Send the current batch to the master. The stats go with the first
+        L{LogStatsBatch} call, and the log lines are split across as many calls
+        as are needed to keep each under the AMP size limit.
+        """
+        self._batchCall = None
+        if self.protocol is None or (self._batchStats is None and not self._batchLines):
+            return
+
+        stats = self._batchStats
+        lines = self._batchLines
+        self._batchStats = None
+        self._batchLines = []
+
+        # Keep the statements merged from all the requests in the batch within the AMP size limit
+        if stats is not None:
+            stats["sql"] = SQLStatementStats.top(stats["sql"], config.Stats.SQLStatementsReported)
+
+        chunks = [[]]
+        size = 0
+        for line in lines:
+            if chunks[-1] and size + len(line) + 2 > self.maxBatchBytes:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(line)
+            size += len(line) + 2
+
+        for chunk in chunks:
+            kwds = {"lines": chunk}
+            if stats is not None:
+                kwds["stats"] = json.dumps(stats)
+                stats = None
+            d = self.protocol.callRemote(LogStatsBatch, **kwds)
+            d.addErrback(log.error)
+
 
 class AMPLoggingProtocol(amp.AMP):
     """
@@ -694,6 +875,12 @@ class AMPLoggingProtocol(amp.AMP):
 
     LogStats.responder(logStats)
 
+    def logStatsBatch(self, lines, stats=None):
+        self.observer.logStatsBatch(json.loads(stats) if stats is not None else None, lines)
+        return {}
+
+    LogStatsBatch.responder(logStatsBatch)
+
 
 class AMPLoggingFactory(protocol.ServerFactory):
 
@@ -17,6 +17,8 @@
 
 from twext.enterprise.jobs.jobitem import JobItem
 
+from calendarserver.tap.profiling import sampler
+
 from twisted.internet.defer import inlineCallbacks, succeed, returnValue
 from twisted.internet.error import ConnectError
 from twisted.internet.protocol import Factory
@@ -76,13 +78,25 @@ class DashboardProtocol (LineReceiver):
     def process_data(self, j):
         results = {}
         for data in j:
-            if hasattr(self, "data_{}".format(data)):
-                result = yield getattr(self, "data_{}".format(data))()
-            elif data.startswith("stats_"):
-                result = yield self.data_stats()
-                result = result.get(data[6:], "")
-            else:
-                result = ""
+            # Commands that take arguments are lists of the name followed by the arguments
+            args = ()
+            if isinstance(data, list) and data:
+                data, args = data[0], data[1:]
+            try:
+                if not isinstance(data, basestring):
+                    raise TypeError("Command name is not a string")
+                if hasattr(self, "data_{}".format(data)):
+                    result = yield getattr(self, "data_{}".format(data))(*args)
+                elif data.startswith("stats_"):
+                    result = yield self.data_stats()
+                    result = result.get(data[6:], "")
+                else:
+                    result = ""
+            except (TypeError, AttributeError):
+                # Malformed command - report it under a key that can be sent back
+                result = json.loads(self.bad_cmd)
+                if not isinstance(data, basestring):
+                    data = json.dumps(data)
             results[data] = result
 
         self.sendLine(json.dumps(results))
@@ -180,6 +194,51 @@ class DashboardProtocol (LineReceiver):
 
         returnValue(results)
 
+    def data_sampler_start(self, seconds, worker=None):
+        """
+        Start the stack sampler in one or all of the workers (or in this process if
+        there are no workers).
+
+        @param seconds: the number of seconds to sample for
+        @type seconds: L{int}
+        @param worker: the id of the worker to sample, or L{None} for all
+        @type worker: L{str}
+
+        @return: the JSON result - whether sampling was started in each worker.
+        @rtype: L{dict}
+        """
+        if not self.factory.allowSampling:
+            return succeed({"error": "sampling is not allowed on this socket"})
+        try:
+            seconds = int(seconds)
+        except (TypeError, ValueError):
+            return succeed({"error": "bad number of seconds: {!r}".format(seconds)})
+        if seconds <= 0:
+            return succeed({"error": "bad number of seconds: {!r}".format(seconds)})
+
+        if self.factory.sampler is not None:
+            return self.factory.sampler.startSampling(seconds, worker)
+        started = not sampler.running
+        sampler.start(min(seconds, config.Profiling.SamplingMaxSeconds))
+        return succeed({"": started})
+
+    def data_sampler_stop(self, worker=None):
+        """
+        Stop the stack sampler in one or all of the workers (or in this process if
+        there are no workers) before its time is up.
+
+        @param worker: the id of the worker to stop, or L{None} for all
+        @type worker: L{str}
+
+        @return: the JSON result - the file the samples of each worker were written to.
+        @rtype: L{dict}
+        """
+        if not self.factory.allowSampling:
+            return succeed({"error": "sampling is not allowed on this socket"})
+        if self.factory.sampler is not None:
+            return self.factory.sampler.stopSampling(worker)
+        return succeed({"": sampler.stop()})
+
     def data_directory(self):
         """
         Return a summary of directory service calls.
@@ -194,6 +253,11 @@ class DashboardProtocol (LineReceiver):
 
 
 class DashboardServer(Factory):
+    """
+    Serves the stats socket. The stack sampler can only be controlled when
+    C{allowSampling} is set, which is only done for the group-owned UNIX
+    socket, as sampling writes files and slows the server down.
+    """
 
     protocol = DashboardProtocol
 
@@ -203,6 +267,8 @@ class DashboardServer(Factory):
         self.logger.limiter = self.limiter
         self.store = None
         self.directory = None
+        self.sampler = None
+        self.allowSampling = False
 
     def makeDirectoryProxyClient(self):
         if config.DirectoryProxy.Enabled:
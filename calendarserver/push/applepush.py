@@ -29,7 +29,7 @@ from txweb2.http_headers import MimeType
 from txweb2.server import parsePOSTData
 from twisted.application import service
 from twisted.internet.protocol import Protocol
-from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed, Deferred
 from twisted.internet.protocol import ClientFactory, ReconnectingClientFactory
 from twistedcaldav.extensions import DAVResource, DAVResourceWithoutChildrenMixin
 from twistedcaldav.resource import ReadOnlyNoCopyResourceMixIn
@@ -43,9 +43,37 @@ from calendarserver.push.util import validToken, TokenHistory, PushScheduler
 from twext.internet.adaptendpoint import connect
 from twext.internet.gaiendpoint import GAIEndpoint
 from twisted.python.constants import Values, ValueConstant
+from twisted.python.failure import Failure
+from twistedcaldav.util import LRUCache
+from collections import OrderedDict
 
 log = Logger()
 
+# Decoded binary device tokens, so that the hex decoding is done once per token
+# rather than once per notification
+_binaryTokens = LRUCache(10000, name="apns-tokens")
+
+
+def binaryToken(token):
+    """
+    Convert a hex device token, as stored in the database, into the binary form sent
+    to APNS.
+
+    @param token: the hex device token
+    @type token: C{str}
+
+    @return: the binary token, or C{None} if the token is not valid hex
+    @rtype: C{str}
+    """
+    result = _binaryTokens.get(token)
+    if result is None:
+        try:
+            result = token.replace(" ", "").decode("hex")
+        except (TypeError, ValueError):
+            return None
+        _binaryTokens.set(token, result)
+    return result
+
 
 class ApplePushPriority(Values):
     """
@@ -69,6 +97,11 @@ class ApplePushNotifierService(service.MultiService):
     """
     log = Logger()
 
+    def __init__(self):
+        service.MultiService.__init__(self)
+        self.pendingKeys = OrderedDict()
+        self.lookupInProgress = False
+
     @classmethod
     def makeService(
         cls, settings, store, testConnectorClass=None,
@@ -182,6 +215,14 @@ class ApplePushNotifierService(service.MultiService):
         Sends an Apple Push Notification to any device token subscribed to
         this pushKey.
 
+        Keys enqueued while a subscription lookup is in progress are gathered
+        and looked up together with a single query once it completes, so under
+        load the number of queries grows with the number of lookups that can
+        be done in the time taken, not with the number of keys.
+
+        @param transaction: the transaction to use for the lookup, which must
+            remain open until the returned L{Deferred} fires
+        @type transaction: L{CommonStoreTransaction}
         @param pushKey: The identifier of the resource that was updated, including
             a prefix indicating whether this is CalDAV or CardDAV related.
 
@@ -209,20 +250,67 @@ class ApplePushNotifierService(service.MultiService):
         provider = self.providers.get(protocol, None)
         if provider is not None:
 
-            # Look up subscriptions for this key
-            subscriptions = (yield transaction.apnSubscriptionsByKey(pushKey))
+            d = Deferred()
+            if pushKey in self.pendingKeys:
+                _ignore_txn, _ignore_provider, oldTimestamp, oldPriority, waiting = self.pendingKeys[pushKey]
+                dataChangedTimestamp = max(dataChangedTimestamp, oldTimestamp)
+                priority = max(priority, oldPriority, key=lambda p: p.value)
+            else:
+                waiting = []
+            waiting.append(d)
+            self.pendingKeys[pushKey] = (transaction, provider, dataChangedTimestamp, priority, waiting,)
 
-            numSubscriptions = len(subscriptions)
-            if numSubscriptions > 0:
-                self.log.debug(
-                    "Sending {num} APNS notifications for {key}",
-                    num=numSubscriptions, key=pushKey
-                )
-                tokens = [record.token for record in subscriptions if record.token and record.subscriberGUID]
-                if tokens:
-                    provider.scheduleNotifications(
-                        tokens, pushKey,
-                        dataChangedTimestamp, priority)
+            if not self.lookupInProgress:
+                self._lookupPendingKeys()
+            yield d
+
+    @inlineCallbacks
+    def _lookupPendingKeys(self):
+        """
+        Look up the subscriptions for all the pending keys with one query and schedule their
+        notifications, repeating until no more keys are pending. If the lookup fails, every caller
+        waiting on those keys gets the failure, so that its work item is retried.
+        """
+        self.lookupInProgress = True
+        try:
+            while self.pendingKeys:
+                pending, self.pendingKeys = self.pendingKeys, OrderedDict()
+
+                # Every enqueue caller waits until its key is done, so any of their transactions
+                # can be used
+                transaction = pending.values()[0][0]
+                try:
+                    subscriptions = (yield transaction.apnSubscriptionsByKeys(pending.keys()))
+                except Exception as e:
+                    self.log.error("Unable to look up APNS subscriptions: {ex}", ex=e)
+                    f = Failure()
+                    for _ignore_txn, _ignore_provider, _ignore_timestamp, _ignore_priority, waiting in pending.values():
+                        for d in waiting:
+                            d.errback(f)
+                    continue
+
+                tokensByKey = {}
+                for record in subscriptions:
+                    if record.token and record.subscriberGUID:
+                        tokensByKey.setdefault(record.resourceKey, []).append(record.token)
+
+                for pushKey, (_ignore_txn, provider, dataChangedTimestamp, priority, waiting,) in pending.items():
+                    tokens = tokensByKey.get(pushKey)
+                    if tokens:
+                        self.log.debug(
+                            "Sending {num} APNS notifications for {key}",
+                            num=len(tokens), key=pushKey
+                        )
+                        try:
+                            provider.scheduleNotifications(
+                                tokens, pushKey,
+                                dataChangedTimestamp, priority)
+                        except Exception as e:
+                            self.log.error("Unable to send APNS notifications for {key}: {ex}", key=pushKey, ex=e)
+                    for d in waiting:
+                        d.callback(None)
+        finally:
+            self.lookupInProgress = False
 
 
 class APNProviderProtocol(Protocol):
@@ -348,18 +436,26 @@ class APNProviderProtocol(Protocol):
             which triggered this notification
         @type key: C{int}
         """
+        self.sendNotifications([token], key, dataChangedTimestamp, priority)
 
-        if not (token and key and dataChangedTimestamp):
-            return
+    def sendNotifications(self, tokens, key, dataChangedTimestamp, priority):
+        """
+        Sends a push notification message for the key to the devices associated
+        with each of the tokens. The payload is encoded once and the frames for
+        all the devices are sent with a single write.
 
-        try:
-            binaryToken = token.replace(" ", "").decode("hex")
-        except:
-            self.log.error("Invalid APN token in database: {token}", token=token)
+        @param tokens: The device tokens subscribed to the key
+        @type tokens: C{list} of C{str}
+        @param key: The key we're sending a notification about
+        @type key: C{str}
+        @param dataChangedTimestamp: Timestamp (epoch seconds) for the data change
+            which triggered this notification
+        @type key: C{int}
+        """
+
+        if not (tokens and key and dataChangedTimestamp):
             return
-        tokenLength = len(binaryToken)
 
-        identifier = self.history.add(token)
         apnsPriority = ApplePushPriority.lookupByValue(priority.value).value
         payload = json.dumps(
             {
@@ -368,12 +464,31 @@ class APNProviderProtocol(Protocol):
                 "pushRequestSubmittedTimestamp": int(time.time()),
             }
         )
-        payloadLength = len(payload)
-        self.log.debug(
-            "Sending APNS notification to {token}: id={id} payload={payload} priority={priority}",
-            token=token, id=identifier, payload=payload, priority=apnsPriority)
+        expiration = int(time.time()) + 72 * 60 * 60  # Expires in 72 hours
 
+        frames = []
+        for token in tokens:
+            if not token:
+                continue
+            binary = binaryToken(token)
+            if binary is None:
+                self.log.error("Invalid APN token in database: {token}", token=token)
+                continue
+
+            identifier = self.history.add(token)
+            self.log.debug(
+                "Sending APNS notification to {token}: id={id} payload={payload} priority={priority}",
+                token=token, id=identifier, payload=payload, priority=apnsPriority)
+            frames.append(self.notificationFrame(binary, payload, identifier, expiration, apnsPriority))
+
+        if frames:
+            self.transport.write("".join(frames))
+
+    @classmethod
+    def notificationFrame(cls, binaryToken, payload, identifier, expiration, apnsPriority):
         """
+        Build the binary notification message for one device.
+
         Notification format
 
         Top level:  Command (1 byte), Frame length (4 bytes), Frame data (variable)
@@ -385,10 +500,26 @@ class APNProviderProtocol(Protocol):
         Item 4: Expiration date (4 bytes) UNIX epoch in secondcs UTC
         Item 5: Priority (1 byte): 10 (push sent immediately) or 5 (push sent
             at a time that conservces power on the device receiving it)
+
+        @param binaryToken: the binary device token
+        @type binaryToken: C{str}
+        @param payload: the JSON payload
+        @type payload: C{str}
+        @param identifier: the notification id
+        @type identifier: C{int}
+        @param expiration: the expiration time (epoch seconds)
+        @type expiration: C{int}
+        @param apnsPriority: the APNS priority
+        @type apnsPriority: C{int}
+
+        @return: the message
+        @rtype: C{str}
         """
+        tokenLength = len(binaryToken)
+        payloadLength = len(payload)
 
         # Frame struct.pack format                ! Network byte order
-        command = self.COMMAND_PROVIDER             # B
+        command = cls.COMMAND_PROVIDER              # B
         frameLength = (  # I
             # Item 1 (Device token)
             1 +  # Item number                       # B
@@ -412,34 +543,32 @@ class APNProviderProtocol(Protocol):
             1    # Priority                         # B
         )
 
-        self.transport.write(
-            struct.pack(
-                "!BIBH%dsBH%dsBHIBHIBHB" % (tokenLength, payloadLength,),
+        return struct.pack(
+            "!BIBH%dsBH%dsBHIBHIBHB" % (tokenLength, payloadLength,),
 
-                command,                         # Command
-                frameLength,                     # Frame length
+            command,                         # Command
+            frameLength,                     # Frame length
 
-                1,                               # Item 1 (Device token)
-                tokenLength,                     # Token Length
-                binaryToken,                     # Token
+            1,                               # Item 1 (Device token)
+            tokenLength,                     # Token Length
+            binaryToken,                     # Token
 
-                2,                               # Item 2 (Payload)
-                payloadLength,                   # Payload length
-                payload,                         # Payload
+            2,                               # Item 2 (Payload)
+            payloadLength,                   # Payload length
+            payload,                         # Payload
 
-                3,                               # Item 3 (Notification ID)
-                4,                               # Notification ID Length
-                identifier,                      # Notification ID
+            3,                               # Item 3 (Notification ID)
+            4,                               # Notification ID Length
+            identifier,                      # Notification ID
 
-                4,                               # Item 4 (Expiration)
-                4,                               # Expiration length
-                int(time.time()) + 72 * 60 * 60,  # Expires in 72 hours
+            4,                               # Item 4 (Expiration)
+            4,                               # Expiration length
+            expiration,                      # Expiration
 
-                5,                               # Item 5 (Priority)
-                1,                               # Priority length
-                apnsPriority,                    # Priority
+            5,                               # Item 5 (Priority)
+            1,                               # Priority length
+            apnsPriority,                    # Priority
 
-            )
         )
 
 
@@ -601,8 +730,7 @@ class APNProviderService(APNConnectionService):
             if self.scheduler is not None:
                 self.scheduler.schedule(tokens, key, dataChangedTimestamp, priority)
             else:
-                for token in tokens:
-                    self.sendNotification(token, key, dataChangedTimestamp, priority)
+                connection.sendNotifications(tokens, key, dataChangedTimestamp, priority)
         else:
             self._saveForWhenConnected(tokens, key, dataChangedTimestamp, priority)
 
@@ -25,7 +25,7 @@ from twext.enterprise.jobs.workitem import WorkItem, WORK_PRIORITY_HIGH, \
     WORK_WEIGHT_1
 from twext.python.log import Logger
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, returnValue
 
 from txdav.common.datastore.sql_tables import schema
 from txdav.idav import IStoreNotifierFactory, IStoreNotifier
@@ -45,6 +45,29 @@ class PushNotificationWork(WorkItem, fromTable(schema.PUSH_NOTIFICATION_WORK)):
     default_priority = WORK_PRIORITY_HIGH
     default_weight = WORK_WEIGHT_1
 
+    @classmethod
+    @inlineCallbacks
+    def enqueueMultiple(cls, txn, pushes, notBefore):
+        """
+        Enqueue work for a number of push IDs in one transaction. Each one goes
+        through the job queue as usual, so that the queue is told about its job
+        when the transaction commits.
+
+        @param txn: the transaction to use
+        @type txn: L{CommonStoreTransaction}
+        @param pushes: the priority value to use for each push ID
+        @type pushes: C{dict} mapping C{str} to C{int}
+        @param notBefore: the time at which the work may be done
+        @type notBefore: L{datetime.datetime}
+        """
+        for pushID in sorted(pushes.keys()):
+            yield txn.enqueue(
+                cls,
+                pushID=pushID,
+                notBefore=notBefore,
+                pushPriority=pushes[pushID]
+            )
+
     @inlineCallbacks
     def doWork(self):
 
@@ -163,6 +186,109 @@ class Notifier(object):
         return self._notifierFactory.pushKeyForId(prefix, id)
 
 
+class PushNotificationBatcher(object):
+    """
+    Gathers the push IDs changed by each transaction, and once the transaction
+    commits, holds them in this process for a short window. At the end of the
+    window one L{PushNotificationWork} per push ID is enqueued, all in a single
+    transaction. A busy collection then produces one
+    job per window instead of one per change, and L{PushNotificationWork.doWork}
+    has far fewer duplicates to delete.
+
+    Push IDs waiting for the end of a window are lost if the process exits,
+    which at worst delays clients noticing a change until their next poll.
+    """
+    log = Logger()
+
+    def __init__(self, windowSeconds, coalesceSeconds, reactor):
+        """
+        @param windowSeconds: how long to gather push IDs before enqueuing them
+        @type windowSeconds: C{float}
+        @param coalesceSeconds: how long after being enqueued the work is done
+        @type coalesceSeconds: C{int}
+        @param reactor: the reactor to use for the window timer
+        """
+        self.store = None   # Set from the first transaction that adds a push ID
+        self.windowSeconds = windowSeconds
+        self.coalesceSeconds = coalesceSeconds
+        self.reactor = reactor
+
+        self._transactions = {}
+        self._pending = {}
+        self._flushCall = None
+
+    def add(self, txn, pushID, priority):
+        """
+        Record a push ID changed by a transaction.
+
+        @param txn: the transaction making the change
+        @type txn: L{CommonStoreTransaction}
+        @param pushID: the push ID
+        @type pushID: C{str}
+        @param priority: the priority level
+        @type priority: L{PushPriority}
+        """
+        pending = self._transactions.get(txn)
+        if pending is None:
+            if self.store is None:
+                self.store = txn.store()
+            pending = self._transactions[txn] = {}
+            txn.postCommit(lambda: self._committed(txn))
+            txn.postAbort(lambda: self._transactions.pop(txn, None))
+        pending[pushID] = max(pending.get(pushID, 0), priority.value)
+
+    def _committed(self, txn):
+        """
+        Move the push IDs of a committed transaction into the current window.
+        """
+        self._merge(self._transactions.pop(txn, {}))
+
+    def _merge(self, pushes):
+        for pushID, priority in pushes.items():
+            self._pending[pushID] = max(self._pending.get(pushID, 0), priority)
+        if self._pending and self._flushCall is None:
+            self._flushCall = self.reactor.callLater(self.windowSeconds, self.flush)
+
+    @inlineCallbacks
+    def flush(self):
+        """
+        Enqueue work for all the push IDs gathered in the current window.
+
+        @return: a L{Deferred} that fires with the number of push IDs enqueued
+        """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+
+        pushes, self._pending = self._pending, {}
+        if not pushes:
+            returnValue(0)
+
+        txn = self.store.newTransaction(label="PushNotificationBatcher.flush")
+        try:
+            yield PushNotificationWork.enqueueMultiple(
+                txn, pushes,
+                datetime.datetime.utcnow() + datetime.timedelta(seconds=self.coalesceSeconds),
+            )
+        except Exception as e:
+            self.log.error("Unable to enqueue push notifications: {ex}", ex=e)
+            yield txn.abort()
+            # Try again in the next window
+            self._merge(pushes)
+            returnValue(0)
+
+        try:
+            yield txn.commit()
+        except Exception as e:
+            self.log.error("Unable to commit push notifications: {ex}", ex=e)
+            # Try again in the next window
+            self._merge(pushes)
+            returnValue(0)
+
+        returnValue(len(pushes))
+
+
 class NotifierFactory(object):
     """
     Notifier Factory
@@ -174,7 +300,14 @@ class NotifierFactory(object):
 
     implements(IStoreNotifierFactory)
 
-    def __init__(self, hostname, coalesceSeconds, reactor=None):
+    def __init__(self, hostname, coalesceSeconds, reactor=None, batchSeconds=0):
+        """
+        @param batchSeconds: if non-zero, push IDs from committed transactions
+            are gathered for this long and enqueued together by a
+            L{PushNotificationBatcher}, rather than each being enqueued in the
+            transaction making the change
+        @type batchSeconds: C{float}
+        """
         self.store = None   # Initialized after the store is created
         self.hostname = hostname
         self.coalesceSeconds = coalesceSeconds
@@ -183,11 +316,18 @@ class NotifierFactory(object):
             from twisted.internet import reactor
         self.reactor = reactor
 
+        self.batcher = PushNotificationBatcher(batchSeconds, coalesceSeconds, reactor) if batchSeconds else None
+
     @inlineCallbacks
     def send(self, prefix, id, txn, priority=PushPriority.high):
         """
-        Enqueue a push notification work item on the provided transaction.
+        Enqueue a push notification work item on the provided transaction, or
+        pass it to the batcher if one is in use.
         """
+        if self.batcher is not None:
+            self.batcher.add(txn, self.pushKeyForId(prefix, id), priority)
+            return
+
         yield txn.enqueue(
             PushNotificationWork,
             pushID=self.pushKeyForId(prefix, id),
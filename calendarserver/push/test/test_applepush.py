@@ -23,7 +23,7 @@ from calendarserver.push.applepush import (
 from calendarserver.push.ipush import PushPriority
 from calendarserver.push.util import validToken, TokenHistory
 from twistedcaldav.test.util import StoreTestCase
-from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.defer import inlineCallbacks, succeed, Deferred
 from twisted.internet.task import Clock
 from txdav.common.icommondatastore import InvalidSubscriptionValues
 from twistedcaldav.config import ConfigDict
@@ -343,6 +343,155 @@ class ApplePushNotifierServiceTests(StoreTestCase):
 
         service.stopService()
 
+    def test_sendNotifications(self):
+        """
+        L{APNProviderProtocol.sendNotifications} writes one frame for each valid
+        token, all with the same payload, in a single write.
+        """
+        token = "2d0d55cd7f98bcb81c6e24abcdc35168254c7846a43e2828b1ba5a8f82e219dfaa"
+        token2 = "3d0d55cd7f98bcb81c6e24abcdc35168254c7846a43e2828b1ba5a8f82e219df"
+        key = "/CalDAV/calendars.example.com/user01/calendar/"
+
+        protocol = APNProviderProtocol()
+        protocol.history = TokenHistory()
+        protocol.transport = StubTransport()
+        protocol.sendNotifications([token, "not hex", token2], key, 1000, PushPriority.medium)
+
+        rawData = protocol.transport.data
+        frames = []
+        while rawData:
+            command, frameLength = struct.unpack("!BI", rawData[:5])
+            self.assertEquals(command, 2)
+            frames.append(rawData[5:5 + frameLength])
+            rawData = rawData[5 + frameLength:]
+        self.assertEquals(len(frames), 2)
+
+        payloads = set()
+        for frame, expectedToken, expectedIdentifier in zip(frames, (token, token2), (1, 2)):
+            itemNum, tokenLength = struct.unpack("!BH", frame[:3])
+            self.assertEquals(itemNum, 1)
+            self.assertEquals(frame[3:3 + tokenLength].encode("hex"), expectedToken)
+            frame = frame[3 + tokenLength:]
+            itemNum, payloadLength = struct.unpack("!BH", frame[:3])
+            self.assertEquals(itemNum, 2)
+            payloads.add(frame[3:3 + payloadLength])
+            frame = frame[3 + payloadLength:]
+            itemNum, _ignore_length, identifier = struct.unpack("!BHI", frame[:7])
+            self.assertEquals(itemNum, 3)
+            self.assertEquals(identifier, expectedIdentifier)
+            itemNum, _ignore_length, priority = struct.unpack("!BHB", frame[14:18])
+            self.assertEquals(itemNum, 5)
+            self.assertEquals(priority, ApplePushPriority.medium.value)
+
+        self.assertEquals(len(payloads), 1)
+        self.assertEquals(json.loads(payloads.pop())["key"], key)
+
+    @inlineCallbacks
+    def test_enqueueBatchedLookup(self):
+        """
+        Keys enqueued while a subscription lookup is in progress are looked up
+        together once it completes.
+        """
+        key1 = "/CalDAV/calendars.example.com/user01/calendar/"
+        key2 = "/CalDAV/calendars.example.com/user02/calendar/"
+        key3 = "/CalDAV/calendars.example.com/user03/calendar/"
+
+        class StubRecord(object):
+            def __init__(self, token, resourceKey):
+                self.token = token
+                self.resourceKey = resourceKey
+                self.subscriberGUID = "D2256BCC-48E2-42D1-BD89-CBA1E4CCDFFB"
+
+        class StubTransaction(object):
+            def __init__(self):
+                self.lookups = []
+
+            def apnSubscriptionsByKeys(self, keys):
+                d = Deferred()
+                self.lookups.append((list(keys), d,))
+                return d
+
+        class StubProvider(object):
+            def __init__(self):
+                self.history = []
+
+            def scheduleNotifications(self, tokens, key, dataChangedTimestamp, priority):
+                self.history.append((key, sorted(tokens), priority,))
+
+        service = ApplePushNotifierService()
+        provider = StubProvider()
+        service.providers = {"CalDAV": provider}
+        txn = StubTransaction()
+
+        d1 = service.enqueue(txn, key1, dataChangedTimestamp=1000, priority=PushPriority.low)
+        d2 = service.enqueue(txn, key2, dataChangedTimestamp=1000, priority=PushPriority.low)
+        d3 = service.enqueue(txn, key3, dataChangedTimestamp=1000, priority=PushPriority.low)
+        d4 = service.enqueue(txn, key2, dataChangedTimestamp=1000, priority=PushPriority.high)
+        self.assertEquals(len(txn.lookups), 1)
+        self.assertEquals(txn.lookups[0][0], [key1])
+
+        txn.lookups[0][1].callback([StubRecord("aa", key1)])
+        yield d1
+        self.assertEquals(len(txn.lookups), 2)
+        self.assertEquals(txn.lookups[1][0], [key2, key3])
+
+        txn.lookups[1][1].callback([StubRecord("bb", key2), StubRecord("cc", key2), StubRecord("dd", key3)])
+        yield d2
+        yield d3
+        yield d4
+        self.assertEquals(len(txn.lookups), 2)
+        self.assertFalse(service.lookupInProgress)
+        self.assertEquals(provider.history, [
+            (key1, ["aa"], PushPriority.low),
+            (key2, ["bb", "cc"], PushPriority.high),
+            (key3, ["dd"], PushPriority.low),
+        ])
+
+    @inlineCallbacks
+    def test_enqueueLookupFailure(self):
+        """
+        If a batched subscription lookup fails, every caller waiting on those
+        keys gets the failure, and keys enqueued meanwhile are still looked up.
+        """
+        key1 = "/CalDAV/calendars.example.com/user01/calendar/"
+        key2 = "/CalDAV/calendars.example.com/user02/calendar/"
+        key3 = "/CalDAV/calendars.example.com/user03/calendar/"
+
+        class StubTransaction(object):
+            def __init__(self):
+                self.lookups = []
+
+            def apnSubscriptionsByKeys(self, keys):
+                d = Deferred()
+                self.lookups.append((list(keys), d,))
+                return d
+
+        class StubProvider(object):
+            def scheduleNotifications(self, tokens, key, dataChangedTimestamp, priority):
+                pass
+
+        service = ApplePushNotifierService()
+        service.providers = {"CalDAV": StubProvider()}
+        txn = StubTransaction()
+
+        d1 = service.enqueue(txn, key1, dataChangedTimestamp=1000, priority=PushPriority.low)
+        d2 = service.enqueue(txn, key2, dataChangedTimestamp=1000, priority=PushPriority.low)
+        d3 = service.enqueue(txn, key3, dataChangedTimestamp=1000, priority=PushPriority.low)
+
+        txn.lookups[0][1].callback([])
+        yield d1
+        self.assertEquals(txn.lookups[1][0], [key2, key3])
+
+        d4 = service.enqueue(txn, key1, dataChangedTimestamp=1000, priority=PushPriority.low)
+        txn.lookups[1][1].errback(RuntimeError("lookup failed"))
+        yield self.assertFailure(d2, RuntimeError)
+        yield self.assertFailure(d3, RuntimeError)
+
+        self.assertEquals(txn.lookups[2][0], [key1])
+        txn.lookups[2][1].callback([])
+        yield d4
+        self.assertFalse(service.lookupInProgress)
+
     def test_validToken(self):
         self.assertTrue(validToken("2d0d55cd7f98bcb81c6e24abcdc35168254c7846a43e2828b1ba5a8f82e219df"))
         self.assertTrue(validToken("d0d55cd7f98bcb81c6e24abcdc35168254c7846a43e2828b1ba5a8f82e219d"))
@@ -18,7 +18,8 @@ from twistedcaldav.test.util import StoreTestCase
 from calendarserver.push.notifier import PushDistributor
 from calendarserver.push.notifier import getPubSubAPSConfiguration
 from calendarserver.push.notifier import PushNotificationWork
-from twisted.internet.defer import inlineCallbacks, succeed
+from calendarserver.push.notifier import PushNotificationBatcher
+from twisted.internet.defer import inlineCallbacks, succeed, fail
 from twistedcaldav.config import ConfigDict
 from txdav.common.datastore.test.util import populateCalendarsFrom
 from txdav.common.datastore.sql_tables import _BIND_MODE_WRITE
@@ -26,6 +27,8 @@ from calendarserver.push.ipush import PushPriority
 from txdav.idav import ChangeCategory
 from twext.enterprise.jobs.jobitem import JobItem
 from twisted.internet import reactor
+from twisted.internet.task import Clock
+from twext.enterprise.dal.syntax import Select, Delete
 
 
 class StubService(object):
@@ -261,6 +264,114 @@ class PushNotificationWorkTests(StoreTestCase):
             [("/CalDAV/localhost/bar/", PushPriority.high)])
 
 
+class PushNotificationBatcherTests(StoreTestCase):
+
+    @inlineCallbacks
+    def _removeJobs(self, txn):
+        """
+        Remove the work enqueued by a test, which is not due for some time.
+        """
+        yield Delete(From=PushNotificationWork.table).on(txn)
+        yield Delete(From=JobItem.table).on(txn)
+
+    @inlineCallbacks
+    def test_batch(self):
+        """
+        Push IDs from committed transactions are enqueued together at the end
+        of the window, once per push ID with the highest priority, and push IDs
+        from aborted transactions are dropped.
+        """
+
+        clock = Clock()
+        batcher = PushNotificationBatcher(1, 60, clock)
+
+        txn = self._sqlCalendarStore.newTransaction()
+        batcher.add(txn, "/CalDAV/localhost/foo/", PushPriority.low)
+        batcher.add(txn, "/CalDAV/localhost/foo/", PushPriority.high)
+        batcher.add(txn, "/CalDAV/localhost/bar/", PushPriority.medium)
+        self.assertEqual(batcher._pending, {})
+        yield txn.commit()
+
+        txn = self._sqlCalendarStore.newTransaction()
+        batcher.add(txn, "/CalDAV/localhost/baz/", PushPriority.high)
+        yield txn.abort()
+
+        txn = self._sqlCalendarStore.newTransaction()
+        batcher.add(txn, "/CalDAV/localhost/bar/", PushPriority.low)
+        yield txn.commit()
+
+        self.assertEqual(batcher._pending, {
+            "/CalDAV/localhost/foo/": PushPriority.high.value,
+            "/CalDAV/localhost/bar/": PushPriority.medium.value,
+        })
+        self.assertTrue(batcher._flushCall.active())
+
+        count = yield batcher.flush()
+        self.assertEqual(count, 2)
+        self.assertEqual(batcher._pending, {})
+        self.assertTrue(batcher._flushCall is None)
+
+        txn = self._sqlCalendarStore.newTransaction()
+        rows = yield Select(
+            [PushNotificationWork.table.PUSH_ID, PushNotificationWork.table.PUSH_PRIORITY],
+            From=PushNotificationWork.table,
+        ).on(txn)
+        self.assertEqual(
+            sorted([tuple(row) for row in rows]),
+            [
+                ("/CalDAV/localhost/bar/", PushPriority.medium.value),
+                ("/CalDAV/localhost/foo/", PushPriority.high.value),
+            ]
+        )
+        jobs = yield JobItem.all(txn)
+        self.assertEqual(len(jobs), 2)
+        yield self._removeJobs(txn)
+        yield txn.commit()
+
+    @inlineCallbacks
+    def test_flushCommitFailure(self):
+        """
+        Push IDs whose transaction fails to commit are kept for the next window.
+        """
+
+        store = self._sqlCalendarStore
+
+        class FailingCommitStore(object):
+
+            def newTransaction(self, label="unlabeled"):
+                txn = store.newTransaction(label=label)
+
+                def commit():
+                    d = txn.abort()
+                    d.addCallback(lambda _ignore: fail(RuntimeError("commit failed")))
+                    return d
+                txn.commit = commit
+                return txn
+
+        clock = Clock()
+        batcher = PushNotificationBatcher(1, 60, clock)
+
+        txn = store.newTransaction()
+        batcher.add(txn, "/CalDAV/localhost/foo/", PushPriority.high)
+        yield txn.commit()
+
+        batcher.store = FailingCommitStore()
+        count = yield batcher.flush()
+        self.assertEqual(count, 0)
+        self.assertEqual(batcher._pending, {"/CalDAV/localhost/foo/": PushPriority.high.value})
+        self.assertTrue(batcher._flushCall.active())
+
+        batcher.store = store
+        count = yield batcher.flush()
+        self.assertEqual(count, 1)
+
+        txn = store.newTransaction()
+        jobs = yield JobItem.all(txn)
+        self.assertEqual(len(jobs), 1)
+        yield self._removeJobs(txn)
+        yield txn.commit()
+
+
 class NotifierFactory(StoreTestCase):
 
     requirements = {
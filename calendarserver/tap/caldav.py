@@ -111,6 +111,7 @@ from calendarserver.accesslog import RotatingFileAccessLoggingObserver
 from calendarserver.controlsocket import ControlSocket
 from calendarserver.controlsocket import ControlSocketConnectingService
 from calendarserver.dashboard_service import DashboardServer
+from calendarserver.tap.profiling import SAMPLER_ROUTE, SamplerMasterFactory, SamplerWorkerFactory
 from calendarserver.push.amppush import AMPPushMaster, AMPPushForwarder
 from calendarserver.push.applepush import ApplePushNotifierService, APNPurgingWork
 from calendarserver.push.notifier import PushDistributor
@@ -922,6 +923,9 @@ class CalDAVServiceMaker (object):
 
         controlSocketClient.addFactory(_LOG_ROUTE, f)
 
+        # Allow the master to start the stack sampler in this worker
+        controlSocketClient.addFactory(SAMPLER_ROUTE, SamplerWorkerFactory())
+
         from txdav.common.datastore.sql import CommonDataStore as SQLStore
 
         if isinstance(store, SQLStore):
@@ -1395,6 +1399,7 @@ class CalDAVServiceMaker (object):
             if config.Stats.EnableUnixStatsSocket:
                 stats = DashboardServer(logObserver, None)
                 stats.store = store
+                stats.allowSampling = True
                 statsService = GroupOwnedUNIXServer(
                     gid, config.Stats.UnixStatsSocket, stats, mode=0660
                 )
@@ -1748,6 +1753,10 @@ class CalDAVServiceMaker (object):
         controlSocket = ControlSocket()
         controlSocket.addFactory(_LOG_ROUTE, logger)
 
+        # Allow the UNIX stats socket to start the stack sampler in workers
+        samplerFactory = SamplerMasterFactory()
+        controlSocket.addFactory(SAMPLER_ROUTE, samplerFactory)
+
         # Allow master to receive alert posts from workers
         AlertPoster.setupForMaster(controlSocket)
 
@@ -1864,6 +1873,8 @@ class CalDAVServiceMaker (object):
         stats = None
         if config.Stats.EnableUnixStatsSocket:
             stats = DashboardServer(logger.observer, cl if config.UseMetaFD else None)
+            stats.sampler = samplerFactory
+            stats.allowSampling = True
             statsService = GroupOwnedUNIXServer(
                 gid, config.Stats.UnixStatsSocket, stats, mode=0660
             )
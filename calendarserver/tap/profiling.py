@@ -14,9 +14,28 @@
 # limitations under the License.
 ##
 
+"""
+Profiling support: a whole-process cProfile runner, and an on-demand stack
+sampler that can be started in any of the worker processes of a running
+server.
+"""
+
+from collections import defaultdict
+import os
+import signal
 import time
 
+from twext.python.log import Logger
+
 from twisted.application.app import CProfileRunner, AppProfiler
+from twisted.internet.defer import DeferredList
+from twisted.internet.protocol import Factory
+from twisted.protocols import amp
+
+from calendarserver.logAnalysis import getAdjustedMethodName
+from twistedcaldav.config import config
+
+log = Logger()
 
 
 class CProfileCPURunner(CProfileRunner):
@@ -48,3 +67,322 @@ class CProfileCPURunner(CProfileRunner):
 
 
 AppProfiler.profilers["cprofile-cpu"] = CProfileCPURunner
+
+
+class StackSampler(object):
+    """
+    A statistical profiler that samples the stack of the main (reactor) thread
+    each time the process has used L{interval} seconds of CPU, using the
+    C{ITIMER_PROF} timer signal. This is cheap enough to run on a loaded server.
+
+    Samples are written as collapsed stacks - one line per distinct stack with
+    its frames separated by semicolons followed by the sample count - which is
+    the input format for flame graph tools. Each stack starts with the type of
+    the request being processed. Because the generators of C{inlineCallbacks}
+    functions are resumed from the reactor, their callers are not on the
+    stack: those are found by following the chain of suspended generators
+    waiting on the running one, so that a sample is attributed to the request
+    that is ultimately waiting on it.
+    """
+
+    # Limit on the number of suspended callers followed
+    maxAsyncDepth = 100
+
+    def __init__(self, interval=None):
+        """
+        @param interval: CPU seconds between samples, defaults to
+            C{config.Profiling.SamplingIntervalMs}
+        @type interval: C{float}
+        """
+        self.interval = interval
+        self.stacks = None
+        self.started = None
+        self._stopCall = None
+        self._labels = {}
+
+    @property
+    def running(self):
+        return self.stacks is not None
+
+    def start(self, seconds, reactor=None):
+        """
+        Start sampling, stopping after the specified time.
+
+        @param seconds: the number of seconds to sample for
+        @type seconds: C{int}
+        """
+        if self.running:
+            return
+        if reactor is None:
+            from twisted.internet import reactor
+        self.stacks = defaultdict(int)
+        self.started = time.time()
+        signal.signal(signal.SIGPROF, self._sample)
+        # Restart rather than fail system calls that the signal interrupts
+        signal.siginterrupt(signal.SIGPROF, False)
+        interval = self.interval if self.interval is not None else config.Profiling.SamplingIntervalMs / 1000.0
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+        self._stopCall = reactor.callLater(seconds, self.stop)
+
+    def stop(self):
+        """
+        Stop sampling and write the samples to a file in
+        C{config.Profiling.BaseDirectory}.
+
+        @return: the path of the file, or C{None} if not sampling
+        @rtype: C{str}
+        """
+        if not self.running:
+            return None
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        if self._stopCall is not None and self._stopCall.active():
+            self._stopCall.cancel()
+        self._stopCall = None
+        stacks = self.stacks
+        self.stacks = None
+
+        if not os.path.exists(config.Profiling.BaseDirectory):
+            os.makedirs(config.Profiling.BaseDirectory)
+        path = os.path.join(
+            config.Profiling.BaseDirectory,
+            "samples-{}-{}.folded".format(
+                config.LogID if config.LogID else os.getpid(),
+                time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started)),
+            )
+        )
+        with open(path, "w") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write("{} {}\n".format(stack, count))
+        log.info("Wrote {count} stack samples to {path}", count=sum(stacks.values()), path=path)
+        return path
+
+    def _sample(self, signum, frame):
+        """
+        Signal handler that records the current stack.
+        """
+        frames = []
+        callers = []
+        while frame is not None:
+            frames.append(frame)
+            if not callers and frame.f_code.co_name == "_inlineCallbacks":
+                # Replace the frames below the innermost generator that was resumed by
+                # a result it was waiting for with its suspended callers
+                callers = self._asyncCallers(frame)
+                if callers:
+                    break
+            frame = frame.f_back
+        frames.reverse()
+        frames = callers + frames
+
+        stack = [self._requestLabel(frames)]
+        stack.extend([self._frameName(f) for f in frames])
+        self.stacks[";".join(stack)] += 1
+
+    def _asyncCallers(self, frame):
+        """
+        Get the frames of the generators suspended waiting on the C{inlineCallbacks}
+        generator being run in a frame of C{_inlineCallbacks}.
+
+        @return: the caller frames, outermost first
+        @rtype: C{list}
+        """
+        callers = []
+        try:
+            deferred = frame.f_locals.get("deferred")
+            for _ignore in range(self.maxAsyncDepth):
+                waiting = None
+                for (callback, _ignore_args, _ignore_kw), _ignore_errback in getattr(deferred, "callbacks", ()):
+                    code = getattr(callback, "__code__", None)
+                    if code is not None and code.co_name == "gotResult" and callback.__closure__:
+                        cells = dict(zip(code.co_freevars, [cell.cell_contents for cell in callback.__closure__]))
+                        g = cells.get("g")
+                        if g is not None and g.gi_frame is not None:
+                            callers.append(g.gi_frame)
+                            waiting = cells.get("deferred")
+                        break
+                if waiting is None:
+                    break
+                deferred = waiting
+        except Exception:
+            pass
+        callers.reverse()
+        return callers
+
+    def _requestLabel(self, frames):
+        """
+        Get the type of the request being processed by a stack, based on the
+        innermost C{request} variable.
+        """
+        for frame in reversed(frames):
+            if "request" in frame.f_code.co_varnames:
+                request = frame.f_locals.get("request")
+                method = getattr(request, "method", None)
+                path = getattr(request, "path", None)
+                if method is not None and path is not None:
+                    key = (method, path,)
+                    label = self._labels.get(key)
+                    if label is None:
+                        try:
+                            label = getAdjustedMethodName({}, method, path)
+                        except Exception:
+                            label = method
+                        if len(self._labels) >= 10000:
+                            self._labels.clear()
+                        self._labels[key] = label = label.replace(";", ":").replace(" ", "_")
+                    return label
+        return "(no-request)"
+
+    @staticmethod
+    def _frameName(frame):
+        code = frame.f_code
+        return "{} ({}:{})".format(
+            code.co_name,
+            "/".join(code.co_filename.split(os.sep)[-2:]),
+            code.co_firstlineno,
+        ).replace(";", ":")
+
+
+# The stack sampler for this process
+sampler = StackSampler()
+
+# Control socket route for starting the stack sampler in workers
+SAMPLER_ROUTE = "sampler"
+
+
+class IdentifyWorker(amp.Command):
+    """
+    Sent by a worker when it connects, to give the master its id.
+    """
+    arguments = [
+        ('workerID', amp.String()),
+    ]
+    response = []
+
+
+class StartSampling(amp.Command):
+    arguments = [
+        ('seconds', amp.Integer()),
+    ]
+    response = [
+        ('started', amp.Boolean()),
+    ]
+
+
+class StopSampling(amp.Command):
+    arguments = []
+    response = [
+        ('path', amp.Unicode(optional=True)),
+    ]
+
+
+class SamplerWorkerProtocol(amp.AMP):
+    """
+    Runs in the workers, starting and stopping the process's stack sampler at the
+    master's request.
+    """
+
+    def startReceivingBoxes(self, sender):
+        super(SamplerWorkerProtocol, self).startReceivingBoxes(sender)
+        d = self.callRemote(IdentifyWorker, workerID=str(config.LogID))
+        d.addErrback(log.error)
+
+    @StartSampling.responder
+    def startSampling(self, seconds):
+        if sampler.running:
+            return {"started": False}
+        sampler.start(min(seconds, config.Profiling.SamplingMaxSeconds))
+        return {"started": True}
+
+    @StopSampling.responder
+    def stopSampling(self):
+        path = sampler.stop()
+        return {"path": path.decode("utf-8") if path is not None else None}
+
+
+class SamplerWorkerFactory(Factory):
+    protocol = SamplerWorkerProtocol
+
+
+class SamplerMasterProtocol(amp.AMP):
+    """
+    Runs in the master, one for each connected worker.
+    """
+
+    workerID = None
+
+    @IdentifyWorker.responder
+    def identifyWorker(self, workerID):
+        self.workerID = workerID
+        self.factory.workers[workerID] = self
+        return {}
+
+    def stopReceivingBoxes(self, reason):
+        if self.workerID is not None and self.factory.workers.get(self.workerID) is self:
+            del self.factory.workers[self.workerID]
+        super(SamplerMasterProtocol, self).stopReceivingBoxes(reason)
+
+
+class SamplerMasterFactory(Factory):
+    """
+    Runs in the master, starting and stopping the stack samplers of one or all of
+    the connected workers.
+
+    @ivar workers: the connected workers
+    @type workers: C{dict} mapping C{str} worker id to L{SamplerMasterProtocol}
+    """
+
+    protocol = SamplerMasterProtocol
+
+    def __init__(self):
+        self.workers = {}
+
+    def _callWorkers(self, command, workerID, **kwargs):
+        """
+        Call a command on one or all workers.
+
+        @return: a L{Deferred} firing with a C{dict} mapping each worker id to its
+            response, or to C{None} if the call failed
+        """
+        if workerID is None:
+            workers = sorted(self.workers.items())
+        elif str(workerID) in self.workers:
+            workers = [(str(workerID), self.workers[str(workerID)],)]
+        else:
+            workers = []
+        d = DeferredList([worker.callRemote(command, **kwargs) for _ignore_id, worker in workers], consumeErrors=True)
+        d.addCallback(lambda results: dict([
+            (key, result if success else None,)
+            for (key, _ignore_worker), (success, result) in zip(workers, results)
+        ]))
+        return d
+
+    def startSampling(self, seconds, workerID=None):
+        """
+        Start sampling in one or all workers.
+
+        @param seconds: the number of seconds to sample for
+        @type seconds: C{int}
+        @param workerID: the worker to sample, or C{None} for all
+        @type workerID: C{str}
+
+        @return: a L{Deferred} firing with a C{dict} mapping each worker id to
+            whether sampling was started
+        """
+        d = self._callWorkers(StartSampling, workerID, seconds=int(seconds))
+        d.addCallback(lambda results: dict([(key, bool(value and value["started"]),) for key, value in results.items()]))
+        return d
+
+    def stopSampling(self, workerID=None):
+        """
+        Stop sampling in one or all workers.
+
+        @param workerID: the worker to stop, or C{None} for all
+        @type workerID: C{str}
+
+        @return: a L{Deferred} firing with a C{dict} mapping each worker id to the
+            path of the file its samples were written to
+        """
+        d = self._callWorkers(StopSampling, workerID)
+        d.addCallback(lambda results: dict([(key, value["path"] if value else None,) for key, value in results.items()]))
+        return d
@@ -0,0 +1,160 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from collections import defaultdict
+import json
+import os
+import sys
+
+from twisted.internet.defer import Deferred, inlineCallbacks, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from calendarserver.dashboard_service import DashboardServer
+from calendarserver.tap.profiling import StackSampler
+from twistedcaldav.config import config
+
+
+class FakeRequest(object):
+    method = "PROPFIND"
+    path = "/calendars/__uids__/user01/"
+
+
+class FakeLogObserver(object):
+    limiter = None
+
+
+class FakeSamplerMaster(object):
+
+    def __init__(self):
+        self.started = []
+
+    def startSampling(self, seconds, workerID=None):
+        self.started.append((seconds, workerID,))
+        return succeed({"1": True})
+
+
+class StackSamplerTests(TestCase):
+    """
+    Tests for L{StackSampler}.
+    """
+
+    def test_asyncCallers(self):
+        """
+        A sample taken in an C{inlineCallbacks} generator resumed by a result
+        includes its suspended callers and is attributed to the request they are
+        processing.
+        """
+
+        sampler = StackSampler()
+        sampler.stacks = defaultdict(int)
+        waiting = Deferred()
+
+        @inlineCallbacks
+        def inner():
+            yield waiting
+            sampler._sample(None, sys._getframe())
+
+        @inlineCallbacks
+        def outer(request):
+            yield inner()
+
+        outer(FakeRequest())
+        waiting.callback(None)
+
+        self.assertEqual(len(sampler.stacks), 1)
+        stack = sampler.stacks.keys()[0].split(";")
+        self.assertEqual(stack[0], "PROPFIND_Calendar_Home")
+        names = [frame.split(" ")[0] for frame in stack]
+        self.assertTrue(names.index("outer") < names.index("inner"))
+        self.assertNotIn("test_asyncCallers", names)
+
+    def test_startStop(self):
+        """
+        Stopping the sampler writes the collapsed stacks to a file, and it stops by
+        itself when its time is up.
+        """
+
+        self.patch(config.Profiling, "BaseDirectory", self.mktemp())
+        clock = Clock()
+        sampler = StackSampler(interval=100.0)
+        sampler.start(10, reactor=clock)
+        self.assertTrue(sampler.running)
+        sampler.stacks["request;frame"] += 3
+
+        clock.advance(10)
+        self.assertFalse(sampler.running)
+        files = os.listdir(config.Profiling.BaseDirectory)
+        self.assertEqual(len(files), 1)
+        with open(os.path.join(config.Profiling.BaseDirectory, files[0])) as f:
+            self.assertEqual(f.read(), "request;frame 3\n")
+
+
+class SamplerCommandTests(TestCase):
+    """
+    Tests for the stack sampler commands of the stats socket.
+    """
+
+    def protocol(self, allowSampling):
+        factory = DashboardServer(FakeLogObserver(), None)
+        factory.sampler = FakeSamplerMaster()
+        factory.allowSampling = allowSampling
+        return factory.buildProtocol(None)
+
+    @inlineCallbacks
+    def test_notAllowed(self):
+        """
+        The sampler cannot be started from a stats socket that does not allow it.
+        """
+        protocol = self.protocol(False)
+        result = yield protocol.data_sampler_start(30)
+        self.assertIn("error", result)
+        result = yield protocol.data_sampler_stop()
+        self.assertIn("error", result)
+        self.assertEqual(protocol.factory.sampler.started, [])
+
+    @inlineCallbacks
+    def test_badSeconds(self):
+        """
+        A bad number of seconds is reported as an error rather than raised.
+        """
+        protocol = self.protocol(True)
+        for seconds in ("soon", None, 0):
+            result = yield protocol.data_sampler_start(seconds)
+            self.assertIn("error", result)
+        self.assertEqual(protocol.factory.sampler.started, [])
+
+        result = yield protocol.data_sampler_start("30", "3")
+        self.assertEqual(result, {"1": True})
+        self.assertEqual(protocol.factory.sampler.started, [(30, "3",)])
+
+    @inlineCallbacks
+    def test_badCommand(self):
+        """
+        A command with the wrong arguments, or a name that is not a string, gets a bad command
+        result without stopping the other commands in the request.
+        """
+        protocol = self.protocol(True)
+        lines = []
+        protocol.sendLine = lines.append
+        yield protocol.process_data([["slots", 1], 5, ["sampler_start", "30"], [["jobs"]]])
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0]), {
+            "slots": {"result": "bad command"},
+            "5": {"result": "bad command"},
+            "sampler_start": {"1": True},
+            '["jobs"]': {"result": "bad command"},
+        })
@@ -259,7 +259,11 @@ def storeFromConfig(config, txnFactory, directoryService):
     #
     notifierFactories = {}
     if config.Notifications.Enabled:
-        notifierFactories["push"] = NotifierFactory(config.ServerHostName, config.Notifications.CoalesceSeconds)
+        notifierFactories["push"] = NotifierFactory(
+            config.ServerHostName,
+            config.Notifications.CoalesceSeconds,
+            batchSeconds=config.Notifications.BatchSeconds,
+        )
 
     if config.EnableResponseCache and config.Memcached.Pools.Default.ClientEnabled:
         notifierFactories["cache"] = CacheStoreNotifierFactory()
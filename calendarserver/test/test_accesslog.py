@@ -14,9 +14,12 @@
 # limitations under the License.
 ##
 
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock
 from twisted.trial.unittest import TestCase
 from calendarserver.accesslog import SystemMonitor, \
-    RotatingFileAccessLoggingObserver
+    RotatingFileAccessLoggingObserver, AMPCommonAccessLoggingObserver, \
+    AMPLoggingProtocol, LogStatsBatch
 from twistedcaldav.stdconfig import config as stdconfig
 from twistedcaldav.config import config
 import time
@@ -25,6 +28,19 @@ import collections
 hasattr(stdconfig, "Servers")   # Quell pyflakes
 
 
+class RecordingAMP(object):
+    """
+    Records the remote calls made by an L{AMPCommonAccessLoggingObserver}.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def callRemote(self, command, **kwds):
+        self.calls.append((command, kwds,))
+        return succeed({})
+
+
 class AccessLog(TestCase):
     """
     Tests for L{calendarserver.accesslog}.
@@ -174,3 +190,118 @@ class AccessLog(TestCase):
         observer.stop()
         self.assertTrue("uid" not in stats)
         self.assertTrue("user-agent" not in stats)
+
+    def test_batchedStats(self):
+        """
+        L{AMPCommonAccessLoggingObserver} aggregates stats and log lines over
+        the batch interval and sends them in one call, which the master merges
+        into its current stats.
+        """
+
+        self.patch(config.Stats, "EnableUnixStatsSocket", True)
+        self.patch(config.Stats, "EnableTCPStatsSocket", False)
+
+        clock = Clock()
+        worker = AMPCommonAccessLoggingObserver(batchInterval=1.0, reactor=clock)
+        amp = RecordingAMP()
+        worker.addClient(amp)
+
+        for i, statusCode in enumerate((200, 207, 500,)):
+            worker.logStats({
+                "type": "access-log",
+                "log-format": "request %(index)d",
+                "index": i,
+                "method": "PROPFIND",
+                "uri": "/calendars/",
+                "statusCode": statusCode,
+                "t": 5.0 * (i + 1),
+            })
+        self.assertEqual(amp.calls, [])
+
+        clock.advance(1.0)
+        self.assertEqual(len(amp.calls), 1)
+        command, kwds = amp.calls[0]
+        self.assertTrue(command is LogStatsBatch)
+        self.assertEqual(kwds["lines"], ["request 0", "request 1", "request 2"])
+
+        logpath = self.mktemp()
+        master = RotatingFileAccessLoggingObserver(logpath)
+        master.start()
+        AMPLoggingProtocol(master).logStatsBatch(kwds["lines"], kwds["stats"])
+        stats = master.ensureSequentialStats()
+        master.stop()
+
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["500"], 1)
+        self.assertEqual(stats["t"], 30.0)
+        self.assertEqual(stats["T"]["<10ms"], 1)
+        self.assertEqual(stats["T"]["10ms<->100ms"], 2)
+        self.assertEqual(stats["T-MAX"], 15.0)
+        with open(logpath) as f:
+            self.assertIn("request 2", f.read())
+
+    def test_batchedSQLStats(self):
+        """
+        SQL statement stats sent with each request are merged over the batch and
+        in the master.
+        """
+
+        self.patch(config.Stats, "EnableUnixStatsSocket", True)
+        self.patch(config.Stats, "EnableTCPStatsSocket", False)
+        self.patch(config.Stats, "SQLStatementsReported", 1)
+
+        clock = Clock()
+        worker = AMPCommonAccessLoggingObserver(batchInterval=1.0, reactor=clock)
+        amp = RecordingAMP()
+        worker.addClient(amp)
+
+        for sql, t in (("select a", 5.0), ("select a", 500.0), ("select b", 1.0),):
+            worker.logStats({
+                "type": "access-log",
+                "log-format": "request",
+                "method": "GET",
+                "uri": "/",
+                "statusCode": 200,
+                "t": 10.0,
+                "sql": {sql: {"count": 1, "rows": 2, "t": t, "t-max": t, "T": {"<1ms": 1}}},
+            })
+        clock.advance(1.0)
+        _ignore_command, kwds = amp.calls[0]
+
+        logpath = self.mktemp()
+        master = RotatingFileAccessLoggingObserver(logpath)
+        master.start()
+        AMPLoggingProtocol(master).logStatsBatch(kwds["lines"], kwds["stats"])
+        stats = master.ensureSequentialStats()
+        master.stop()
+
+        self.assertEqual(set(stats["sql"].keys()), set(("select a", "(other)",)))
+        self.assertEqual(stats["sql"]["select a"]["count"], 2)
+        self.assertEqual(stats["sql"]["select a"]["rows"], 4)
+        self.assertEqual(stats["sql"]["select a"]["t"], 505.0)
+        self.assertEqual(stats["sql"]["select a"]["t-max"], 500.0)
+        self.assertEqual(stats["sql"]["select a"]["T"]["<1ms"], 2)
+        self.assertEqual(stats["sql"]["(other)"]["count"], 1)
+
+    def test_batchedLinesSplit(self):
+        """
+        Log lines in a batch are split across calls to stay under the AMP size
+        limit, with the stats sent only once.
+        """
+
+        self.patch(config.Stats, "EnableUnixStatsSocket", False)
+        self.patch(config.Stats, "EnableTCPStatsSocket", False)
+
+        worker = AMPCommonAccessLoggingObserver(batchInterval=1.0, reactor=Clock())
+        worker.maxBatchBytes = 30
+        amp = RecordingAMP()
+        worker.addClient(amp)
+        for i in range(5):
+            worker.logStats({"type": "access-log", "log-format": "line %(index)05d", "index": i})
+        worker.flushBatch()
+
+        self.assertEqual(
+            [kwds["lines"] for _ignore_command, kwds in amp.calls],
+            [["line 00000", "line 00001"], ["line 00002", "line 00003"], ["line 00004"]],
+        )
+        self.assertFalse(any(["stats" in kwds for _ignore_command, kwds in amp.calls]))
@@ -44,9 +44,13 @@ from __future__ import print_function
 from uuid import uuid4
 import collections
 import itertools
+import json
+import os
 import sys
+import tempfile
 import time
 import traceback
+import zlib
 
 from calendarserver.tools import tables
 from calendarserver.tools.cmdline import utilityMain, WorkerService
@@ -58,7 +62,8 @@ from pycalendar.period import Period
 from pycalendar.timezone import Timezone
 from twext.enterprise.dal.syntax import Select, Parameter, Count, Update
 from twext.python.log import Logger
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, gatherResults
+from twisted.internet.utils import getProcessValue
 from twisted.python import usage
 from twisted.python.usage import Options
 from twistedcaldav.datafilters.peruserdata import PerUserDataFilter
@@ -202,7 +207,7 @@ Component.validRecurrenceIDs = new_validRecurrenceIDs
 if not hasattr(Component, "maxAlarmCounts"):
     Component.hasDuplicateAlarms = new_hasDuplicateAlarms
 
-VERSION = "13"
+VERSION = "14"
 
 
 def printusage(e=None):
@@ -253,6 +258,17 @@ Options for all modes:
 --config   : caldavd.plist file for the server.
 -v         : verbose logging
 
+Options for --ical / --double:
+
+--workers    : number of worker processes to split the scan across. Events
+               (--ical) or calendar homes (--double) are divided between the
+               workers, each using its own store transactions, and their
+               results are merged into one summary.
+--checkpoint : file used to record progress. An interrupted scan re-run with
+               the same --checkpoint (and --workers) resumes where it stopped.
+               With --workers each worker uses this path with its worker
+               number appended.
+
 Options for --ical / --upgrade:
 
 --uuid     : only scan specified calendar homes. Can be a partial GUID
@@ -320,6 +336,9 @@ v12: Fix double-booking false positives caused by timezones-by-reference.
 
 v13: Add new options for --nuke and --ical. Add fix for invalid GEO.
 
+v14: Add --workers and --checkpoint for parallel, resumable --ical and
+     --double scans.
+
 """ % (VERSION,)
 
 
@@ -365,6 +384,9 @@ class CalVerifyOptions(Options):
         ['days', 'T', "365", "Number of days for scanning events into the future."],
         ['path', '', "", "Split event given its path."],
         ['rid', '', "", "Split date-time."],
+        ['workers', 'w', "0", "Number of worker processes to scan with."],
+        ['checkpoint', 'c', "", "Progress file for resuming a scan."],
+        ['shard', '', "", "Internal: the INDEX/COUNT of the shard a worker scans."],
     ]
 
     def __init__(self):
@@ -443,6 +465,135 @@ class CalVerifyService(WorkerService, object):
         """
         return self._directory
 
+    def workerCount(self):
+        """
+        The number of worker processes the scan is to be split across, or zero
+        to scan in this process.
+        """
+        return int(self.options.get("workers") or 0)
+
+    def shard(self):
+        """
+        The shard of the data this process is scanning.
+
+        @return: the shard index and the shard count, or C{None} if scanning
+            all the data
+        @rtype: C{tuple} of (C{int}, C{int}) or C{None}
+        """
+        shard = self.options.get("shard")
+        if not shard:
+            return None
+        index, count = shard.split("/")
+        return int(index), int(count)
+
+    def inShard(self, key):
+        """
+        Whether the item with the specified key is part of this process's shard.
+
+        @param key: a resource-id or calendar home owner UID
+        @type key: C{int} or C{str}
+        """
+        shard = self.shard()
+        if shard is None:
+            return True
+        if not isinstance(key, (int, long)):
+            key = zlib.crc32(key) & 0xffffffff
+        return key % shard[1] == shard[0]
+
+    def loadCheckpoint(self, path=None, shard=None):
+        """
+        Read the progress recorded in a checkpoint file. Progress recorded for
+        a different scan or shard is ignored.
+
+        @param path: the checkpoint file, defaults to C{--checkpoint}
+        @type path: C{str}
+        @param shard: the shard expected in the file, defaults to C{--shard}
+        @type shard: C{str}
+
+        @return: the recorded state or C{None}
+        @rtype: C{dict}
+        """
+        if path is None:
+            path = self.options.get("checkpoint")
+            shard = self.options.get("shard")
+        if not path or not os.path.exists(path):
+            return None
+        with open(path) as f:
+            state = json.load(f)
+        if state.get("title") != self.title() or state.get("shard") != shard:
+            return None
+        return state
+
+    def saveCheckpoint(self, state):
+        """
+        Record progress in the checkpoint file, if there is one. The file is
+        replaced atomically so an interruption never leaves a partial file.
+
+        @param state: the progress to record
+        @type state: C{dict}
+        """
+        path = self.options.get("checkpoint")
+        if not path:
+            return
+        state["title"] = self.title()
+        state["shard"] = self.options.get("shard")
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.rename(path + ".tmp", path)
+
+    @inlineCallbacks
+    def runWorkers(self):
+        """
+        Run this scan in L{workerCount} child processes, each scanning one shard
+        of the data with its own store and writing its progress and results to
+        its own checkpoint file. The output of each worker is copied to this
+        process's output.
+
+        @return: the final checkpoint state of each worker that completed its
+            shard
+        @rtype: C{list} of C{dict}
+        """
+        workers = self.workerCount()
+        checkpoint = self.options.get("checkpoint")
+        if not checkpoint:
+            checkpoint = os.path.join(tempfile.mkdtemp(prefix="calverify"), "checkpoint")
+        args = getattr(self.options, "args", sys.argv[1:])
+
+        self.output.write("\n---- Scanning with %d workers ----\n" % (workers,))
+        self.output.flush()
+        ds = []
+        for index in range(workers):
+            path = "%s.%d" % (checkpoint, index,)
+            ds.append(getProcessValue(
+                sys.executable,
+                ["-m", "calendarserver.tools.calverify"] + list(args) + [
+                    "--workers", "0",
+                    "--shard", "%d/%d" % (index, workers,),
+                    "--checkpoint", path,
+                    "--output", path + ".log",
+                ],
+                env=os.environ,
+                reactor=self.reactor,
+            ))
+        exitCodes = yield gatherResults(ds)
+
+        states = []
+        for index, exitCode in enumerate(exitCodes):
+            path = "%s.%d" % (checkpoint, index,)
+            if os.path.exists(path + ".log"):
+                with open(path + ".log") as f:
+                    self.output.write(f.read())
+            state = self.loadCheckpoint(path, "%d/%d" % (index, workers,))
+            if exitCode != 0 or state is None or not state.get("complete"):
+                self.output.write(
+                    "\nWorker %d did not complete its scan (exit code %s). Re-run with --checkpoint %s to resume.\n" % (
+                        index, exitCode, checkpoint,
+                    )
+                )
+            else:
+                states.append(state)
+        returnValue(states)
+
     @inlineCallbacks
     def getAllHomeUIDs(self):
         ch = schema.CALENDAR_HOME
@@ -979,6 +1130,16 @@ class BadDataService(CalVerifyService):
 
         self.tzid = Timezone(tzid=self.options["tzid"] if self.options["tzid"] else "America/Los_Angeles")
 
+        if self.workerCount() > 1:
+            states = yield self.runWorkers()
+            self.total = sum([state["total"] for state in states])
+            self.logResult("Number of events to process", self.total)
+            self.addSummaryBreak()
+            results_bad = [tuple(item) for item in itertools.chain(*[state["bad"] for state in states])]
+            yield self.reportCalendarDataCheck(results_bad, self.total)
+            self.printSummary()
+            returnValue(None)
+
         self.txn = self.store.newTransaction()
 
         if self.options["verbose"]:
@@ -1010,6 +1171,9 @@ class BadDataService(CalVerifyService):
         if self.options["verbose"]:
             self.output.write("%s time: %.1fs\n" % (descriptor, time.time() - t,))
 
+        # When running as a worker only scan the events in our shard
+        rows = [row for row in rows if self.inShard(row[1])]
+
         self.total = len(rows)
         self.logResult("Number of events to process", self.total)
         self.addSummaryBreak()
@@ -1035,6 +1199,20 @@ class BadDataService(CalVerifyService):
         total = len(rows)
         badlen = 0
         rjust = 10
+
+        # Scan in resource-id order so that progress can be checkpointed as the last resource-id done
+        last = None
+        if self.options.get("checkpoint"):
+            rows = sorted(rows, key=lambda row: row[1])
+            state = self.loadCheckpoint()
+            if state is not None:
+                results_bad = [tuple(item) for item in state["bad"]]
+                badlen = len(results_bad)
+                count = state["count"]
+                last = state["last"]
+                rows = [] if state["complete"] else [row for row in rows if row[1] > last]
+                self.output.write("Resuming after %d of %d resources\n" % (count, total,))
+
         for owner, resid, uid, calname, _ignore_md5, _ignore_organizer, _ignore_created, _ignore_modified in rows:
             try:
                 result, message = yield self.validCalendarData(resid, calname == "inbox")
@@ -1047,8 +1225,9 @@ class BadDataService(CalVerifyService):
                 results_bad.append((owner, uid, resid, message))
                 badlen += 1
             count += 1
+            last = resid
             if self.options["verbose"]:
-                if count == 1:
+                if resid == rows[0][1]:
                     self.output.write("Bad".rjust(rjust) + "Current".rjust(rjust) + "Total".rjust(rjust) + "Complete".rjust(rjust) + "\n")
                     last_output = time.time()
                 if divmod(count, 100)[1] == 0 or time.time() - last_output > 1:
@@ -1067,9 +1246,11 @@ class BadDataService(CalVerifyService):
             if divmod(count, 100)[1] == 0:
                 yield self.txn.commit()
                 self.txn = self.store.newTransaction()
+                self.saveCheckpoint({"last": last, "count": count, "total": total, "bad": results_bad, "complete": False})
 
         yield self.txn.commit()
         self.txn = None
+        self.saveCheckpoint({"last": last, "count": count, "total": total, "bad": results_bad, "complete": True})
         if self.options["verbose"]:
             self.output.write((
                 "\r" +
@@ -1079,6 +1260,21 @@ class BadDataService(CalVerifyService):
                 ("%d%%" % safePercent(count, total)).rjust(rjust)
             ).ljust(80) + "\n")
 
+        yield self.reportCalendarDataCheck(results_bad, total)
+
+        if self.options["verbose"]:
+            diff_time = time.time() - t
+            self.output.write("Time: %.2f s  Average: %.1f ms/resource\n" % (
+                diff_time,
+                safePercent(diff_time, total, 1000.0),
+            ))
+
+    @inlineCallbacks
+    def reportCalendarDataCheck(self, results_bad, total):
+        """
+        Print the table of resources with bad calendar data and add the count to the summary.
+        """
+
         # Print table of results
         table = tables.Table()
         table.addHeader(("Owner", "Event UID", "RID", "Problem",))
@@ -1097,13 +1293,6 @@ class BadDataService(CalVerifyService):
         self.results["Bad iCalendar data"] = results_bad
         table.printTable(os=self.output)
 
-        if self.options["verbose"]:
-            diff_time = time.time() - t
-            self.output.write("Time: %.2f s  Average: %.1f ms/resource\n" % (
-                diff_time,
-                safePercent(diff_time, total, 1000.0),
-            ))
-
     errorPrefix = "Calendar data had unfixable problems:\n  "
 
     @inlineCallbacks
@@ -2095,6 +2284,15 @@ class DoubleBookingService(CalVerifyService):
         # Check loop over uuid
         UUIDDetails = collections.namedtuple("UUIDDetails", ("uuid", "rname", "auto", "doubled",))
         self.uuid_details = []
+
+        if self.workerCount() > 1:
+            states = yield self.runWorkers()
+            for state in states:
+                self.uuid_details.extend([UUIDDetails(*item) for item in state["details"]])
+            if self.options["summary"]:
+                self.printDoubleBookingSummary()
+            returnValue(None)
+
         if len(self.options["uuid"]) != 36:
             self.txn = self.store.newTransaction()
             if self.options["uuid"]:
@@ -2111,6 +2309,15 @@ class DoubleBookingService(CalVerifyService):
         else:
             uuids = [self.options["uuid"], ]
 
+        # When running as a worker only scan the homes in our shard, skipping any already checkpointed
+        uuids = [uuid for uuid in uuids if self.inShard(uuid)]
+        state = self.loadCheckpoint()
+        if state is not None:
+            self.uuid_details = [UUIDDetails(*item) for item in state["details"]]
+            done = set([item.uuid for item in self.uuid_details])
+            uuids = [uuid for uuid in uuids if uuid not in done]
+            self.output.write("Resuming after %d homes\n" % (len(done),))
+
         count = 0
         for uuid in uuids:
             self.results = {}
@@ -2162,7 +2369,8 @@ class DoubleBookingService(CalVerifyService):
             else:
                 doubled = False
 
-            self.uuid_details.append(UUIDDetails(uuid, rname, autoScheduleMode, doubled))
+            self.uuid_details.append(UUIDDetails(uuid, rname, autoScheduleMode.description, doubled))
+            self.saveCheckpoint({"details": self.uuid_details, "complete": False})
 
             if not self.options["summary"]:
                 self.printSummary()
@@ -2170,27 +2378,35 @@ class DoubleBookingService(CalVerifyService):
                 self.output.write(" - %s\n" % ("Double-booked" if doubled else "OK",))
                 self.output.flush()
 
+        self.saveCheckpoint({"details": self.uuid_details, "complete": True})
+
         if self.options["summary"]:
-            table = tables.Table()
-            table.addHeader(("GUID", "Name", "Auto-Schedule", "Double-Booked",))
-            doubled = 0
-            for item in sorted(self.uuid_details):
-                if not item.doubled:
-                    continue
-                table.addRow((
-                    item.uuid,
-                    item.rname,
-                    item.autoScheduleMode,
-                    item.doubled,
-                ))
-                doubled += 1
-            table.addFooter(("Total", "", "", "%d of %d" % (doubled, len(self.uuid_details),),))
-            self.output.write("\n")
-            table.printTable(os=self.output)
+            self.printDoubleBookingSummary()
 
             if self.options["verbose"]:
                 self.output.write("%s time: %.1fs\n" % ("Summary", time.time() - ot,))
 
+    def printDoubleBookingSummary(self):
+        """
+        Print the table of homes with double-bookings.
+        """
+        table = tables.Table()
+        table.addHeader(("GUID", "Name", "Auto-Schedule", "Double-Booked",))
+        doubled = 0
+        for item in sorted(self.uuid_details):
+            if not item.doubled:
+                continue
+            table.addRow((
+                item.uuid,
+                item.rname,
+                item.auto,
+                item.doubled,
+            ))
+            doubled += 1
+        table.addFooter(("Total", "", "", "%d of %d" % (doubled, len(self.uuid_details),),))
+        self.output.write("\n")
+        table.printTable(os=self.output)
+
     @inlineCallbacks
     def getTimeRangeInfoWithUUID(self, uuid, start):
         co = schema.CALENDAR_OBJECT
@@ -3194,6 +3410,9 @@ def main(argv=sys.argv, stderr=sys.stderr, reactor=None):
     except usage.UsageError, e:
         printusage(e)
 
+    # Kept for starting worker processes with the same options
+    options.args = argv[1:]
+
     try:
         output = options.openOutput()
     except IOError, e:
@@ -628,6 +628,28 @@ class Aggregator(object):
             if key in serversdata[0]:
                 results[key] = Aggregator.dictValueSums(map(itemgetter(key), serversdata))
 
+        # Values that are summed dicts of dict values
+        for key in ("caches",):
+            if key in serversdata[0]:
+                results[key] = OrderedDict()
+                for server_data in map(itemgetter(key), serversdata):
+                    for name, counts in server_data.items():
+                        results[key][name] = Aggregator.dictValueSums((results[key].get(name, {}), counts,))
+
+        # SQL statement stats are summed apart from the maximum time
+        if "sql" in serversdata[0]:
+            results["sql"] = OrderedDict()
+            for server_data in map(itemgetter("sql"), serversdata):
+                for statement, stats in server_data.items():
+                    merged = results["sql"].get(statement)
+                    if merged is None:
+                        results["sql"][statement] = dict(stats)
+                    else:
+                        for item in ("count", "rows", "t",):
+                            merged[item] += stats[item]
+                        merged["t-max"] = max(merged["t-max"], stats["t-max"])
+                        merged["T"] = Aggregator.dictValueSums((merged["T"], stats["T"],))
+
         return results
 
     @staticmethod
@@ -1464,6 +1486,108 @@ class DirectoryStatsWindow(BaseWindow):
         self.window.refresh()
 
 
+class CachesWindow(BaseWindow):
+    """
+    Displays the activity of the server's in-process caches over the last minute.
+    """
+
+    help = "Caches"
+    clientItem = "stats"
+    stats_key = "1m"
+
+    windowTitle = "Caches (1m)"
+    formatWidth = 84
+    additionalRows = 4
+
+    def updateRowCount(self):
+        self.rowCount = len(defaultIfNone(self.clientData(), {}).get(self.stats_key, {}).get("caches", {}))
+
+    def update(self):
+        records = defaultIfNone(self.clientData(), {}).get(self.stats_key, {}).get("caches", {})
+        if len(records) != self.rowCount:
+            self.needsReset = True
+            return
+        self.iter += 1
+
+        s1 = " {:<30}{:>10}{:>10}{:>8}{:>12}{:>12} ".format(
+            "Cache", "Hits", "Misses", "Hit", "Evictions", "Memory"
+        )
+        s2 = " {:<30}{:>10}{:>10}{:>8}{:>12}{:>12} ".format(
+            "", "", "", "(%)", "", "(MB)"
+        )
+        pt = self.tableHeader((s1, s2,), len(records))
+
+        for name, counts in sorted(records.items(), key=lambda x: x[0]):
+            hits = counts.get("hits", 0)
+            misses = counts.get("misses", 0)
+            s = " {:<30}{:>10}{:>10}{:>7.1f}%{:>12}{:>12} ".format(
+                name,
+                hits,
+                misses,
+                safeDivision(float(hits), hits + misses, 100.0),
+                counts.get("evictions", 0),
+                "{:.1f}".format(counts["memory"] / (1000.0 * 1000.0)) if "memory" in counts else "-",
+            )
+            self.tableRow(s, pt)
+
+        self.window.refresh()
+        self.lastResult = records
+
+
+class SQLStatementsWindow(BaseWindow):
+    """
+    Displays the SQL statements that took the most time over the last minute.
+    """
+
+    help = "SQL Statements"
+    clientItem = "stats"
+    stats_key = "1m"
+
+    windowTitle = "SQL Statements (1m)"
+    formatWidth = 130
+    additionalRows = 4
+    maxStatements = 20
+
+    def updateRowCount(self):
+        self.rowCount = min(
+            len(defaultIfNone(self.clientData(), {}).get(self.stats_key, {}).get("sql", {})),
+            self.maxStatements,
+        )
+
+    def update(self):
+        records = defaultIfNone(self.clientData(), {}).get(self.stats_key, {}).get("sql", {})
+        if min(len(records), self.maxStatements) != self.rowCount:
+            self.needsReset = True
+            return
+        self.iter += 1
+
+        s1 = " {:<60}{:>10}{:>10}{:>12}{:>10}{:>10}{:>10}{:>8} ".format(
+            "Statement", "Count", "Rows", "Total", "Avg", "Max", "Over", "DB"
+        )
+        s2 = " {:<60}{:>10}{:>10}{:>12}{:>10}{:>10}{:>10}{:>8} ".format(
+            "", "", "", "(ms)", "(ms)", "(ms)", "100ms", "(%)"
+        )
+        pt = self.tableHeader((s1, s2,), self.rowCount)
+
+        total = sum([stats["t"] for stats in records.values()])
+        ordered = sorted(records.items(), key=lambda x: x[1]["t"], reverse=True)
+        for statement, stats in ordered[:self.maxStatements]:
+            s = " {:<60}{:>10}{:>10}{:>12.1f}{:>10.1f}{:>10.1f}{:>10}{:>7.1f}% ".format(
+                statement[:59],
+                stats["count"],
+                stats["rows"],
+                stats["t"],
+                safeDivision(stats["t"], stats["count"]),
+                stats["t-max"],
+                stats["T"].get("100ms<->1s", 0) + stats["T"].get(">1s", 0),
+                safeDivision(stats["t"], total, 100.0),
+            )
+            self.tableRow(s, pt)
+
+        self.window.refresh()
+        self.lastResult = records
+
+
 Dashboard.registerWindow(HelpWindow, "h")
 Dashboard.registerWindow(SystemWindow, "s")
 Dashboard.registerWindow(RequestStatsWindow, "r")
@@ -1472,6 +1596,8 @@ Dashboard.registerWindow(MethodsWindow, "m")
 Dashboard.registerWindow(AssignmentsWindow, "w")
 Dashboard.registerWindow(JobsWindow, "j")
 Dashboard.registerWindow(DirectoryStatsWindow, "d")
+Dashboard.registerWindow(CachesWindow, "k")
+Dashboard.registerWindow(SQLStatementsWindow, "b")
 
 Dashboard.registerWindowSet(SystemWindow, "H")
 Dashboard.registerWindowSet(RequestStatsWindow, "H")
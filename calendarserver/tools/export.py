@@ -43,12 +43,14 @@ import sys
 from calendarserver.tools.cmdline import utilityMain, WorkerService
 from twext.enterprise.dal.syntax import Select
 from twext.python.log import Logger
-from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed, \
+    gatherResults
 from twisted.python.text import wordWrap
 from twisted.python.usage import Options, UsageError
 from twistedcaldav import customxml
 from twistedcaldav.ical import Component, Property
 from twistedcaldav.stdconfig import DEFAULT_CONFIG_FILE
+from twistedcaldav.timezones import readVTZ, TimezoneException
 from txdav.base.propertystore.base import PropertyName
 from txdav.caldav.datastore.scheduling.utils import normalizeCUAddr
 from txdav.caldav.datastore.sql import Calendar
@@ -58,6 +60,9 @@ from txdav.xml import element as davxml
 
 log = Logger()
 
+# Number of object resources loaded from the store per query when exporting
+BATCH_SIZE = 50
+
 
 def usage(e=None):
     if e:
@@ -100,6 +105,8 @@ class ExportOptions(Options):
 
     optParameters = [
         ['config', 'f', DEFAULT_CONFIG_FILE, "Specify caldavd.plist configuration path."],
+        ['batch-size', 'b', str(BATCH_SIZE), "Number of resources to load from the store at a time."],
+        ['parallel', 'p', "4", "Number of homes to export concurrently with --all."],
     ]
 
     def __init__(self):
@@ -192,6 +199,15 @@ class ExportOptions(Options):
         else:
             self.exportAllType = "VCARD"
 
+    def postOptions(self):
+        for key in ("batch-size", "parallel"):
+            try:
+                self[key] = int(self[key])
+            except ValueError:
+                raise UsageError("--{} must be an integer".format(key))
+            if self[key] < 1:
+                raise UsageError("--{} must be at least 1".format(key))
+
     def openOutput(self):
         """
         Open the appropriate output file based on the '--output' option.
@@ -306,40 +322,163 @@ class DirectoryExporter(_ExporterBase):
 
 
 @inlineCallbacks
-def exportToFile(calendars, fileobj, convertToMailto=False):
+def objectResourceBatches(collection, batchSize=None):
+    """
+    Load the object resources of a collection a batch at a time, so that only
+    one batch of resources (and their data) needs to be in memory at once. The
+    resources are not cached on the collection.
+
+    @param collection: the calendar or address book to load from
+    @type collection: L{CommonHomeChild}
+
+    @param batchSize: the number of resources per batch, or C{None} for
+        L{BATCH_SIZE}
+    @type batchSize: C{int}
+
+    @return: a L{Deferred} that fires with a C{list} of C{list}s of resource
+        names, each of which can be passed to L{loadObjectResources}
+    """
+    if batchSize is None:
+        batchSize = BATCH_SIZE
+    names = yield collection.listObjectResources()
+    returnValue([names[i:i + batchSize] for i in range(0, len(names), batchSize)])
+
+
+def loadObjectResources(collection, names):
+    """
+    Load the named object resources of a collection without caching them on
+    the collection.
+    """
+    return collection._objectResourceClass.loadAllObjectsWithNames(collection, names)
+
+
+class CalendarStreamWriter(object):
+    """
+    Write a single C{VCALENDAR} to a file one component at a time, rather than
+    building the whole calendar in memory and serializing it at the end.
+
+    Each C{VTIMEZONE} is written once, ahead of the first component that
+    refers to it.
+
+    @ivar fileobj: the file being written to
+    @ivar convertToMailto: whether to convert calendar user addresses to
+        C{mailto:} form
+    @ivar timezones: the TZIDs of the C{VTIMEZONE}s written so far
+    @type timezones: C{set} of C{str}
+    """
+
+    END = "END:VCALENDAR\r\n"
+
+    def __init__(self, fileobj, convertToMailto=False):
+        self.fileobj = fileobj
+        self.convertToMailto = convertToMailto
+        self.timezones = set()
+
+    def begin(self, properties=()):
+        """
+        Write the start of the C{VCALENDAR} and its properties.
+
+        @param properties: extra properties for the C{VCALENDAR}
+        @type properties: iterable of L{Property}
+        """
+        header = Component.newCalendar()
+        for prop in properties:
+            header.addProperty(prop)
+        text = str(header)
+        assert text.endswith(self.END), "Unexpected calendar data: {!r}".format(text)
+        self.fileobj.write(text[:-len(self.END)])
+
+    def end(self):
+        """
+        Write the end of the C{VCALENDAR}.
+        """
+        self.fileobj.write(self.END)
+
+    def write(self, calendar):
+        """
+        Write the components of a calendar object's data, preceded by any
+        C{VTIMEZONE}s they use that have not been written yet.
+
+        @param calendar: calendar object data
+        @type calendar: L{Component}
+        """
+        embedded = {}
+        subcomponents = []
+        for sub in calendar.subcomponents():
+            if sub.name() == "VTIMEZONE":
+                embedded[sub.propertyValue("TZID")] = sub
+            else:
+                subcomponents.append(sub)
+
+        tzids = set(embedded.keys())
+        tzids.update(calendar.timezoneIDs())
+        for tzid in sorted(tzids - self.timezones):
+            self.timezones.add(tzid)
+            vtimezone = embedded.get(tzid)
+            if vtimezone is None:
+                try:
+                    tzcal = Component(None, pycalendar=readVTZ(tzid))
+                except TimezoneException:
+                    log.warn("Unknown time zone: {tzid}", tzid=tzid)
+                    continue
+                for vtimezone in tzcal.subcomponents():
+                    if vtimezone.name() == "VTIMEZONE":
+                        break
+                else:
+                    continue
+            self.fileobj.write(str(vtimezone))
+
+        for sub in subcomponents:
+            if self.convertToMailto:
+                convertCUAsToMailto(sub)
+            self.fileobj.write(str(sub))
+
+    @inlineCallbacks
+    def writeCollection(self, collection, batchSize=None):
+        """
+        Write every calendar object in a calendar as its owner would see it.
+
+        @param collection: the calendar to export
+        @type collection: L{Calendar}
+        """
+        homeUID = collection.ownerCalendarHome().uid()
+        for names in (yield objectResourceBatches(collection, batchSize)):
+            for obj in (yield loadObjectResources(collection, names)):
+                evt = yield obj.filteredComponent(homeUID, True)
+                self.write(evt)
+
+
+@inlineCallbacks
+def exportToFile(calendars, fileobj, convertToMailto=False, batchSize=None):
     """
     Export some calendars to a file as their owner would see them.
 
+    The calendar data is written as it is read, so memory use is bounded by
+    C{batchSize} rather than the size of the export.
+
     @param calendars: an iterable of L{ICalendar} providers (or L{Deferred}s of
         same).
 
     @param fileobj: an object with a C{write} method that will accept some
         iCalendar data.
 
+    @param batchSize: the number of calendar objects to load at a time, or
+        C{None} for L{BATCH_SIZE}.
+
     @return: a L{Deferred} which fires when the export is complete.  (Note that
         the file will not be closed.)
     @rtype: L{Deferred} that fires with C{None}
     """
-    comp = Component.newCalendar()
+    writer = CalendarStreamWriter(fileobj, convertToMailto)
+    writer.begin()
     for calendar in calendars:
         calendar = yield calendar
-        for obj in (yield calendar.calendarObjects()):
-            evt = yield obj.filteredComponent(
-                calendar.ownerCalendarHome().uid(), True
-            )
-            for sub in evt.subcomponents():
-                if sub.name() != 'VTIMEZONE':
-                    # Omit all VTIMEZONE components here - we will include them later
-                    # when we serialize the whole calendar.
-                    if convertToMailto:
-                        convertCUAsToMailto(sub)
-                    comp.addComponent(sub)
-
-    fileobj.write(comp.getTextWithTimezones(True))
+        yield writer.writeCollection(calendar, batchSize)
+    writer.end()
 
 
 @inlineCallbacks
-def exportToDirectory(collections, dirname, convertToMailto=False):
+def exportToDirectory(collections, dirname, convertToMailto=False, batchSize=None):
     """
     Export some calendars to a file as their owner would see them.
 
@@ -349,6 +488,9 @@ def exportToDirectory(collections, dirname, convertToMailto=False):
     @param dirname: the path to a directory to store calendar files in; each
         calendar being exported will have its own .ics file
 
+    @param batchSize: the number of objects to load at a time, or C{None} for
+        L{BATCH_SIZE}.
+
     @return: a L{Deferred} which fires when the export is complete.  (Note that
         the file will not be closed.)
     @rtype: L{Deferred} that fires with C{None}
@@ -360,7 +502,7 @@ def exportToDirectory(collections, dirname, convertToMailto=False):
             homeUID = collection.ownerCalendarHome().uid()
 
             calendarProperties = collection.properties()
-            comp = Component.newCalendar()
+            properties = []
             for element, propertyName in (
                 (davxml.DisplayName, "NAME"),
                 (customxml.CalendarColor, "COLOR"),
@@ -368,33 +510,27 @@ def exportToDirectory(collections, dirname, convertToMailto=False):
 
                 value = calendarProperties.get(PropertyName.fromElement(element), None)
                 if value:
-                    comp.addProperty(Property(propertyName, str(value)))
+                    properties.append(Property(propertyName, str(value)))
 
             source = "/calendars/__uids__/{}/{}/".format(homeUID, collection.name())
-            comp.addProperty(Property("SOURCE", source))
-
-            for obj in (yield collection.calendarObjects()):
-                evt = yield obj.filteredComponent(homeUID, True)
-                for sub in evt.subcomponents():
-                    if sub.name() != 'VTIMEZONE':
-                        # Omit all VTIMEZONE components here - we will include them later
-                        # when we serialize the whole calendar.
-                        if convertToMailto:
-                            convertCUAsToMailto(sub)
-                        comp.addComponent(sub)
+            properties.append(Property("SOURCE", source))
 
             filename = os.path.join(dirname, "{}_{}.ics".format(homeUID, collection.name()))
             with open(filename, 'wb') as fileobj:
-                fileobj.write(comp.getTextWithTimezones(True))
+                writer = CalendarStreamWriter(fileobj, convertToMailto)
+                writer.begin(properties)
+                yield writer.writeCollection(collection, batchSize)
+                writer.end()
 
         else: # addressbook
 
             homeUID = collection.ownerAddressBookHome().uid()
             filename = os.path.join(dirname, "{}_{}.vcf".format(homeUID, collection.name()))
             with open(filename, 'wb') as fileobj:
-                for obj in (yield collection.addressbookObjects()):
-                    vcard = yield obj.component()
-                    fileobj.write(vcard.getText())
+                for names in (yield objectResourceBatches(collection, batchSize)):
+                    for obj in (yield loadObjectResources(collection, names)):
+                        vcard = yield obj.component()
+                        fileobj.write(vcard.getText())
 
 
 def convertCUAsToMailto(comp):
@@ -429,45 +565,84 @@ class ExporterService(WorkerService, object):
         """
         Do the export, stopping the reactor when done.
         """
-        txn = self.store.newTransaction()
-
-        if self.options.exportAll:
-            if self.options.exportAllType == "VEVENT":
-                homeTable = schema.CALENDAR_HOME
-            else:
-                homeTable = schema.ADDRESSBOOK_HOME
-
-            rows = (yield Select(
-                [homeTable.OWNER_UID, ],
-                From=homeTable,
-            ).on(txn))
-            for uid in [row[0] for row in rows]:
-                self.options.exporters.append(UIDExporter(uid, exportType=self.options.exportAllType))
-
         try:
+            if self.options.exportAll:
+                if self.options.exportAllType == "VEVENT":
+                    homeTable = schema.CALENDAR_HOME
+                else:
+                    homeTable = schema.ADDRESSBOOK_HOME
 
-            allCollections = itertools.chain(
-                *[(yield exporter.listCollections(txn, self)) for exporter in
-                  self.options.exporters]
-            )
+                txn = self.store.newTransaction()
+                rows = (yield Select(
+                    [homeTable.OWNER_UID, ],
+                    From=homeTable,
+                ).on(txn))
+                yield txn.commit()
+                for uid in [row[0] for row in rows]:
+                    self.options.exporters.append(UIDExporter(uid, exportType=self.options.exportAllType))
 
             if self.options.outputDirectoryName:
                 dirname = self.options.outputDirectoryName
                 if os.path.exists(dirname):
                     shutil.rmtree(dirname)
                 os.mkdir(dirname)
-                yield exportToDirectory(allCollections, dirname, self.options.convertToMailto)
+                writer = None
             else:
-                yield exportToFile(allCollections, self.output, self.options.convertToMailto)
+                writer = CalendarStreamWriter(self.output, self.options.convertToMailto)
+                writer.begin()
+
+            # Each home is exported in its own transaction so that nothing it
+            # caches outlives the export of that home. With --all, a few homes
+            # are exported at once.
+            parallel = self.options["parallel"] if self.options.exportAll else 1
+            exporters = iter(self.options.exporters)
+            yield gatherResults([
+                self.exportHomes(exporters, writer) for _ignore in range(parallel)
+            ])
+
+            if writer is not None:
+                writer.end()
                 self.output.close()
-
-            yield txn.commit()
-            # TODO: should be read-only, so commit/abort shouldn't make a
-            # difference.  commit() for now, in case any transparent cache /
-            # update stuff needed to happen, don't want to undo it.
         except:
             log.failure("doWork()")
 
+    @inlineCallbacks
+    def exportHomes(self, exporters, writer):
+        """
+        Export homes until there are none left. Several of these may share one
+        iterator of exporters to export homes concurrently.
+
+        @param exporters: the exporters still to be run
+        @type exporters: iterator of L{_ExporterBase}
+
+        @param writer: the writer for a single output file, or C{None} when
+            exporting to a directory
+        @type writer: L{CalendarStreamWriter}
+        """
+        batchSize = self.options["batch-size"]
+        for exporter in exporters:
+            txn = self.store.newTransaction(label="Export")
+            try:
+                collections = yield exporter.listCollections(txn, self)
+                if writer is None:
+                    yield exportToDirectory(
+                        collections,
+                        self.options.outputDirectoryName,
+                        self.options.convertToMailto,
+                        batchSize,
+                    )
+                else:
+                    for collection in collections:
+                        yield writer.writeCollection(collection, batchSize)
+            except:
+                log.failure("Export failed")
+                yield txn.abort()
+            else:
+                # TODO: should be read-only, so commit/abort shouldn't make a
+                # difference.  commit() for now, in case any transparent cache /
+                # update stuff needed to happen, don't want to undo it.
+                yield txn.commit()
+
     def directoryService(self):
         """
         Get an appropriate directory service.
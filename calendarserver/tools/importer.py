@@ -26,21 +26,26 @@ therefore does not apply any of the access restrictions that the server would.
 
 from __future__ import print_function
 
+import json
 import os
 import sys
+import time
 import uuid
 
 from calendarserver.tools.cmdline import utilityMain, WorkerService
 from twext.python.log import Logger
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed
 from twisted.python.text import wordWrap
 from twisted.python.usage import Options, UsageError
 from twistedcaldav import customxml
+from twistedcaldav.config import config
 from twistedcaldav.ical import Component
 from twistedcaldav.stdconfig import DEFAULT_CONFIG_FILE
 from twistedcaldav.timezones import TimezoneCache
+from twistedcaldav.util import LRUCache
 from txdav.base.propertystore.base import PropertyName
 from txdav.caldav.datastore.scheduling.cuaddress import LocalCalendarUser
+from txdav.caldav.datastore.scheduling.implicit import ImplicitScheduler
 from txdav.caldav.datastore.scheduling.itip import iTipGenerator
 from txdav.caldav.datastore.scheduling.processing import ImplicitProcessor
 from txdav.caldav.icalendarstore import ComponentUpdateState
@@ -49,6 +54,9 @@ from txdav.xml import element as davxml
 
 log = Logger()
 
+# Number of events stored per transaction in a --bulk import
+BULK_BATCH_SIZE = 100
+
 
 def usage(e=None):
     if e:
@@ -89,10 +97,15 @@ class ImportOptions(Options):
 
     optFlags = [
         ['debug', 'D', "Debug logging."],
+        ['bulk', 'B', "Bulk import: store events in batches and cache directory lookups."],
     ]
 
     optParameters = [
         ['config', 'f', DEFAULT_CONFIG_FILE, "Specify caldavd.plist configuration path."],
+        ['batch-size', 'b', None, "Number of events to store per transaction (default: 1, or {} with --bulk).".format(BULK_BATCH_SIZE)],
+        ['checkpoint', 'c', None, "Record progress in this file, and resume from the progress recorded there."],
+        ['defer-scheduling', None, None, "Store events without implicit scheduling, recording what is needed in this file for a later --schedule run."],
+        ['schedule', None, None, "Do the implicit scheduling recorded in this file by a --defer-scheduling import, instead of importing."],
     ]
 
     def __init__(self):
@@ -100,6 +113,19 @@ class ImportOptions(Options):
         self.inputName = '-'
         self.inputDirectoryName = None
 
+    def postOptions(self):
+        if self["batch-size"] is None:
+            self["batch-size"] = BULK_BATCH_SIZE if self["bulk"] else 1
+        else:
+            try:
+                self["batch-size"] = int(self["batch-size"])
+            except ValueError:
+                raise UsageError("--batch-size must be an integer")
+            if self["batch-size"] < 1:
+                raise UsageError("--batch-size must be at least 1")
+        if self["schedule"] and self["defer-scheduling"]:
+            raise UsageError("--schedule and --defer-scheduling cannot be used together")
+
     def opt_directory(self, dirname):
         """
         Specify input directory path.
@@ -144,8 +170,150 @@ def getCollectionPropertyValue(collection, element):
         return None
 
 
+def cacheCalendarUserAddressLookups(directory, maxRecords=None):
+    """
+    Make calendar user address lookups on a directory service remember their
+    results (including unknown addresses) for the rest of the process, so that
+    the organizer and attendees of each imported event, which tend to be the
+    same few users, are only looked up once. The directory's
+    C{recordWithCalendarUserAddress} is patched, so the lookups done by
+    implicit scheduling in the store are cached too.
+
+    This is only suitable for tools such as this one, which run for a fixed
+    job during which the directory is not expected to change.
+
+    @param directory: the directory service
+    @type directory: L{IDirectoryService}
+    @param maxRecords: the maximum number of addresses remembered, defaulting
+        to C{DirectoryCaching.MaxRecords}
+    @type maxRecords: C{int}
+    """
+    if hasattr(directory, "_uncached_recordWithCalendarUserAddress"):
+        return
+
+    lookup = directory._uncached_recordWithCalendarUserAddress = directory.recordWithCalendarUserAddress
+    cache = LRUCache(maxRecords if maxRecords is not None else config.DirectoryCaching.MaxRecords)
+
+    def recordWithCalendarUserAddress(address, timeoutSeconds=None):
+        if address in cache:
+            return succeed(cache.get(address))
+
+        def _cache(record):
+            cache.set(address, record)
+            return record
+        return lookup(address, timeoutSeconds=timeoutSeconds).addCallback(_cache)
+
+    directory.recordWithCalendarUserAddress = recordWithCalendarUserAddress
+
+
+class ImportProgress(object):
+    """
+    Reports the progress of an import, and records it in a checkpoint file so
+    that an interrupted import can be resumed. Progress is recorded as the
+    number of events (grouped by UID) of each imported calendar that have been
+    committed, so resuming skips those events in the same input.
+
+    @ivar path: the checkpoint file, or C{None} to only report progress
+    @type path: C{str}
+    @ivar offsets: the number of events committed for each calendar, keyed by
+        its SOURCE
+    @type offsets: C{dict}
+    """
+
+    def __init__(self, path=None, output=None):
+        self.path = path
+        self.output = output
+        self.offsets = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.offsets = json.load(f)
+        self.started = None
+
+    def begin(self, source, total):
+        """
+        Start importing a calendar.
+
+        @param source: the calendar's SOURCE
+        @type source: C{str}
+        @param total: the number of events in the calendar
+        @type total: C{int}
+
+        @return: the number of events to skip because they were imported
+            before
+        @rtype: C{int}
+        """
+        self.started = (time.time(), self.offsets.get(source, 0))
+        if self.started[1]:
+            print(
+                "Resuming {} after {} of {} events".format(source, self.started[1], total),
+                file=self.output
+            )
+        return self.started[1]
+
+    def update(self, source, offset, total):
+        """
+        Record that the first C{offset} events of a calendar are committed.
+        """
+        self.offsets[source] = offset
+        if self.path is not None:
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.offsets, f)
+            os.rename(self.path + ".tmp", self.path)
+
+        elapsed = time.time() - self.started[0]
+        rate = (offset - self.started[1]) / elapsed if elapsed else 0.0
+        print(
+            "Progress: {} {} of {} events ({:.1f}/s)".format(source, offset, total, rate),
+            file=self.output
+        )
+
+
+class SchedulingBacklog(object):
+    """
+    The implicit scheduling skipped by a C{--defer-scheduling} import, stored
+    as one JSON object per line so that L{processSchedulingBacklog} can do it
+    later. Organizer events are recorded by their object resource; events
+    imported for an attendee are recorded by UID and organizer, so that the
+    attendee's copy in the store can be sent to the organizer.
+
+    @ivar path: the backlog file
+    @type path: C{str}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+
+    def addOrganizerEvent(self, homeUID, calendarName, resourceName):
+        self.entries.append({
+            "type": "organizer",
+            "home": homeUID,
+            "calendar": calendarName,
+            "resource": resourceName,
+        })
+
+    def addAttendeeEvent(self, homeUID, uid, organizerUID):
+        self.entries.append({
+            "type": "attendee",
+            "home": homeUID,
+            "uid": uid,
+            "organizer": organizerUID,
+        })
+
+    def flush(self):
+        """
+        Append the entries added since the last flush to the file. This is
+        called once the events they refer to are committed.
+        """
+        if self.entries:
+            with open(self.path, "a") as f:
+                for entry in self.entries:
+                    f.write(json.dumps(entry) + "\n")
+            self.entries = []
+
+
 @inlineCallbacks
-def importCollectionComponent(store, component):
+def importCollectionComponent(store, component, batchSize=1, backlog=None, progress=None):
     """
     Import a component representing a collection (e.g. VCALENDAR) into the
     store.
@@ -165,6 +333,14 @@ def importCollectionComponent(store, component):
     @type store: L{IDataStore}
     @param component: The component to store
     @type component: L{twistedcaldav.ical.Component}
+    @param batchSize: The number of objects to store per transaction
+    @type batchSize: C{int}
+    @param backlog: If not C{None}, implicit scheduling is not done, and what
+        is needed to do it later is recorded here instead
+    @type backlog: L{SchedulingBacklog}
+    @param progress: If not C{None}, used to report progress and skip objects
+        imported by an earlier, interrupted run
+    @type progress: L{ImportProgress}
     """
 
     sourceURI = component.propertyValue("SOURCE")
@@ -197,93 +373,182 @@ def importCollectionComponent(store, component):
             )
     yield txn.commit()
 
-    # Populate the collection; NB we use a txn for each object, and we might
-    # want to batch them?
+    # Populate the collection, batchSize objects per txn. Replies from an
+    # attendee's copy are sent to the organizer once that copy is committed.
     groupedComponents = Component.componentsFromComponent(component)
-    for groupedComponent in groupedComponents:
+    total = len(groupedComponents)
+    skip = progress.begin(sourceURI, total) if progress is not None else 0
+    batch = []
+    replies = []
+
+    @inlineCallbacks
+    def storeBatch(offset):
+        yield storeComponentsInHomeAndCalendar(
+            store, batch, ownerUID, collectionResourceName
+        )
+
+        # Now use the iTip reply processing to update the organizer's copy
+        # with the PARTSTATs from the component we're restoring.
+        for attendeeComponent, organizerRecord in replies:
+            txn = store.newTransaction()
+            yield sendRestoreReply(txn, attendeeComponent, ownerRecord, organizerRecord)
+            yield txn.commit()
+
+        if backlog is not None:
+            backlog.flush()
+        if progress is not None:
+            progress.update(sourceURI, offset + 1, total)
+        del batch[:]
+        del replies[:]
+
+    for offset in range(skip, total):
+        groupedComponent = groupedComponents[offset]
 
         try:
             uid = list(groupedComponent.subcomponents())[0].propertyValue("UID")
         except:
-            continue
+            uid = None
 
-        # If event is unscheduled or the organizer matches homeUID, store the
-        # component
+        if uid is not None:
+            # If event is unscheduled or the organizer matches homeUID, store the
+            # component
 
-        print("Event UID: {}".format(uid))
-        storeDirectly = True
-        organizer = groupedComponent.getOrganizer()
-        if organizer is not None:
-            organizerRecord = yield dir.recordWithCalendarUserAddress(organizer)
-            if organizerRecord is None:
+            print("Event UID: {}".format(uid))
+            resourceName = "{}.ics".format(str(uuid.uuid4()))
+            organizerRecord = None
+            organizer = groupedComponent.getOrganizer()
+            if organizer is not None:
+                organizerRecord = yield dir.recordWithCalendarUserAddress(organizer)
+
+            if organizer is not None and organizerRecord is None:
                 # Organizer does not exist, so skip this event
-                continue
+                pass
+
+            elif organizerRecord is None or ownerRecord.uid == organizerRecord.uid:
+                if backlog is not None and organizerRecord is not None:
+                    state = ComponentUpdateState.ORGANIZER_ITIP_UPDATE
+                    backlog.addOrganizerEvent(ownerUID, collectionResourceName, resourceName)
+                else:
+                    state = ComponentUpdateState.NORMAL
+                batch.append((uid, groupedComponent, resourceName, state))
+
             else:
-                if ownerRecord.uid != organizerRecord.uid:
-                    # Owner is not the organizer
-                    storeDirectly = False
+                # Owner is an attendee, not the organizer
+                # Apply the PARTSTATs from the import and from the possibly
+                # existing event (existing event takes precedence) to the
+                # organizer's copy.
 
-        if storeDirectly:
-            resourceName = "{}.ics".format(str(uuid.uuid4()))
-            try:
-                yield storeComponentInHomeAndCalendar(
-                    store, groupedComponent, ownerUID, collectionResourceName,
-                    resourceName
-                )
-                print("Imported: {}".format(uid))
-            except UIDExistsError:
-                # That event is already in the home
-                print("Skipping since UID already exists: {}".format(uid))
-
-            except Exception, e:
-                print(
-                    "Failed to import due to: {error}\n{comp}".format(
-                        error=e,
-                        comp=groupedComponent
-                    )
-                )
+                # Put the attendee copy into the right calendar now otherwise it
+                # could end up on the default calendar when the change to the
+                # organizer's copy causes an attendee update
+                batch.append((uid, groupedComponent, resourceName, ComponentUpdateState.ATTENDEE_ITIP_UPDATE))
+                if backlog is not None:
+                    backlog.addAttendeeEvent(ownerUID, uid, organizerRecord.uid)
+                else:
+                    replies.append((groupedComponent, organizerRecord))
+
+        if len(batch) >= batchSize or offset == total - 1:
+            yield storeBatch(offset)
 
+
+@inlineCallbacks
+def sendRestoreReply(txn, component, attendeeRecord, organizerRecord):
+    """
+    Update the organizer's copy of an event with the PARTSTATs in an attendee's
+    copy, using iTIP reply processing.
+
+    @param component: the attendee's copy of the event
+    @type component: L{twistedcaldav.ical.Component}
+    """
+    attendeeCUA = attendeeRecord.canonicalCalendarUserAddress()
+    organizerCUA = organizerRecord.canonicalCalendarUserAddress()
+    processor = ImplicitProcessor()
+    newComponent = iTipGenerator.generateAttendeeReply(component, attendeeCUA, method="X-RESTORE")
+    if newComponent is not None:
+        yield processor.doImplicitProcessing(
+            txn,
+            newComponent,
+            LocalCalendarUser(attendeeCUA, attendeeRecord),
+            LocalCalendarUser(organizerCUA, organizerRecord)
+        )
+
+
+@inlineCallbacks
+def storeComponentsInHomeAndCalendar(store, batch, homeUID, collectionResourceName):
+    """
+    Add a batch of components to the store as object resources in one
+    transaction, reporting the outcome for each. Components whose UID is
+    already in use in the home are skipped. If anything else goes wrong, the
+    transaction is abandoned and the components are stored one per
+    transaction instead, so that one bad component only loses itself.
+
+    @param store: The db store to add the components to
+    @type store: L{IDataStore}
+    @param batch: The components to store, each as a tuple of its UID, the
+        component, the name of its object resource and the
+        L{ComponentUpdateState} to store it with
+    @type batch: C{list} of C{tuple}
+    @param homeUID: uid of the home collection
+    @type homeUID: C{str}
+    @param collectionResourceName: name of the collection resource
+    @type collectionResourceName: C{str}
+    """
+    if len(batch) > 1:
+        txn = store.newTransaction(label="Import batch")
+        try:
+            home = yield txn.calendarHomeWithUID(homeUID, create=True)
+            collection = yield home.childWithName(collectionResourceName)
+            if not collection:
+                collection = yield home.createChildWithName(collectionResourceName)
+            existing = []
+            for uid, component, objectResourceName, state in batch:
+                try:
+                    yield collection._createCalendarObjectWithNameInternal(
+                        objectResourceName, component, state
+                    )
+                except UIDExistsError:
+                    existing.append(uid)
+            yield txn.commit()
+        except Exception, e:
+            log.error("Import batch failed, retrying individually: {ex}", ex=e)
+            yield txn.abort()
         else:
-            # Owner is an attendee, not the organizer
-            # Apply the PARTSTATs from the import and from the possibly
-            # existing event (existing event takes precedence) to the
-            # organizer's copy.
-
-            # Put the attendee copy into the right calendar now otherwise it
-            # could end up on the default calendar when the change to the
-            # organizer's copy causes an attendee update
-            resourceName = "{}.ics".format(str(uuid.uuid4()))
-            try:
-                yield storeComponentInHomeAndCalendar(
-                    store, groupedComponent, ownerUID, collectionResourceName,
-                    resourceName, asAttendee=True
-                )
-                print("Imported: {}".format(uid))
-            except UIDExistsError:
-                # No need since the event is already in the home
-                pass
+            for uid, _ignore_component, _ignore_name, state in batch:
+                _reportStored(uid, state, uid in existing)
+            returnValue(None)
 
-            # Now use the iTip reply processing to update the organizer's copy
-            # with the PARTSTATs from the component we're restoring.
-            attendeeCUA = ownerRecord.canonicalCalendarUserAddress()
-            organizerCUA = organizerRecord.canonicalCalendarUserAddress()
-            processor = ImplicitProcessor()
-            newComponent = iTipGenerator.generateAttendeeReply(groupedComponent, attendeeCUA, method="X-RESTORE")
-            if newComponent is not None:
-                txn = store.newTransaction()
-                yield processor.doImplicitProcessing(
-                    txn,
-                    newComponent,
-                    LocalCalendarUser(attendeeCUA, ownerRecord),
-                    LocalCalendarUser(organizerCUA, organizerRecord)
+    for uid, component, objectResourceName, state in batch:
+        try:
+            yield storeComponentInHomeAndCalendar(
+                store, component, homeUID, collectionResourceName,
+                objectResourceName, internal_state=state
+            )
+            _reportStored(uid, state, False)
+        except UIDExistsError:
+            _reportStored(uid, state, True)
+
+        except Exception, e:
+            print(
+                "Failed to import due to: {error}\n{comp}".format(
+                    error=e,
+                    comp=component
                 )
-                yield txn.commit()
+            )
+
+
+def _reportStored(uid, state, uidExists):
+    if not uidExists:
+        print("Imported: {}".format(uid))
+    elif state != ComponentUpdateState.ATTENDEE_ITIP_UPDATE:
+        # That event is already in the home (no need to say so for an
+        # attendee's copy, since the organizer is still updated)
+        print("Skipping since UID already exists: {}".format(uid))
 
 
 @inlineCallbacks
 def storeComponentInHomeAndCalendar(
     store, component, homeUID, collectionResourceName, objectResourceName,
-    asAttendee=False
+    asAttendee=False, internal_state=None
 ):
     """
     Add a component to the store as an objectResource
@@ -302,24 +567,77 @@ def storeComponentInHomeAndCalendar(
     @type collectionResourceName: C{str}
     @param objectResourceName: name of the objectresource
     @type objectResourceName: C{str}
+    @param internal_state: how to store the component, overriding
+        C{asAttendee}
+    @type internal_state: L{ComponentUpdateState}
     """
-    txn = store.newTransaction()
-    home = yield txn.calendarHomeWithUID(homeUID, create=True)
-    collection = yield home.childWithName(collectionResourceName)
-    if not collection:
-        collection = yield home.createChildWithName(collectionResourceName)
-
-    yield collection._createCalendarObjectWithNameInternal(
-        objectResourceName, component,
-        (
+    if internal_state is None:
+        internal_state = (
             ComponentUpdateState.ATTENDEE_ITIP_UPDATE
             if asAttendee else
             ComponentUpdateState.NORMAL
         )
-    )
+
+    txn = store.newTransaction()
+    try:
+        home = yield txn.calendarHomeWithUID(homeUID, create=True)
+        collection = yield home.childWithName(collectionResourceName)
+        if not collection:
+            collection = yield home.createChildWithName(collectionResourceName)
+
+        yield collection._createCalendarObjectWithNameInternal(
+            objectResourceName, component, internal_state
+        )
+    except:
+        yield txn.abort()
+        raise
     yield txn.commit()
 
 
+@inlineCallbacks
+def processSchedulingBacklog(store, path):
+    """
+    Do the implicit scheduling recorded in a L{SchedulingBacklog} file: send
+    each organizer event to its attendees, and update the organizer's copy of
+    each attendee event with the attendee's PARTSTATs. Each entry is done in
+    its own transaction.
+
+    @param store: The db store
+    @type store: L{IDataStore}
+    @param path: the backlog file
+    @type path: C{str}
+    """
+    dir = store.directoryService()
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+
+    for ctr, entry in enumerate(entries):
+        txn = store.newTransaction(label="Import scheduling")
+        try:
+            home = yield txn.calendarHomeWithUID(entry["home"])
+            if home is None:
+                raise ImportException("No calendar home: {}".format(entry["home"]))
+            if entry["type"] == "organizer":
+                collection = yield home.childWithName(entry["calendar"])
+                resource = (yield collection.objectResourceWithName(entry["resource"])) if collection else None
+                if resource is not None:
+                    yield ImplicitScheduler().refreshAllAttendeesExceptSome(txn, resource)
+            else:
+                attendeeRecord = yield dir.recordWithUID(entry["home"])
+                organizerRecord = yield dir.recordWithUID(entry["organizer"])
+                if attendeeRecord is None or organizerRecord is None:
+                    raise ImportException("Attendee or organizer is not in the directory")
+                for resource in (yield home.objectResourcesWithUID(entry["uid"], ["inbox"])):
+                    component = yield resource.componentForUser()
+                    yield sendRestoreReply(txn, component, attendeeRecord, organizerRecord)
+            yield txn.commit()
+        except Exception, e:
+            yield txn.abort()
+            print("Failed to schedule {}: {}".format(entry, e))
+        else:
+            print("Scheduled {} of {}".format(ctr + 1, len(entries)))
+
+
 class ImporterService(WorkerService, object):
     """
     Service which runs, imports the data, then stops the reactor.
@@ -340,6 +658,21 @@ class ImporterService(WorkerService, object):
         Do the export, stopping the reactor when done.
         """
         try:
+            if self.options["schedule"]:
+                yield processSchedulingBacklog(self.store, self.options["schedule"])
+                returnValue(None)
+
+            if self.options["bulk"]:
+                cacheCalendarUserAddressLookups(self.store.directoryService())
+
+            kwds = {"batchSize": self.options["batch-size"]}
+            if self.options["checkpoint"] or self.options["batch-size"] > 1:
+                # Only report progress for imports using the new options, so
+                # that a plain import prints what it always has
+                kwds["progress"] = ImportProgress(self.options["checkpoint"])
+            if self.options["defer-scheduling"]:
+                kwds["backlog"] = SchedulingBacklog(self.options["defer-scheduling"])
+
             if self.options.inputDirectoryName:
                 dirname = self.options.inputDirectoryName
                 if not os.path.exists(dirname):
@@ -352,7 +685,7 @@ class ImporterService(WorkerService, object):
                     print("Importing {}".format(fullpath))
                     with open(fullpath, 'r') as fileobj:
                         component = Component.allFromStream(fileobj)
-                    yield importCollectionComponent(self.store, component)
+                    yield importCollectionComponent(self.store, component, **kwds)
 
             else:
                 try:
@@ -365,7 +698,7 @@ class ImporterService(WorkerService, object):
 
                 component = Component.allFromStream(input)
                 input.close()
-                yield importCollectionComponent(self.store, component)
+                yield importCollectionComponent(self.store, component, **kwds)
         except:
             log.failure("doWork()")
 
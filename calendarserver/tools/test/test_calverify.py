@@ -495,6 +495,63 @@ class CalVerifyDataTests(StoreTestCase):
         sync_token_new = (yield (yield self.calendarUnderTest()).syncToken())
         self.assertEqual(sync_token_old, sync_token_new)
 
+    @inlineCallbacks
+    def test_scanBadDataShards(self):
+        """
+        CalVerifyService.doScan split into shards finds the same errors as a single
+        scan, and re-running a shard with its checkpoint resumes from it.
+        """
+
+        checkpoint = self.mktemp()
+        results = []
+        total = 0
+        for shard in ("0/2", "1/2",):
+            options = {
+                "ical": True,
+                "fix": False,
+                "nobase64": False,
+                "verbose": False,
+                "uid": "",
+                "uuid": "",
+                "path": "",
+                "tzid": "",
+                "shard": shard,
+                "checkpoint": checkpoint + shard[0],
+            }
+            output = StringIO()
+            calverify = BadDataService(self._sqlCalendarStore, options, output, reactor, config)
+            calverify.emailDomain = "example.com"
+            yield calverify.doAction()
+            total += calverify.results["Number of events to process"]
+            results.extend(calverify.results["Bad iCalendar data"])
+
+        self.assertEqual(total, self.number_to_process)
+        self.verifyResultsByUID(results, set((
+            ("home1", "BAD1",),
+            ("home1", "BAD2",),
+            ("home1", "BAD3",),
+            ("home1", "BAD4",),
+            ("home1", "BAD5",),
+            ("home1", "BAD6",),
+            ("home1", "BAD10",),
+            ("home1", "BAD11",),
+            ("home1", "BAD12",),
+            ("home1", "BAD13",),
+            ("home1", "BAD14",),
+        )))
+
+        # A completed shard is not scanned again
+        output = StringIO()
+        calverify = BadDataService(self._sqlCalendarStore, options, output, reactor, config)
+        calverify.emailDomain = "example.com"
+        calverify.validCalendarData = lambda resid, isinbox: self.fail("Resource scanned again")
+        yield calverify.doAction()
+        self.assertTrue("Resuming" in output.getvalue())
+        self.assertEqual(
+            set([result[2] for result in calverify.results["Bad iCalendar data"]]),
+            set([result[2] for result in results if calverify.inShard(result[2])]),
+        )
+
     @inlineCallbacks
     def test_fixBadData(self):
         """
@@ -26,6 +26,7 @@ from twisted.trial.unittest import TestCase
 
 from twisted.internet.defer import inlineCallbacks
 from twisted.python.modules import getModule
+from twisted.python.usage import UsageError
 
 from twext.enterprise.ienterprise import AlreadyFinishedError
 
@@ -137,6 +138,18 @@ class CommandLine(TestCase):
         self.assertTrue(eo.exportAll)
         self.assertEquals(eo.exportAllType, "VCARD")
 
+    def test_batchSizeAndParallel(self):
+        """
+        The --batch-size and --parallel options are converted to integers, and
+        values less than one are rejected.
+        """
+        eo = ExportOptions()
+        eo.parseOptions(["--all", "--batch-size", "10", "--parallel", "2"])
+        self.assertEquals(eo["batch-size"], 10)
+        self.assertEquals(eo["parallel"], 2)
+        self.assertRaises(UsageError, ExportOptions().parseOptions, ["--parallel", "0"])
+        self.assertRaises(UsageError, ExportOptions().parseOptions, ["--batch-size", "many"])
+
     def test_homeAndCollections(self):
         """
         The --collection option adds specific calendars to the last home that
@@ -384,6 +397,39 @@ class IntegrationTests(StoreTestCase):
                           # sure we don't depend on caching effects elsewhere.
                           set(["America/New_Yrok", "US/Pacific"]))
 
+    @inlineCallbacks
+    def test_batchedExport(self):
+        """
+        Exporting in batches smaller than the calendar writes every event, and
+        each C{VTIMEZONE} only once, ahead of the first event that uses it.
+        """
+        yield populateCalendarsFrom(
+            {
+                "user01": {
+                    "calendar1": {
+                        "1.ics": (one, {}),  # EST
+                        "2.ics": (another, {}),  # EST
+                        "3.ics": (third, {})  # PST
+                    }
+                }
+            }, self.store
+        )
+
+        io = StringIO()
+        yield exportToFile(
+            [(yield self.txn().calendarHomeWithUID("user01"))
+                .calendarWithName("calendar1")], io, batchSize=2
+        )
+        text = io.getvalue()
+        result = Component.fromString(text)
+
+        names = [c.name() for c in result.subcomponents()]
+        self.assertEquals(names.count("VEVENT"), 3)
+        self.assertEquals(names.count("VTIMEZONE"), 2)
+        self.assertTrue(
+            text.index("TZID:US/Pacific") < text.index("DTSTART;TZID=US/Pacific")
+        )
+
     @inlineCallbacks
     def test_perUserFiltering(self):
         """
@@ -18,9 +18,13 @@
 Unit tests for L{calendarsever.tools.importer}.
 """
 
+import json
+from cStringIO import StringIO
+
 from calendarserver.tools.importer import (
     importCollectionComponent, ImportException,
-    storeComponentInHomeAndCalendar
+    storeComponentInHomeAndCalendar, ImportProgress, SchedulingBacklog,
+    processSchedulingBacklog
 )
 from twext.enterprise.jobs.jobitem import JobItem
 from twisted.internet import reactor
@@ -29,6 +33,7 @@ from twistedcaldav import customxml
 from twistedcaldav.ical import Component
 from twistedcaldav.test.util import StoreTestCase
 from txdav.base.propertystore.base import PropertyName
+from txdav.caldav.datastore.sql import Calendar
 from txdav.xml import element as davxml
 
 
@@ -503,3 +508,133 @@ class ImportTests(StoreTestCase):
         yield txn.commit()
 
     test_ImportComponentAttendee.todo = "Need to fix iTip reply processing"
+
+    def recordTransactions(self):
+        """
+        Record the label of each transaction the store starts.
+
+        @return: the labels, in order
+        @rtype: C{list}
+        """
+        labels = []
+        newTransaction = self.store.newTransaction
+
+        def _newTransaction(*args, **kwargs):
+            labels.append(kwargs.get("label"))
+            return newTransaction(*args, **kwargs)
+        self.patch(self.store, "newTransaction", _newTransaction)
+        return labels
+
+    @inlineCallbacks
+    def test_ImportComponentBatch(self):
+        """
+        A batched import stores several events in one transaction.
+        """
+
+        labels = self.recordTransactions()
+        component = Component.allFromString(DATA_NO_SCHEDULING)
+        yield importCollectionComponent(self.store, component, batchSize=5)
+        self.assertEquals(labels, [None, "Import batch"])
+
+        txn = self.store.newTransaction()
+        home = yield txn.calendarHomeWithUID("user01")
+        collection = yield home.childWithName("calendar")
+        objects = yield collection.listObjectResources()
+        self.assertEquals(len(objects), 2)
+        yield txn.commit()
+
+    @inlineCallbacks
+    def test_ImportComponentBatchFailure(self):
+        """
+        If one event in a batch cannot be stored, the batch is stored one
+        event per transaction instead, and the other events are still
+        imported.
+        """
+
+        createInternal = Calendar._createCalendarObjectWithNameInternal
+
+        def _createInternal(self, name, component, *args, **kwargs):
+            if component.resourceUID() == "F6342D53-7D5E-4B5E-9E0A-F0A08977AFE5":
+                raise RuntimeError("Bad event")
+            return createInternal(self, name, component, *args, **kwargs)
+        self.patch(Calendar, "_createCalendarObjectWithNameInternal", _createInternal)
+
+        labels = self.recordTransactions()
+        component = Component.allFromString(DATA_NO_SCHEDULING)
+        yield importCollectionComponent(self.store, component, batchSize=5)
+        self.assertEquals(labels, [None, "Import batch", None, None])
+
+        txn = self.store.newTransaction()
+        home = yield txn.calendarHomeWithUID("user01")
+        collection = yield home.childWithName("calendar")
+        objects = yield collection.objectResources()
+        self.assertEquals(
+            [obj.uid() for obj in objects],
+            ["5CE3B280-DBC9-4E8E-B0B2-996754020E5F"]
+        )
+        yield txn.commit()
+
+    @inlineCallbacks
+    def test_ImportComponentResume(self):
+        """
+        A batched import records its progress in the checkpoint file, and an
+        import using that checkpoint skips the events already imported.
+        """
+
+        checkpoint = self.mktemp()
+        source = "http://example.com/calendars/__uids__/user01/calendar/"
+        with open(checkpoint, "w") as f:
+            json.dump({source: 1}, f)
+
+        component = Component.allFromString(DATA_NO_SCHEDULING)
+        progress = ImportProgress(checkpoint, output=StringIO())
+        yield importCollectionComponent(self.store, component, batchSize=5, progress=progress)
+        with open(checkpoint) as f:
+            self.assertEquals(json.load(f), {source: 2})
+
+        # Everything has been imported now, so a re-run adds nothing
+        progress = ImportProgress(checkpoint, output=StringIO())
+        yield importCollectionComponent(self.store, component, batchSize=5, progress=progress)
+
+        txn = self.store.newTransaction()
+        home = yield txn.calendarHomeWithUID("user01")
+        collection = yield home.childWithName("calendar")
+        objects = yield collection.listObjectResources()
+        self.assertEquals(len(objects), 1)
+        yield txn.commit()
+
+    @inlineCallbacks
+    def test_ImportComponentDeferScheduling(self):
+        """
+        An import that defers scheduling stores the organizer's event without
+        inviting the attendees, who are only invited when the backlog is
+        processed.
+        """
+
+        backlog = SchedulingBacklog(self.mktemp())
+        component = Component.allFromString(DATA_WITH_ORGANIZER)
+        yield importCollectionComponent(self.store, component, batchSize=5, backlog=backlog)
+        yield JobItem.waitEmpty(self.store.newTransaction, reactor, 60)
+
+        with open(backlog.path) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEquals(len(entries), 1)
+        self.assertEquals(entries[0]["type"], "organizer")
+
+        txn = self.store.newTransaction()
+        home = yield txn.calendarHomeWithUID("user02", create=True)
+        collection = yield home.childWithName("calendar")
+        objects = yield collection.listObjectResources()
+        self.assertEquals(len(objects), 0)
+        yield txn.commit()
+
+        yield processSchedulingBacklog(self.store, backlog.path)
+        yield JobItem.waitEmpty(self.store.newTransaction, reactor, 60)
+
+        txn = self.store.newTransaction()
+        for uid in ("user01", "user02", "user03", "mercury"):
+            home = yield txn.calendarHomeWithUID(uid)
+            collection = yield home.childWithName("calendar")
+            objects = yield collection.listObjectResources()
+            self.assertEquals(len(objects), 1)
+        yield txn.commit()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+from __future__ import print_function
+
+"""
+A fake APNS gateway that accepts binary provider notifications and counts them,
+and a benchmark that measures how many notifications per second the server's
+APNS provider protocol can deliver to it.
+
+The gateway can also be run on its own (optionally with TLS) and the server's
+ProviderHost/ProviderPort pointed at it.
+"""
+
+from getopt import getopt, GetoptError
+import os
+import random
+import struct
+import sys
+import time
+
+from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.protocol import Protocol, ServerFactory, ClientFactory
+from twisted.internet.task import LoopingCall
+
+from calendarserver.push.applepush import APNProviderProtocol
+from calendarserver.push.ipush import PushPriority
+
+
+class FakeAPNSGatewayProtocol(Protocol):
+    """
+    Parses binary provider notification frames and counts them. Nothing is ever
+    sent back, as the real gateway only responds with errors.
+    """
+
+    HEADER_LENGTH = 5
+
+    def connectionMade(self):
+        self.buffer = ""
+
+    def dataReceived(self, data):
+        self.buffer += data
+        offset = 0
+        count = 0
+        while len(self.buffer) - offset >= self.HEADER_LENGTH:
+            command, frameLength = struct.unpack("!BI", self.buffer[offset:offset + self.HEADER_LENGTH])
+            if command != APNProviderProtocol.COMMAND_PROVIDER:
+                self.transport.loseConnection()
+                return
+            if len(self.buffer) - offset < self.HEADER_LENGTH + frameLength:
+                break
+            offset += self.HEADER_LENGTH + frameLength
+            count += 1
+        self.buffer = self.buffer[offset:]
+        if count:
+            self.factory.notificationsReceived(count)
+
+
+class FakeAPNSGatewayFactory(ServerFactory):
+
+    protocol = FakeAPNSGatewayProtocol
+
+    def __init__(self):
+        self.received = 0
+        self.waiting = []
+
+    def notificationsReceived(self, count):
+        self.received += count
+        waiting = self.waiting
+        self.waiting = []
+        for total, d in waiting:
+            if self.received >= total:
+                d.callback(self.received)
+            else:
+                self.waiting.append((total, d))
+
+    def whenReceived(self, total):
+        """
+        @return: a L{Deferred} that fires once the total number of notifications
+            received reaches C{total}
+        """
+        d = Deferred()
+        self.waiting.append((total, d))
+        self.notificationsReceived(0)
+        return d
+
+
+class BenchmarkProviderFactory(ClientFactory):
+    """
+    Stands in for L{APNProviderFactory} so that the provider protocol can be
+    connected directly to the fake gateway without the push service and store.
+    """
+
+    protocol = APNProviderProtocol
+
+    def __init__(self):
+        self.connection = None
+        self.connected = Deferred()
+
+    def clientConnectionMade(self):
+        self.connected.callback(self.connection)
+
+
+@inlineCallbacks
+def benchmark(reactor, keyCount, tokenCount, rounds, perToken):
+    gateway = FakeAPNSGatewayFactory()
+    port = reactor.listenTCP(0, gateway, interface="127.0.0.1")
+
+    factory = BenchmarkProviderFactory()
+    reactor.connectTCP("127.0.0.1", port.getHost().port, factory)
+    provider = yield factory.connected
+
+    keys = ["/CalDAV/calendars.example.com/user%05d/calendar/" % (i,) for i in range(keyCount)]
+    tokens = ["%064x" % (random.getrandbits(256),) for _ignore in range(tokenCount)]
+    total = keyCount * tokenCount * rounds
+
+    start = time.time()
+    for _ignore in range(rounds):
+        for key in keys:
+            if perToken:
+                for token in tokens:
+                    provider.sendNotification(token, key, int(time.time()), PushPriority.high)
+            else:
+                provider.sendNotifications(tokens, key, int(time.time()), PushPriority.high)
+    yield gateway.whenReceived(total)
+    elapsed = time.time() - start
+
+    print("{} notifications ({} keys x {} tokens x {} rounds, {}) in {:.2f} secs: {:.0f} notifications/sec".format(
+        total, keyCount, tokenCount, rounds,
+        "one write per token" if perToken else "one write per key",
+        elapsed, total / elapsed,
+    ))
+
+    provider.transport.loseConnection()
+    yield port.stopListening()
+
+
+def serve(reactor, port, certPath, keyPath):
+    gateway = FakeAPNSGatewayFactory()
+    if certPath:
+        from twisted.internet.ssl import DefaultOpenSSLContextFactory
+        reactor.listenSSL(port, gateway, DefaultOpenSSLContextFactory(keyPath, certPath))
+    else:
+        reactor.listenTCP(port, gateway)
+
+    last = [0]
+
+    def report():
+        print("{} notifications/sec ({} total)".format(gateway.received - last[0], gateway.received))
+        last[0] = gateway.received
+
+    LoopingCall(report).start(1.0, now=False)
+    print("Fake APNS gateway listening on port {}".format(port))
+
+
+def usage(e=None):
+    name = os.path.basename(sys.argv[0])
+    print("usage: %s [options]" % (name,))
+    print("")
+    print("options:")
+    print("  -h --help: print this help and exit")
+    print("  -k: number of push keys [100]")
+    print("  -t: number of device tokens subscribed to each key [50]")
+    print("  -r: number of rounds [10]")
+    print("  --per-token: send each notification with its own write")
+    print("  -s --serve PORT: run only the gateway on the given port")
+    print("  --cert PATH: certificate to use when serving with TLS")
+    print("  --key PATH: private key to use when serving with TLS")
+    print("")
+    print("Benchmarks APNS notification throughput against a local fake gateway.")
+
+    if e:
+        print(e)
+        sys.exit(64)
+    else:
+        sys.exit(0)
+
+
+def main():
+    try:
+        (optargs, _ignore_args) = getopt(
+            sys.argv[1:], "hk:t:r:s:", [
+                "help",
+                "per-token",
+                "serve=",
+                "cert=",
+                "key=",
+            ],
+        )
+    except GetoptError, e:
+        usage(e)
+
+    keyCount = 100
+    tokenCount = 50
+    rounds = 10
+    perToken = False
+    servePort = None
+    certPath = keyPath = None
+
+    for opt, arg in optargs:
+        if opt in ("-h", "--help"):
+            usage()
+        elif opt == "-k":
+            keyCount = int(arg)
+        elif opt == "-t":
+            tokenCount = int(arg)
+        elif opt == "-r":
+            rounds = int(arg)
+        elif opt == "--per-token":
+            perToken = True
+        elif opt in ("-s", "--serve"):
+            servePort = int(arg)
+        elif opt == "--cert":
+            certPath = arg
+        elif opt == "--key":
+            keyPath = arg
+        else:
+            raise NotImplementedError(opt)
+
+    from twisted.internet import reactor
+    if servePort is not None:
+        serve(reactor, servePort, certPath, keyPath)
+    else:
+        d = benchmark(reactor, keyCount, tokenCount, rounds, perToken)
+        d.addErrback(lambda f: f.printTraceback())
+        d.addBoth(lambda _ignore: reactor.stop())
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
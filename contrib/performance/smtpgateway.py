@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+from __future__ import print_function
+
+"""
+A local SMTP server that accepts and counts messages, and a benchmark that
+measures how many iMIP messages per second the server's SMTP senders can deliver
+to it, with a new connection per message or with pooled sessions.
+
+The server can also be run on its own (optionally offering STARTTLS) and the
+server's Scheduling.iMIP.Sending Server/Port pointed at it.
+"""
+
+from getopt import getopt, GetoptError
+import os
+import sys
+import time
+
+from twisted.internet.defer import gatherResults, inlineCallbacks, succeed
+from twisted.internet.protocol import ServerFactory
+from twisted.internet.task import LoopingCall
+from twisted.mail.smtp import ESMTP, IMessage, IMessageDelivery
+from zope.interface import implementer
+
+from txdav.caldav.datastore.scheduling.imip.smtpsender import (
+    SMTPSender, PooledSMTPSender
+)
+
+
+@implementer(IMessage)
+class CountingMessage(object):
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def lineReceived(self, line):
+        pass
+
+    def eomReceived(self):
+        self.factory.received += 1
+        return succeed(None)
+
+    def connectionLost(self):
+        pass
+
+
+@implementer(IMessageDelivery)
+class CountingDelivery(object):
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def receivedHeader(self, helo, origin, recipients):
+        return "Received: from benchmark"
+
+    def validateFrom(self, helo, origin):
+        return origin
+
+    def validateTo(self, user):
+        return lambda: CountingMessage(self.factory)
+
+
+class FakeSMTPServerFactory(ServerFactory):
+    """
+    Accepts every message, counting the messages and connections.
+    """
+
+    def __init__(self, contextFactory=None):
+        self.contextFactory = contextFactory
+        self.received = 0
+        self.connections = 0
+
+    def buildProtocol(self, addr):
+        p = ESMTP(contextFactory=self.contextFactory)
+        p.delivery = CountingDelivery(self)
+        p.factory = self
+        self.connections += 1
+        return p
+
+
+@inlineCallbacks
+def benchmark(reactor, count, connections, pooled, certPath, keyPath):
+    server = FakeSMTPServerFactory(contextFactory(certPath, keyPath))
+    port = reactor.listenTCP(0, server, backlog=1024, interface="127.0.0.1")
+
+    useSSL = certPath is not None
+    if pooled:
+        sender = PooledSMTPSender(
+            "", "", useSSL, "127.0.0.1", port.getHost().port,
+            maxConnections=connections, idleTimeout=1,
+        )
+    else:
+        sender = SMTPSender("", "", useSSL, "127.0.0.1", port.getHost().port)
+
+    message = "Subject: Benchmark\r\n\r\n" + "Invitation body\r\n" * 100
+
+    start = time.time()
+    results = yield gatherResults([
+        sender.sendMessage(
+            "server@example.com", "attendee{}@example.com".format(i),
+            SMTPSender.betterMessageID(), message,
+        ) for i in range(count)
+    ])
+    elapsed = time.time() - start
+
+    print("{} messages ({} sent, {}) over {} connections in {:.2f} secs: {:.0f} messages/sec".format(
+        count, results.count(True),
+        "pooled, at most {} sessions".format(connections) if pooled else "one connection per message",
+        server.connections, elapsed, count / elapsed,
+    ))
+
+    yield port.stopListening()
+
+
+def contextFactory(certPath, keyPath):
+    if certPath:
+        from twisted.internet.ssl import DefaultOpenSSLContextFactory
+        return DefaultOpenSSLContextFactory(keyPath, certPath)
+    return None
+
+
+def serve(reactor, port, certPath, keyPath):
+    server = FakeSMTPServerFactory(contextFactory(certPath, keyPath))
+    reactor.listenTCP(port, server, backlog=1024)
+
+    last = [0]
+
+    def report():
+        print("{} messages/sec ({} total, {} connections)".format(
+            server.received - last[0], server.received, server.connections
+        ))
+        last[0] = server.received
+
+    LoopingCall(report).start(1.0, now=False)
+    print("Fake SMTP server listening on port {}".format(port))
+
+
+def usage(e=None):
+    name = os.path.basename(sys.argv[0])
+    print("usage: %s [options]" % (name,))
+    print("")
+    print("options:")
+    print("  -h --help: print this help and exit")
+    print("  -n: number of messages to send [300]")
+    print("  -c: maximum number of pooled sessions [4]")
+    print("  --unpooled: send each message over its own connection")
+    print("  -s --serve PORT: run only the server on the given port")
+    print("  --cert PATH: certificate for the server to offer STARTTLS with")
+    print("  --key PATH: private key for the server to offer STARTTLS with")
+    print("")
+    print("Benchmarks iMIP message throughput against a local SMTP server.")
+
+    if e:
+        print(e)
+        sys.exit(64)
+    else:
+        sys.exit(0)
+
+
+def main():
+    try:
+        (optargs, _ignore_args) = getopt(
+            sys.argv[1:], "hn:c:s:", [
+                "help",
+                "unpooled",
+                "serve=",
+                "cert=",
+                "key=",
+            ],
+        )
+    except GetoptError, e:
+        usage(e)
+
+    count = 300
+    connections = 4
+    pooled = True
+    servePort = None
+    certPath = keyPath = None
+
+    for opt, arg in optargs:
+        if opt in ("-h", "--help"):
+            usage()
+        elif opt == "-n":
+            count = int(arg)
+        elif opt == "-c":
+            connections = int(arg)
+        elif opt == "--unpooled":
+            pooled = False
+        elif opt in ("-s", "--serve"):
+            servePort = int(arg)
+        elif opt == "--cert":
+            certPath = arg
+        elif opt == "--key":
+            keyPath = arg
+        else:
+            raise NotImplementedError(opt)
+
+    from twisted.internet import reactor
+    if servePort is not None:
+        serve(reactor, servePort, certPath, keyPath)
+    else:
+        d = benchmark(reactor, count, connections, pooled, certPath, keyPath)
+        d.addErrback(lambda f: f.printTraceback())
+        d.addBoth(lambda _ignore: reactor.stop())
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
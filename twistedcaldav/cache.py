@@ -15,6 +15,7 @@
 ##
 
 from twext.python.log import Logger
+from txweb2 import responsecode
 from txweb2.dav.util import allDataFromStream
 from txweb2.http import Response
 from txweb2.iweb import IResource
@@ -33,6 +34,7 @@ import cPickle
 import hashlib
 import urllib
 import uuid
+import zlib
 
 """
 The basic principals of the PROPFIND cache are this:
@@ -67,6 +69,14 @@ so sharee's homes use that token. That way a single token for all shared instanc
 (6) Principals and directory records need to be included as tokens to take account of variations in access control based on who
 is making the request (including proxy state changes etc).
 
+(7) The CollectionCacheMixin class is mixed into calendar/address book collections. That causes Depth:1 PROPFIND responses, and
+sync-collection REPORT responses that report no changes, to be cached. Any change to a child resource changes the collection's own
+token, so instead of child tokens the owner's URI for the collection is tracked (which for shared collections differs from the
+request URI).
+
+(8) Large entries are compressed, and those still too big for a single memcache value are split into chunks stored under separate
+keys. The memcache flags on the entry's key record which of these applies.
+
 """
 
 
@@ -255,6 +265,9 @@ class BaseResponseCache(object):
             requestLines.sort()
             requestBody = "\n".join(requestLines)
 
+        # Only sync-collection reports are cached
+        request.cacheableReport = request.method == "REPORT" and requestBody is not None and "sync-collection" in requestBody
+
         request.cacheKey = (request.method,
                             self._principalURI(request.authnUser),
                             request.uri,
@@ -271,6 +284,14 @@ class BaseResponseCache(object):
 
 class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
 
+    # Memcache flags for entries that are compressed or split into chunks
+    FLAG_COMPRESSED = 1
+    FLAG_CHUNKED = 2
+
+    # Largest value stored under a single key, leaving room below the
+    # memcache 1MB item limit for the key and item overhead
+    CHUNK_SIZE = 1000 * 1000
+
     def __init__(self, docroot, cachePool=None):
         self._docroot = docroot
         self._cachePool = cachePool
@@ -291,38 +312,55 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
         returnValue(result)
 
     @inlineCallbacks
-    def _tokenForRecord(self, uri, request):
-        """
-        Get the current token for a particular principal URI's directory record.
+    def _tokensForURIs(self, uris):
         """
+        Get the current tokens for a number of URIs with a single cache request.
 
-        record = (yield self._getRecordForURI(uri, request))
-        returnValue(record.cacheToken())
+        @param uris: the URIs
+        @type uris: iterable of C{str}
+
+        @return: a C{dict} mapping each URI to its token, or C{None} if it has none
+        @rtype: C{dict}
+        """
+        keys = dict([
+            (uri, 'cacheToken:%s' % (uri.encode("utf-8") if isinstance(uri, unicode) else uri,))
+            for uri in uris
+        ])
+        if not keys:
+            returnValue({})
+        results = (yield self.getCachePool().get_multi(list(set(keys.values()))))
+        returnValue(dict([(uri, results.get(key, (0, None))[1]) for uri, key in keys.items()]))
 
     @inlineCallbacks
-    def _tokensForChildren(self, rURI, request):
+    def _tokenForRecord(self, uri, request):
         """
-        Create a dict of child resource tokens for any "recorded" during this request in the childCacheURIs attribute.
+        Get the current token for a particular principal URI's directory record.
         """
 
-        if hasattr(request, "childCacheURIs"):
-            tokens = dict([(uri, (yield self._tokenForURI(uri)),) for uri in request.childCacheURIs])
-            returnValue(tokens)
-        else:
-            returnValue({})
+        record = (yield self._getRecordForURI(uri, request))
+        returnValue(record.cacheToken())
 
     @inlineCallbacks
-    def _getTokens(self, request):
+    def _getTokens(self, request, childURIs=None):
         """
         Tokens are a principal token, directory record token, resource token and list
         of child resource tokens. A change to any one of those will cause cache invalidation.
+
+        The resource token and the child tokens are fetched together.
+
+        @param childURIs: the child URIs to get tokens for, defaults to any "recorded" during
+            this request in the childCacheURIs attribute
+        @type childURIs: C{list} of C{str}
         """
+        if childURIs is None:
+            childURIs = getattr(request, "childCacheURIs", ())
         tokens = []
         pURI, rURI = (yield self._getURIs(request))
         tokens.append((yield self._tokenForURI(pURI, "PrincipalToken")))
         tokens.append((yield self._tokenForRecord(pURI, request)))
-        tokens.append((yield self._tokenForURI(rURI)))
-        tokens.append((yield self._tokensForChildren(rURI, request)))
+        uriTokens = (yield self._tokensForURIs([rURI] + list(childURIs)))
+        tokens.append(uriTokens[rURI])
+        tokens.append(dict([(uri, uriTokens[uri]) for uri in childURIs]))
         returnValue(tokens)
 
     @inlineCallbacks
@@ -337,6 +375,70 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
         self.log.debug("hashing key for get: {old!r} to {new!r}", old=oldkey, new=key)
         returnValue(request.cacheKey)
 
+    @inlineCallbacks
+    def _getEntry(self, key):
+        """
+        Get a response cache entry, joining its chunks and decompressing it as needed.
+
+        @param key: the entry key
+        @type key: C{str}
+
+        @return: the pickled entry, or C{None} if it, or any of its chunks, is not cached
+        @rtype: C{str}
+        """
+        flags, value = (yield self.getCachePool().get(key))
+        if value is None:
+            returnValue(None)
+
+        if flags & self.FLAG_CHUNKED:
+            chunkID, count = value.split(":")
+            chunkKeys = ["%s:%s:%d" % (key, chunkID, index) for index in range(int(count))]
+            chunks = (yield self.getCachePool().get_multi(chunkKeys))
+            value = []
+            for chunkKey in chunkKeys:
+                _ignore_flags, chunk = chunks.get(chunkKey, (0, None))
+                if chunk is None:
+                    self.log.debug("Missing chunk {chunk!r} for: {key!r}", chunk=chunkKey, key=key)
+                    returnValue(None)
+                value.append(chunk)
+            value = "".join(value)
+
+        if flags & self.FLAG_COMPRESSED:
+            value = zlib.decompress(value)
+
+        returnValue(value)
+
+    @inlineCallbacks
+    def _setEntry(self, key, value):
+        """
+        Store a response cache entry, compressing it if it is large, and splitting it into
+        chunks if it is still larger than a single memcache value can be. Chunk keys include
+        a unique ID so that a concurrent update of the same entry cannot mix up chunks.
+
+        @param key: the entry key
+        @type key: C{str}
+        @param value: the pickled entry
+        @type value: C{str}
+        """
+        flags = 0
+        if config.ResponseCacheCompressSize and len(value) > config.ResponseCacheCompressSize:
+            value = zlib.compress(value)
+            flags |= self.FLAG_COMPRESSED
+
+        if len(value) > self.CHUNK_SIZE:
+            chunkID = uuid.uuid4().hex
+            chunks = dict([
+                ("%s:%s:%d" % (key, chunkID, index), value[offset:offset + self.CHUNK_SIZE])
+                for index, offset in enumerate(range(0, len(value), self.CHUNK_SIZE))
+            ])
+            yield self.getCachePool().set_multi(chunks, expireTime=config.ResponseCacheTimeout * 60)
+            value = "%s:%d" % (chunkID, len(chunks),)
+            flags |= self.FLAG_CHUNKED
+
+        yield self.getCachePool().set(
+            key, value, flags=flags, expireTime=config.ResponseCacheTimeout * 60
+        )
+
     @inlineCallbacks
     def getResponseForRequest(self, request):
         """
@@ -347,8 +449,11 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
         try:
             key = (yield self._hashedRequestKey(request))
 
+            if request.method == "REPORT" and not request.cacheableReport:
+                returnValue(None)
+
             self.log.debug("Checking cache for: {key!r}", key=key)
-            _ignore_flags, value = (yield self.getCachePool().get(key))
+            value = (yield self._getEntry(key))
 
             if value is None:
                 self.log.debug("Not in cache: {key!r}", key=key)
@@ -366,7 +471,7 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
                 )
             )
 
-            currentTokens = (yield self._getTokens(request))
+            currentTokens = (yield self._getTokens(request, childTokens.keys()))
 
             if currentTokens[0] != principalToken:
                 self.log.debug(
@@ -396,7 +501,7 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
                 returnValue(None)
 
             for childuri, token in childTokens.items():
-                currentToken = (yield self._tokenForURI(childuri))
+                currentToken = currentTokens[3][childuri]
                 if currentToken != token:
                     self.log.debug(
                         "Child {uri} token doesn't match for {key!r}: {currentToken!r} != {token!r}",
@@ -448,7 +553,7 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
                     dict(list(response.headers.getAllRawHeaders())),
                     responseBody
                 )
-            ))
+            ), cPickle.HIGHEST_PROTOCOL)
             self.log.debug(
                 "Adding to cache: {key!r} = tokens - {tokens!r}",
                 key=key,
@@ -459,9 +564,7 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
                     cTokens,
                 )
             )
-            yield self.getCachePool().set(
-                key, cacheEntry, expireTime=config.ResponseCacheTimeout * 60
-            )
+            yield self._setEntry(key, cacheEntry)
 
         except URINotFoundException, e:
             self.log.debug("Could not locate URI: {e!r}", e=e)
@@ -495,15 +598,56 @@ class PropfindCacheMixin(object):
     def renderHTTP(self, request):
         response = (yield super(PropfindCacheMixin, self).renderHTTP(request))
 
-        if request.method == 'PROPFIND':
+        if self.responseIsCacheable(request, response):
             resource = (yield request.locateResource("/"))
 
             # responseCache might not be present during unit tests
             if hasattr(resource, "responseCache"):
+                request.childCacheURIs = self.responseCacheChildURIs(request)
                 yield resource.responseCache.cacheResponseForRequest(request, response)
 
         returnValue(response)
 
+    def responseIsCacheable(self, request, response):
+        """
+        Whether the response to a request should be cached.
+
+        @rtype: C{bool}
+        """
+        return request.method == 'PROPFIND'
+
+    def responseCacheChildURIs(self, request):
+        """
+        The URIs, other than the request URI, whose tokens a cached response depends on.
+
+        @rtype: C{list} of C{str}
+        """
+        return getattr(request, "childCacheURIs", [])
+
+
+class CollectionCacheMixin(PropfindCacheMixin):
+    """
+    A mixin that causes a calendar or address book collection's Depth:1 PROPFIND responses, and any
+    sync-collection REPORT responses that report no changes, to be cached.
+
+    A change to any child resource changes the collection's own token, so per-child tokens are not
+    needed. The token of the collection's owner URI is tracked instead, as that is the one that changes
+    for shared collections.
+    """
+
+    def responseIsCacheable(self, request, response):
+        if response.code != responsecode.MULTI_STATUS:
+            return False
+        if request.method == "PROPFIND":
+            return request.headers.getHeader("depth") == "1"
+        elif request.method == "REPORT":
+            return getattr(request, "syncReportEmpty", False)
+        else:
+            return False
+
+    def responseCacheChildURIs(self, request):
+        return [self.owner_url() or self.url()]
+
 
 class CacheStoreNotifierFactory(CachePoolUserMixIn):
     """
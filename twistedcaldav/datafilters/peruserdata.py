@@ -115,6 +115,33 @@ class PerUserDataFilter(CalendarFilter):
 
         return ical
 
+    def filterCopy(self, ical):
+        """
+        Filter a copy of the supplied iCalendar object, leaving the original unchanged. The
+        X-CALENDARSERVER-PERUSER components for other users, which the filter would discard, are
+        left out of the copy altogether, rather than copied by a full L{Component.duplicate} only
+        to be removed again. Everything else is copied, since a subcomponent can only belong to one
+        calendar.
+
+        @param ical: iCalendar object - this will not be modified
+        @type ical: L{Component}
+
+        @return: L{Component} for the filtered calendar data
+        """
+
+        copy = Component("VCALENDAR")
+        for property in ical.properties():
+            copy.addProperty(property.duplicate())
+        for component in ical.subcomponents():
+            if component.name() == PERUSER_COMPONENT and component.propertyValue(PERUSER_UID) != self.uid:
+                continue
+            else:
+                copy.addComponent(component.duplicate())
+        if hasattr(ical, "noInstanceIndexing"):
+            copy.noInstanceIndexing = ical.noInstanceIndexing
+
+        return self.filter(copy)
+
     def _filterBack(self, ical, peruser):
         """
         Merge the per-user data back into the main calendar data.
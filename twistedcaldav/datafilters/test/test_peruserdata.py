@@ -15,7 +15,7 @@
 ##
 
 import twistedcaldav.test.util
-from twistedcaldav.ical import Component
+from twistedcaldav.ical import Component, Property
 from twistedcaldav.datafilters.peruserdata import PerUserDataFilter
 from twistedcaldav.timezones import TimezoneCache
 
@@ -292,6 +292,49 @@ END:VCALENDAR
             self.assertEqual(str(PerUserDataFilter("").filter(item)),
                              resultForOtherUser)
 
+    def test_filterCopy(self):
+        """
+        L{PerUserDataFilter.filterCopy} returns the same results as L{PerUserDataFilter.filter}
+        without changing the original data.
+        """
+
+        ical = Component.fromString(dataForTwoUsers)
+        for uid, result in (
+            ("user01", resultForUser1),
+            ("user02", resultForUser2),
+            ("user03", resultForOtherUser),
+            ("", resultForOtherUser),
+        ):
+            self.assertEqual(str(PerUserDataFilter(uid).filterCopy(ical)), result)
+        self.assertEqual(str(ical), dataForTwoUsers)
+
+    def test_filterCopyTimezone(self):
+        """
+        L{PerUserDataFilter.filterCopy} copies the VTIMEZONE components, so changing them in the
+        filtered data does not change the original.
+        """
+
+        data = dataForTwoUsers.replace("BEGIN:VEVENT", """BEGIN:VTIMEZONE
+TZID:Etc/Test
+BEGIN:STANDARD
+DTSTART:19700101T000000
+TZNAME:TST
+TZOFFSETFROM:+0000
+TZOFFSETTO:+0000
+END:STANDARD
+END:VTIMEZONE
+BEGIN:VEVENT""".replace("\n", "\r\n"), 1)
+
+        ical = Component.fromString(data)
+        copy = PerUserDataFilter("user01").filterCopy(ical)
+        timezones = [component for component in copy.subcomponents() if component.name() == "VTIMEZONE"]
+        self.assertEqual(len(timezones), 1)
+        timezones[0].addProperty(Property("X-TEST", "copy"))
+
+        timezones = [component for component in ical.subcomponents() if component.name() == "VTIMEZONE"]
+        self.assertEqual(len(timezones), 1)
+        self.assertEqual(timezones[0].propertyValue("X-TEST"), None)
+
 
 class PerUserDataFilterTestRecurring (twistedcaldav.test.util.TestCase):
 
@@ -209,6 +209,23 @@ class DirectoryProvisioningResource (
     def principalForCalendarUserAddress(self, address):
         raise NotImplementedError("Subclass must implement principalForCalendarUserAddress()")
 
+    @inlineCallbacks
+    def principalsForCalendarUserAddresses(self, addresses):
+        """
+        Look up the principals for a number of calendar user addresses.
+
+        @param addresses: the calendar user addresses
+        @type addresses: iterable of L{str}
+
+        @return: map of each address to its principal, or L{None}
+        @rtype: L{dict}
+        """
+        principals = {}
+        for address in addresses:
+            if address not in principals:
+                principals[address] = (yield self.principalForCalendarUserAddress(address))
+        returnValue(principals)
+
     def principalForRecord(self, record):
         if record is None or not record.enabled:
             return succeed(None)
@@ -384,6 +401,38 @@ class DirectoryPrincipalProvisioningResource (DirectoryProvisioningResource):
         log.debug("No principal for calendar user address: {addr}", addr=address)
         returnValue(None)
 
+    @inlineCallbacks
+    def principalsForCalendarUserAddresses(self, addresses):
+        """
+        Look up the principals for a number of calendar user addresses as per
+        L{principalForCalendarUserAddress}, but with a single directory lookup
+        for all the addresses that are not principal URIs.
+        """
+        principals = {}
+        lookups = []
+        for address in addresses:
+            if address in principals:
+                continue
+            principal = yield self._principalForURI(address)
+            if principal:
+                if not (
+                    isinstance(principal, DirectoryCalendarPrincipalResource) and
+                    principal.record.hasCalendars
+                ):
+                    principal = None
+            else:
+                lookups.append(address)
+            principals[address] = principal
+
+        if lookups:
+            records = yield self.directory.recordsWithCalendarUserAddresses(lookups)
+            for address in lookups:
+                record = records.get(address)
+                if record is not None and record.hasCalendars:
+                    principals[address] = (yield self.principalForRecord(record))
+
+        returnValue(principals)
+
     @inlineCallbacks
     def principalForRecord(self, record):
         child = (yield self.getChild(uidsResourceName))
@@ -443,6 +492,9 @@ class DirectoryPrincipalTypeProvisioningResource (DirectoryProvisioningResource)
     def principalForCalendarUserAddress(self, address):
         return self.parent.principalForCalendarUserAddress(address)
 
+    def principalsForCalendarUserAddresses(self, addresses):
+        return self.parent.principalsForCalendarUserAddresses(addresses)
+
     def principalForRecord(self, record):
         return self.parent.principalForRecord(record)
 
@@ -514,6 +566,9 @@ class DirectoryPrincipalUIDProvisioningResource (DirectoryProvisioningResource):
     def principalForCalendarUserAddress(self, address):
         return self.parent.principalForCalendarUserAddress(address)
 
+    def principalsForCalendarUserAddresses(self, addresses):
+        return self.parent.principalsForCalendarUserAddresses(addresses)
+
     def principalForRecord(self, record):
         if record is None:
             return succeed(None)
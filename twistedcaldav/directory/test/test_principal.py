@@ -342,6 +342,40 @@ class ProvisionedPrincipals(StoreTestCase):
             None
         )
 
+    @inlineCallbacks
+    def test_principalsForCalendarUserAddresses(self):
+        """
+        DirectoryPrincipalProvisioningResource
+        .principalsForCalendarUserAddresses() returns the same principals as
+        principalForCalendarUserAddress() for each address.
+        """
+        provisioningResource = yield self.actualRoot.getChild("principals")
+
+        addresses = []
+        for (
+            _ignore_provisioningResource, _ignore_recordType, recordResource, record
+        ) in (yield self._allRecords()):
+            addresses.extend([
+                address for address in record.calendarUserAddresses
+                if "mailto:cache-user" not in address
+            ])
+            if recordResource:
+                addresses.append(recordResource.principalURL())
+        addresses.extend((
+            "mailto:nocalendar@example.com",
+            "urn:uuid:543D28BA-F74F-4D5F-9243-B3E3A61171E5",
+            "/principals/users/nocalendar/",
+        ))
+
+        principals = yield provisioningResource.principalsForCalendarUserAddresses(addresses)
+        self.assertEquals(set(principals.keys()), set(addresses))
+        for address in addresses:
+            principal = yield provisioningResource.principalForCalendarUserAddress(address)
+            if principal is None:
+                self.failUnlessIdentical(principals[address], None)
+            else:
+                self.assertEquals(principals[address].record, principal.record)
+
     @inlineCallbacks
     def test_hasCalendars(self):
         """
@@ -16,7 +16,7 @@
 
 from twisted.python.failure import Failure
 
-from twisted.internet.defer import Deferred, fail
+from twisted.internet.defer import Deferred, DeferredList, fail
 from twisted.internet.protocol import ReconnectingClientFactory
 from twisted.protocols.memcache import MemCacheProtocol, NoSuchCommand
 
@@ -45,6 +45,27 @@ class PooledMemCacheProtocol(MemCacheProtocol):
             self.factory.deferred.callback(self)
             self.factory.deferred = None
 
+    def setMultiple(self, values, flags=0, expireTime=0):
+        """
+        Set a number of keys. The set commands are all written to the connection
+        before any response is read, so the whole operation takes a single round
+        trip to the server.
+
+        @param values: the values to set
+        @type values: C{dict} mapping C{str} key to C{str} value
+
+        @return: a L{Deferred} that fires with a C{dict} mapping each key to the
+            result of its set command
+        """
+        keys = values.keys()
+        d = DeferredList(
+            [self.set(key, values[key], flags, expireTime) for key in keys],
+            fireOnOneErrback=True,
+            consumeErrors=True,
+        )
+        d.addCallback(lambda results: dict(zip(keys, [result for _ignore_success, result in results])))
+        return d
+
 
 class MemCacheClientFactory(ReconnectingClientFactory):
     """
@@ -237,7 +258,7 @@ class MemCachePool(object):
                 "Memcache error: {ex}; request: {cmd} {args}",
                 ex=failure.value,
                 cmd=command,
-                args=" ".join(args)[:self.REQUEST_LOGGING_SIZE],
+                args=" ".join([arg if isinstance(arg, str) else repr(arg) for arg in args])[:self.REQUEST_LOGGING_SIZE],
             )
             self.clientFree(client)
 
@@ -371,6 +392,12 @@ class MemCachePool(object):
     def get(self, *args, **kwargs):
         return self.performRequest('get', *args, **kwargs)
 
+    def get_multi(self, *args, **kwargs):
+        return self.performRequest('getMultiple', *args, **kwargs)
+
+    def set_multi(self, *args, **kwargs):
+        return self.performRequest('setMultiple', *args, **kwargs)
+
     def set(self, *args, **kwargs):
         return self.performRequest('set', *args, **kwargs)
 
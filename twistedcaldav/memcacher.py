@@ -129,6 +129,18 @@ class Memcacher(CachePoolUserMixIn):
             else:
                 return succeed((0, value,))
 
+        def get_multi(self, keys, withIdentifier=False):
+            results = {}
+            for key in keys:
+                results[key] = self.get(key, withIdentifier=withIdentifier).result
+            return succeed(results)
+
+        def set_multi(self, values, expireTime=0):
+            results = {}
+            for key, value in values.items():
+                results[key] = self.set(key, value, expireTime=expireTime).result
+            return succeed(results)
+
         def delete(self, key):
             self._check_key(key)
 
@@ -206,6 +218,12 @@ class Memcacher(CachePoolUserMixIn):
         def get(self, key, withIdentifier=False):
             return succeed((0, None,))
 
+        def get_multi(self, keys, withIdentifier=False):
+            return succeed(dict([(key, (0, None,)) for key in keys]))
+
+        def set_multi(self, values, expireTime=0):
+            return succeed(dict([(key, True) for key in values]))
+
         def delete(self, key):
             return succeed(True)
 
@@ -324,6 +342,66 @@ class Memcacher(CachePoolUserMixIn):
         d.addCallback(_gotit, withIdentifier)
         return d
 
+    def get_multi(self, keys):
+        """
+        Get the values of a number of keys using a single request to the cache.
+
+        @param keys: the keys to get
+        @type keys: C{list} of C{str}
+
+        @return: a L{Deferred} that fires with a C{dict} mapping each key to its value, or
+            C{None} if the key is not cached
+        """
+        cacheKeys = dict([('%s:%s' % (self._namespace, self._normalizeKey(key)), key) for key in keys])
+        if not cacheKeys:
+            return succeed({})
+
+        def _gotem(results):
+            values = {}
+            for cacheKey, key in cacheKeys.items():
+                _ignore_flags, value = results.get(cacheKey, (0, None,))
+                if self._pickle and value is not None:
+                    value = cPickle.loads(value)
+                values[key] = value
+            return values
+
+        self.log.debug("Getting Cache Tokens for {k!r}", k=keys)
+        d = self._getMemcacheProtocol().get_multi(cacheKeys.keys())
+        d.addCallback(_gotem)
+        return d
+
+    def set_multi(self, values, expireTime=0):
+        """
+        Set the values of a number of keys using a single request to the cache.
+
+        @param values: the values to set
+        @type values: C{dict} mapping C{str} key to value
+        @param expireTime: the expiration time for all the keys
+        @type expireTime: C{int}
+
+        @return: a L{Deferred} that fires with a C{dict} mapping each key to a C{bool}
+            indicating whether it was stored
+        """
+        if not values:
+            return succeed({})
+
+        proto = self._getMemcacheProtocol()
+
+        cacheKeys = {}
+        cacheValues = {}
+        for key, value in values.items():
+            cacheKey = '%s:%s' % (self._namespace, self._normalizeKey(key))
+            cacheKeys[cacheKey] = key
+            cacheValues[cacheKey] = cPickle.dumps(value) if self._pickle else value
+
+        def _setem(results):
+            return dict([(cacheKeys[cacheKey], result) for cacheKey, result in results.items()])
+
+        self.log.debug("Setting Cache Tokens for {k!r}", k=values.keys())
+        d = proto.set_multi(cacheValues, expireTime=expireTime)
+        d.addCallback(_setem)
+        return d
+
     def delete(self, key):
         self.log.debug("Deleting Cache Token for {k!r}", k=key)
         return self._getMemcacheProtocol().delete('%s:%s' % (self._namespace, self._normalizeKey(key)))
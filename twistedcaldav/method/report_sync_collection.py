@@ -166,4 +166,7 @@ def report_DAV__sync_collection(self, request, sync_collection):
 
     responses.append(element.SyncToken.fromString(newtoken))
 
+    # A report with no changes stays valid until the collection next changes, so it can be cached
+    request.syncReportEmpty = not (changed or removed or notallowed or resourceChanged)
+
     returnValue(MultiStatusResponse(responses))
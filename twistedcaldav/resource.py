@@ -1016,6 +1016,19 @@ class CalDAVResource (
                 returnValue(principal)
         returnValue(None)
 
+    @inlineCallbacks
+    def principalsForCalendarUserAddresses(self, addresses):
+        principals = dict([(address, None) for address in addresses])
+        for principalCollection in self.principalCollections():
+            remaining = [address for address, principal in principals.items() if principal is None]
+            if not remaining:
+                break
+            found = (yield principalCollection.principalsForCalendarUserAddresses(remaining))
+            for address, principal in found.items():
+                if principal is not None:
+                    principals[address] = principal
+        returnValue(principals)
+
     @inlineCallbacks
     def principalForUID(self, principalUID):
         for principalCollection in self.principalCollections():
@@ -1638,6 +1651,9 @@ class CalendarPrincipalCollectionResource (DAVPrincipalCollectionResource, CalDA
     def principalForCalendarUserAddress(self, address):
         return None
 
+    def principalsForCalendarUserAddresses(self, addresses):
+        return succeed(dict([(address, None) for address in addresses]))
+
     def supportedReports(self):
         """
         Principal collections are the only resources supporting the
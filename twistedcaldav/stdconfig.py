@@ -476,6 +476,16 @@ DEFAULT_CONFIG = {
         "UnixStatsSocket": "caldavd-stats.sock",
         "EnableTCPStatsSocket": False,
         "TCPStatsPort": 8100,
+        # Seconds for which workers aggregate request stats and access log
+        # lines before sending them to the master, or zero to send each request
+        # to the master as it completes
+        "AccessLogBatchSeconds": 1.0,
+        # Aggregate the count, rows and time of each SQL statement and send
+        # them with the request stats
+        "SQLStatementStats": True,
+        # Number of statements with the most time sent individually in each
+        # report, the rest being combined into one entry
+        "SQLStatementsReported": 25,
     },
 
     "LogDatabase": {
@@ -565,6 +575,9 @@ DEFAULT_CONFIG = {
                                      # secondary service MUST define its own writable path if
                                      # not None
         "PrettyPrintJSON": True,    # User friendly JSON output
+        "ExpandCacheSize": 10,      # Approximate MB of timezone expansions cached per process (0 to disable)
+        "PrecomputeExpansions": [],  # Expansion windows computed at startup for all timezones, as
+                                     # [start, end] year offsets from the current year, e.g. [[-1, 2]]
 
         "SecondaryService": {
             # Only one of these should be used when a secondary service is used
@@ -769,6 +782,9 @@ DEFAULT_CONFIG = {
                 "Username": "",  # For account sending mail
                 "Password": "",  # For account sending mail
                 "SuppressionDays": 7,  # Messages for events older than this may days are not sent
+                "PoolConnections": 4,  # SMTP sessions kept open and reused for sending (0 = one connection per message)
+                "PoolIdleSeconds": 30,  # Close a pooled session after it has had nothing to send for this long
+                "PoolMessagesPerConnection": 100,  # Replace a pooled session after it has sent this many messages
             },
             "Receiving": {
                 "Server": "",  # Server to retrieve email messages from
@@ -805,6 +821,14 @@ DEFAULT_CONFIG = {
             "DelegeteRichFreeBusy": True,  # Delegates can get extra info in a freebusy request
             "RoomResourceRichFreeBusy": True,  # Any user can get extra info for rooms/resources in a freebusy request
 
+            "FreeBusyFanout": {
+                "MaxConcurrent": 10,  # Maximum number of local attendee freebusy queries run at the same time
+                # Run each attendee freebusy query in its own transaction, so the queries themselves run concurrently.
+                # Off by default: with one shared transaction only the directory and cache lookups overlap, but each
+                # request then holds a single database connection rather than up to MaxConcurrent of them.
+                "SeparateTransactions": False,
+            },
+
             "AutoSchedule": {
                 "Enabled": True,  # Auto-scheduling will never occur if set to False
                 "Always": False,  # Override augments setting and always auto-schedule
@@ -828,6 +852,7 @@ DEFAULT_CONFIG = {
                 "AttendeeRefreshBatchIntervalSeconds": 5,          # Time between attendee batch refreshes
                 "TemporaryFailureDelay": 60,         # Delay in seconds before a work item is executed again after a temp failure
                 "MaxTemporaryFailures": 10,         # Max number of temp failure retries before treating as a permanent failure
+                "OrganizerSendBatchSize": 10,         # Number of attendees delivered to by each organizer send job: 0 or 1 - no batching
             },
 
             #
@@ -856,6 +881,7 @@ DEFAULT_CONFIG = {
     "Notifications": {
         "Enabled": False,
         "CoalesceSeconds": 3,
+        "BatchSeconds": 1,  # Gather each process's push IDs for this long and enqueue them together (0 to disable)
 
         "Services": {
             "APNS": {
@@ -904,12 +930,14 @@ DEFAULT_CONFIG = {
         "Enabled": False,
         "SocketPath": "directory-proxy.sock",
         "InSidecarCachingSeconds": 120,
+        "CoalesceLookups": True,  # Batch single record lookups made in the same reactor turn
     },
 
     "DirectoryCaching": {
         "CachingSeconds": 60,               # How long to cache in worker and in memcached
         "NegativeCachingEnabled": True,
-        "LookupsBetweenPurges": 10000       # 0 = purging turned off
+        "LookupsBetweenPurges": 10000,      # 0 = purging turned off
+        "MaxRecords": 10000,                # Maximum in-process cache entries for each index
     },
 
     #
@@ -1007,6 +1035,11 @@ DEFAULT_CONFIG = {
     # Defaults off, because it weakens TLS (CRIME attack).
     "ResponseCompression": False,
 
+    # Write file response bodies (static files and attachments) to plain TCP
+    # connections with sendfile where the platform supports it, rather than
+    # copying them through the process. TLS connections always copy.
+    "EnableSendfile": True,
+
     # The retry-after value (in seconds) to return with a 503 error
     "HTTPRetryAfter": 180,
 
@@ -1014,6 +1047,11 @@ DEFAULT_CONFIG = {
     "Profiling": {
         "Enabled": False,
         "BaseDirectory": "/tmp/stats",
+        # CPU time between stack samples when the stack sampler is started
+        # via the stats socket
+        "SamplingIntervalMs": 10,
+        # Longest time the stack sampler can be started for
+        "SamplingMaxSeconds": 300,
     },
 
     "Memcached": {
@@ -1131,6 +1169,10 @@ DEFAULT_CONFIG = {
 
     "EnableResponseCache": True,
     "ResponseCacheTimeout": 30,  # Minutes
+    "ResponseCacheCompressSize": 16 * 1024,  # Compress cached responses larger than this (bytes), 0 to disable
+
+    "PropertyValueCacheSize": 5,  # Approximate MB of parsed dead property values cached per process (0 to disable)
+    "ComponentCacheSize": 0,  # Approximate MB of parsed calendar data cached per process (0 to disable)
 
     "EnableFreeBusyCache": True,
     "FreeBusyCacheDaysBack": 7,
@@ -1141,6 +1183,9 @@ DEFAULT_CONFIG = {
     "FreeBusyIndexExpandMaxDays": 5 * 365,
     "FreeBusyIndexDelayedExpand": False,
     "FreeBusyIndexSmartUpdate": True,
+    "FreeBusyIndexBatchInsert": True,  # Write all instances of a resource with multi-row inserts
+    "FreeBusyIndexBatchSize": 500,  # Maximum number of rows in each multi-row insert
+    "FreeBusyIndexIncremental": True,  # On update only delete/insert the instances that changed
 
     # The RootResource uses a twext property store. Specify the class here
     "RootResourcePropStoreClass": "txweb2.dav.xattrprops.xattrPropertyStore",
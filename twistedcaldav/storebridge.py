@@ -24,9 +24,9 @@ from pycalendar.datetime import DateTime
 from twext.enterprise.locking import LockTimeout
 from twext.python.log import Logger
 from twisted.internet.defer import succeed, inlineCallbacks, returnValue, maybeDeferred
-from twisted.internet.protocol import Protocol
 from twisted.python.util import FancyEqMixin
 from twistedcaldav import customxml, carddavxml, caldavxml, ical
+from twistedcaldav.cache import CollectionCacheMixin
 from twistedcaldav.caldavxml import (
     caldav_namespace, MaxAttendeesPerInstance, MaxInstances, NoUIDConflict
 )
@@ -96,7 +96,7 @@ from txweb2.responsecode import (
     FORBIDDEN, NO_CONTENT, NOT_FOUND, CREATED, CONFLICT, PRECONDITION_FAILED,
     BAD_REQUEST, OK, INSUFFICIENT_STORAGE_SPACE, SERVICE_UNAVAILABLE
 )
-from txweb2.stream import ProducerStream, readStream, MemoryStream
+from txweb2.stream import FileStream, readStream, MemoryStream
 from twistedcaldav.timezones import TimezoneException
 
 
@@ -1088,7 +1088,7 @@ class _CalendarCollectionBehaviorMixin():
         return True
 
 
-class CalendarCollectionResource(DefaultAlarmPropertyMixin, _CalendarCollectionBehaviorMixin, _CommonHomeChildCollectionMixin, CalDAVResource):
+class CalendarCollectionResource(CollectionCacheMixin, DefaultAlarmPropertyMixin, _CalendarCollectionBehaviorMixin, _CommonHomeChildCollectionMixin, CalDAVResource):
     """
     Wrapper around a L{txdav.caldav.icalendar.ICalendar}.
     """
@@ -1589,11 +1589,10 @@ class CalendarObjectDropbox(_GetChildHelper):
 
         othersCanWrite = self._newStoreCalendarObject.attendeesCanManageAttachments()
         cuas = (yield self._newStoreCalendarObject.component()).getAttendees()
+        principals = yield self.principalsForCalendarUserAddresses(cuas)
         newACEs = []
         for calendarUserAddress in cuas:
-            principal = yield self.principalForCalendarUserAddress(
-                calendarUserAddress
-            )
+            principal = principals[calendarUserAddress]
             if principal is None:
                 continue
 
@@ -1904,11 +1903,10 @@ class AttachmentsChildCollection(_GetChildHelper):
             )
 
         cuas = (yield self._newStoreCalendarObject.component()).getAttendees()
+        principals = yield self.principalsForCalendarUserAddresses(cuas)
         newACEs = []
         for calendarUserAddress in cuas:
-            principal = yield self.principalForCalendarUserAddress(
-                calendarUserAddress
-            )
+            principal = principals[calendarUserAddress]
             if principal is None:
                 continue
 
@@ -2102,20 +2100,10 @@ class CalendarAttachment(_NewStoreFileMetaDataHelper, _GetChildHelper):
             log.debug("Resource not found: {s!r}", s=self)
             raise HTTPError(NOT_FOUND)
 
-        stream = ProducerStream()
-
-        class StreamProtocol(Protocol):
-
-            def connectionMade(self):
-                stream.registerProducer(self.transport, False)
-
-            def dataReceived(self, data):
-                stream.write(data)
-
-            def connectionLost(self, reason):
-                stream.finish()
+        # Serve the file directly so that its length is known up front and it
+        # can be sent with sendfile
         try:
-            self._newStoreAttachment.retrieve(StreamProtocol())
+            stream = FileStream(self._newStoreAttachment.retrieveFile())
         except IOError, e:
             log.error("Unable to read attachment: {s!r}, due to: {ex}", s=self, ex=e)
             raise HTTPError(NOT_FOUND)
@@ -3108,7 +3096,7 @@ class CalendarObjectResource(_CalendarObjectMetaDataMixin, _CommonObjectResource
         returnValue(result)
 
 
-class AddressBookCollectionResource(_CommonHomeChildCollectionMixin, CalDAVResource):
+class AddressBookCollectionResource(CollectionCacheMixin, _CommonHomeChildCollectionMixin, CalDAVResource):
     """
     Wrapper around a L{txdav.carddav.iaddressbook.IAddressBook}.
     """
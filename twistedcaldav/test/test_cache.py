@@ -26,7 +26,8 @@ from txweb2.http_headers import Headers
 
 from twistedcaldav.cache import MemcacheResponseCache, CacheStoreNotifier
 from twistedcaldav.cache import MemcacheChangeNotifier
-from twistedcaldav.cache import PropfindCacheMixin
+from twistedcaldav.cache import PropfindCacheMixin, CollectionCacheMixin
+from twistedcaldav.config import config
 
 from twistedcaldav.test.util import InMemoryMemcacheProtocol
 from twistedcaldav.test.util import TestCase
@@ -395,6 +396,11 @@ class MemcacheResponseCacheTests(BaseCacheTestMixin, TestCase):
 
         self.rc._tokenForURI = _getToken
 
+        def _getTokens(uris):
+            return succeed(dict([(uri, self.tokens.get(uri)) for uri in uris]))
+
+        self.rc._tokensForURIs = _getTokens
+
         self.expected_response = (200, Headers({}), "Foo")
 
         expected_key = hashlib.md5(':'.join([str(t) for t in (
@@ -462,6 +468,70 @@ class MemcacheResponseCacheTests(BaseCacheTestMixin, TestCase):
         d.addCallback(self.assertResponse, expected_response)
         return d
 
+    @inlineCallbacks
+    def test_tokensForURIs(self):
+        """
+        L{MemcacheResponseCache._tokensForURIs} gets the tokens for all the URIs in one request.
+        """
+        self.memcacheStub._cache['cacheToken:/calendars/__uids__/cdaboo/calendar/'] = (0, 'token1')
+        self.memcacheStub._cache['cacheToken:/calendars/__uids__/cdaboo/tasks/'] = (0, 'token2')
+        calls = []
+        self.patch(self.memcacheStub, "get", lambda key: calls.append(key))
+
+        tokens = yield MemcacheResponseCache._tokensForURIs(self.rc, [
+            '/calendars/__uids__/cdaboo/calendar/',
+            u'/calendars/__uids__/cdaboo/tasks/',
+            '/calendars/__uids__/cdaboo/inbox/',
+        ])
+        self.assertEquals(tokens, {
+            '/calendars/__uids__/cdaboo/calendar/': 'token1',
+            u'/calendars/__uids__/cdaboo/tasks/': 'token2',
+            '/calendars/__uids__/cdaboo/inbox/': None,
+        })
+        self.assertEquals(calls, [])
+
+    @inlineCallbacks
+    def test_largeResponseChunked(self):
+        """
+        A large response is compressed and, if still too large for one memcache value, split into chunks.
+        """
+        self.patch(config, "ResponseCacheCompressSize", 1024)
+        self.rc.CHUNK_SIZE = 100
+        body = "".join([str(i) for i in range(10000)])
+        expected_response = StubResponse(207, {}, body)
+
+        yield self.rc.cacheResponseForRequest(
+            StubRequest('PROPFIND', '/principals/__uids__/dreid/', '/principals/__uids__/dreid/'),
+            expected_response,
+        )
+        entries = [value for value in self.memcacheStub._cache.values() if value[0] != 0]
+        self.assertEquals(len(entries), 1)
+        self.assertEquals(entries[0][0], self.rc.FLAG_COMPRESSED | self.rc.FLAG_CHUNKED)
+        self.assertTrue(int(entries[0][1].split(":")[1]) > 1)
+
+        response = yield self.rc.getResponseForRequest(
+            StubRequest('PROPFIND', '/principals/__uids__/dreid/', '/principals/__uids__/dreid/')
+        )
+        yield self.assertResponse(response, (207, expected_response.headers, body))
+
+    def test_getResponseForNonSyncReport(self):
+        """
+        Only sync-collection REPORTs are looked up in the cache.
+        """
+        calls = []
+        self.patch(self.memcacheStub, "get", lambda key: calls.append(key))
+
+        d = self.rc.getResponseForRequest(StubRequest(
+            'REPORT',
+            '/calendars/__uids__/cdaboo/calendar/',
+            '/principals/__uids__/cdaboo/',
+            body='<calendar-query/>'
+        ))
+
+        d.addCallback(self.assertEquals, None)
+        d.addCallback(lambda _: self.assertEquals(calls, []))
+        return d
+
 
 class StubResponseCacheResource(object):
 
@@ -493,6 +563,20 @@ class TestCachingResource(PropfindCacheMixin, TestRenderMixin):
         self.response = response
 
 
+class TestCachingCollection(CollectionCacheMixin, TestRenderMixin):
+
+    def __init__(self, response, url, ownerURL):
+        self.response = response
+        self._url = url
+        self._ownerURL = ownerURL
+
+    def url(self):
+        return self._url
+
+    def owner_url(self):
+        return self._ownerURL
+
+
 class TestCacheStoreNotifier(TestCase):
 
     @inlineCallbacks
@@ -577,3 +661,52 @@ class PropfindCacheMixinTests(TestCase):
         d.addCallback(_checkCache)
 
         return d
+
+
+class CollectionCacheMixinTests(TestCase):
+    """
+    Test the CollectionCacheMixin
+    """
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.resource = TestCachingCollection(
+            StubResponse(207, {}, "foobar"),
+            '/calendars/__uids__/dreid/shared/',
+            '/calendars/__uids__/cdaboo/calendar/',
+        )
+        self.responseCache = StubResponseCacheResource()
+
+    @inlineCallbacks
+    def test_propfindDepth(self):
+        """
+        Only Depth:1 PROPFINDs are cached, tracking the owner's URI for the collection.
+        """
+        request = StubRequest('PROPFIND', '/calendars/__uids__/dreid/shared/', '/principals/__uids__/dreid/', depth='0')
+        request.resources['/'] = self.responseCache
+        yield self.resource.renderHTTP(request)
+        self.assertFalse(request in self.responseCache.cache)
+
+        request = StubRequest('PROPFIND', '/calendars/__uids__/dreid/shared/', '/principals/__uids__/dreid/')
+        request.resources['/'] = self.responseCache
+        request.childCacheURIs = ['/calendars/__uids__/dreid/shared/1.ics']
+        yield self.resource.renderHTTP(request)
+        self.assertTrue(request in self.responseCache.cache)
+        self.assertEquals(request.childCacheURIs, ['/calendars/__uids__/cdaboo/calendar/'])
+
+    @inlineCallbacks
+    def test_syncReport(self):
+        """
+        Only sync-collection REPORTs with no changes are cached.
+        """
+        request = StubRequest('REPORT', '/calendars/__uids__/dreid/shared/', '/principals/__uids__/dreid/')
+        request.resources['/'] = self.responseCache
+        request.syncReportEmpty = False
+        yield self.resource.renderHTTP(request)
+        self.assertFalse(request in self.responseCache.cache)
+
+        request = StubRequest('REPORT', '/calendars/__uids__/dreid/shared/', '/principals/__uids__/dreid/')
+        request.resources['/'] = self.responseCache
+        request.syncReportEmpty = True
+        yield self.resource.renderHTTP(request)
+        self.assertTrue(request in self.responseCache.cache)
@@ -68,6 +68,26 @@ class MemcacherTestCase(TestCase):
             result = yield cacher.get("akey")
             self.assertEquals(None, result)
 
+    @inlineCallbacks
+    def test_multi(self):
+
+        for processType in ("Single", "Combined",):
+            config.ProcessType = processType
+
+            cacher = Memcacher("testing", pickle=True)
+
+            result = yield cacher.set_multi({"akey": ["1", "2"], "bkey": set(("3",))})
+            self.assertEquals(result, {"akey": True, "bkey": True})
+
+            result = yield cacher.get_multi(["akey", "bkey", "ckey"])
+            if isinstance(cacher._memcacheProtocol, Memcacher.nullCacher):
+                self.assertEquals(result, {"akey": None, "bkey": None, "ckey": None})
+            else:
+                self.assertEquals(result, {"akey": ["1", "2"], "bkey": set(("3",)), "ckey": None})
+
+            result = yield cacher.get_multi([])
+            self.assertEquals(result, {})
+
     @inlineCallbacks
     def test_all_pickled(self):
 
@@ -14,11 +14,15 @@
 # limitations under the License.
 ##
 
+from pycalendar.datetime import DateTime
+from pycalendar.timezone import Timezone
+from twistedcaldav.config import config
 from twistedcaldav.timezones import TimezoneCache
 from twistedcaldav.timezonestdservice import TimezoneInfo, \
-    PrimaryTimezoneDatabase
+    PrimaryTimezoneDatabase, TimezoneStdServiceResource
 from xml.etree.ElementTree import Element
 import hashlib
+import json
 import os
 import twistedcaldav.test.util
 
@@ -149,3 +153,54 @@ class TestPrimaryTimezoneDatabase (twistedcaldav.test.util.TestCase):
         tz1 = db.getTimezone("US/Eastern")
         self.assertTrue(str(tz1).find("VTIMEZONE") != -1)
         self.assertTrue(str(tz1).find("TZID:US/Eastern") != -1)
+
+
+class StubParent(object):
+
+    def principalCollections(self):
+        return ()
+
+
+class TestTimezoneStdServiceResource (twistedcaldav.test.util.TestCase):
+    """
+    Timezone service resource tests
+    """
+
+    def setUp(self):
+        TimezoneCache.create()
+
+    def testExpandCache(self):
+
+        xmlfile = self.mktemp()
+        db = PrimaryTimezoneDatabase(TimezoneCache.getDBPath(), xmlfile)
+        db.createNewDatabase()
+
+        def _initPrimaryService(resource):
+            resource.timezones = db
+        self.patch(TimezoneStdServiceResource, "_initPrimaryService", _initPrimaryService)
+        self.patch(config.TimezoneService, "PrecomputeExpansions", [[0, 1]])
+        resource = TimezoneStdServiceResource(StubParent())
+
+        # Precomputed windows are served from the cache
+        resource.precomputeExpansions()
+        self.assertEqual(len(resource.expandcache), len(list(db.listTimezones(None))))
+
+        year = DateTime.getToday().getYear()
+        start = DateTime(year, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
+        end = DateTime(year + 1, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
+        hits = resource.expandcache.hits
+        body, etag = resource._expandedBody("America/New_York", start, end)
+        self.assertEqual(resource.expandcache.hits, hits + 1)
+        self.assertEqual(etag, hashlib.md5(body).hexdigest())
+        result = json.loads(body)
+        self.assertEqual(result["tzid"], "America/New_York")
+        self.assertNotEqual(len(result["observances"]), 0)
+
+        # A database change means the expansion is re-calculated
+        db.dtstamp = "20500101T000000Z"
+        misses = resource.expandcache.misses
+        body, etag = resource._expandedBody("America/New_York", start, end)
+        self.assertEqual(resource.expandcache.misses, misses + 1)
+        self.assertEqual(json.loads(body)["dtstamp"], db.dtstamp)
+
+        self.assertEqual(resource._expandedBody("Bogus", start, end), None)
@@ -18,7 +18,8 @@ from txweb2.http_headers import Headers
 
 from twistedcaldav.config import ConfigDict
 from twistedcaldav.stdconfig import _updateClientFixes
-from twistedcaldav.util import bestAcceptType, userAgentProductTokens, matchClientFixes
+from twistedcaldav.util import bestAcceptType, userAgentProductTokens, matchClientFixes, \
+    LRUCache
 import twistedcaldav.test.util
 
 
@@ -219,3 +220,69 @@ class AcceptType(twistedcaldav.test.util.TestCase):
                 set(),
                 msg="Incorrectly matched {}".format(ua),
             )
+
+
+class LRUCacheTests(twistedcaldav.test.util.TestCase):
+    """
+    L{LRUCache} tests
+    """
+
+    def test_eviction(self):
+        """
+        The least recently used entry is discarded when the cache is full.
+        """
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue("b" not in cache)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats(), {"size": 2, "max-size": 2, "hits": 3, "misses": 1, "evictions": 1})
+
+        cache = LRUCache(0)
+        cache.set("a", 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_memoryEviction(self):
+        """
+        A cache with a C{sizeOf} function discards the least recently used entries once
+        the total memory of its values exceeds its maximum size.
+        """
+        cache = LRUCache(10, sizeOf=len)
+        cache.set("a", "1234")
+        cache.set("b", "12345")
+        self.assertEqual(cache.memory, 9)
+        cache.set("c", "12")
+        self.assertEqual(len(cache), 2)
+        self.assertTrue("a" not in cache)
+        self.assertEqual(cache.memory, 7)
+        cache.set("d", "12345678901")
+        self.assertTrue("d" not in cache)
+        cache.pop("b")
+        self.assertEqual(cache.stats(), {"size": 1, "max-size": 10, "hits": 0, "misses": 0, "evictions": 1, "memory": 2})
+
+    def test_countsSinceLastReport(self):
+        """
+        Named caches report the counts accumulated since the last report.
+        """
+        self.patch(LRUCache, "namedCaches", {})
+        cache = LRUCache(2, name="test")
+        self.assertEqual(LRUCache.countsSinceLastReport(), {})
+
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual(LRUCache.countsSinceLastReport(), {"test": {"hits": 1, "misses": 1, "evictions": 0}})
+
+        cache.get("a")
+        self.assertEqual(LRUCache.countsSinceLastReport(), {"test": {"hits": 1, "misses": 0, "evictions": 0}})
+        self.assertEqual(LRUCache.countsSinceLastReport(), {})
+
+        sized = LRUCache(10, name="sized", sizeOf=len)
+        sized.set("a", "1234")
+        sized.get("a")
+        self.assertEqual(LRUCache.countsSinceLastReport(), {"sized": {"hits": 1, "misses": 0, "evictions": 0, "memory": 4}})
@@ -448,6 +448,9 @@ class InMemoryMemcacheProtocol(object):
 
         return succeed(self._cache[key])
 
+    def get_multi(self, keys):
+        return succeed(dict([(key, self._cache.get(key, (0, None))) for key in keys]))
+
     def _timeoutKey(self, expireTime, key):
         def _removeKey():
             del self._cache[key]
@@ -471,6 +474,12 @@ class InMemoryMemcacheProtocol(object):
         except Exception:
             return fail(Failure())
 
+    def set_multi(self, values, flags=0, expireTime=0):
+        return succeed(dict([
+            (key, self.set(key, value, flags=flags, expireTime=expireTime).result)
+            for key, value in values.items()
+        ]))
+
     def add(self, key, value, flags=0, expireTime=0):
         if key in self._cache:
             return succeed(False)
@@ -32,7 +32,7 @@ from txweb2.dav.noneprops import NonePropertyStore
 from txweb2.dav.util import joinURL
 from txweb2.http import HTTPError, JSONResponse, StatusResponse
 from txweb2.http import Response
-from txweb2.http_headers import MimeType
+from txweb2.http_headers import ETag, MimeType
 from txweb2.stream import MemoryStream
 from txdav.xml import element as davxml
 
@@ -48,12 +48,13 @@ from twistedcaldav.ical import tzexpandlocal
 from twistedcaldav.resource import ReadOnlyNoCopyResourceMixIn
 from twistedcaldav.timezones import TimezoneException, TimezoneCache, readVTZ, \
     addVTZ
-from twistedcaldav.util import bestAcceptType
+from twistedcaldav.util import bestAcceptType, LRUCache
 from twistedcaldav.xmlutil import addSubElement
 
 from pycalendar.icalendar.calendar import Calendar
 from pycalendar.datetime import DateTime
 from pycalendar.exceptions import InvalidData
+from pycalendar.timezone import Timezone
 
 import hashlib
 import itertools
@@ -80,7 +81,13 @@ class TimezoneStdServiceResource (ReadOnlyNoCopyResourceMixIn, DAVResourceWithou
         DAVResource.__init__(self, principalCollections=parent.principalCollections())
 
         self.parent = parent
-        self.expandcache = {}
+        self.expandcache = LRUCache(
+            config.TimezoneService.ExpandCacheSize * 1000 * 1000,
+            name="timezone-expansions",
+            sizeOf=lambda value: len(value[0]),
+        )
+        self.zonecache = {}
+        self.zonecache_dtstamp = None
         self.primary = True
         self.info_source = None
 
@@ -124,8 +131,32 @@ class TimezoneStdServiceResource (ReadOnlyNoCopyResourceMixIn, DAVResourceWithou
         self.info_source = "Secondary"
         self.primary = False
 
+    @inlineCallbacks
     def onStartup(self):
-        return self.timezones.onStartup()
+        yield self.timezones.onStartup()
+        self.precomputeExpansions()
+
+    def precomputeExpansions(self):
+        """
+        Expand every timezone over each of the configured common expansion windows, so that those
+        requests are answered from the expansion cache. Each window is a pair of year offsets from
+        the current year, with the expansion running from January 1st of the first year to
+        January 1st of the second.
+        """
+
+        windows = config.TimezoneService.PrecomputeExpansions
+        if not windows or self.expandcache.maxSize <= 0:
+            return
+
+        year = DateTime.getToday().getYear()
+        count = 0
+        for tzinfo in self.timezones.listTimezones(None):
+            for startOffset, endOffset in windows:
+                start = DateTime(year + startOffset, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
+                end = DateTime(year + endOffset, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
+                if self._expandedBody(tzinfo.tzid, start, end) is not None:
+                    count += 1
+        log.info("Precomputed {count} timezone expansions", count=count)
 
     def deadProperties(self):
         if not hasattr(self, "_dead_properties"):
@@ -367,16 +398,22 @@ class TimezoneStdServiceResource (ReadOnlyNoCopyResourceMixIn, DAVResourceWithou
         if accepted_type is None:
             self.problemReport("invalid-format", "Accept header does not match available media types", responsecode.NOT_ACCEPTABLE)
 
-        calendar = self.timezones.getTimezone(tzid)
-        if calendar is None:
-            self.problemReport("tzid-not-found", "Time zone identifier not found", responsecode.NOT_FOUND)
+        # Rendered timezone data is cached until the database changes
+        if self.zonecache_dtstamp != self.timezones.dtstamp:
+            self.zonecache = {}
+            self.zonecache_dtstamp = self.timezones.dtstamp
 
-        tzdata = calendar.getText(format=accepted_type if accepted_type != "text/plain" else None)
+        cached = self.zonecache.get((tzid, accepted_type,))
+        if cached is None:
+            calendar = self.timezones.getTimezone(tzid)
+            if calendar is None:
+                self.problemReport("tzid-not-found", "Time zone identifier not found", responsecode.NOT_FOUND)
 
-        response = Response()
-        response.stream = MemoryStream(tzdata)
-        response.headers.setHeader("content-type", MimeType.fromString("%s; charset=utf-8" % (accepted_type,)))
-        return response
+            tzdata = calendar.getText(format=accepted_type if accepted_type != "text/plain" else None)
+            cached = (tzdata, hashlib.md5(tzdata).hexdigest(),)
+            self.zonecache[(tzid, accepted_type,)] = cached
+
+        return self._cachedResponse(cached, "%s; charset=utf-8" % (accepted_type,))
 
     def actionExpand(self, request, tzid):
         """
@@ -414,30 +451,65 @@ class TimezoneStdServiceResource (ReadOnlyNoCopyResourceMixIn, DAVResourceWithou
             if end <= start:
                 self.problemReport("invalid-end", "Invalid end request-URI query parameter value - earlier than start", responsecode.BAD_REQUEST)
 
-        tzdata = self.timezones.getTimezone(tzid)
-        if tzdata is None:
+        cached = self._expandedBody(tzid, start, end)
+        if cached is None:
             self.problemReport("tzid-not-found", "Time zone identifier not found", responsecode.NOT_FOUND)
 
-        # Now do the expansion (but use a cache to avoid re-calculating TZs)
-        observances = self.expandcache.get((tzid, start, end), None)
-        if observances is None:
+        return self._cachedResponse(cached, "application/json")
+
+    def _expandedBody(self, tzid, start, end):
+        """
+        Get the rendered JSON body for the expansion of a timezone, using a cache to avoid
+        re-calculating TZs. Entries are keyed by the database dtstamp, so any change to the
+        database leaves old entries to be evicted.
+
+        @return: C{tuple} of JSON body and its ETag value, or C{None} if the timezone does not exist
+        @rtype: C{tuple}
+        """
+        key = (tzid, self.timezones.dtstamp, start, end,)
+        cached = self.expandcache.get(key)
+        if cached is None:
+            tzdata = self.timezones.getTimezone(tzid)
+            if tzdata is None:
+                return None
             observances = tzexpandlocal(tzdata, start, end, utc_onset=True)
-            self.expandcache[(tzid, start, end)] = observances
 
-        # Turn into JSON
-        result = {
-            "dtstamp": self.timezones.dtstamp,
-            "tzid": tzid,
-            "observances": [
-                {
-                    "name": name,
-                    "onset": onset.getXMLText(),
-                    "utc-offset-from": utc_offset_from,
-                    "utc-offset-to": utc_offset_to,
-                } for onset, utc_offset_from, utc_offset_to, name in observances
-            ],
-        }
-        return JSONResponse(responsecode.OK, result, pretty=config.TimezoneService.PrettyPrintJSON)
+            # Turn into JSON
+            result = {
+                "dtstamp": self.timezones.dtstamp,
+                "tzid": tzid,
+                "observances": [
+                    {
+                        "name": name,
+                        "onset": onset.getXMLText(),
+                        "utc-offset-from": utc_offset_from,
+                        "utc-offset-to": utc_offset_to,
+                    } for onset, utc_offset_from, utc_offset_to, name in observances
+                ],
+            }
+            if config.TimezoneService.PrettyPrintJSON:
+                body = json.dumps(result, indent=2, separators=(",", ":",))
+            else:
+                body = json.dumps(result)
+            cached = (body, hashlib.md5(body).hexdigest(),)
+            self.expandcache.set(key, cached)
+        return cached
+
+    def _cachedResponse(self, cached, contentType):
+        """
+        Build a response for a cached body. The ETag lets clients revalidate with a conditional
+        request, which the GET precondition filter then answers with a 304.
+
+        @param cached: C{tuple} of body and its ETag value
+        @type cached: C{tuple}
+        @param contentType: the content type of the body
+        @type contentType: C{str}
+        """
+        body, etag = cached
+        response = Response(responsecode.OK, stream=MemoryStream(body))
+        response.headers.setHeader("content-type", MimeType.fromString(contentType))
+        response.headers.setHeader("etag", ETag(etag))
+        return response
 
     def actionFind(self, request):
         """
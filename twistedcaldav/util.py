@@ -20,6 +20,7 @@ import sys
 import base64
 import itertools
 
+from collections import OrderedDict
 from subprocess import Popen, PIPE, STDOUT
 from hashlib import md5, sha1
 
@@ -209,6 +210,139 @@ def utf8String(s):
     return s
 
 
+class LRUCache(object):
+    """
+    A bounded in-memory cache that discards the least recently used entries once
+    it is full. Hit, miss and eviction counts are kept so that named caches can be
+    reported in the server stats. The cache is bounded either by the number of
+    entries, or, when a C{sizeOf} function is supplied, by the total (approximate)
+    memory used by the values.
+
+    @cvar namedCaches: the named caches in this process
+    @type namedCaches: C{dict} mapping C{str} to L{LRUCache}
+    """
+
+    namedCaches = {}
+
+    def __init__(self, maxSize, name=None, sizeOf=None):
+        """
+        @param maxSize: the maximum number of entries, or the maximum total memory
+            if C{sizeOf} is supplied, with zero or less meaning nothing is cached
+        @type maxSize: C{int}
+        @param name: if not C{None}, the name under which the cache counts are
+            reported
+        @type name: C{str}
+        @param sizeOf: if not C{None}, a function returning the approximate memory
+            used by a value
+        @type sizeOf: C{callable}
+        """
+        self.maxSize = maxSize
+        self.sizeOf = sizeOf
+        self.memory = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._reported = (0, 0, 0,)
+        if name is not None:
+            LRUCache.namedCaches[name] = self
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        Get a cached value and mark it as the most recently used.
+        """
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Cache a value, discarding the least recently used entries if the cache is full.
+        """
+        if self.maxSize <= 0:
+            return
+        self.pop(key)
+        if self.sizeOf is not None:
+            size = self.sizeOf(value)
+            if size > self.maxSize:
+                return
+            self._sizes[key] = size
+            self.memory += size
+        self._data[key] = value
+        while (self.memory if self.sizeOf is not None else len(self._data)) > self.maxSize:
+            oldest, _ignore_value = self._data.popitem(last=False)
+            self.memory -= self._sizes.pop(oldest, 0)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        self.memory -= self._sizes.pop(key, 0)
+        return self._data.pop(key, default)
+
+    def items(self):
+        """
+        Get all the cached entries, least recently used first, without changing
+        their order.
+        """
+        return self._data.items()
+
+    def clear(self):
+        self._data.clear()
+        self._sizes.clear()
+        self.memory = 0
+
+    def stats(self):
+        """
+        @return: the current size, maximum size and counts, and the memory in use if
+            the cache is bounded by memory
+        @rtype: C{dict}
+        """
+        results = {
+            "size": len(self._data),
+            "max-size": self.maxSize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+        if self.sizeOf is not None:
+            results["memory"] = self.memory
+        return results
+
+    @classmethod
+    def countsSinceLastReport(cls):
+        """
+        Get the hit, miss and eviction counts of each named cache that have accumulated
+        since the last call. Caches bounded by memory also report the memory they are
+        currently using.
+
+        @return: the counts for each named cache that has had any activity
+        @rtype: C{dict} mapping C{str} cache name to C{dict} of counts
+        """
+        results = {}
+        for name, cache in cls.namedCaches.items():
+            current = (cache.hits, cache.misses, cache.evictions,)
+            if current != cache._reported:
+                results[name] = dict(zip(
+                    ("hits", "misses", "evictions",),
+                    [now - then for now, then in zip(current, cache._reported)],
+                ))
+                if cache.sizeOf is not None:
+                    results[name]["memory"] = cache.memory
+                cache._reported = current
+        return results
+
+
 ##
 # Keychain access
 ##
@@ -24,11 +24,14 @@ __all__ = [
 ]
 
 
+from twistedcaldav.config import config
 from twistedcaldav.memcacher import Memcacher
+from twistedcaldav.util import LRUCache
 
 from twext.enterprise.dal.syntax import (
     Select, Parameter, Update, Insert, TableSyntax, Delete)
 
+from txdav.xml.base import WebDAVElement, WebDAVEmptyElement, WebDAVOneShotElement
 from txdav.xml.parser import WebDAVDocument
 from txdav.common.icommondatastore import AllRetriesFailed
 from txdav.common.datastore.sql_tables import schema
@@ -41,6 +44,60 @@ from twisted.internet.defer import inlineCallbacks, returnValue
 prop = schema.RESOURCE_PROPERTY
 
 
+def _copyElement(element):
+    """
+    Copy a parsed XML element tree so that the copy can be changed without affecting the
+    original. Attribute-less empty and one-shot elements are shared singletons even when
+    freshly parsed, so those are not copied.
+    """
+    if isinstance(element, (WebDAVEmptyElement, WebDAVOneShotElement)) and not element.attributes:
+        return element
+    clone = object.__new__(element.__class__)
+    clone.__dict__.update(element.__dict__)
+    if isinstance(element, WebDAVElement):
+        clone.children = tuple([_copyElement(child) for child in element.children])
+        clone.attributes = dict(element.attributes)
+    return clone
+
+
+# A parsed property value, together with its serialized key, takes roughly this many times the
+# memory of the serialized text
+_PROPERTY_MEMORY_FACTOR = 10
+
+_parsedValueCache = None
+
+
+def _parsedValue(value):
+    """
+    Parse a serialized property value, using a per-process cache of parsed values so that
+    commonly used values are not re-parsed on each read. The cache holds the original parsed
+    element and every caller gets its own copy. It is bounded by the approximate memory of the
+    cached values, so that a few large values (such as calendar timezones) cannot grow it
+    without limit. Each cached value is a C{tuple} of the element and its text length.
+
+    @param value: the serialized property value
+    @type value: C{str}
+
+    @return: the parsed property
+    @rtype: L{WebDAVElement}
+    """
+    global _parsedValueCache
+    if config.PropertyValueCacheSize <= 0:
+        return WebDAVDocument.fromString(value).root_element
+    if _parsedValueCache is None:
+        _parsedValueCache = LRUCache(
+            config.PropertyValueCacheSize * 1000 * 1000,
+            name="property-values",
+            sizeOf=lambda cached: cached[1] * _PROPERTY_MEMORY_FACTOR,
+        )
+
+    cached = _parsedValueCache.get(value)
+    if cached is None:
+        cached = (WebDAVDocument.fromString(value).root_element, len(value),)
+        _parsedValueCache.set(value, cached)
+    return _copyElement(cached[0])
+
+
 class PropertyStore(AbstractPropertyStore):
     """
     We are going to use memcache to cache properties per-resource/per-user. However, we
@@ -69,55 +126,114 @@ class PropertyStore(AbstractPropertyStore):
               (prop.VIEWER_UID == Parameter("viewerID"))
     )
 
+    @staticmethod
+    def _cacheTokenFor(resourceID, userid):
+        return "{0!s}/{1}".format(resourceID, userid)
+
     def _cacheToken(self, userid):
-        return "{0!s}/{1}".format(self._resourceID, userid)
+        return self._cacheTokenFor(self._resourceID, userid)
 
-    @inlineCallbacks
-    def _refresh(self, txn):
+    def _cacheUIDs(self):
         """
-        Load, or re-load, this object with the given transaction; first from
-        memcache, then pulling from the database again.
+        The user ids whose properties are loaded into this store: the owner first, then the sharee
+        and proxy if different.
         """
-        # Cache existing properties in this object
-        # Look for memcache entry first
+        uids = [self._defaultUser]
+        if self._perUser != self._defaultUser:
+            uids.append(self._perUser)
+        if self._proxyUser not in uids:
+            uids.append(self._proxyUser)
+        return uids
 
-        @inlineCallbacks
-        def _cache_user_props(uid):
+    @classmethod
+    @inlineCallbacks
+    def _cachedRows(cls, resourceIDs, uids):
+        """
+        Fetch the valid cached users and the cached per-user rows for a set of resources, using a
+        single memcache request for all of them.
 
-            # First check whether uid already has a valid cached entry
-            rows = None
-            if self._cacher is not None:
-                valid_cached_users = yield self._cacher.get(str(self._resourceID))
-                if valid_cached_users is None:
-                    valid_cached_users = set()
+        @param resourceIDs: the resources to fetch
+        @type resourceIDs: C{list} of C{int}
+        @param uids: the user ids to fetch rows for
+        @type uids: C{list} of C{str}
+
+        @return: a L{Deferred} that fires with a C{dict} mapping resource ID to a C{tuple} of the
+            C{set} of valid cached users and a C{dict} mapping user id to cached rows, for those
+            users that have valid cached rows.
+        """
+        keys = []
+        for resourceID in resourceIDs:
+            keys.append(str(resourceID))
+            keys.extend([cls._cacheTokenFor(resourceID, uid) for uid in uids])
+        values = yield cls._cacher.get_multi(keys)
 
-                # Fetch cached user data if valid and present
+        results = {}
+        for resourceID in resourceIDs:
+            valid_cached_users = values.get(str(resourceID))
+            if valid_cached_users is None:
+                valid_cached_users = set()
+            cached_rows = {}
+            for uid in uids:
                 if uid in valid_cached_users:
-                    rows = yield self._cacher.get(self._cacheToken(uid))
+                    rows = values.get(cls._cacheTokenFor(resourceID, uid))
+                    if rows is not None:
+                        cached_rows[uid] = rows
+            results[resourceID] = (valid_cached_users, cached_rows,)
+        returnValue(results)
+
+    @classmethod
+    @inlineCallbacks
+    def _cacheRows(cls, resourceRows):
+        """
+        Add per-user rows for a set of resources to the cache and mark those users as valid. The
+        rows are stored before the valid user sets are updated, so that a valid user always has
+        rows present.
+
+        @param resourceRows: the rows to cache
+        @type resourceRows: C{dict} mapping resource ID to a C{tuple} of the C{set} of valid cached
+            users and a C{dict} mapping user id to rows
+        """
+        rowValues = {}
+        validValues = {}
+        for resourceID, (valid_cached_users, rows,) in resourceRows.items():
+            for uid, userRows in rows.items():
+                rowValues[cls._cacheTokenFor(resourceID, uid)] = userRows if userRows is not None else ()
+                valid_cached_users.add(uid)
+            validValues[str(resourceID)] = valid_cached_users
+        yield cls._cacher.set_multi(rowValues)
+        yield cls._cacher.set_multi(validValues)
+
+    @inlineCallbacks
+    def _refresh(self, txn):
+        """
+        Load, or re-load, this object with the given transaction; first from
+        memcache, then pulling from the database again.
+        """
+        # Look for memcache entries for all users first
+        uids = self._cacheUIDs()
+        valid_cached_users = set()
+        cached_rows = {}
+        if self._cacher is not None:
+            cached = yield self._cachedRows((self._resourceID,), uids)
+            valid_cached_users, cached_rows = cached[self._resourceID]
 
-            # If no cached data, fetch from SQL DB and cache
+        # Fetch from SQL DB anything not cached
+        loaded_rows = {}
+        for uid in uids:
+            rows = cached_rows.get(uid)
             if rows is None:
                 rows = yield self._allWithIDViewer.on(
                     txn,
                     resourceID=self._resourceID,
                     viewerID=uid,
                 )
-                if self._cacher is not None:
-                    yield self._cacher.set(self._cacheToken(uid), rows if rows is not None else ())
-
-                    # Mark this uid as valid
-                    valid_cached_users.add(uid)
-                    yield self._cacher.set(str(self._resourceID), valid_cached_users)
+                loaded_rows[uid] = rows
 
             for name, value in rows:
                 self._cached[(name, uid)] = value
 
-        # Cache for the owner first, then the sharee if different
-        yield _cache_user_props(self._defaultUser)
-        if self._perUser != self._defaultUser:
-            yield _cache_user_props(self._perUser)
-        if self._proxyUser != self._perUser:
-            yield _cache_user_props(self._proxyUser)
+        if self._cacher is not None and loaded_rows:
+            yield self._cacheRows({self._resourceID: (valid_cached_users, loaded_rows,)})
 
     @classmethod
     @inlineCallbacks
@@ -206,26 +322,68 @@ class PropertyStore(AbstractPropertyStore):
         @return: a L{Deferred} that fires with a C{dict} mapping resource ID (a
             value taken from C{childColumn}) to a L{PropertyStore} for that ID.
         """
-        query = Select([
-            prop.RESOURCE_ID, prop.NAME, prop.VIEWER_UID, prop.VALUE],
-            From=prop,
-            Where=prop.RESOURCE_ID.In(Parameter("resourceIDs", len(resourceIDs)))
-        )
-        rows = yield query.on(txn, resourceIDs=resourceIDs)
-        stores = cls._createMultipleStores(defaultUser, shareeUser, proxyUser, txn, rows)
-
-        # Make sure we have a store for each resourceID even if no properties exist
-        for resourceID in resourceIDs:
-            if resourceID not in stores:
-                store = cls.__new__(cls)
-                super(PropertyStore, store).__init__(defaultUser, shareeUser, proxyUser)
-                store._txn = txn
-                store._resourceID = resourceID
-                store._cached = {}
-                stores[resourceID] = store
+        stores = {}
+        uncachedIDs = resourceIDs
+        cached = None
+
+        # Look for memcache entries for all resources and users in one go, and only query the
+        # resources that are not fully cached
+        if cls._cacher is not None and txn.store().queryCachingEnabled() and resourceIDs:
+            uids = cls._newStore(defaultUser, shareeUser, proxyUser, txn, None)._cacheUIDs()
+            cached = yield cls._cachedRows(resourceIDs, uids)
+            uncachedIDs = []
+            for resourceID in resourceIDs:
+                _ignore_valid_cached_users, cached_rows = cached[resourceID]
+                if len(cached_rows) == len(uids):
+                    store = cls._newStore(defaultUser, shareeUser, proxyUser, txn, resourceID)
+                    for uid, rows in cached_rows.items():
+                        for name, value in rows:
+                            store._cached[(name, uid)] = value
+                    stores[resourceID] = store
+                else:
+                    uncachedIDs.append(resourceID)
+
+        if uncachedIDs:
+            query = Select([
+                prop.RESOURCE_ID, prop.NAME, prop.VIEWER_UID, prop.VALUE],
+                From=prop,
+                Where=prop.RESOURCE_ID.In(Parameter("resourceIDs", len(uncachedIDs)))
+            )
+            rows = yield query.on(txn, resourceIDs=uncachedIDs)
+            stores.update(cls._createMultipleStores(defaultUser, shareeUser, proxyUser, txn, rows))
+
+            # Make sure we have a store for each resourceID even if no properties exist
+            for resourceID in uncachedIDs:
+                if resourceID not in stores:
+                    stores[resourceID] = cls._newStore(defaultUser, shareeUser, proxyUser, txn, resourceID)
+
+            # Cache what was loaded
+            if cached is not None:
+                resourceRows = {}
+                for resourceID in uncachedIDs:
+                    store = stores[resourceID]
+                    valid_cached_users, _ignore_cached_rows = cached[resourceID]
+                    userRows = dict([(uid, []) for uid in uids])
+                    for (name, uid), value in store._cached.items():
+                        if uid in userRows:
+                            userRows[uid].append((name, value,))
+                    resourceRows[resourceID] = (valid_cached_users, userRows,)
+                yield cls._cacheRows(resourceRows)
 
         returnValue(stores)
 
+    @classmethod
+    def _newStore(cls, defaultUser, shareeUser, proxyUser, txn, resourceID):
+        """
+        Create an empty store for a resource.
+        """
+        store = cls.__new__(cls)
+        super(PropertyStore, store).__init__(defaultUser, shareeUser, proxyUser)
+        store._txn = txn
+        store._resourceID = resourceID
+        store._cached = {}
+        return store
+
     @classmethod
     def _createMultipleStores(cls, defaultUser, shareeUser, proxyUser, txn, rows):
         """
@@ -241,20 +399,10 @@ class PropertyStore(AbstractPropertyStore):
                 resource_id, name, view_uid, value = row
             if resource_id:
                 if resource_id not in createdStores:
-                    store = cls.__new__(cls)
-                    super(PropertyStore, store).__init__(defaultUser, shareeUser, proxyUser)
-                    store._txn = txn
-                    store._resourceID = resource_id
-                    store._cached = {}
-                    createdStores[resource_id] = store
+                    createdStores[resource_id] = cls._newStore(defaultUser, shareeUser, proxyUser, txn, resource_id)
                 createdStores[resource_id]._cached[(name, view_uid)] = value
             elif object_resource_id:
-                store = cls.__new__(cls)
-                super(PropertyStore, store).__init__(defaultUser, shareeUser, proxyUser)
-                store._txn = txn
-                store._resourceID = object_resource_id
-                store._cached = {}
-                createdStores[object_resource_id] = store
+                createdStores[object_resource_id] = cls._newStore(defaultUser, shareeUser, proxyUser, txn, object_resource_id)
 
         return createdStores
 
@@ -266,7 +414,7 @@ class PropertyStore(AbstractPropertyStore):
         except KeyError:
             raise KeyError(key)
 
-        return WebDAVDocument.fromString(value).root_element
+        return _parsedValue(value)
 
     _updateQuery = Update({prop.VALUE: Parameter("value")},
                           Where=(
@@ -31,7 +31,10 @@ from txdav.base.propertystore.test.base import (
 from twisted.internet.defer import gatherResults
 from twext.enterprise.ienterprise import AlreadyFinishedError
 
+from twistedcaldav.util import LRUCache
+
 try:
+    from txdav.base.propertystore import sql
     from txdav.base.propertystore.sql import PropertyStore
 except ImportError, e:
     # XXX: when could this ever fail?
@@ -236,6 +239,88 @@ class PropertyStoreTest(PropertyStoreTest):
         yield store1_user1.__setitem__(pname, pvalue)
         self.assertEqual(store1_user1[pname], pvalue)
 
+    @inlineCallbacks
+    def test_forMultipleResourcesWithResourceIDs(self):
+        """
+        Test that bulk loading property stores populates the cache, and that a subsequent bulk load
+        is satisfied from the cache with a single multi-get and no SQL query.
+        """
+
+        store1_user1 = yield PropertyStore.load("user01", None, None, self._txn, 20)
+        store1_user2 = yield PropertyStore.load("user01", "user02", None, self._txn, 20)
+        store2_user1 = yield PropertyStore.load("user01", None, None, self._txn, 21)
+
+        pname1 = propertyName("dummy1")
+        pvalue1 = propertyValue("value1-user1")
+        pvalue2 = propertyValue("value1-user2")
+        pname3 = propertyName("dummy3")
+        pvalue3 = propertyValue("value3-user1")
+
+        yield store1_user1.__setitem__(pname1, pvalue1)
+        yield store1_user2.__setitem__(pname1, pvalue2)
+        yield store2_user1.__setitem__(pname3, pvalue3)
+        yield self._txn.commit()
+
+        # First load comes from the database and populates the cache
+        self._txn = self.store.newTransaction()
+        self.assertFalse("SQL.props:20/user02" in PropertyStore._cacher._memcacheProtocol._cache)
+        stores = yield PropertyStore.forMultipleResourcesWithResourceIDs("user01", "user02", None, self._txn, (20, 21, 22,))
+        self.assertEqual(set(stores.keys()), set((20, 21, 22,)))
+        self.assertEqual(stores[20][pname1], pvalue2)
+        self.assertTrue("SQL.props:20/user01" in PropertyStore._cacher._memcacheProtocol._cache)
+        self.assertTrue("SQL.props:20/user02" in PropertyStore._cacher._memcacheProtocol._cache)
+        self.assertTrue("SQL.props:22/user02" in PropertyStore._cacher._memcacheProtocol._cache)
+        yield self._txn.commit()
+
+        # Second load comes only from the cache
+        self._txn = self.store.newTransaction()
+        getMultiCalls = []
+        originalGetMulti = PropertyStore._cacher.get_multi
+
+        def _get_multi(keys):
+            getMultiCalls.append(keys)
+            return originalGetMulti(keys)
+        self.patch(PropertyStore._cacher, "get_multi", _get_multi)
+        self.patch(self._txn, "execSQL", lambda *a, **kw: self.fail("Unexpected SQL query"))
+
+        stores = yield PropertyStore.forMultipleResourcesWithResourceIDs("user01", "user02", None, self._txn, (20, 21, 22,))
+        self.assertEqual(len(getMultiCalls), 1)
+        self.assertEqual(set(stores.keys()), set((20, 21, 22,)))
+        self.assertEqual(stores[20][pname1], pvalue2)
+        self.assertEqual(stores[21]._getitem_uid(pname3, "user01"), pvalue3)
+        self.assertEqual(len(stores[22].keys()), 0)
+
+    @inlineCallbacks
+    def test_parsedValueCache(self):
+        """
+        Test that property values read from different stores are parsed once, and that each
+        read returns an element that can be changed without affecting other reads.
+        """
+
+        self.patch(sql, "_parsedValueCache", LRUCache(1000 * 1000, sizeOf=lambda cached: cached[1] * sql._PROPERTY_MEMORY_FACTOR))
+
+        store1_user1 = yield PropertyStore.load("user01", None, None, self._txn, 30)
+        store2_user1 = yield PropertyStore.load("user01", None, None, self._txn, 31)
+
+        pname = propertyName("dummy1")
+        pvalue = propertyValue("value1")
+
+        yield store1_user1.__setitem__(pname, pvalue)
+        yield store2_user1.__setitem__(pname, pvalue)
+
+        value1 = store1_user1[pname]
+        value2 = store2_user1[pname]
+        self.assertEqual(value1, pvalue)
+        self.assertEqual(value2, pvalue)
+        self.assertEqual(sql._parsedValueCache.misses, 1)
+        self.assertEqual(sql._parsedValueCache.hits, 1)
+        self.assertEqual(sql._parsedValueCache.memory, len(pvalue.toxml()) * sql._PROPERTY_MEMORY_FACTOR)
+
+        self.assertTrue(value1 is not value2)
+        value1.children = ()
+        value1.attributes["changed"] = "true"
+        self.assertEqual(store2_user1[pname], pvalue)
+
     @inlineCallbacks
     def test_cacher_failure(self):
         """
@@ -475,7 +475,7 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
 
         if user_uuid is None:
             user_uuid = self._parentCollection.viewerHome().uid()
-        return PerUserDataFilter(user_uuid).filter(self.component().duplicate())
+        return PerUserDataFilter(user_uuid).filterCopy(self.component())
 
     def _text(self):
         if self._objectText is not None:
@@ -812,6 +812,9 @@ class Attachment(FileMetaDataMixin):
     def retrieve(self, protocol):
         return AttachmentRetrievalTransport(self._path).start(protocol)
 
+    def retrieveFile(self):
+        return self._path.open()
+
     @property
     def _path(self):
         return self._dropboxPath.child(self.name())
@@ -14,7 +14,7 @@
 # limitations under the License.
 ##
 
-from twext.enterprise.dal.syntax import Select, Coalesce
+from twext.enterprise.dal.syntax import Select, Coalesce, Parameter
 
 from txdav.common.datastore.query import expression
 from txdav.common.datastore.query.generator import SQLQueryGenerator
@@ -41,6 +41,10 @@ class CalDAVSQLQueryGenerator(SQLQueryGenerator):
         @type expr: L{expression}
         @param collection: the resource targeted by the query
         @type collection: L{CommonHomeChild}
+        @param whereid: the resource-id of the targeted calendar, or a C{list} of resource-ids to query
+            multiple calendars at once - in that case the calendar resource-id is returned as the last
+            column of each result row
+        @type whereid: C{int} or C{list}
         @param userid: user for whom query is being done - query will be scoped to that user's privileges and their per-user data
         @type userid: C{str}
         @param freebusy: whether or not a freebusy query is being done - if it is, additional time range and peruser information is returned
@@ -64,6 +68,8 @@ class CalDAVSQLQueryGenerator(SQLQueryGenerator):
         self.argcount = 0
         obj = self.collection._objectSchema
 
+        multiple = isinstance(self.whereid, (list, tuple,))
+
         columns = [obj.RESOURCE_NAME, obj.ICALENDAR_UID, obj.ICALENDAR_TYPE]
         if self.freebusy:
             columns.extend([
@@ -75,11 +81,16 @@ class CalDAVSQLQueryGenerator(SQLQueryGenerator):
                 self._timerange.TRANSPARENT,
                 self._peruser.TRANSPARENT,
             ])
+        if multiple:
+            columns.append(obj.CALENDAR_RESOURCE_ID)
 
         # For SQL data DB we need to restrict the query to just the targeted calendar resource-id if provided
         if self.whereid:
 
-            test = expression.isExpression(obj.CALENDAR_RESOURCE_ID, self.whereid, True)
+            if multiple:
+                test = expression.inExpression(obj.CALENDAR_RESOURCE_ID, self.whereid, True)
+            else:
+                test = expression.isExpression(obj.CALENDAR_RESOURCE_ID, self.whereid, True)
 
             # Since timerange expression already have the calendar resource-id test in them, do not
             # add the additional term to those. When the additional term is added, add it as the first
@@ -128,7 +139,12 @@ class CalDAVSQLQueryGenerator(SQLQueryGenerator):
         where = self.generateExpression(self.expression)
 
         if self.usedtimerange:
-            where = where.And(self._timerange.CALENDAR_OBJECT_RESOURCE_ID == obj.RESOURCE_ID).And(self._timerange.CALENDAR_RESOURCE_ID == self.whereid)
+            if multiple:
+                argname = self.addArgument(self.whereid)
+                calendarTest = self._timerange.CALENDAR_RESOURCE_ID.In(Parameter(argname, len(self.whereid)))
+            else:
+                calendarTest = self._timerange.CALENDAR_RESOURCE_ID == self.whereid
+            where = where.And(self._timerange.CALENDAR_OBJECT_RESOURCE_ID == obj.RESOURCE_ID).And(calendarTest)
 
         # Set of tables depends on use of timespan and fb use
         if self.usedtimerange:
@@ -29,6 +29,7 @@ from twistedcaldav.config import config
 from txdav.base.propertystore.base import PropertyName
 from txdav.caldav.datastore.scheduling.delivery import DeliveryService
 from txdav.caldav.datastore.scheduling.freebusy import FreebusyQuery
+from txdav.caldav.datastore.scheduling.freebusyfanout import FreebusyFanout
 from txdav.caldav.datastore.scheduling.itip import iTIPRequestStatus
 from txdav.caldav.datastore.scheduling.processing import ImplicitProcessor, ImplicitProcessorException
 from txdav.caldav.datastore.scheduling.utils import extractEmailDomain
@@ -94,17 +95,23 @@ class ScheduleViaCalDAV(DeliveryService):
         organizerProp = self.scheduler.calendar.getOrganizerProperty()
         uid = self.scheduler.calendar.resourceUID()
 
-        # Freebusy needs to be optimized by doing multiple attendee in parallel if possible
+        # Freebusy for multiple attendees is done in parallel
         if self.freebusy:
             # Look for special delegate extended free-busy request
             use_extended_free_busy = self.scheduler.calendar.getExtendedFreeBusy() is not None
 
-            for recipient in self.recipients:
-                event_details = [] if use_extended_free_busy else None
+            # Check access controls - we do not do this right now. But if we ever implement access controls to
+            # determine which users can schedule with other users, here is where we would do that test.
+            fanout = FreebusyFanout(self.scheduler.txn)
+            results = yield fanout.run(
+                self.recipients,
+                lambda recipient: self.generateFreeBusyResult(recipient, organizerProp, uid, [] if use_extended_free_busy else None),
+            )
+            fanout.logTimings(self.scheduler.organizer, self.scheduler.logItems)
 
-                # Check access controls - we do not do this right now. But if we ever implement access controls to
-                # determine which users can schedule with other users, here is where we would do that test.
-                yield self.generateFreeBusyResponse(recipient, self.responses, organizerProp, uid, event_details)
+            # Responses are added in recipient order
+            for recipient, result in zip(self.recipients, results):
+                self.addFreeBusyResponse(recipient, self.responses, result)
         else:
             for recipient in self.recipients:
                 # Check access controls - we do not do this right now. But if we ever implement access controls to
@@ -190,33 +197,48 @@ class ScheduleViaCalDAV(DeliveryService):
                 self.scheduler.logItems["itip.auto"] = self.scheduler.logItems.get("itip.auto", 0) + 1
         returnValue(True)
 
-    @inlineCallbacks
-    def generateFreeBusyResponse(self, recipient, responses, organizerProp, uid, event_details):
+    def generateFreeBusyResult(self, recipient, organizerProp, uid, event_details):
+        """
+        Generate the free busy result for one recipient.
+
+        @return: a L{Deferred} that fires with the VFREEBUSY iTIP reply L{Component}
+        """
 
         # Extract the ATTENDEE property matching current recipient from the calendar data
         cuas = recipient.record.calendarUserAddresses
         attendeeProp = self.scheduler.calendar.getAttendeeProperty(cuas)
 
-        try:
-            fbresult = yield FreebusyQuery(
-                organizer=self.scheduler.organizer,
-                organizerProp=organizerProp,
-                recipient=recipient,
-                attendeeProp=attendeeProp,
-                uid=uid,
-                timerange=self.scheduler.timeRange,
-                excludeUID=self.scheduler.excludeUID,
-                logItems=self.scheduler.logItems,
-                event_details=event_details,
-            ).generateAttendeeFreeBusyResponse()
-        except Exception as e:
+        return FreebusyQuery(
+            organizer=self.scheduler.organizer,
+            organizerProp=organizerProp,
+            recipient=recipient,
+            attendeeProp=attendeeProp,
+            uid=uid,
+            timerange=self.scheduler.timeRange,
+            excludeUID=self.scheduler.excludeUID,
+            logItems=self.scheduler.logItems,
+            event_details=event_details,
+        ).generateAttendeeFreeBusyResponse()
+
+    def addFreeBusyResponse(self, recipient, responses, result):
+        """
+        Add the free busy response for one recipient.
+
+        @param result: the VFREEBUSY iTIP reply, or a L{Failure} if it could not be generated
+        @type result: L{Component} or L{Failure}
+
+        @return: C{True} if the result was successful
+        @rtype: C{bool}
+        """
+
+        if isinstance(result, Failure):
             log.failure(
                 "Could not determine free busy information for recipient {cuaddr}",
-                cuaddr=recipient.cuaddr, level=LogLevel.debug
+                result, cuaddr=recipient.cuaddr, level=LogLevel.debug
             )
             log.error(
                 "Could not determine free busy information for recipient {cuaddr}: {ex}",
-                cuaddr=recipient.cuaddr, ex=e
+                cuaddr=recipient.cuaddr, ex=result.value
             )
             err = HTTPError(ErrorResponse(
                 responsecode.FORBIDDEN,
@@ -228,12 +250,12 @@ class ScheduleViaCalDAV(DeliveryService):
                 Failure(exc_value=err),
                 reqstatus=iTIPRequestStatus.NO_AUTHORITY
             )
-            returnValue(False)
+            return False
         else:
             responses.add(
                 recipient.cuaddr,
                 responsecode.OK,
                 reqstatus=iTIPRequestStatus.SUCCESS,
-                calendar=fbresult
+                calendar=result
             )
-            returnValue(True)
+            return True
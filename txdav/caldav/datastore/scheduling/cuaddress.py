@@ -222,6 +222,30 @@ def calendarUserFromCalendarUserAddress(cuaddr, txn):
     returnValue((yield _fromRecord(cuaddr, record, txn)))
 
 
+@inlineCallbacks
+def calendarUsersFromCalendarUserAddresses(cuaddrs, txn):
+    """
+    Map a number of calendar user addresses into L{CalendarUser}s as per
+    L{calendarUserFromCalendarUserAddress}, but with a single directory lookup
+    for all of them.
+
+    @param cuaddrs: the calendar user addresses to map
+    @type cuaddrs: L{list} of L{str}
+    @param txn: a transaction to use for store operations
+    @type txn: L{ICommonStoreTransaction}
+
+    @return: map of each calendar user address to its L{CalendarUser}
+    @rtype: L{dict}
+    """
+
+    records = yield txn.directoryService().recordsWithCalendarUserAddresses(cuaddrs)
+    results = {}
+    for cuaddr in cuaddrs:
+        if cuaddr not in results:
+            results[cuaddr] = (yield _fromRecord(cuaddr, records.get(cuaddr), txn))
+    returnValue(results)
+
+
 @inlineCallbacks
 def calendarUserFromCalendarUserUID(uid, txn):
     """
@@ -40,7 +40,7 @@ from txdav.common.icommondatastore import IndexedSearchException, \
     InternalDataStoreError
 
 import uuid
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 log = Logger()
 
@@ -492,93 +492,68 @@ class FreebusyQuery(object):
     @inlineCallbacks
     def _matchResources(self, fbset):
         """
-        For now iterate over each calendar and collect the results. In the longer term we might want to consider
-        doing a single DB query in the case where multiple calendars need to be searched.
+        Match the free busy resources in each calendar and collect the results. Calendars with a valid
+        L{FBCacheEntry} use that, the remainder are searched with a single DB query for all of them (one
+        per distinct calendar timezone, since that determines how floating time-ranges are matched).
+        External (cross-pod) calendars have no rows in the local index, so those are always searched
+        one at a time via their own L{Calendar.search}, which goes through the conduit.
 
         @param fbset: list of calendars to process
         @type fbset: L{list} of L{Calendar}
+
+        @return: a C{dict} mapping calendar ids to a C{tuple} of aggregated resources, timezone, and filter
+        @rtype: C{dict}
         """
 
         results = {}
+        uncached = OrderedDict()
         for calresource in fbset:
-            aggregated_resources, tzinfo, filter = yield self._matchCalendarResources(calresource)
-            results[calresource.id()] = (aggregated_resources, tzinfo, filter,)
+            # Get the timezone property from the collection.
+            tz = calresource.getTimezone()
+
+            aggregated_resources = yield self._cachedCalendarResources(calresource)
+            if aggregated_resources is not None:
+                # Determine appropriate timezone (UTC is the default)
+                tzinfo = tz.gettimezone() if tz is not None else Timezone.UTCTimezone
+                results[calresource.id()] = (aggregated_resources, tzinfo, None,)
+            elif calresource.external():
+                results[calresource.id()] = yield self._matchCalendarResources(calresource, tz=tz, checkCache=False)
+            else:
+                tzid = tz.gettimezone().getTimezoneID() if tz is not None else None
+                uncached.setdefault(tzid, (tz, [],))[1].append(calresource)
+
+        for tz, calresources in uncached.values():
+            if len(calresources) == 1:
+                calresource = calresources[0]
+                results[calresource.id()] = yield self._matchCalendarResources(calresource, tz=tz, checkCache=False)
+            else:
+                results.update((yield self._matchMultipleCalendarResources(calresources, tz)))
 
         returnValue(results)
 
     @inlineCallbacks
-    def _matchCalendarResources(self, calresource):
+    def _cachedCalendarResources(self, calresource):
+        """
+        Get the aggregated resources for a calendar from the free busy cache, and log whether
+        that was a hit or a miss.
 
-        # Get the timezone property from the collection.
-        tz = calresource.getTimezone()
+        @param calresource: the calendar to get resources for
+        @type calresource: L{Calendar}
+
+        @return: the cached aggregated resources or L{None} if not cached
+        @rtype: C{dict}
+        """
 
         # Try cache
         aggregated_resources = (yield FBCacheEntry.getCacheEntry(calresource, self.attendee_uid, self.timerange)) if config.EnableFreeBusyCache else None
 
         if aggregated_resources is None:
-
             if self.accountingItems is not None:
                 self.accountingItems["fb-uncached"] = self.accountingItems.get("fb-uncached", 0) + 1
 
-            caching = False
-            if config.EnableFreeBusyCache:
-                # Log extended item
-                if self.logItems is not None:
-                    self.logItems["fb-uncached"] = self.logItems.get("fb-uncached", 0) + 1
-
-                # We want to cache a large range of time based on the current date
-                cache_start = normalizeToUTC(DateTime.getToday() + Duration(days=0 - config.FreeBusyCacheDaysBack))
-                cache_end = normalizeToUTC(DateTime.getToday() + Duration(days=config.FreeBusyCacheDaysForward))
-
-                # If the requested time range would fit in our allowed cache range, trigger the cache creation
-                if compareDateTime(self.timerange.getStart(), cache_start) >= 0 and compareDateTime(self.timerange.getEnd(), cache_end) <= 0:
-                    cache_timerange = Period(cache_start, cache_end)
-                    caching = True
-
-            #
-            # What we do is a fake calendar-query for VEVENT/VFREEBUSYs in the specified time-range.
-            # We then take those results and merge them into one VFREEBUSY component
-            # with appropriate FREEBUSY properties, and return that single item as iCal data.
-            #
-
-            # Create fake filter element to match time-range
-            tr = TimeRange(
-                start=(cache_timerange if caching else self.timerange).getStart().getText(),
-                end=(cache_timerange if caching else self.timerange).getEnd().getText(),
-            )
-            filter = caldavxml.Filter(
-                caldavxml.ComponentFilter(
-                    caldavxml.ComponentFilter(
-                        tr,
-                        name=("VEVENT", "VFREEBUSY", "VAVAILABILITY"),
-                    ),
-                    name="VCALENDAR",
-                )
-            )
-            filter = Filter(filter)
-            tzinfo = filter.settimezone(tz)
-            if self.accountingItems is not None:
-                self.accountingItems["fb-query-timerange"] = (str(tr.start), str(tr.end),)
-
-            try:
-                resources = yield calresource.search(filter, useruid=self.attendee_uid, fbtype=True)
-
-                aggregated_resources = {}
-                for name, uid, comptype, test_organizer, float, start, end, fbtype, transp in resources:
-                    if transp == 'T' and fbtype != '?':
-                        fbtype = 'F'
-                    aggregated_resources.setdefault((name, uid, comptype, test_organizer,), []).append((
-                        float,
-                        tupleFromDateTime(parseSQLTimestampToPyCalendar(start)),
-                        tupleFromDateTime(parseSQLTimestampToPyCalendar(end)),
-                        fbtype,
-                    ))
-
-                if caching:
-                    yield FBCacheEntry.makeCacheEntry(calresource, self.attendee_uid, cache_timerange, aggregated_resources)
-            except IndexedSearchException:
-                raise InternalDataStoreError("Invalid indexedSearch query")
-
+            # Log extended item
+            if config.EnableFreeBusyCache and self.logItems is not None:
+                self.logItems["fb-uncached"] = self.logItems.get("fb-uncached", 0) + 1
         else:
             if self.accountingItems is not None:
                 self.accountingItems["fb-cached"] = self.accountingItems.get("fb-cached", 0) + 1
@@ -587,12 +562,152 @@ class FreebusyQuery(object):
             if self.logItems is not None:
                 self.logItems["fb-cached"] = self.logItems.get("fb-cached", 0) + 1
 
-            # Determine appropriate timezone (UTC is the default)
-            tzinfo = tz.gettimezone() if tz is not None else Timezone.UTCTimezone
-            filter = None
+        returnValue(aggregated_resources)
+
+    def _freebusyFilter(self, tz):
+        """
+        Build the calendar-query filter used to find free busy resources. If the requested time-range
+        fits within the cacheable range, the filter uses the cacheable range instead, so that the
+        results can be cached.
+
+        @param tz: the calendar timezone
+        @type tz: L{Component} or L{None}
+
+        @return: a C{tuple} of the filter, the timezone, and the cache time-range (L{None} if not caching)
+        @rtype: C{tuple}
+        """
+
+        cache_timerange = None
+        if config.EnableFreeBusyCache:
+            # We want to cache a large range of time based on the current date
+            cache_start = normalizeToUTC(DateTime.getToday() + Duration(days=0 - config.FreeBusyCacheDaysBack))
+            cache_end = normalizeToUTC(DateTime.getToday() + Duration(days=config.FreeBusyCacheDaysForward))
+
+            # If the requested time range would fit in our allowed cache range, trigger the cache creation
+            if compareDateTime(self.timerange.getStart(), cache_start) >= 0 and compareDateTime(self.timerange.getEnd(), cache_end) <= 0:
+                cache_timerange = Period(cache_start, cache_end)
+
+        #
+        # What we do is a fake calendar-query for VEVENT/VFREEBUSYs in the specified time-range.
+        # We then take those results and merge them into one VFREEBUSY component
+        # with appropriate FREEBUSY properties, and return that single item as iCal data.
+        #
+
+        # Create fake filter element to match time-range
+        tr = TimeRange(
+            start=(cache_timerange if cache_timerange is not None else self.timerange).getStart().getText(),
+            end=(cache_timerange if cache_timerange is not None else self.timerange).getEnd().getText(),
+        )
+        filter = caldavxml.Filter(
+            caldavxml.ComponentFilter(
+                caldavxml.ComponentFilter(
+                    tr,
+                    name=("VEVENT", "VFREEBUSY", "VAVAILABILITY"),
+                ),
+                name="VCALENDAR",
+            )
+        )
+        filter = Filter(filter)
+        tzinfo = filter.settimezone(tz)
+        if self.accountingItems is not None:
+            self.accountingItems["fb-query-timerange"] = (str(tr.start), str(tr.end),)
+
+        return filter, tzinfo, cache_timerange
+
+    @staticmethod
+    def _aggregateResources(resources):
+        """
+        Group the free busy rows returned by a calendar search by resource.
+
+        @param resources: rows returned by L{Calendar.search}
+        @type resources: C{list}
+
+        @return: the aggregated resources
+        @rtype: C{dict}
+        """
+        aggregated_resources = {}
+        for name, uid, comptype, test_organizer, float, start, end, fbtype, transp in resources:
+            if transp == 'T' and fbtype != '?':
+                fbtype = 'F'
+            aggregated_resources.setdefault((name, uid, comptype, test_organizer,), []).append((
+                float,
+                tupleFromDateTime(parseSQLTimestampToPyCalendar(start)),
+                tupleFromDateTime(parseSQLTimestampToPyCalendar(end)),
+                fbtype,
+            ))
+        return aggregated_resources
+
+    @inlineCallbacks
+    def _matchCalendarResources(self, calresource, tz=None, checkCache=True):
+        """
+        Match the free busy resources in a single calendar.
+
+        @param calresource: the calendar to process
+        @type calresource: L{Calendar}
+        @param tz: the calendar timezone, if already known
+        @type tz: L{Component} or L{None}
+        @param checkCache: whether to try the free busy cache first
+        @type checkCache: C{bool}
+
+        @return: a C{tuple} of aggregated resources, timezone, and filter
+        @rtype: C{tuple}
+        """
+
+        # Get the timezone property from the collection.
+        if tz is None:
+            tz = calresource.getTimezone()
+
+        if checkCache:
+            aggregated_resources = yield self._cachedCalendarResources(calresource)
+            if aggregated_resources is not None:
+                # Determine appropriate timezone (UTC is the default)
+                tzinfo = tz.gettimezone() if tz is not None else Timezone.UTCTimezone
+                returnValue((aggregated_resources, tzinfo, None,))
+
+        filter, tzinfo, cache_timerange = self._freebusyFilter(tz)
+
+        try:
+            resources = yield calresource.search(filter, useruid=self.attendee_uid, fbtype=True)
+            aggregated_resources = self._aggregateResources(resources)
+
+            if cache_timerange is not None:
+                yield FBCacheEntry.makeCacheEntry(calresource, self.attendee_uid, cache_timerange, aggregated_resources)
+        except IndexedSearchException:
+            raise InternalDataStoreError("Invalid indexedSearch query")
 
         returnValue((aggregated_resources, tzinfo, filter,))
 
+    @inlineCallbacks
+    def _matchMultipleCalendarResources(self, calresources, tz):
+        """
+        Match the free busy resources in a set of calendars that share the same timezone, using a single
+        query for all of them. The results for each calendar are cached individually.
+
+        @param calresources: the calendars to process
+        @type calresources: L{list} of L{Calendar}
+        @param tz: the timezone of the calendars
+        @type tz: L{Component} or L{None}
+
+        @return: a C{dict} mapping calendar ids to a C{tuple} of aggregated resources, timezone, and filter
+        @rtype: C{dict}
+        """
+
+        filter, tzinfo, cache_timerange = self._freebusyFilter(tz)
+
+        try:
+            resources = yield calresources[0].searchMultiple(calresources, filter, useruid=self.attendee_uid, fbtype=True)
+        except IndexedSearchException:
+            raise InternalDataStoreError("Invalid indexedSearch query")
+
+        results = {}
+        for calresource in calresources:
+            aggregated_resources = self._aggregateResources(resources[calresource.id()])
+            if cache_timerange is not None:
+                yield FBCacheEntry.makeCacheEntry(calresource, self.attendee_uid, cache_timerange, aggregated_resources)
+            results[calresource.id()] = (aggregated_resources, tzinfo, filter,)
+
+        returnValue(results)
+
     @inlineCallbacks
     def _testIgnoreExcludeUID(self, uid, test_organizer, recordUIDCache, dirservice):
         """
@@ -0,0 +1,165 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from twext.python.log import Logger
+
+from twisted.internet.defer import inlineCallbacks, returnValue, \
+    DeferredSemaphore, DeferredList, maybeDeferred
+
+from twistedcaldav.accounting import accountingEnabled, emitAccounting
+from twistedcaldav.config import config
+
+from txdav.caldav.datastore.scheduling.cuaddress import LocalCalendarUser
+
+import copy
+import time
+
+"""
+Runs the free busy queries for a set of local attendees concurrently.
+"""
+
+__all__ = [
+    "FreebusyFanout",
+]
+
+log = Logger()
+
+
+class FreebusyFanout(object):
+    """
+    Runs a free busy operation for each of a set of local attendees, with a limit on how many are in progress at
+    any one time. Directory and store lookups for different attendees can then overlap, so that the overall time
+    is closer to that of the slowest attendee rather than the sum of all of them.
+
+    Each operation either runs in the scheduling transaction (where statements for the different attendees are
+    interleaved on the one connection), or in its own transaction, which is always aborted as free busy
+    never writes to the store.
+    """
+
+    def __init__(self, txn, maxConcurrent=None, separateTransactions=None):
+        """
+        @param txn: the scheduling transaction
+        @type txn: L{CommonStoreTransaction}
+        @param maxConcurrent: maximum number of operations to run at the same time, defaults to
+            the configured value
+        @type maxConcurrent: C{int}
+        @param separateTransactions: whether to run each operation in its own transaction, defaults
+            to the configured value
+        @type separateTransactions: C{bool}
+        """
+        self.txn = txn
+        self.maxConcurrent = max(
+            maxConcurrent if maxConcurrent is not None else config.Scheduling.Options.FreeBusyFanout.MaxConcurrent,
+            1,
+        )
+        self.separateTransactions = (
+            separateTransactions if separateTransactions is not None else config.Scheduling.Options.FreeBusyFanout.SeparateTransactions
+        )
+        self.timings = []
+
+    @inlineCallbacks
+    def run(self, recipients, operation):
+        """
+        Run the operation for each recipient.
+
+        @param recipients: the local attendees
+        @type recipients: C{list} of L{LocalCalendarUser}
+        @param operation: a callable taking a recipient and returning a L{Deferred} that fires with the result
+            for that recipient. The recipient passed in may be a copy of the original bound to a separate
+            transaction.
+        @type operation: C{callable}
+
+        @return: a C{list} of the results, or L{Failure}s for operations that failed, in the same order as
+            the recipients
+        @rtype: C{list}
+        """
+        self.timings = [None] * len(recipients)
+        semaphore = DeferredSemaphore(self.maxConcurrent)
+
+        results = yield DeferredList(
+            [semaphore.run(self._runOne, index, recipient, operation) for index, recipient in enumerate(recipients)],
+            consumeErrors=True,
+        )
+        returnValue([result for _ignore_success, result in results])
+
+    @inlineCallbacks
+    def _runOne(self, index, recipient, operation):
+        """
+        Run the operation for one recipient and record how long it took.
+        """
+        start = time.time()
+        txn = None
+        try:
+            if self.separateTransactions and isinstance(recipient, LocalCalendarUser):
+                txn = self.txn.store().newTransaction(label="FreebusyFanout", authz_uid=self.txn._authz_uid)
+                recipient = yield self._recipientInTransaction(recipient, txn)
+            result = yield maybeDeferred(operation, recipient)
+        finally:
+            if txn is not None:
+                yield txn.abort()
+            self.timings[index] = (recipient.cuaddr, time.time() - start,)
+        returnValue(result)
+
+    @inlineCallbacks
+    def _recipientInTransaction(self, recipient, txn):
+        """
+        Get a copy of the recipient whose inbox is loaded in the specified transaction.
+
+        @param recipient: the local attendee
+        @type recipient: L{LocalCalendarUser}
+        @param txn: the transaction to use
+        @type txn: L{CommonStoreTransaction}
+
+        @return: the recipient copy, or the original recipient if the inbox could not be found
+        @rtype: L{LocalCalendarUser}
+        """
+        home = yield txn.calendarHomeWithUID(recipient.record.uid)
+        inbox = (yield home.calendarWithName("inbox")) if home is not None else None
+        if inbox is None:
+            log.error("Could not load inbox for {cuaddr} in free busy fan-out transaction", cuaddr=recipient.cuaddr)
+            returnValue(recipient)
+        recipient = copy.copy(recipient)
+        recipient.inbox = inbox
+        returnValue(recipient)
+
+    def logTimings(self, organizer, logItems=None):
+        """
+        Record the per-attendee timings of the last run in the free busy accounting log of the organizer,
+        and the attendee count and slowest time in the request log.
+
+        @param organizer: the organizer of the free busy request
+        @type organizer: L{CalendarUser}
+        @param logItems: items to add to request logging
+        @type logItems: C{dict}
+        """
+        timings = [timing for timing in self.timings if timing is not None]
+        if not timings:
+            return
+
+        if logItems is not None:
+            logItems["fb-fanout"] = len(timings)
+            logItems["fb-fanout-max"] = "%.1f" % (max([elapsed for _ignore_cuaddr, elapsed in timings]) * 1000.0,)
+
+        if isinstance(organizer, LocalCalendarUser) and accountingEnabled("iTIP-VFREEBUSY", organizer.record):
+            emitAccounting(
+                "iTIP-VFREEBUSY",
+                organizer.record,
+                "Free busy fan-out (concurrency {c}{t}):\n{r}\n".format(
+                    c=self.maxConcurrent,
+                    t=", separate transactions" if self.separateTransactions else "",
+                    r="".join(["    {}: {:.1f} ms\n".format(cuaddr, elapsed * 1000.0) for cuaddr, elapsed in timings]),
+                )
+            )
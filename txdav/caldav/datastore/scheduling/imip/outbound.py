@@ -41,7 +41,8 @@ from twistedcaldav.config import config
 from twistedcaldav.ical import Component
 from twistedcaldav.localization import translationTo, _, getLanguage
 from txdav.caldav.datastore.scheduling.utils import normalizeCUAddr
-from txdav.caldav.datastore.scheduling.imip.smtpsender import SMTPSender
+from txdav.caldav.datastore.scheduling.imip.smtpsender import SMTPSender, \
+    PooledSMTPSender
 from txdav.common.datastore.sql_tables import schema
 
 
@@ -80,9 +81,17 @@ class IMIPInvitationWork(WorkItem, fromTable(schema.IMIP_INVITATION_WORK)):
         if cls.mailSender is None:
             if config.Scheduling.iMIP.Enabled:
                 settings = config.Scheduling.iMIP.Sending
-                smtpSender = SMTPSender(
-                    settings.Username, settings.Password,
-                    settings.UseSSL, settings.Server, settings.Port)
+                if settings.PoolConnections > 0:
+                    smtpSender = PooledSMTPSender(
+                        settings.Username, settings.Password,
+                        settings.UseSSL, settings.Server, settings.Port,
+                        maxConnections=settings.PoolConnections,
+                        idleTimeout=settings.PoolIdleSeconds,
+                        messagesPerConnection=settings.PoolMessagesPerConnection)
+                else:
+                    smtpSender = SMTPSender(
+                        settings.Username, settings.Password,
+                        settings.UseSSL, settings.Server, settings.Port)
                 cls.mailSender = MailSender(
                     settings.Address,
                     settings.SuppressionDays, smtpSender, getLanguage(config))
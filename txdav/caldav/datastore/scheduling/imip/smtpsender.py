@@ -18,6 +18,7 @@
 SMTP sending utility
 """
 
+from collections import deque
 from cStringIO import StringIO
 
 from twext.internet.adaptendpoint import connect
@@ -25,13 +26,20 @@ from twext.internet.gaiendpoint import GAIEndpoint
 from twext.internet.ssl import simpleClientContextFactory
 from twext.python.log import Logger
 from twisted.internet import defer, reactor as _reactor
-from twisted.mail.smtp import ESMTPSenderFactory, messageid
+from twisted.internet.protocol import ClientFactory
+from twisted.mail.smtp import (
+    ESMTPSender, ESMTPSenderFactory, SMTPClient, SMTPClientError,
+    SMTPConnectError, SMTPDeliveryError, SUCCESS, messageid
+)
 from twistedcaldav.config import config
 
 log = Logger()
 
 
 class SMTPSender(object):
+    """
+    Sends each message over its own connection to the SMTP server.
+    """
 
     def __init__(self, username, password, useSSL, server, port):
         self.username = username
@@ -40,55 +48,56 @@ class SMTPSender(object):
         self.server = server
         self.port = port
 
+    def contextFactory(self):
+        if self.useSSL:
+            return simpleClientContextFactory(self.server)
+        else:
+            return None
+
     def sendMessage(self, fromAddr, toAddr, msgId, message):
 
         log.debug("Sending: {msg}", msg=message)
 
-        def _success(result, msgId, fromAddr, toAddr):
-            log.info(
-                "Sent IMIP message {id} from {fr} to {to}",
-                id=msgId,
-                fr=fromAddr,
-                to=toAddr,
-            )
-            return True
-
-        def _failure(failure, msgId, fromAddr, toAddr):
-            log.error(
-                "Failed to send IMIP message {id} from {fr} to {to} (Reason: {err})",
-                id=msgId,
-                fr=fromAddr,
-                to=toAddr,
-                err=failure.getErrorMessage(),
-            )
-            from OpenSSL.SSL import Error as TLSError
-            if failure.type is TLSError:
-                from calendarserver.tap.util import AlertPoster
-                AlertPoster.postAlert("MailCertificateAlert", 7 * 24 * 60 * 60, [])
-            return False
-
         deferred = defer.Deferred()
 
-        if self.useSSL:
-            contextFactory = simpleClientContextFactory(self.server)
-        else:
-            contextFactory = None
-
         factory = ESMTPSenderFactory(
             self.username, self.password,
             fromAddr, toAddr,
             # per http://trac.calendarserver.org/ticket/416 ...
             StringIO(message.replace("\r\n", "\n")), deferred,
-            contextFactory=contextFactory,
+            contextFactory=self.contextFactory(),
             requireAuthentication=False,
             requireTransportSecurity=self.useSSL)
 
         connect(GAIEndpoint(_reactor, self.server, self.port),
                 factory)
-        deferred.addCallback(_success, msgId, fromAddr, toAddr)
-        deferred.addErrback(_failure, msgId, fromAddr, toAddr)
+        deferred.addCallback(self._sent, msgId, fromAddr, toAddr)
+        deferred.addErrback(self._failed, msgId, fromAddr, toAddr)
         return deferred
 
+    def _sent(self, result, msgId, fromAddr, toAddr):
+        log.info(
+            "Sent IMIP message {id} from {fr} to {to}",
+            id=msgId,
+            fr=fromAddr,
+            to=toAddr,
+        )
+        return True
+
+    def _failed(self, failure, msgId, fromAddr, toAddr):
+        log.error(
+            "Failed to send IMIP message {id} from {fr} to {to} (Reason: {err})",
+            id=msgId,
+            fr=fromAddr,
+            to=toAddr,
+            err=failure.getErrorMessage(),
+        )
+        from OpenSSL.SSL import Error as TLSError
+        if failure.type is TLSError:
+            from calendarserver.tap.util import AlertPoster
+            AlertPoster.postAlert("MailCertificateAlert", 7 * 24 * 60 * 60, [])
+        return False
+
     @staticmethod
     def betterMessageID():
         """
@@ -99,3 +108,302 @@ class SMTPSender(object):
         @rtype: L{str}
         """
         return "{}@{}>".format(messageid().split("@")[0], config.ServerHostName)
+
+
+class QueuedMessage(object):
+    """
+    A message waiting to be sent by a L{PooledSMTPSender}.
+
+    @ivar attempts: the number of times sending this message has been
+        abandoned because of a connection problem
+    @type attempts: C{int}
+    """
+
+    def __init__(self, fromAddr, toAddr, message, deferred):
+        self.fromAddr = fromAddr
+        self.toAddr = toAddr
+        self.file = StringIO(message.replace("\r\n", "\n"))
+        self.deferred = deferred
+        self.attempts = 0
+
+
+class PooledESMTPSender(ESMTPSender):
+    """
+    An ESMTP client that sends the messages queued in its L{PooledSMTPSender}
+    one after another over a single session. When there is nothing to send it
+    keeps the session open, so that the next message does not need a new
+    connection, TLS handshake and authentication, until the pool's idle time
+    has passed.
+
+    @ivar pool: the sender whose messages this session sends
+    @type pool: L{PooledSMTPSender}
+    @ivar current: the message being sent
+    @type current: L{QueuedMessage}
+    @ivar sent: the number of messages sent in this session
+    @type sent: C{int}
+    """
+
+    def __init__(self, pool, *args, **kwargs):
+        ESMTPSender.__init__(self, *args, **kwargs)
+        self.pool = pool
+        self.ready = False
+        self.current = None
+        self.sent = 0
+        self._charged = False
+        self._parked = None
+        self._idleCall = None
+
+    def connectionMade(self):
+        # The session goes back and forth with the server for every message,
+        # so small writes must not wait on delayed ACKs
+        self.transport.setTcpNoDelay(True)
+        ESMTPSender.connectionMade(self)
+
+    def smtpState_from(self, code, resp):
+        """
+        The session is ready to send a message: send the next queued one, or
+        wait for one to be queued.
+        """
+        if not self.ready:
+            self.ready = True
+            self.pool._sessionReady(self)
+
+        if not self.pool.queue and self.sent < self.pool.messagesPerConnection:
+            self._parked = (code, resp)
+            self.setTimeout(None)
+            self._idleCall = self.pool.reactor.callLater(self.pool.idleTimeout, self._idleTimeout)
+            self.pool.idle.append(self)
+        else:
+            ESMTPSender.smtpState_from(self, code, resp)
+
+    def resume(self):
+        """
+        Send the next queued message in a session that is waiting for one.
+        """
+        self._idleCall.cancel()
+        self._idleCall = None
+        self.setTimeout(self.timeout)
+        code, resp = self._parked
+        self._parked = None
+        ESMTPSender.smtpState_from(self, code, resp)
+
+    def _idleTimeout(self):
+        self._idleCall = None
+        self._parked = None
+        self.pool.idle.remove(self)
+        self.setTimeout(self.timeout)
+        self._disconnectFromServer()
+
+    def getMailFrom(self):
+        if self.sent >= self.pool.messagesPerConnection:
+            return None
+        self.current = self.pool._nextMessage()
+        if self.current is None:
+            return None
+        self.sent += 1
+        self.current.file.seek(0, 0)
+        return str(self.current.fromAddr)
+
+    def getMailTo(self):
+        return [self.current.toAddr]
+
+    def getMailData(self):
+        return self.current.file
+
+    def sentMail(self, code, resp, numOk, addresses, log):
+        # The server has replied to the message, so it is not retried - not even
+        # after a 4xx reply, which is the same as the non-pooled sender
+        message, self.current = self.current, None
+        if code not in SUCCESS:
+            errlog = []
+            for addr, acode, aresp in addresses:
+                if acode not in SUCCESS:
+                    errlog.append("%s: %03d %s" % (addr, acode, aresp))
+            errlog.append(log.str())
+            message.deferred.errback(SMTPDeliveryError(code, resp, "\n".join(errlog), addresses))
+        else:
+            message.deferred.callback((numOk, addresses))
+
+    def sendError(self, exc):
+        SMTPClient.sendError(self, exc)
+        message, self.current = self.current, None
+        if message is None and not self.ready and not self._charged:
+            # Failed to set up the session - hold the next message responsible
+            # so that a server we cannot talk to does not retry forever
+            self._charged = True
+            message = self.pool._nextMessage()
+        if message is not None:
+            self.pool._retry(message, exc)
+
+    def connectionLost(self, reason):
+        ESMTPSender.connectionLost(self, reason)
+        if self._idleCall is not None:
+            self._idleCall.cancel()
+            self._idleCall = None
+            self.pool.idle.remove(self)
+        message, self.current = self.current, None
+        if message is None and not self.ready and not self._charged:
+            # The connection went away while setting up the session without an
+            # SMTP error (e.g. a failed TLS handshake, or a server that closed
+            # the connection) - hold the next message responsible, as above
+            self._charged = True
+            message = self.pool._nextMessage()
+        if message is not None:
+            self.pool._retry(message, reason.value)
+        self.pool._sessionLost(self)
+
+
+class PooledESMTPSenderFactory(ClientFactory):
+    """
+    Builds the L{PooledESMTPSender} for one connection of a
+    L{PooledSMTPSender}.
+    """
+
+    protocol = PooledESMTPSender
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def buildProtocol(self, addr):
+        pool = self.pool
+        p = self.protocol(
+            pool, pool.username, pool.password, pool.contextFactory(),
+            ESMTPSenderFactory.domain,
+        )
+        p.heloFallback = False
+        p.requireAuthentication = False
+        p.requireTransportSecurity = pool.useSSL
+        p.factory = self
+        p.timeout = pool.timeout
+        return p
+
+    def clientConnectionFailed(self, connector, reason):
+        self.pool._connectionFailed(reason)
+
+
+class PooledSMTPSender(SMTPSender):
+    """
+    Sends messages over a small pool of SMTP sessions that are kept open and
+    reused, rather than a new connection per message. Messages are queued and
+    sent in order over at most C{maxConnections} sessions, which bounds how
+    many are in flight at once. Each session sends up to
+    C{messagesPerConnection} messages, and closes once it has had nothing to
+    send for C{idleTimeout} seconds.
+
+    A message that cannot be sent because of a connection problem, or a 4xx
+    reply while setting up the session, is queued again, up to C{retries}
+    times. Once a session could not be set up, more sessions are only opened
+    after C{retryDelay} seconds, doubling for each failure in a row up to
+    C{maxRetryDelay}. A message the server replies to with an error, even a
+    4xx one, is failed and not retried.
+
+    @ivar queue: the messages waiting for a session
+    @type queue: C{deque} of L{QueuedMessage}
+    @ivar idle: the sessions waiting for a message
+    @type idle: C{list} of L{PooledESMTPSender}
+    @ivar connections: the number of sessions open or being opened
+    @type connections: C{int}
+    @ivar starting: the number of sessions being opened
+    @type starting: C{int}
+    """
+
+    def __init__(
+        self, username, password, useSSL, server, port,
+        maxConnections=4, idleTimeout=30, messagesPerConnection=100,
+        retries=5, timeout=60, retryDelay=1, maxRetryDelay=60, reactor=None
+    ):
+        super(PooledSMTPSender, self).__init__(username, password, useSSL, server, port)
+        self.maxConnections = maxConnections
+        self.idleTimeout = idleTimeout
+        self.messagesPerConnection = messagesPerConnection
+        self.retries = retries
+        self.timeout = timeout
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+        self.reactor = reactor if reactor is not None else _reactor
+        self.queue = deque()
+        self.idle = []
+        self.connections = 0
+        self.starting = 0
+        self._failures = 0
+        self._retryCall = None
+
+    def sendMessage(self, fromAddr, toAddr, msgId, message):
+
+        log.debug("Sending: {msg}", msg=message)
+
+        deferred = defer.Deferred()
+        self.queue.append(QueuedMessage(fromAddr, toAddr, message, deferred))
+        self._dispatch()
+
+        deferred.addCallback(self._sent, msgId, fromAddr, toAddr)
+        deferred.addErrback(self._failed, msgId, fromAddr, toAddr)
+        return deferred
+
+    def _dispatch(self):
+        """
+        Give queued messages to idle sessions, and open more sessions (up to
+        the limit) for any messages left over, unless waiting after a failure.
+        """
+        while self.queue and self.idle:
+            self.idle.pop().resume()
+        if self._retryCall is not None:
+            return
+        while len(self.queue) > self.starting and self.connections < self.maxConnections:
+            self.connections += 1
+            self.starting += 1
+            connect(
+                GAIEndpoint(self.reactor, self.server, self.port),
+                PooledESMTPSenderFactory(self)
+            )
+
+    def _nextMessage(self):
+        return self.queue.popleft() if self.queue else None
+
+    def _retry(self, message, exc):
+        """
+        Queue a message again after a connection problem, or fail it once it
+        has been tried too many times or the server said not to retry.
+        """
+        message.attempts += 1
+        retry = message.attempts <= self.retries
+        if isinstance(exc, SMTPClientError):
+            retry = retry and (exc.retry or 400 <= exc.code < 500)
+        if retry:
+            self.queue.appendleft(message)
+        else:
+            message.deferred.errback(exc)
+
+    def _sessionReady(self, session):
+        self.starting -= 1
+        self._failures = 0
+
+    def _sessionLost(self, session):
+        self.connections -= 1
+        if not session.ready:
+            self.starting -= 1
+            self._backOff()
+        self._dispatch()
+
+    def _connectionFailed(self, reason):
+        self.connections -= 1
+        self.starting -= 1
+        message = self._nextMessage()
+        if message is not None:
+            self._retry(message, SMTPConnectError(-1, "Unable to connect to server: {}".format(reason.getErrorMessage())))
+        self._backOff()
+        self._dispatch()
+
+    def _backOff(self):
+        """
+        A session could not be set up: wait before opening another one for
+        any messages still queued.
+        """
+        self._failures += 1
+        if self.queue and self._retryCall is None:
+            delay = min(self.retryDelay * 2 ** (self._failures - 1), self.maxRetryDelay)
+            self._retryCall = self.reactor.callLater(delay, self._retryNow)
+
+    def _retryNow(self):
+        self._retryCall = None
+        self._dispatch()
@@ -0,0 +1,267 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, inlineCallbacks, gatherResults, succeed
+from twisted.internet.protocol import ServerFactory
+from twisted.mail.smtp import (
+    ESMTP, IMessage, IMessageDelivery, SMTPBadRcpt, SMTPServerError
+)
+from twisted.trial import unittest
+from zope.interface import implementer
+
+from txdav.caldav.datastore.scheduling.imip.smtpsender import PooledSMTPSender
+
+
+@implementer(IMessage)
+class TestMessage(object):
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.lines = []
+
+    def lineReceived(self, line):
+        self.lines.append(line)
+
+    def eomReceived(self):
+        self.factory.messages.append("\n".join(self.lines))
+        return succeed(None)
+
+    def connectionLost(self):
+        pass
+
+
+@implementer(IMessageDelivery)
+class TestDelivery(object):
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def receivedHeader(self, helo, origin, recipients):
+        return "Received: from test"
+
+    def validateFrom(self, helo, origin):
+        return origin
+
+    def validateTo(self, user):
+        if user.dest.local == "bad":
+            raise SMTPBadRcpt(user)
+        if user.dest.local == "busy":
+            self.factory.busy += 1
+            raise SMTPServerError(451, "Try again later")
+        return lambda: TestMessage(self.factory)
+
+
+class TestESMTP(ESMTP):
+
+    def connectionLost(self, reason):
+        ESMTP.connectionLost(self, reason)
+        self.factory.connectionClosed()
+
+
+class DroppingESMTP(TestESMTP):
+    """
+    An SMTP server that closes each connection before greeting the client.
+    """
+
+    def connectionMade(self):
+        self.transport.loseConnection()
+
+
+class TestSMTPServerFactory(ServerFactory):
+    """
+    A local SMTP server that accepts all messages, except to "bad@..." (which
+    it rejects) and "busy@..." (which gets a 4xx reply), and counts the
+    connections made to it.
+    """
+
+    protocol = TestESMTP
+
+    def __init__(self):
+        self.messages = []
+        self.busy = 0
+        self.connections = 0
+        self.open = 0
+        self.waiting = []
+
+    def buildProtocol(self, addr):
+        p = self.protocol()
+        p.delivery = TestDelivery(self)
+        p.factory = self
+        self.connections += 1
+        self.open += 1
+        return p
+
+    def connectionClosed(self):
+        self.open -= 1
+        if self.open == 0:
+            waiting, self.waiting = self.waiting, []
+            for d in waiting:
+                d.callback(None)
+
+    def whenClosed(self):
+        """
+        @return: a L{Deferred} that fires once no connections are open
+        """
+        if self.open == 0:
+            return succeed(None)
+        d = Deferred()
+        self.waiting.append(d)
+        return d
+
+
+class ObservedPooledSMTPSender(PooledSMTPSender):
+    """
+    A L{PooledSMTPSender} that can say when all of its sessions have closed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        PooledSMTPSender.__init__(self, *args, **kwargs)
+        self.waiting = []
+
+    def _sessionLost(self, session):
+        PooledSMTPSender._sessionLost(self, session)
+        if self.connections == 0:
+            waiting, self.waiting = self.waiting, []
+            for d in waiting:
+                d.callback(None)
+
+    def whenClosed(self):
+        if self.connections == 0:
+            return succeed(None)
+        d = Deferred()
+        self.waiting.append(d)
+        return d
+
+
+class PooledSMTPSenderTests(unittest.TestCase):
+    """
+    Tests for L{PooledSMTPSender}, sending to a local SMTP server.
+    """
+
+    def setUp(self):
+        self.server = TestSMTPServerFactory()
+        self.port = reactor.listenTCP(0, self.server, interface="127.0.0.1")
+        self.addCleanup(self.port.stopListening)
+
+    def sender(self, port=None, **kwargs):
+        return ObservedPooledSMTPSender(
+            "", "", False, "127.0.0.1",
+            self.port.getHost().port if port is None else port,
+            idleTimeout=0.1, retryDelay=0.01, **kwargs
+        )
+
+    def closed(self, sender):
+        return gatherResults([self.server.whenClosed(), sender.whenClosed()])
+
+    def send(self, sender, count, toAddr="attendee@example.com"):
+        return gatherResults([
+            sender.sendMessage(
+                "server@example.com", toAddr, "<{}@example.com>".format(i),
+                "Subject: Message {}\r\n\r\nBody\r\n".format(i)
+            ) for i in range(count)
+        ])
+
+    @inlineCallbacks
+    def test_sessionsReused(self):
+        """
+        Messages are sent over no more than C{maxConnections} sessions, which
+        close once they have nothing left to send.
+        """
+        sender = self.sender(maxConnections=2)
+        results = yield self.send(sender, 10)
+        self.assertEqual(results, [True] * 10)
+        self.assertEqual(len(self.server.messages), 10)
+        self.assertTrue(self.server.connections <= 2)
+
+        yield self.closed(sender)
+        self.assertEqual(sender.idle, [])
+        self.assertEqual(sender.starting, 0)
+
+    @inlineCallbacks
+    def test_messagesPerConnection(self):
+        """
+        A session is replaced once it has sent C{messagesPerConnection}
+        messages.
+        """
+        sender = self.sender(maxConnections=1, messagesPerConnection=3)
+        results = yield self.send(sender, 7)
+        self.assertEqual(results, [True] * 7)
+        self.assertEqual(self.server.connections, 3)
+        yield self.closed(sender)
+
+    @inlineCallbacks
+    def test_rejected(self):
+        """
+        A message the server rejects fails without being retried, and the
+        session goes on to send the next message.
+        """
+        sender = self.sender(maxConnections=1)
+        rejected = self.send(sender, 1, toAddr="bad@example.com")
+        accepted = self.send(sender, 1)
+        results = yield gatherResults([rejected, accepted])
+        self.assertEqual(results, [[False], [True]])
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(self.server.connections, 1)
+        yield self.closed(sender)
+
+    @inlineCallbacks
+    def test_busy(self):
+        """
+        A message the server replies to with a 4xx code fails without being
+        retried, and the session goes on to send the next message.
+        """
+        sender = self.sender(maxConnections=1)
+        busy = self.send(sender, 1, toAddr="busy@example.com")
+        accepted = self.send(sender, 1)
+        results = yield gatherResults([busy, accepted])
+        self.assertEqual(results, [[False], [True]])
+        self.assertEqual(self.server.busy, 1)
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(self.server.connections, 1)
+        yield self.closed(sender)
+
+    @inlineCallbacks
+    def test_connectionRefused(self):
+        """
+        A message that cannot be sent because the server cannot be reached is
+        retried C{retries} times, and then fails.
+        """
+        port = self.port.getHost().port
+        yield self.port.stopListening()
+        sender = self.sender(port=port, maxConnections=1, retries=2)
+        results = yield self.send(sender, 2)
+        self.assertEqual(results, [False, False])
+        self.assertEqual(sender.connections, 0)
+        self.assertEqual(sender.starting, 0)
+        self.assertEqual(sender._retryCall, None)
+
+    @inlineCallbacks
+    def test_droppedBeforeGreeting(self):
+        """
+        A message that cannot be sent because the server closes each
+        connection before the session is ready is retried C{retries} times,
+        and then fails.
+        """
+        self.server.protocol = DroppingESMTP
+        sender = self.sender(maxConnections=1, retries=2)
+        results = yield self.send(sender, 1)
+        self.assertEqual(results, [False])
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(self.server.messages, [])
+        yield self.closed(sender)
+        self.assertEqual(sender.starting, 0)
+        self.assertEqual(sender._retryCall, None)
@@ -256,6 +256,9 @@ class GenerateFreeBusyInfo(CommonCommonTests, TestCase):
         self.now_13H = self.now.duplicate()
         self.now_13H.offsetHours(13)
 
+        self.now_14H = self.now.duplicate()
+        self.now_14H.offsetHours(14)
+
         self.now_1D = self.now.duplicate()
         self.now_1D.offsetDay(1)
 
@@ -270,6 +273,8 @@ class GenerateFreeBusyInfo(CommonCommonTests, TestCase):
             "user01": {
                 "calendar_1": {
                 },
+                "calendar_2": {
+                },
                 "inbox": {
                 },
             },
@@ -382,3 +387,44 @@ END:VCALENDAR
         self.assertEqual(len(fbinfo.unavailable), 0)
         self.assertEqual(len(event_details), 1)
         self.assertEqual(str(event_details[0]), str(tuple(Component.fromString(data).subcomponents())[0]))
+
+    @inlineCallbacks
+    def test_multiple_calendars(self):
+        """
+        Test that events in several calendars are all found using a single query.
+        """
+
+        data = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:%s
+DTSTAMP:20080601T000000Z
+DTSTART:%s
+DTEND:%s
+END:VEVENT
+END:VCALENDAR
+"""
+
+        calendar1 = (yield self.calendarUnderTest(home="user01", name="calendar_1"))
+        yield calendar1.createCalendarObjectWithName("test1.ics", Component.fromString(data % ("1234-5678", self.now_12H.getText(), self.now_13H.getText(),)))
+        calendar2 = (yield self.calendarUnderTest(home="user01", name="calendar_2"))
+        yield calendar2.createCalendarObjectWithName("test2.ics", Component.fromString(data % ("1234-5679", self.now_13H.getText(), self.now_14H.getText(),)))
+        yield self.commit()
+
+        calendar1 = (yield self.calendarUnderTest(home="user01", name="calendar_1"))
+        calendar2 = (yield self.calendarUnderTest(home="user01", name="calendar_2"))
+        self.patch(calendar1, "search", lambda *args, **kwargs: self.fail("Single calendar search used"))
+        self.patch(calendar2, "search", lambda *args, **kwargs: self.fail("Single calendar search used"))
+        fbinfo = FreebusyQuery.FBInfo([], [], [])
+        timerange = Period(self.now, self.now_1D)
+
+        organizer = recipient = yield calendarUserFromCalendarUserAddress("mailto:user01@example.com", self.transactionUnderTest())
+        freebusy = FreebusyQuery(organizer=organizer, recipient=recipient, timerange=timerange)
+        result = (yield freebusy.generateFreeBusyInfo([calendar1, calendar2, ], fbinfo))
+        self.assertEqual(result, 2)
+        self.assertEqual(len(fbinfo.busy), 2)
+        self.assertIn(Period(self.now_12H, self.now_13H), fbinfo.busy)
+        self.assertIn(Period(self.now_13H, self.now_14H), fbinfo.busy)
+        self.assertEqual(len(fbinfo.tentative), 0)
+        self.assertEqual(len(fbinfo.unavailable), 0)
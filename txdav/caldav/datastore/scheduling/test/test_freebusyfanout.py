@@ -0,0 +1,89 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Tests for txdav.caldav.datastore.scheduling.freebusyfanout
+"""
+
+from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.python.failure import Failure
+from twisted.trial import unittest
+
+from txdav.caldav.datastore.scheduling.cuaddress import RemoteCalendarUser
+from txdav.caldav.datastore.scheduling.freebusyfanout import FreebusyFanout
+
+
+class FreebusyFanoutTests(unittest.TestCase):
+    """
+    Tests for L{FreebusyFanout}.
+    """
+
+    def test_concurrencyLimit(self):
+        """
+        No more than the maximum number of operations are in progress at once, and results are
+        returned in recipient order irrespective of completion order.
+        """
+        recipients = [RemoteCalendarUser("mailto:user%02d@example.com" % (i,)) for i in range(5)]
+        pending = {}
+
+        def operation(recipient):
+            d = Deferred()
+            pending[recipient.cuaddr] = d
+            return d
+
+        def complete(cuaddr):
+            pending.pop(cuaddr).callback(int(cuaddr[11:13]))
+
+        fanout = FreebusyFanout(None, maxConcurrent=2, separateTransactions=False)
+        results = []
+        fanout.run(recipients, operation).addCallback(results.extend)
+
+        self.assertEqual(sorted(pending.keys()), ["mailto:user00@example.com", "mailto:user01@example.com"])
+        complete("mailto:user01@example.com")
+        self.assertEqual(len(pending), 2)
+        complete("mailto:user00@example.com")
+        self.assertEqual(len(pending), 2)
+
+        # Complete the rest latest recipient first - each completion starts the next operation
+        while pending:
+            complete(max(pending.keys()))
+
+        self.assertEqual(results, [0, 1, 2, 3, 4])
+        self.assertEqual([cuaddr for cuaddr, _ignore_elapsed in fanout.timings], [recipient.cuaddr for recipient in recipients])
+
+    @inlineCallbacks
+    def test_failures(self):
+        """
+        An operation that fails does not stop the others and its failure is returned in its place.
+        """
+        recipients = [RemoteCalendarUser("mailto:user%02d@example.com" % (i,)) for i in range(3)]
+
+        def operation(recipient):
+            if recipient.cuaddr == "mailto:user01@example.com":
+                raise ValueError("Failed")
+            return recipient.cuaddr
+
+        fanout = FreebusyFanout(None, maxConcurrent=1, separateTransactions=False)
+        results = yield fanout.run(recipients, operation)
+
+        self.assertEqual(results[0], "mailto:user00@example.com")
+        self.assertTrue(isinstance(results[1], Failure))
+        self.assertTrue(results[1].check(ValueError))
+        self.assertEqual(results[2], "mailto:user02@example.com")
+
+        logItems = {}
+        fanout.logTimings(None, logItems)
+        self.assertEqual(logItems["fb-fanout"], 3)
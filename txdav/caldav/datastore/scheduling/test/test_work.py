@@ -358,6 +358,101 @@ END:VCALENDAR
         yield jobs[0].delete()
         yield self.commit()
 
+    @inlineCallbacks
+    def test_batch(self):
+        """
+        Test that a L{txdav.caldav.datastore.scheduling.work.ScheduleOrganizerSendWork} job also delivers
+        to the attendees of the queued work items that follow it, and removes those work items.
+        """
+
+        self.patch(self.config.Scheduling.Options.WorkQueues, "OrganizerSendBatchSize", 10)
+
+        txn = self.transactionUnderTest()
+        home = yield self.homeUnderTest(name="user01")
+        for count, attendee in enumerate(("urn:x-uid:user02", "urn:x-uid:user03",)):
+            yield ScheduleOrganizerSendWork.schedule(
+                txn,
+                "create",
+                home,
+                None,
+                "urn:x-uid:user01",
+                attendee,
+                self.itip_new,
+                True,
+                1000 + count,
+            )
+        yield self.commit()
+
+        works = yield ScheduleOrganizerSendWork.all(self.transactionUnderTest())
+        self.assertEqual(len(works), 2)
+        work = sorted(works, key=lambda x: x.workID)[0]
+        baseWork = yield ScheduleWork.query(self.transactionUnderTest(), ScheduleWork.workID == work.workID)
+        work.addBaseWork(baseWork[0])
+        yield work.doWork()
+        yield self.commit()
+
+        for user in ("user02", "user03",):
+            calendar = yield self.calendarUnderTest(home=user, name="calendar")
+            cobjs = yield calendar.calendarObjects()
+            self.assertEqual(len(cobjs), 1)
+        yield self.commit()
+
+        works = yield ScheduleOrganizerSendWork.all(self.transactionUnderTest())
+        self.assertEqual([item.attendee for item in works], ["urn:x-uid:user02"])
+        yield self.commit()
+
+    @inlineCallbacks
+    def test_batchFailure(self):
+        """
+        Test that when delivery to a batched attendee fails, that attendee's changes are rolled back and the
+        batch stops, leaving the failed work item and the ones after it for their own jobs.
+        """
+
+        self.patch(self.config.Scheduling.Options.WorkQueues, "OrganizerSendBatchSize", 10)
+
+        original = ScheduleOrganizerSendWork._sendToAttendee
+
+        @inlineCallbacks
+        def _sendToAttendee(work, *args):
+            yield original(work, *args)
+            if work.attendee == "urn:x-uid:user03":
+                raise ValueError("Delivery failed")
+        self.patch(ScheduleOrganizerSendWork, "_sendToAttendee", _sendToAttendee)
+
+        txn = self.transactionUnderTest()
+        home = yield self.homeUnderTest(name="user01")
+        attendees = ("urn:x-uid:user02", "urn:x-uid:user03", "urn:x-uid:user04",)
+        for count, attendee in enumerate(attendees):
+            yield ScheduleOrganizerSendWork.schedule(
+                txn,
+                "create",
+                home,
+                None,
+                "urn:x-uid:user01",
+                attendee,
+                self.itip_new,
+                True,
+                1000 + count,
+            )
+        yield self.commit()
+
+        works = yield ScheduleOrganizerSendWork.all(self.transactionUnderTest())
+        work = sorted(works, key=lambda x: x.workID)[0]
+        baseWork = yield ScheduleWork.query(self.transactionUnderTest(), ScheduleWork.workID == work.workID)
+        work.addBaseWork(baseWork[0])
+        yield work.doWork()
+        yield self.commit()
+
+        for user, count in (("user02", 1,), ("user03", 0,),):
+            calendar = yield self.calendarUnderTest(home=user, name="calendar")
+            cobjs = yield calendar.calendarObjects()
+            self.assertEqual(len(cobjs), count)
+        yield self.commit()
+
+        works = yield ScheduleOrganizerSendWork.all(self.transactionUnderTest())
+        self.assertEqual(sorted([item.attendee for item in works]), list(attendees))
+        yield self.commit()
+
 
 class TestScheduleWork(BaseWorkTests):
     """
@@ -15,7 +15,8 @@
 ##
 
 from twext.enterprise.dal.record import fromTable, Record
-from twext.enterprise.dal.syntax import Select, Insert, Delete, Parameter
+from twext.enterprise.dal.syntax import Select, Insert, Delete, Parameter, \
+    SavepointAction
 from twext.enterprise.locking import NamedLock
 from twext.enterprise.jobs.jobitem import JobItem, JobTemporaryError
 from twext.enterprise.jobs.workitem import WorkItem, WORK_PRIORITY_MEDIUM, \
@@ -544,7 +545,6 @@ class ScheduleOrganizerSendWork(ScheduleWorkMixin, fromTable(schema.SCHEDULE_ORG
         try:
             home = (yield self.transaction.calendarHomeWithResourceID(self.homeResourceID))
             resource = (yield home.objectResourceWithID(self.resourceID))
-            itipmsg = Component.fromString(self.itipMsg)
 
             organizerAddress = yield calendarUserFromCalendarUserUID(home.uid(), self.transaction)
             organizer = organizerAddress.record.canonicalCalendarUserAddress()
@@ -559,36 +559,39 @@ class ScheduleOrganizerSendWork(ScheduleWorkMixin, fromTable(schema.SCHEDULE_ORG
             # We need to get the UID lock for implicit processing.
             yield NamedLock.acquire(self.transaction, "ImplicitUIDLock:%s" % (hashlib.md5(self.icalendarUID).hexdigest(),))
 
-            from txdav.caldav.datastore.scheduling.implicit import ImplicitScheduler
-            scheduler = ImplicitScheduler()
-            yield scheduler.queuedOrganizerSending(
-                self.transaction,
-                scheduleActionFromSQL[self.scheduleAction],
-                home,
-                resource,
-                self.icalendarUID,
-                organizer,
-                self.attendee,
-                itipmsg,
-                self.noRefresh
-            )
-
-            # Handle responses - update the actual resource in the store. Note that for a create the resource did not previously
-            # exist and is stored as None for the work item, but the scheduler will attempt to find the new resources and use
-            # that. We need to grab the scheduler's resource for further processing.
-            resource = scheduler.resource
-            if resource is not None:
-                responses, all_delivered = self.extractSchedulingResponse(scheduler.queuedResponses)
-                if not all_delivered:
-
-                    # Check for all connection failed
-                    yield self.checkTemporaryFailure(responses)
-
-                    # Update calendar data to reflect error status
-                    calendar = (yield resource.componentForUser())
-                    changed = self.handleSchedulingResponse(responses, calendar, True)
-                    if changed:
-                        yield resource._setComponentInternal(calendar, internal_state=ComponentUpdateState.ORGANIZER_ITIP_UPDATE)
+            # Attendees sent the same iTIP message share one parse of it
+            parsed = {}
+            yield self._sendToAttendee(home, resource, organizer, parsed)
+
+            # Deliver to a batch of the following queued attendees too. Each delivery is done under a savepoint,
+            # so a failure only rolls back that attendee's changes and leaves the transaction usable. The batch
+            # stops there: the failed work item, and the ones after it, are left for their own jobs to retry, and
+            # nothing else runs against state that may still reflect the rolled back changes.
+            batch = yield self._batchedWork()
+            for work in batch:
+                savepoint = SavepointAction("ScheduleOrganizerSendWork")
+                yield savepoint.acquire(self.transaction)
+                try:
+                    yield work._sendToAttendee(home, resource, organizer, parsed)
+                except JobTemporaryError:
+                    yield savepoint.rollback(self.transaction)
+                    log.debug("ScheduleOrganizerSendWork - batched temporary failure ID: {id}, UID: '{uid}'", id=work.workID, uid=work.icalendarUID)
+                    break
+                except Exception, e:
+                    yield savepoint.rollback(self.transaction)
+                    log.debug("ScheduleOrganizerSendWork - batched exception ID: {id}, UID: '{uid}', {err}", id=work.workID, uid=work.icalendarUID, err=str(e))
+                    log.debug(traceback.format_exc())
+                    break
+                yield savepoint.release(self.transaction)
+                yield work.delete()
+                work._dequeued()
+                log.debug(
+                    "ScheduleOrganizerSendWork - batched for ID: {id}, UID: {uid}, organizer: {org}, attendee: {att}",
+                    id=work.workID,
+                    uid=work.icalendarUID,
+                    org=organizer,
+                    att=work.attendee
+                )
 
             self._dequeued()
 
@@ -609,6 +612,100 @@ class ScheduleOrganizerSendWork(ScheduleWorkMixin, fromTable(schema.SCHEDULE_ORG
             att=self.attendee
         )
 
+    @inlineCallbacks
+    def _batchedWork(self):
+        """
+        Find the queued L{ScheduleOrganizerSendWork} items that immediately follow this one for the same
+        organizer and resource, up to the configured batch size. The caller already holds the row locks for
+        all the work with this UID. Paused work, and any work after other work types, is left alone so that
+        work for the UID is still done in order.
+
+        The notBefore stagger of the batched items is not honored. It only spaces out when the queued items
+        first become due: L{afterWork} already promotes the next item for the UID to run as soon as the
+        previous one is done, and the UID lock means they never run at the same time. A batch delivers to
+        its attendees one after another in the same way, and OrganizerSendBatchSize bounds how long one job
+        takes.
+
+        @return: the work items
+        @rtype: L{Deferred} returning L{list} of L{ScheduleOrganizerSendWork}
+        """
+        batchSize = config.Scheduling.Options.WorkQueues.OrganizerSendBatchSize
+        if batchSize <= 1:
+            returnValue([])
+
+        baseItems = yield ScheduleWork.query(
+            self.transaction,
+            (ScheduleWork.icalendarUID == self.icalendarUID).And(ScheduleWork.workID > self.workID),
+            order=ScheduleWork.workID,
+            limit=batchSize - 1,
+        )
+        if not baseItems:
+            returnValue([])
+        jobs = yield JobItem.query(self.transaction, JobItem.jobID.In([baseItem.jobID for baseItem in baseItems]))
+        paused = set([job.jobID for job in jobs if job.pause])
+        workItems = yield ScheduleOrganizerSendWork.query(
+            self.transaction,
+            ScheduleOrganizerSendWork.workID.In([baseItem.workID for baseItem in baseItems])
+        )
+        workItems = dict([(workItem.workID, workItem,) for workItem in workItems])
+
+        batch = []
+        for baseItem in baseItems:
+            workItem = workItems.get(baseItem.workID)
+            if (
+                baseItem.workType != self.workType() or baseItem.jobID in paused or workItem is None or
+                workItem.homeResourceID != self.homeResourceID or workItem.resourceID != self.resourceID
+            ):
+                break
+            workItem.addBaseWork(baseItem)
+            batch.append(workItem)
+        returnValue(batch)
+
+    @inlineCallbacks
+    def _sendToAttendee(self, home, resource, organizer, parsed):
+        """
+        Send this work item's iTIP message to its attendee, and update the organizer's resource with any
+        failed delivery status.
+
+        @param parsed: parsed iTIP messages, keyed by their text, shared by all the work in a batch
+        @type parsed: L{dict}
+        """
+
+        itipmsg = parsed.get(self.itipMsg)
+        if itipmsg is None:
+            itipmsg = parsed[self.itipMsg] = Component.fromString(self.itipMsg)
+
+        from txdav.caldav.datastore.scheduling.implicit import ImplicitScheduler
+        scheduler = ImplicitScheduler()
+        yield scheduler.queuedOrganizerSending(
+            self.transaction,
+            scheduleActionFromSQL[self.scheduleAction],
+            home,
+            resource,
+            self.icalendarUID,
+            organizer,
+            self.attendee,
+            itipmsg.duplicate(),
+            self.noRefresh
+        )
+
+        # Handle responses - update the actual resource in the store. Note that for a create the resource did not previously
+        # exist and is stored as None for the work item, but the scheduler will attempt to find the new resources and use
+        # that. We need to grab the scheduler's resource for further processing.
+        resource = scheduler.resource
+        if resource is not None:
+            responses, all_delivered = self.extractSchedulingResponse(scheduler.queuedResponses)
+            if not all_delivered:
+
+                # Check for all connection failed
+                yield self.checkTemporaryFailure(responses)
+
+                # Update calendar data to reflect error status
+                calendar = (yield resource.componentForUser())
+                changed = self.handleSchedulingResponse(responses, calendar, True)
+                if changed:
+                    yield resource._setComponentInternal(calendar, internal_state=ComponentUpdateState.ORGANIZER_ITIP_UPDATE)
+
 
 class ScheduleReplyWork(ScheduleWorkMixin, fromTable(schema.SCHEDULE_REPLY_WORK)):
     """
@@ -51,6 +51,7 @@ from twistedcaldav.dateops import normalizeForIndex, \
 from twistedcaldav.ical import Component, InvalidICalendarDataError, Property, ATTENDEE_COMMENT
 from twistedcaldav.instance import InvalidOverriddenInstanceError
 from twistedcaldav.timezones import TimezoneException, readVTZ, hasTZ
+from twistedcaldav.util import LRUCache
 
 from txdav.base.propertystore.base import PropertyName
 from txdav.caldav.datastore.query.builder import buildExpression
@@ -91,6 +92,7 @@ from txdav.common.datastore.sql_tables import _ATTACHMENTS_MODE_NONE, \
     _TRANSP_OPAQUE, _TRANSP_TRANSPARENT, schema, _CHILD_TYPE_TRASH, \
     _HOME_STATUS_NORMAL
 from txdav.common.datastore.sql_sharing import SharingInvitation
+from txdav.common.datastore.sql_util import bulkInsert, nextSequenceValues
 from txdav.common.icommondatastore import IndexedSearchException, \
     InternalDataStoreError, HomeChildNameAlreadyExistsError, \
     HomeChildNameNotAllowedError, ObjectResourceTooBigError, \
@@ -122,6 +124,34 @@ import uuid
 log = Logger()
 
 
+# Parsed calendar data takes roughly this many times the memory of its text
+_COMPONENT_MEMORY_FACTOR = 10
+
+_componentCache = None
+
+
+def _getComponentCache():
+    """
+    Get the per-process cache of parsed and validated calendar data, which is keyed by resource ID,
+    MD5 and data version, and bounded by the approximate memory of the cached data. Each cached
+    value is a C{tuple} of the L{Component} and its text length. The cached L{Component} is never
+    handed out: callers always get a copy.
+
+    @return: the cache, or L{None} if it is disabled
+    @rtype: L{LRUCache}
+    """
+    global _componentCache
+    if config.ComponentCacheSize <= 0:
+        return None
+    if _componentCache is None:
+        _componentCache = LRUCache(
+            config.ComponentCacheSize * 1000 * 1000,
+            name="calendar-components",
+            sizeOf=lambda value: value[1] * _COMPONENT_MEMORY_FACTOR,
+        )
+    return _componentCache
+
+
 class CalendarStoreFeatures(object):
     """
     Manages store-wide operations specific to calendars.
@@ -1734,36 +1764,7 @@ class Calendar(CommonHomeChild):
 
         # Check for time-range re-expand
         if usedtimerange is not None:
-
-            today = DateTime.getToday()
-
-            # Determine how far we need to extend the current expansion of
-            # events. If we have an open-ended time-range we will expand
-            # one year past the start. That should catch bounded
-            # recurrences - unbounded will have been indexed with an
-            # "infinite" value always included.
-            maxDate, isStartDate = filter.getmaxtimerange()
-            if maxDate:
-                maxDate = maxDate.duplicate()
-                maxDate.offsetDay(1)
-                maxDate.setDateOnly(True)
-                upperLimit = today + Duration(days=config.FreeBusyIndexExpandMaxDays)
-                if maxDate > upperLimit:
-                    raise TimeRangeUpperLimit(upperLimit)
-                if isStartDate:
-                    maxDate += Duration(days=365)
-
-            # Determine if the start date is too early for the restricted range we
-            # are applying. If it is today or later we don't need to worry about truncation
-            # in the past.
-            minDate, _ignore_isEndDate = filter.getmintimerange()
-            if minDate >= today:
-                minDate = None
-            if minDate is not None and config.FreeBusyIndexLowerLimitDays:
-                truncateLowerLimit = today - Duration(days=config.FreeBusyIndexLowerLimitDays)
-                if minDate < truncateLowerLimit:
-                    raise TimeRangeLowerLimit(truncateLowerLimit)
-
+            minDate, maxDate = self._searchExpansionLimits(filter)
             if maxDate is not None or minDate is not None:
                 yield self.testAndUpdateIndex(minDate, maxDate)
 
@@ -1772,18 +1773,116 @@ class Calendar(CommonHomeChild):
         # Check result for missing resources
         results = []
         for row in rowiter:
-            if fbtype:
-                row = list(row)
-                row[4] = 'Y' if row[4] else 'N'
-                row[7] = indexfbtype_to_icalfbtype[row[7]]
-                if row[9] is not None:
-                    row[8] = row[9]
-                row[8] = 'T' if row[8] else 'F'
-                del row[9]
-            results.append(row)
+            results.append(self._searchResultRow(row, fbtype))
 
         returnValue(results)
 
+    @classmethod
+    @inlineCallbacks
+    def searchMultiple(cls, calendars, filter, useruid=None, fbtype=False):
+        """
+        Finds resources matching the given qualifiers in each of a set of calendars, using a single
+        query for all of them rather than one per calendar. The calendars must all belong to the same
+        transaction and share the timezone used to set up the L{Filter}.
+
+        @param calendars: the calendars to search
+        @type calendars: L{list} of L{Calendar}
+        @param filter: the L{Filter} for the calendar-query to execute.
+        @return: a C{dict} mapping each calendar's resource-id to a C{list} of results, with each
+            result being the same as those returned by L{search}.
+        """
+
+        # Make sure we have a proper Filter element and get the partial SQL statement to use.
+        sql_stmt = cls._sqlqueryMultiple(calendars, filter, useruid, fbtype)
+
+        # No result means it is too complex for us
+        if sql_stmt is None:
+            raise IndexedSearchException()
+        sql_stmt, args, usedtimerange = sql_stmt
+
+        # Check for time-range re-expand
+        calendarsByID = dict([(calendar.id(), calendar,) for calendar in calendars])
+        txn = calendars[0]._txn
+        if usedtimerange is not None:
+            minDate, maxDate = cls._searchExpansionLimits(filter)
+            if maxDate is not None or minDate is not None:
+                rows = yield cls._notExpandedWithinMultipleQuery(len(calendarsByID)).on(
+                    txn,
+                    minDate=pyCalendarToSQLTimestamp(normalizeForIndex(minDate)) if minDate is not None else None,
+                    maxDate=pyCalendarToSQLTimestamp(normalizeForIndex(maxDate)),
+                    resourceIDs=calendarsByID.keys(),
+                )
+                for calendarID, name in rows:
+                    calendar = calendarsByID[calendarID]
+                    calendar.log.info("Search falls outside range of index for {name} {min} to {max}", name=name, min=minDate, max=maxDate)
+                    yield calendar.reExpandResource(name, minDate, maxDate)
+
+        rowiter = yield sql_stmt.on(txn, **args)
+
+        # The calendar resource-id is the last column of each row
+        results = dict([(calendarID, [],) for calendarID in calendarsByID.keys()])
+        for row in rowiter:
+            results[row[-1]].append(cls._searchResultRow(row[:-1], fbtype))
+
+        returnValue(results)
+
+    @staticmethod
+    def _searchExpansionLimits(filter):
+        """
+        Determine how far the instance index needs to be expanded to satisfy the time-range
+        in the supplied filter.
+
+        @param filter: the L{Filter} for the calendar-query to execute.
+        @return: a C{tuple} of the lower and upper L{DateTime} limits to expand to - either may
+            be C{None} if no expansion is needed
+        """
+
+        today = DateTime.getToday()
+
+        # Determine how far we need to extend the current expansion of
+        # events. If we have an open-ended time-range we will expand
+        # one year past the start. That should catch bounded
+        # recurrences - unbounded will have been indexed with an
+        # "infinite" value always included.
+        maxDate, isStartDate = filter.getmaxtimerange()
+        if maxDate:
+            maxDate = maxDate.duplicate()
+            maxDate.offsetDay(1)
+            maxDate.setDateOnly(True)
+            upperLimit = today + Duration(days=config.FreeBusyIndexExpandMaxDays)
+            if maxDate > upperLimit:
+                raise TimeRangeUpperLimit(upperLimit)
+            if isStartDate:
+                maxDate += Duration(days=365)
+
+        # Determine if the start date is too early for the restricted range we
+        # are applying. If it is today or later we don't need to worry about truncation
+        # in the past.
+        minDate, _ignore_isEndDate = filter.getmintimerange()
+        if minDate >= today:
+            minDate = None
+        if minDate is not None and config.FreeBusyIndexLowerLimitDays:
+            truncateLowerLimit = today - Duration(days=config.FreeBusyIndexLowerLimitDays)
+            if minDate < truncateLowerLimit:
+                raise TimeRangeLowerLimit(truncateLowerLimit)
+
+        return minDate, maxDate
+
+    @staticmethod
+    def _searchResultRow(row, fbtype):
+        """
+        Convert a row returned by a search query into the form returned by L{search}.
+        """
+        if fbtype:
+            row = list(row)
+            row[4] = 'Y' if row[4] else 'N'
+            row[7] = indexfbtype_to_icalfbtype[row[7]]
+            if row[9] is not None:
+                row[8] = row[9]
+            row[8] = 'T' if row[8] else 'F'
+            del row[9]
+        return row
+
     def _sqlquery(self, filter, useruid, fbtype):
         """
         Convert the supplied addressbook-query into a partial SQL statement.
@@ -1804,6 +1903,23 @@ class Calendar(CommonHomeChild):
         except ValueError:
             return None
 
+    @classmethod
+    def _sqlqueryMultiple(cls, calendars, filter, useruid, fbtype):
+        """
+        Convert the supplied calendar-query into a partial SQL statement that targets all the
+        supplied calendars. See L{_sqlquery}.
+        """
+
+        if not isinstance(filter, Filter):
+            return None
+
+        try:
+            expression = buildExpression(filter, cls._queryFields)
+            sql = CalDAVSQLQueryGenerator(expression, calendars[0], [calendar.id() for calendar in calendars], useruid, fbtype)
+            return sql.generate()
+        except ValueError:
+            return None
+
     @classproperty
     def _notExpandedWithinQuery(cls):  # @NoSelf
         """
@@ -1819,6 +1935,21 @@ class Calendar(CommonHomeChild):
             ).And(co.CALENDAR_RESOURCE_ID == Parameter("resourceID"))
         )
 
+    @classmethod
+    def _notExpandedWithinMultipleQuery(cls, count):
+        """
+        Query to find resources that need to be re-expanded in any of a set of calendars
+        """
+        co = cls._objectSchema
+        return Select(
+            [co.CALENDAR_RESOURCE_ID, co.RESOURCE_NAME],
+            From=co,
+            Where=(
+                (co.RECURRANCE_MIN > Parameter("minDate"))
+                .Or(co.RECURRANCE_MAX < Parameter("maxDate"))
+            ).And(co.CALENDAR_RESOURCE_ID.In(Parameter("resourceIDs", count)))
+        )
+
     @inlineCallbacks
     def notExpandedWithin(self, minDate, maxDate):
         """
@@ -3487,7 +3618,7 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
             # raw component is written out.
             if split_details is not None:
                 user_uuid = self._parentCollection.viewerHome().uid()
-                component = PerUserDataFilter(user_uuid).filter(component.duplicate())
+                component = PerUserDataFilter(user_uuid).filterCopy(component)
 
             scheduler = ImplicitScheduler(logItems=self._txn.logItems, options=options)
 
@@ -3952,6 +4083,10 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
         # Do not update if reCreate (re-indexing - we don't want to re-write data
         # or cause modified to change)
         if not reCreate:
+            cache = _getComponentCache()
+            if cache is not None and self._resourceID is not None:
+                cache.pop(self._componentCacheKey())
+
             componentText = str(component)
             self._objectText = componentText
             self._cachedComponent = component
@@ -4029,13 +4164,6 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
                         Return=co.MODIFIED,
                     ).on(txn)
                 )[0][0])
-
-                # Need to wipe the existing time-range for this and rebuild if required
-                if instanceIndexingRequired:
-                    yield Delete(
-                        From=tr,
-                        Where=tr.CALENDAR_OBJECT_RESOURCE_ID == self._resourceID
-                    ).on(txn)
         else:
             # Keep MODIFIED the same when doing an index-only update
             values = {
@@ -4049,21 +4177,25 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
                 Where=co.RESOURCE_ID == self._resourceID
             ).on(txn)
 
-            # Need to wipe the existing time-range for this and rebuild
-            yield Delete(
-                From=tr,
-                Where=tr.CALENDAR_OBJECT_RESOURCE_ID == self._resourceID
-            ).on(txn)
-
-        if instanceIndexingRequired and doInstanceIndexing:
-            yield self._addInstances(component, instances, truncateLowerLimit, isInboxItem, txn)
+        if instanceIndexingRequired:
+            if doInstanceIndexing:
+                yield self._addInstances(component, instances, truncateLowerLimit, isInboxItem, txn, replace=not inserting)
+            elif not inserting:
+                # Need to wipe the existing time-range for this
+                yield Delete(
+                    From=tr,
+                    Where=tr.CALENDAR_OBJECT_RESOURCE_ID == self._resourceID
+                ).on(txn)
 
         yield self.removeOldEventGroupLink(component, instances, inserting, txn)
 
     @inlineCallbacks
-    def _addInstances(self, component, instances, truncateLowerLimit, isInboxItem, txn):
+    def _addInstances(self, component, instances, truncateLowerLimit, isInboxItem, txn, replace=False):
         """
-        Add the set of supplied instances to the store.
+        Add the set of supplied instances to the store. When replacing an
+        existing time-range either only the rows that changed are updated
+        (when C{config.FreeBusyIndexIncremental} is set), or all existing rows
+        are removed first.
 
         @param component: the component whose instances are being added
         @type component: L{Component}
@@ -4075,9 +4207,40 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
         @type isInboxItem: C{bool}
         @param txn: transaction to use
         @type txn: L{Transaction}
+        @param replace: whether the instances replace an existing time-range
+        @type replace: C{bool}
+        """
+
+        details = self._instanceDetails(component, instances, truncateLowerLimit)
+        if replace and config.FreeBusyIndexIncremental:
+            yield self._updateInstanceDetails(component, details, isInboxItem, txn)
+        else:
+            if replace:
+                # Need to wipe the existing time-range for this and rebuild
+                tr = schema.TIME_RANGE
+                yield Delete(
+                    From=tr,
+                    Where=tr.CALENDAR_OBJECT_RESOURCE_ID == self._resourceID
+                ).on(txn)
+            yield self._addInstanceDetailsList(component, details, isInboxItem, txn)
+
+    def _instanceDetails(self, component, instances, truncateLowerLimit):
+        """
+        Get the details of the TIME_RANGE rows for the supplied instances.
+
+        @param component: the component whose instances are being indexed
+        @type component: L{Component}
+        @param instances: the set of instances
+        @type instances: L{InstanceList}
+        @param truncateLowerLimit: the lower limit for instances
+        @type truncateLowerLimit: L{DateTime}
+
+        @return: the instances, as tuples of (rid, start, end, floating, transp, fbtype)
+        @rtype: C{list} of C{tuple}
         """
 
         # TIME_RANGE table update
+        details = []
         lowerLimitApplied = False
         for key in instances:
             instance = instances[key]
@@ -4094,14 +4257,14 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
                 lowerLimitApplied = True
                 continue
 
-            yield self._addInstanceDetails(component, instance.rid, start, end, floating, transp, fbtype, isInboxItem, txn)
+            details.append((instance.rid, start, end, floating, transp, fbtype,))
 
         # For truncated items we insert a tomb stone lower bound so that a time-range
         # query with just an end bound will match
         if lowerLimitApplied or instances.lowerLimit and len(instances.instances) == 0:
             start = DateTime(1901, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
             end = DateTime(1901, 1, 1, 1, 0, 0, tzid=Timezone.UTCTimezone)
-            yield self._addInstanceDetails(component, None, start, end, False, True, "UNKNOWN", isInboxItem, txn)
+            details.append((None, start, end, False, True, "UNKNOWN",))
 
         # Special - for unbounded recurrence we insert a value for "infinity"
         # that will allow an open-ended time-range to always match it.
@@ -4110,15 +4273,117 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
         if component.isRecurringUnbounded() or instances.limit and len(instances.instances) == 0:
             start = DateTime(2100, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
             end = DateTime(2100, 1, 1, 1, 0, 0, tzid=Timezone.UTCTimezone)
-            yield self._addInstanceDetails(component, None, start, end, False, True, "UNKNOWN", isInboxItem, txn)
+            details.append((None, start, end, False, True, "UNKNOWN",))
+
+        return details
 
     @inlineCallbacks
-    def _addInstanceDetails(self, component, rid, start, end, floating, transp, fbtype, isInboxItem, txn):
+    def _addInstanceDetailsList(self, component, details, isInboxItem, txn):
+        """
+        Add a set of instances to the TIME_RANGE and PERUSER tables.
+
+        @param details: the instances to add, as tuples of (rid, start, end,
+            floating, transp, fbtype)
+        @type details: C{list} of C{tuple}
+        """
+        if config.FreeBusyIndexBatchInsert:
+            yield self._addInstanceDetailsBatch(component, details, isInboxItem, txn)
+        else:
+            for rid, start, end, floating, transp, fbtype in details:
+                yield self._addInstanceDetails(component, rid, start, end, floating, transp, fbtype, isInboxItem, txn)
+
+    @inlineCallbacks
+    def _updateInstanceDetails(self, component, details, isInboxItem, txn):
+        """
+        Bring the TIME_RANGE and PERUSER rows for this resource into line with a new set of
+        instances by only deleting the existing rows that no longer match an instance, and only
+        inserting rows for the instances that have no matching existing row. Rows match when
+        their start, end, fbtype, transparency, floating state and per-user data are all the
+        same. Changing one instance of a long recurring series then only rewrites that
+        instance's rows, rather than the whole series.
+
+        @param component: the component whose instances are being indexed
+        @type component: L{Component}
+        @param details: the new instances, as tuples of (rid, start, end, floating, transp,
+            fbtype)
+        @type details: C{list} of C{tuple}
+        @param isInboxItem: indicates if an inbox item
+        @type isInboxItem: C{bool}
+        @param txn: transaction to use
+        @type txn: L{Transaction}
+        """
 
         tr = schema.TIME_RANGE
         tpy = schema.PERUSER
 
-        instanceid = (yield Insert({
+        def _timestamp(value):
+            # Databases differ in how they return timestamps, and date-only values need
+            # to compare equal to the midnight timestamps they are stored as
+            if isinstance(value, str):
+                value = parseSQLTimestamp(value)
+            elif isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+                value = datetime.datetime(value.year, value.month, value.day)
+            return value
+
+        # Existing rows, keyed by their values
+        rows = yield Select(
+            [tr.INSTANCE_ID, tr.START_DATE, tr.END_DATE, tr.FBTYPE, tr.TRANSPARENT, tr.FLOATING],
+            From=tr,
+            Where=tr.CALENDAR_OBJECT_RESOURCE_ID == self._resourceID,
+        ).on(txn)
+        perUserRows = yield Select(
+            [tpy.TIME_RANGE_INSTANCE_ID, tpy.USER_ID, tpy.TRANSPARENT, tpy.ADJUSTED_START_DATE, tpy.ADJUSTED_END_DATE],
+            From=tr.join(tpy, tr.INSTANCE_ID == tpy.TIME_RANGE_INSTANCE_ID),
+            Where=tr.CALENDAR_OBJECT_RESOURCE_ID == self._resourceID,
+        ).on(txn)
+        perUser = collections.defaultdict(list)
+        for instanceID, userID, transp, adjustedStart, adjustedEnd in perUserRows:
+            perUser[instanceID].append((userID, bool(transp), _timestamp(adjustedStart), _timestamp(adjustedEnd),))
+
+        existing = collections.defaultdict(list)
+        for instanceID, start, end, fbtype, transp, floating in rows:
+            key = (
+                _timestamp(start), _timestamp(end), fbtype, bool(transp), bool(floating),
+                tuple(sorted(perUser[instanceID])),
+            )
+            existing[key].append(instanceID)
+
+        # Keep the existing rows that match a new instance
+        added = []
+        for detail in details:
+            rid, start, end, floating, transp, fbtype = detail
+            values = self._instanceValues(start, end, floating, transp, fbtype)
+            perUserValues = self._perUserInstanceValues(component, rid, start, end, transp) if not isInboxItem else ()
+            key = (
+                _timestamp(values[tr.START_DATE]), _timestamp(values[tr.END_DATE]), values[tr.FBTYPE],
+                bool(transp), bool(floating),
+                tuple(sorted([(
+                    userValues[tpy.USER_ID], bool(userValues[tpy.TRANSPARENT]),
+                    _timestamp(userValues[tpy.ADJUSTED_START_DATE]), _timestamp(userValues[tpy.ADJUSTED_END_DATE]),
+                ) for userValues in perUserValues])),
+            )
+            if existing.get(key):
+                existing[key].pop()
+            else:
+                added.append(detail)
+
+        # PERUSER rows are removed by cascade
+        removed = list(itertools.chain(*existing.values()))
+        for offset in range(0, len(removed), config.FreeBusyIndexBatchSize):
+            batch = removed[offset:offset + config.FreeBusyIndexBatchSize]
+            yield Delete(
+                From=tr,
+                Where=tr.INSTANCE_ID.In(Parameter("instanceIDs", len(batch))),
+            ).on(txn, instanceIDs=batch)
+
+        yield self._addInstanceDetailsList(component, added, isInboxItem, txn)
+
+    def _instanceValues(self, start, end, floating, transp, fbtype):
+        """
+        Generate the TIME_RANGE column values for one instance.
+        """
+        tr = schema.TIME_RANGE
+        return {
             tr.CALENDAR_RESOURCE_ID: self._calendar._resourceID,
             tr.CALENDAR_OBJECT_RESOURCE_ID: self._resourceID,
             tr.FLOATING: floating,
@@ -4126,29 +4391,98 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
             tr.END_DATE: pyCalendarToSQLTimestamp(end),
             tr.FBTYPE: icalfbtype_to_indexfbtype.get(fbtype, icalfbtype_to_indexfbtype["FREE"]),
             tr.TRANSPARENT: transp,
-        }, Return=tr.INSTANCE_ID).on(txn))[0][0]
+        }
+
+    def _perUserInstanceValues(self, component, rid, start, end, transp):
+        """
+        Generate the PERUSER column values for one instance, excluding the
+        TIME_RANGE_INSTANCE_ID. Only users whose view of the instance differs
+        from the shared one get a row.
+        """
+        tpy = schema.PERUSER
+
+        def _adjustDateTime(dt, adjustment, add_duration):
+            if isinstance(adjustment, Duration):
+                return pyCalendarToSQLTimestamp((dt + adjustment) if add_duration else (dt - adjustment))
+            elif isinstance(adjustment, DateTime):
+                return pyCalendarToSQLTimestamp(normalizeForIndex(adjustment))
+            else:
+                return None
+
+        results = []
+        for useruid, (usertransp, adjusted_start, adjusted_end) in component.perUserData(rid):
+            if usertransp != transp or adjusted_start is not None or adjusted_end is not None:
+                results.append({
+                    tpy.USER_ID: useruid if useruid else ".",
+                    tpy.TRANSPARENT: usertransp,
+                    tpy.ADJUSTED_START_DATE: _adjustDateTime(start, adjusted_start, add_duration=False),
+                    tpy.ADJUSTED_END_DATE: _adjustDateTime(end, adjusted_end, add_duration=True),
+                })
+        return results
+
+    @inlineCallbacks
+    def _addInstanceDetails(self, component, rid, start, end, floating, transp, fbtype, isInboxItem, txn):
+
+        tr = schema.TIME_RANGE
+        tpy = schema.PERUSER
+
+        instanceid = (yield Insert(
+            self._instanceValues(start, end, floating, transp, fbtype),
+            Return=tr.INSTANCE_ID,
+        ).on(txn))[0][0]
 
         # Don't do transparency for inbox items - we never do freebusy on inbox
         if not isInboxItem:
-            peruserdata = component.perUserData(rid)
-            for useruid, (usertransp, adjusted_start, adjusted_end) in peruserdata:
-
-                def _adjustDateTime(dt, adjustment, add_duration):
-                    if isinstance(adjustment, Duration):
-                        return pyCalendarToSQLTimestamp((dt + adjustment) if add_duration else (dt - adjustment))
-                    elif isinstance(adjustment, DateTime):
-                        return pyCalendarToSQLTimestamp(normalizeForIndex(adjustment))
-                    else:
-                        return None
+            for values in self._perUserInstanceValues(component, rid, start, end, transp):
+                values[tpy.TIME_RANGE_INSTANCE_ID] = instanceid
+                yield Insert(values).on(txn)
+
+    @inlineCallbacks
+    def _addInstanceDetailsBatch(self, component, details, isInboxItem, txn):
+        """
+        Add a set of instances to the TIME_RANGE and PERUSER tables using one
+        multi-row insert for each table, rather than one insert per row. The
+        TIME_RANGE instance ids are always allocated from the sequence up
+        front: the PERUSER rows need to reference them, and a raw multi-row
+        insert gets no column default on Oracle.
+
+        @param component: the component whose instances are being added
+        @type component: L{Component}
+        @param details: the instances to add, as tuples of (rid, start, end,
+            floating, transp, fbtype)
+        @type details: C{list} of C{tuple}
+        @param isInboxItem: indicates if an inbox item
+        @type isInboxItem: C{bool}
+        @param txn: transaction to use
+        @type txn: L{Transaction}
+        """
+
+        if not details:
+            returnValue(None)
+
+        tr = schema.TIME_RANGE
+        tpy = schema.PERUSER
 
-                if usertransp != transp or adjusted_start is not None or adjusted_end is not None:
-                    (yield Insert({
-                        tpy.TIME_RANGE_INSTANCE_ID: instanceid,
-                        tpy.USER_ID: useruid if useruid else ".",
-                        tpy.TRANSPARENT: usertransp,
-                        tpy.ADJUSTED_START_DATE: _adjustDateTime(start, adjusted_start, add_duration=False),
-                        tpy.ADJUSTED_END_DATE: _adjustDateTime(end, adjusted_end, add_duration=True),
-                    }).on(txn))
+        instanceRows = []
+        perUserRows = []
+        for rid, start, end, floating, transp, fbtype in details:
+            instanceRows.append(self._instanceValues(start, end, floating, transp, fbtype))
+
+            # Don't do transparency for inbox items - we never do freebusy on inbox
+            perUserRows.append(
+                self._perUserInstanceValues(component, rid, start, end, transp) if not isInboxItem else ()
+            )
+
+        allPerUserRows = []
+        instanceIDs = yield nextSequenceValues(txn, tr.INSTANCE_ID.model.default.name, len(instanceRows))
+        for instanceID, instanceValues, perUserValues in zip(instanceIDs, instanceRows, perUserRows):
+            instanceValues[tr.INSTANCE_ID] = instanceID
+            for values in perUserValues:
+                values[tpy.TIME_RANGE_INSTANCE_ID] = instanceID
+                allPerUserRows.append(values)
+
+        yield bulkInsert(txn, instanceRows, config.FreeBusyIndexBatchSize)
+        yield bulkInsert(txn, allPerUserRows, config.FreeBusyIndexBatchSize)
 
     @inlineCallbacks
     def copyMetadata(self, other):
@@ -4184,6 +4518,15 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
 
         if self._cachedComponent is None:
 
+            # Use the per-process cache only for data that needs no upgrade
+            cache = _getComponentCache() if self._dataversion >= self._currentDataVersion else None
+            if cache is not None:
+                cached = cache.get(self._componentCacheKey())
+                if cached is not None:
+                    self._cachedComponent = cached[0].duplicate()
+                    self._cachedCommponentPerUser = {}
+                    returnValue(self._cachedComponent)
+
             text = yield self._text()
 
             try:
@@ -4215,11 +4558,21 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
             if self._dataversion < self._currentDataVersion:
                 yield self.upgradeData(component, doUpdate)
 
+            if cache is not None:
+                cache.set(self._componentCacheKey(), (component.duplicate(), len(text),))
+
             self._cachedComponent = component
             self._cachedCommponentPerUser = {}
 
         returnValue(self._cachedComponent)
 
+    def _componentCacheKey(self):
+        """
+        Key for this object's data in the per-process component cache. The MD5 changes whenever the
+        data is written, so no other process can see stale data for a key.
+        """
+        return (self._resourceID, self._md5, self._dataversion,)
+
     @inlineCallbacks
     def componentForUser(self, user_uuid=None):
         """
@@ -4237,7 +4590,7 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
 
         if user_uuid not in self._cachedCommponentPerUser:
             caldata = yield self.component()
-            filtered = PerUserDataFilter(user_uuid).filter(caldata.duplicate())
+            filtered = PerUserDataFilter(user_uuid).filterCopy(caldata)
             self._cachedCommponentPerUser[user_uuid] = filtered
         returnValue(self._cachedCommponentPerUser[user_uuid])
 
@@ -481,6 +481,9 @@ class Attachment(object):
     def retrieve(self, protocol):
         return AttachmentRetrievalTransport(self._path).start(protocol)
 
+    def retrieveFile(self):
+        return self._path.open()
+
     def changed(self, contentType, dispositionName, md5, size):
         raise NotImplementedError
 
@@ -42,6 +42,7 @@ from twistedcaldav.dateops import datetimeMktime
 from twistedcaldav.ical import Component, normalize_iCalStr, diff_iCalStrs, Property
 from twistedcaldav.instance import InvalidOverriddenInstanceError
 from twistedcaldav.timezones import TimezoneCache, readVTZ, TimezoneException
+from twistedcaldav.util import LRUCache
 
 from txdav.base.propertystore.base import PropertyName
 from txdav.caldav.datastore.query.filter import Filter
@@ -52,6 +53,7 @@ from txdav.caldav.datastore.scheduling.implicit import ImplicitScheduler
 from txdav.caldav.datastore.scheduling.itip import iTIPRequestStatus
 from txdav.caldav.datastore.scheduling.processing import ImplicitProcessor
 from txdav.caldav.datastore.scheduling.scheduler import ScheduleResponseQueue
+from txdav.caldav.datastore import sql
 from txdav.caldav.datastore.sql import CalendarStoreFeatures, CalendarObject
 from txdav.common.datastore.sql import ECALENDARTYPE, CommonObjectResource, \
     CommonStoreTransactionMonitor
@@ -73,7 +75,8 @@ from txdav.xml.rfc2518 import GETContentLanguage, ResourceType
 
 from twext.enterprise.dal.syntax import Select, Parameter, Insert, Delete, \
     Update
-from twext.enterprise.ienterprise import AlreadyFinishedError
+from twext.enterprise.ienterprise import AlreadyFinishedError, \
+    DatabaseType, ORACLE_DIALECT
 from twext.enterprise.jobs.jobitem import JobItem
 from twext.enterprise.util import parseSQLTimestamp
 
@@ -1531,6 +1534,291 @@ END:VCALENDAR
         yield obj1.remove()
         yield self.commit()
 
+    @inlineCallbacks
+    def test_batchInstanceIndexing(self):
+        """
+        Instance indexing with multi-row inserts produces the same TIME_RANGE
+        and PERUSER rows as one insert per instance.
+        """
+
+        caldata = """BEGIN:VCALENDAR
+VERSION:2.0
+CALSCALE:GREGORIAN
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:{uid}
+DTSTART:%(now)s0102T140000Z
+DURATION:PT1H
+CREATED:20060102T190000Z
+DTSTAMP:20051222T210507Z
+RRULE:FREQ=DAILY;COUNT=20
+SUMMARY:instance
+END:VEVENT
+BEGIN:X-CALENDARSERVER-PERUSER
+UID:{uid}
+X-CALENDARSERVER-PERUSER-UID:user02
+BEGIN:X-CALENDARSERVER-PERINSTANCE
+TRANSP:TRANSPARENT
+END:X-CALENDARSERVER-PERINSTANCE
+END:X-CALENDARSERVER-PERUSER
+END:VCALENDAR
+""".replace("\n", "\r\n") % self.nowYear
+
+        self.patch(config, "FreeBusyIndexDelayedExpand", False)
+        self.patch(config, "FreeBusyIndexBatchSize", 7)
+
+        @inlineCallbacks
+        def _indexRows(batch):
+            self.patch(config, "FreeBusyIndexBatchInsert", batch)
+            uid = "batch-{}".format(batch)
+            calendar = yield self.calendarUnderTest()
+            calendarObject = yield calendar.createCalendarObjectWithName(
+                "{}.ics".format(uid), Component.fromString(caldata.format(uid=uid))
+            )
+
+            tr = schema.TIME_RANGE
+            tpy = schema.PERUSER
+            rows = yield Select(
+                [tr.START_DATE, tr.END_DATE, tr.FBTYPE, tr.TRANSPARENT, tr.FLOATING],
+                From=tr,
+                Where=tr.CALENDAR_OBJECT_RESOURCE_ID == calendarObject._resourceID,
+            ).on(self.transactionUnderTest())
+            peruser = yield Select(
+                [tr.START_DATE, tpy.USER_ID, tpy.TRANSPARENT],
+                From=tr.join(tpy, tr.INSTANCE_ID == tpy.TIME_RANGE_INSTANCE_ID),
+                Where=tr.CALENDAR_OBJECT_RESOURCE_ID == calendarObject._resourceID,
+            ).on(self.transactionUnderTest())
+            returnValue((sorted(rows), sorted(peruser),))
+
+        rows, peruser = yield _indexRows(False)
+        batchRows, batchPeruser = yield _indexRows(True)
+        self.assertEqual(len(rows), 20)
+        self.assertEqual(len(peruser), 20)
+        self.assertEqual(batchRows, rows)
+        self.assertEqual(batchPeruser, peruser)
+        yield self.commit()
+
+    @inlineCallbacks
+    def test_batchInstanceIndexingOracle(self):
+        """
+        On Oracle, multi-row TIME_RANGE inserts get no INSTANCE_ID column
+        default, so every row is given an id from the sequence even when there
+        are no PERUSER rows.
+        """
+
+        class RecordingOracleTransaction(object):
+            dbtype = DatabaseType(ORACLE_DIALECT, "numeric")
+
+            def __init__(self):
+                self.statements = []
+
+            def execSQL(self, sql, args=None, raiseOnZeroRowCount=None):
+                self.statements.append((sql, args,))
+                if sql.startswith("select"):
+                    return succeed([(100 + i,) for i in range(args[0])])
+                return succeed(None)
+
+        caldata = """BEGIN:VCALENDAR
+VERSION:2.0
+CALSCALE:GREGORIAN
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:batch-oracle
+DTSTART:%(now)s0102T140000Z
+DURATION:PT1H
+CREATED:20060102T190000Z
+DTSTAMP:20051222T210507Z
+SUMMARY:instance
+END:VEVENT
+END:VCALENDAR
+""".replace("\n", "\r\n") % self.nowYear
+
+        calendar = yield self.calendarUnderTest()
+        calendarObject = yield calendar.createCalendarObjectWithName(
+            "batch-oracle.ics", Component.fromString(caldata)
+        )
+        component = yield calendarObject.componentForUser()
+
+        details = [
+            (None, DateTime(2017, 1, day, 14, 0, 0, tzid=Timezone.UTCTimezone),
+             DateTime(2017, 1, day, 15, 0, 0, tzid=Timezone.UTCTimezone), False, False, "BUSY",)
+            for day in (2, 3, 4)
+        ]
+        txn = RecordingOracleTransaction()
+        yield calendarObject._addInstanceDetailsBatch(component, details, False, txn)
+
+        self.assertEqual(len(txn.statements), 2)
+        sequenceSQL, sequenceArgs = txn.statements[0]
+        self.assertIn("INSTANCE_ID_SEQ.nextval", sequenceSQL)
+        self.assertEqual(sequenceArgs, [3])
+
+        insertSQL, insertArgs = txn.statements[1]
+        self.assertTrue(insertSQL.startswith("insert all into TIME_RANGE ("))
+        self.assertEqual(insertSQL.count("into TIME_RANGE"), 3)
+        columns = insertSQL.split("(", 1)[1].split(")", 1)[0].split(", ")
+        self.assertIn("INSTANCE_ID", columns)
+        index = columns.index("INSTANCE_ID")
+        self.assertEqual(insertArgs[index::len(columns)], [100, 101, 102])
+        yield self.commit()
+
+    @inlineCallbacks
+    def test_incrementalInstanceIndexing(self):
+        """
+        Re-indexing an updated resource incrementally produces the same TIME_RANGE
+        and PERUSER rows as a full rebuild, and keeps the rows for unchanged instances.
+        """
+
+        caldata = """BEGIN:VCALENDAR
+VERSION:2.0
+CALSCALE:GREGORIAN
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:{uid}
+DTSTART:%(now)s0102T140000Z
+DURATION:PT1H
+CREATED:20060102T190000Z
+DTSTAMP:20051222T210507Z
+RRULE:FREQ=DAILY;COUNT=20
+SUMMARY:instance
+END:VEVENT
+{override}BEGIN:X-CALENDARSERVER-PERUSER
+UID:{uid}
+X-CALENDARSERVER-PERUSER-UID:user02
+BEGIN:X-CALENDARSERVER-PERINSTANCE
+TRANSP:TRANSPARENT
+END:X-CALENDARSERVER-PERINSTANCE
+END:X-CALENDARSERVER-PERUSER
+END:VCALENDAR
+"""
+        override = """BEGIN:VEVENT
+UID:{uid}
+RECURRENCE-ID:%(now)s0105T140000Z
+DTSTART:%(now)s0105T160000Z
+DURATION:PT1H
+CREATED:20060102T190000Z
+DTSTAMP:20051222T210507Z
+SUMMARY:moved
+END:VEVENT
+"""
+
+        self.patch(config, "FreeBusyIndexDelayedExpand", False)
+        self.patch(config, "FreeBusyIndexSmartUpdate", False)
+
+        @inlineCallbacks
+        def _indexRows(calendarObject):
+            tr = schema.TIME_RANGE
+            tpy = schema.PERUSER
+            rows = yield Select(
+                [tr.INSTANCE_ID, tr.START_DATE, tr.END_DATE, tr.FBTYPE, tr.TRANSPARENT, tr.FLOATING],
+                From=tr,
+                Where=tr.CALENDAR_OBJECT_RESOURCE_ID == calendarObject._resourceID,
+            ).on(self.transactionUnderTest())
+            peruser = yield Select(
+                [tr.START_DATE, tpy.USER_ID, tpy.TRANSPARENT],
+                From=tr.join(tpy, tr.INSTANCE_ID == tpy.TIME_RANGE_INSTANCE_ID),
+                Where=tr.CALENDAR_OBJECT_RESOURCE_ID == calendarObject._resourceID,
+            ).on(self.transactionUnderTest())
+            returnValue((dict([(row[0], row[1:]) for row in rows]), sorted(peruser),))
+
+        @inlineCallbacks
+        def _update(incremental):
+            self.patch(config, "FreeBusyIndexIncremental", incremental)
+            uid = "incremental-{}".format(incremental)
+            data = caldata.replace("\n", "\r\n") % self.nowYear
+            calendar = yield self.calendarUnderTest()
+            calendarObject = yield calendar.createCalendarObjectWithName(
+                "{}.ics".format(uid), Component.fromString(data.format(uid=uid, override=""))
+            )
+            before, _ignore_peruser = yield _indexRows(calendarObject)
+
+            moved = (override.replace("\n", "\r\n") % self.nowYear).format(uid=uid)
+            yield calendarObject.setComponent(Component.fromString(data.format(uid=uid, override=moved)))
+            after, peruser = yield _indexRows(calendarObject)
+            returnValue((before, after, peruser,))
+
+        fullBefore, fullAfter, fullPeruser = yield _update(False)
+        before, after, peruser = yield _update(True)
+
+        self.assertEqual(len(after), 20)
+        self.assertEqual(sorted(after.values()), sorted(fullAfter.values()))
+        self.assertEqual(peruser, fullPeruser)
+
+        # Only the moved instance was replaced
+        self.assertEqual(len(set(before.keys()) & set(after.keys())), 19)
+        self.assertEqual(len(set(fullBefore.keys()) & set(fullAfter.keys())), 0)
+        yield self.commit()
+
+    @inlineCallbacks
+    def test_componentCache(self):
+        """
+        Parsed calendar data is shared between transactions through the per-process component
+        cache, each transaction gets its own copy, and writing the data invalidates it.
+        """
+
+        caldata = """BEGIN:VCALENDAR
+VERSION:2.0
+CALSCALE:GREGORIAN
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:cached
+DTSTART:%(now)s0102T140000Z
+DURATION:PT1H
+CREATED:20060102T190000Z
+DTSTAMP:20051222T210507Z
+SUMMARY:{summary}
+END:VEVENT
+END:VCALENDAR
+""".replace("\n", "\r\n") % self.nowYear
+
+        cache = LRUCache(1000 * 1000, sizeOf=lambda value: value[1] * sql._COMPONENT_MEMORY_FACTOR)
+        self.patch(config, "ComponentCacheSize", 1)
+        self.patch(sql, "_componentCache", cache)
+
+        calendar = yield self.calendarUnderTest()
+        yield calendar.createCalendarObjectWithName("cached.ics", Component.fromString(caldata.format(summary="original")))
+        yield self.commit()
+
+        calendarObject = yield self.calendarObjectUnderTest(name="cached.ics")
+        component = yield calendarObject.component()
+        self.assertEqual((cache.hits, cache.misses,), (0, 1,))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.memory, calendarObject._size * sql._COMPONENT_MEMORY_FACTOR)
+        component.mainComponent().replaceProperty(Property("SUMMARY", "changed"))
+        yield self.commit()
+
+        calendarObject = yield self.calendarObjectUnderTest(name="cached.ics")
+        component = yield calendarObject.component()
+        self.assertEqual((cache.hits, cache.misses,), (1, 1,))
+        self.assertEqual(component.mainComponent().propertyValue("SUMMARY"), "original")
+        component = component.duplicate()
+        component.mainComponent().replaceProperty(Property("SUMMARY", "updated"))
+        yield calendarObject.setComponent(component)
+        self.assertEqual(len(cache), 0)
+        yield self.commit()
+
+        calendarObject = yield self.calendarObjectUnderTest(name="cached.ics")
+        component = yield calendarObject.component()
+        self.assertEqual((cache.hits, cache.misses,), (1, 2,))
+        self.assertEqual(component.mainComponent().propertyValue("SUMMARY"), "updated")
+        yield self.commit()
+
+    @inlineCallbacks
+    def test_componentCacheDisabled(self):
+        """
+        With no L{config.ComponentCacheSize}, the per-process component cache is not created.
+        """
+
+        self.patch(config, "ComponentCacheSize", 0)
+        self.patch(sql, "_componentCache", None)
+
+        calendarObject = yield self.calendarObjectUnderTest(name="1.ics")
+        component = yield calendarObject.component()
+        self.assertTrue(component is not None)
+        component = component.duplicate()
+        yield calendarObject.setComponent(component)
+        self.assertTrue(sql._componentCache is None)
+        yield self.commit()
+
     @inlineCallbacks
     def test_loadObjectResourcesWithName(self):
         """
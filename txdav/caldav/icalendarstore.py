@@ -684,6 +684,17 @@ class IAttachment(IDataStoreObject):
         @type protocol: L{IProtocol}
         """
 
+    def retrieveFile():  # @NoSelf
+        """
+        Open the content of this attachment for reading, so that it can be
+        written to a connection directly from the file.
+
+        @return: the open file
+        @rtype: C{file}
+
+        @raise IOError: if the content cannot be opened
+        """
+
 
 #
 # Exceptions
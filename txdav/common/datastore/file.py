@@ -376,6 +376,9 @@ class CommonStoreTransaction(DataStoreTransaction):
     def apnSubscriptionsByKey(self, key):
         return NotImplementedError
 
+    def apnSubscriptionsByKeys(self, keys):
+        return NotImplementedError
+
     def apnSubscriptionsBySubscriber(self, guid):
         return NotImplementedError
 
@@ -915,6 +915,53 @@ END:VCALENDAR
         self.assertEqual(len(fbinfo[2]), 0)
         yield self.commitTransaction(1)
 
+    @inlineCallbacks
+    def test_freebusy_mixed(self):
+        """
+        Test that a free busy query over local calendars and an external shared calendar
+        includes the busy time from the shared calendar.
+        """
+
+        yield self.createShare("user01", "puser01")
+
+        calendar1 = yield self.calendarUnderTest(txn=self.theTransactionUnderTest(0), home="user01", name="calendar")
+        yield calendar1.createCalendarObjectWithName("1.ics", Component.fromString(self.caldata1))
+        yield self.commitTransaction(0)
+
+        home = yield self.homeUnderTest(txn=self.theTransactionUnderTest(1), name="puser01")
+        local1 = yield home.calendarWithName("calendar")
+        yield local1.createCalendarObjectWithName("2.ics", Component.fromString(self.caldata2))
+        local2 = yield home.createCalendarWithName("calendar2")
+        yield local2.createCalendarObjectWithName("3.ics", Component.fromString(self.caldata3))
+        yield self.commitTransaction(1)
+
+        fbstart = "{now:04d}0102T000000Z".format(**self.nowYear)
+        fbend = "{now:04d}0103T000000Z".format(**self.nowYear)
+
+        home = yield self.homeUnderTest(txn=self.theTransactionUnderTest(1), name="puser01")
+        local1 = yield home.calendarWithName("calendar")
+        local2 = yield home.calendarWithName("calendar2")
+        shared = yield home.calendarWithName("shared-calendar")
+        self.assertTrue(shared.external())
+
+        fbinfo = FreebusyQuery.FBInfo([], [], [])
+        timerange = Period(DateTime.parseText(fbstart), DateTime.parseText(fbend))
+        organizer = recipient = (yield calendarUserFromCalendarUserAddress("mailto:puser01@example.com", self.theTransactionUnderTest(1)))
+
+        # Go straight to the internal path so the external calendar is matched alongside local ones
+        freebusy = FreebusyQuery(organizer=organizer, recipient=recipient, timerange=timerange)
+        matchtotal = (yield freebusy._internalGenerateFreeBusyInfo([local1, shared, local2, ], fbinfo, 0))
+
+        self.assertEqual(matchtotal, 3)
+        self.assertEqual(sorted(fbinfo[0]), [
+            Period.parseText("{now:04d}0102T140000Z/PT1H".format(**self.nowYear)),
+            Period.parseText("{now:04d}0102T160000Z/PT1H".format(**self.nowYear)),
+            Period.parseText("{now:04d}0102T160000Z/PT1H".format(**self.nowYear)),
+        ])
+        self.assertEqual(len(fbinfo[1]), 0)
+        self.assertEqual(len(fbinfo[2]), 0)
+        yield self.commitTransaction(1)
+
     def attachmentToString(self, attachment):
         """
         Convenience to convert an L{IAttachment} to a string.
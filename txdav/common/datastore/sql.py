@@ -91,6 +91,7 @@ import datetime
 import inspect
 import itertools
 import os
+import re
 import sys
 import time
 from uuid import uuid4
@@ -483,6 +484,151 @@ class TransactionStatsCollector(object):
         return (total_statements, total_rows, total_time,)
 
 
+class SQLStatementStats(object):
+    """
+    Statistics for the SQL statements executed in this process, aggregated by
+    statement so that they are cheap enough to always collect and can be sent to
+    the master along with the request stats. Unlike L{TransactionStatsCollector}
+    no bind values are kept: statements are keyed by the SQL the DAL generates,
+    with runs of placeholders (e.g. an C{IN} list or the rows of a multi-row
+    insert) collapsed so that the same query with a different number of values
+    is counted as one statement.
+
+    @cvar statements: the stats for each statement since the last report
+    @type statements: C{dict} mapping C{str} statement to C{dict} of stats
+    """
+
+    # Latency histogram bins with their upper limits in ms
+    histogram = (
+        ("<1ms", 1.0),
+        ("1ms<->10ms", 10.0),
+        ("10ms<->100ms", 100.0),
+        ("100ms<->1s", 1000.0),
+        (">1s", None),
+    )
+
+    # Statements longer than this are truncated
+    maxStatementLength = 1000
+
+    statements = {}
+    _normalized = {}
+
+    _placeholders = re.compile(r"\(\s*(?:%s|\?|:\d+)(?:\s*,\s*(?:%s|\?|:\d+))*\s*\)")
+    _rows = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+
+    @classmethod
+    def normalize(cls, sql):
+        """
+        Get the statement that SQL is counted as.
+
+        @param sql: the SQL as generated by the DAL
+        @type sql: C{str}
+
+        @rtype: C{str}
+        """
+        key = cls._normalized.get(sql)
+        if key is None:
+            # The DAL generates a bounded set of SQL, but do not let odd callers grow this forever
+            if len(cls._normalized) >= 10000:
+                cls._normalized.clear()
+            key = cls._rows.sub("(...)", cls._placeholders.sub("(...)", " ".join(sql.split())))
+            cls._normalized[sql] = key = key[:cls.maxStatementLength]
+        return key
+
+    @classmethod
+    def record(cls, sql, rows, t):
+        """
+        Count one execution of a statement.
+
+        @param sql: the SQL as generated by the DAL
+        @type sql: C{str}
+        @param rows: number of rows returned
+        @type rows: C{int}
+        @param t: time taken in ms
+        @type t: C{float}
+        """
+        key = cls.normalize(sql)
+        stats = cls.statements.get(key)
+        if stats is None:
+            stats = cls.statements[key] = {
+                "count": 0,
+                "rows": 0,
+                "t": 0.0,
+                "t-max": 0.0,
+                "T": dict([(bin, 0) for bin, _ignore_limit in cls.histogram]),
+            }
+        stats["count"] += 1
+        stats["rows"] += rows
+        stats["t"] += t
+        if t > stats["t-max"]:
+            stats["t-max"] = t
+        for bin, limit in cls.histogram:
+            if limit is None or t < limit:
+                stats["T"][bin] += 1
+                break
+
+    @classmethod
+    def merge(cls, current, statements):
+        """
+        Merge the stats for a set of statements into another.
+
+        @param current: the stats to merge into
+        @type current: C{dict}
+        @param statements: the stats to merge
+        @type statements: C{dict}
+        """
+        for key, stats in statements.items():
+            merged = current.get(key)
+            if merged is None:
+                current[key] = dict(stats)
+                current[key]["T"] = dict(stats["T"])
+            else:
+                merged["count"] += stats["count"]
+                merged["rows"] += stats["rows"]
+                merged["t"] += stats["t"]
+                merged["t-max"] = max(merged["t-max"], stats["t-max"])
+                for bin, value in stats["T"].items():
+                    merged["T"][bin] = merged["T"].get(bin, 0) + value
+
+    @classmethod
+    def top(cls, statements, limit):
+        """
+        Limit a set of statement stats to those that took the most time, with the
+        rest merged into one C{"(other)"} entry.
+
+        @param statements: the stats to limit
+        @type statements: C{dict}
+        @param limit: the number of statements to keep
+        @type limit: C{int}
+
+        @rtype: C{dict}
+        """
+        if len(statements) <= limit:
+            return statements
+        ordered = sorted(statements.items(), key=lambda x: x[1]["t"], reverse=True)
+        results = dict(ordered[:limit])
+        other = {}
+        for _ignore_key, stats in ordered[limit:]:
+            cls.merge(other, {"(other)": stats})
+        cls.merge(results, other)
+        return results
+
+    @classmethod
+    def countsSinceLastReport(cls, limit):
+        """
+        Get the stats of the statements executed since the last call.
+
+        @param limit: the number of statements to report individually
+        @type limit: C{int}
+
+        @return: the stats for each statement
+        @rtype: C{dict} mapping C{str} statement to C{dict} of stats
+        """
+        results = cls.statements
+        cls.statements = {}
+        return cls.top(results, limit)
+
+
 class CommonStoreTransactionMonitor(object):
     """
     Object that monitors the state of a transaction over time and logs or times out
@@ -979,6 +1125,8 @@ class CommonStoreTransaction(
         """
         if self._stats:
             statsContext = self._stats.startStatement(a[0], a[1] if len(a) > 1 else ())
+        sql = a[0]
+        tstamp = time.time()
         self.currentStatement = a[0]
         if self._store.logTransactionWaits and a[0].split(" ", 1)[0].lower() in ("insert", "update", "delete",):
             self.iudCount += 1
@@ -994,6 +1142,8 @@ class CommonStoreTransaction(
             self.currentStatement = None
             if self._stats:
                 self._stats.endStatement(statsContext, results)
+            if config.Stats.SQLStatementStats:
+                SQLStatementStats.record(sql, len(results) if results else 0, (time.time() - tstamp) * 1000.0)
         returnValue(results)
 
     @inlineCallbacks
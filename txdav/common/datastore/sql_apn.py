@@ -109,6 +109,12 @@ class APNSubscriptionsMixin(object):
             resourceKey=key,
         )
 
+    def apnSubscriptionsByKeys(self, keys):
+        return APNSubscriptionsRecord.query(
+            self,
+            APNSubscriptionsRecord.resourceKey.In(keys),
+        )
+
     def apnSubscriptionsBySubscriber(self, guid):
         return APNSubscriptionsRecord.querysimple(
             self,
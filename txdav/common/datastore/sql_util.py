@@ -17,6 +17,7 @@
 
 from twext.enterprise.dal.syntax import Max, Select, Parameter, Delete, Insert, \
     Update, ColumnSyntax, TableSyntax, Upper, utcNowSQL
+from twext.enterprise.ienterprise import ORACLE_DIALECT
 from twext.python.clsprop import classproperty
 from twext.python.log import Logger
 from twisted.internet.defer import succeed, inlineCallbacks, returnValue
@@ -47,6 +48,105 @@ class _EmptyCacher(object):
         return succeed(True)
 
 
+def _placeholders(dbtype):
+    """
+    Generate an endless sequence of SQL parameter placeholders appropriate to
+    the parameter style of the database.
+
+    @param dbtype: the database type of the transaction
+    @type dbtype: L{twext.enterprise.ienterprise.DatabaseType}
+    """
+    if dbtype.paramstyle == "numeric":
+        ctr = 0
+        while True:
+            ctr += 1
+            yield ":%d" % (ctr,)
+    elif dbtype.paramstyle == "qmark":
+        while True:
+            yield "?"
+    else:
+        while True:
+            yield "%s"
+
+
+def nextSequenceValues(txn, sequenceName, count):
+    """
+    Allocate a block of values from a database sequence in a single query.
+    This allows a caller to know the primary keys of rows before inserting
+    them, which L{bulkInsert} requires when dependent rows are to be inserted
+    in the same batch.
+
+    @param txn: the transaction to use
+    @type txn: L{CommonStoreTransaction}
+    @param sequenceName: the name of the sequence
+    @type sequenceName: C{str}
+    @param count: the number of values to allocate
+    @type count: C{int}
+
+    @return: a L{Deferred} that fires with a C{list} of C{int}
+    """
+    placeholder = _placeholders(txn.dbtype).next()
+    if txn.dbtype.dialect == ORACLE_DIALECT:
+        sql = "select {seq}.nextval from dual connect by level <= {p}"
+    else:
+        sql = "select nextval('{seq}') from generate_series(1, {p})"
+    d = txn.execSQL(sql.format(seq=sequenceName, p=placeholder), [count])
+    d.addCallback(lambda rows: [int(row[0]) for row in rows])
+    return d
+
+
+@inlineCallbacks
+def bulkInsert(txn, rows, batchSize=500):
+    """
+    Insert a set of rows into a single table using multi-row INSERT
+    statements, to avoid one database round trip per row. PostgreSQL uses a
+    multi-row VALUES list, Oracle uses INSERT ALL. Neither dialect reliably
+    returns generated keys in row order, so any sequence generated primary key
+    that the caller needs must be allocated up front with
+    L{nextSequenceValues} and included in the rows.
+
+    @param txn: the transaction to use
+    @type txn: L{CommonStoreTransaction}
+    @param rows: the rows to insert - each is a C{dict} mapping
+        L{ColumnSyntax} to a value, and every row must use the same columns of
+        the same table
+    @type rows: C{list} of C{dict}
+    @param batchSize: maximum number of rows per statement
+    @type batchSize: C{int}
+    """
+    if not rows:
+        returnValue(None)
+
+    columns = sorted(rows[0].keys(), key=lambda column: column.model.name)
+    tableName = columns[0].model.table.name
+    columnNames = ", ".join([column.model.name for column in columns])
+    isOracle = txn.dbtype.dialect == ORACLE_DIALECT
+
+    for offset in range(0, len(rows), batchSize):
+        batch = rows[offset:offset + batchSize]
+        placeholders = _placeholders(txn.dbtype)
+        values = []
+        args = []
+        for row in batch:
+            values.append("({})".format(", ".join([placeholders.next() for _ignore in columns])))
+            for column in columns:
+                value = row[column]
+                if isOracle and isinstance(value, bool):
+                    value = int(value)
+                args.append(value)
+
+        if isOracle:
+            into = "into {} ({}) values ".format(tableName, columnNames)
+            sql = "insert all {} select * from dual".format(
+                " ".join([into + rowValues for rowValues in values])
+            )
+        else:
+            sql = "insert into {} ({}) values {}".format(
+                tableName, columnNames, ", ".join(values)
+            )
+        yield txn.execSQL(sql, args)
+
+
 class _SharedSyncLogic(object):
     """
     Logic for maintaining sync-token shared between notification collections and
@@ -20,7 +20,7 @@ Tests for L{txdav.common.datastore.sql}.
 
 from uuid import UUID
 
-from twext.enterprise.dal.syntax import Insert
+from twext.enterprise.dal.syntax import Insert, Parameter
 from twext.enterprise.dal.syntax import Select
 from twisted.internet.defer import Deferred
 from twisted.internet.defer import inlineCallbacks, returnValue, succeed
@@ -29,7 +29,7 @@ from twisted.trial.unittest import TestCase
 # from twistedcaldav.vcard import Component as VCard
 from txdav.common.datastore.sql import (
     log, CommonStoreTransactionMonitor,
-    CommonHome, CommonHomeChild, ECALENDARTYPE
+    CommonHome, CommonHomeChild, ECALENDARTYPE, SQLStatementStats
 )
 from txdav.common.datastore.sql_tables import schema
 from txdav.common.datastore.sql_util import _normalizeColumnUUIDs, \
@@ -81,6 +81,41 @@ class CommonSQLStoreTests(CommonCommonTests, TestCase):
         self.assertEqual(len(version), 1)
         self.assertEqual(len(version[0]), 1)
 
+    @inlineCallbacks
+    def test_statementStats(self):
+        """
+        txn.execSQL aggregates stats for each statement, with queries that only differ
+        in the number of values counted as the same statement.
+        """
+
+        self.patch(SQLStatementStats, "statements", {})
+
+        txn = self.transactionUnderTest()
+        cs = schema.CALENDARSERVER
+        for names in (("VERSION",), ("VERSION", "CALENDAR-DATAVERSION",),):
+            yield Select(
+                [cs.VALUE],
+                From=cs,
+                Where=cs.NAME.In(Parameter("names", len(names))),
+            ).on(txn, names=names)
+
+        statements = SQLStatementStats.countsSinceLastReport(10)
+        self.assertEqual(SQLStatementStats.statements, {})
+        keys = [key for key in statements.keys() if "CALENDARSERVER" in key]
+        self.assertEqual(len(keys), 1)
+        self.assertTrue("(...)" in keys[0])
+        stats = statements[keys[0]]
+        self.assertEqual(stats["count"], 2)
+        self.assertEqual(stats["rows"], 3)
+        self.assertEqual(sum(stats["T"].values()), 2)
+
+        # Statements beyond the limit are combined
+        for i in range(3):
+            SQLStatementStats.record("select %d" % (i,), 1, 10.0 * (i + 1))
+        statements = SQLStatementStats.countsSinceLastReport(2)
+        self.assertEqual(set(statements.keys()), set(("select 2", "select 1", "(other)",)))
+        self.assertEqual(statements["(other)"]["t"], 10.0)
+
     def test_logWaits(self):
         """
         CommonStoreTransactionMonitor logs waiting transactions.
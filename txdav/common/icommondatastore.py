@@ -342,6 +342,16 @@ class ICommonTransaction(ITransaction):
         @return: list of L{Record}
         """
 
+    def apnSubscriptionsByKeys(keys):  # @NoSelf
+        """
+        Retrieve all subscription entries for any of the keys.
+
+        @param keys: The push keys
+        @type keys: C{list} of C{str}
+
+        @return: list of L{Record}
+        """
+
     def apnSubscriptionsBySubscriber(guid):  # @NoSelf
         """
         Retrieve all subscription entries for the subscriber.
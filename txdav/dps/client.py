@@ -14,6 +14,7 @@
 # limitations under the License.
 ##
 
+from collections import OrderedDict
 import cPickle as pickle
 import time
 import uuid
@@ -26,17 +27,20 @@ from twext.who.idirectory import RecordType, IDirectoryService
 import twext.who.idirectory
 from twext.who.util import ConstantsContainer
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed, \
+    Deferred
 from twisted.internet.error import ConnectError
 from twisted.internet.protocol import ClientCreator
 from twisted.protocols import amp
 from twisted.python.constants import Names, NamedConstant
+from twisted.python.failure import Failure
 from txdav.caldav.icalendardirectoryservice import (
     ICalendarStoreDirectoryRecord
 )
 from txdav.common.idirectoryservice import IStoreDirectoryService
 from txdav.dps.commands import (
     RecordWithShortNameCommand, RecordWithUIDCommand, RecordWithGUIDCommand,
+    RecordsWithUIDsCommand, RecordsWithCalendarUserAddressesCommand,
     RecordsWithRecordTypeCommand, RecordsWithEmailAddressCommand,
     RecordsMatchingTokensCommand, RecordsMatchingFieldsCommand,
     MembersCommand, GroupsCommand, SetMembersCommand,
@@ -91,6 +95,26 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
          txdav.who.augment.FieldName)
     )
 
+    # Maximum number of keys sent in one batch lookup command, keeping the
+    # request within the AMP value size limit
+    maxBatchKeys = 500
+
+    # Map of coalesced lookup kind to the names of the single and batch
+    # lookup methods
+    _lookupMethods = {
+        "uid": ("_recordWithUID", "recordsWithUIDs"),
+        "cua": ("_recordWithCalendarUserAddress", "recordsWithCalendarUserAddresses"),
+    }
+
+    def __init__(self, realmName):
+        BaseDirectoryService.__init__(self, realmName)
+
+        # Single record lookups waiting to be sent as one batch at the end of
+        # the current reactor turn. A dictionary whose keys are the lookup
+        # kind and whose values are an ordered map of lookup key to the list
+        # of L{Deferred}s waiting on that key.
+        self._pendingLookups = {}
+
     def _dictToRecord(self, serializedFields):
         """
         Turn a dictionary of fields sent from the server into a directory
@@ -151,6 +175,18 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
                 results.append(record)
         return results
 
+    def _processKeyedRecords(self, result):
+        """
+        Takes a dictionary with a "items" key whose value is an iterable
+        of pickled (key, fields) tuples, and returns a dictionary mapping
+        each key to its record, or C{None}.
+        """
+        records = {}
+        for item in result["items"]:
+            key, serializedFields = pickle.loads(item)
+            records[key.decode("utf-8")] = self._dictToRecord(serializedFields)
+        return records
+
     @inlineCallbacks
     def _getConnection(self):
 
@@ -260,12 +296,104 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
             **kwds
         )
 
+    def _coalescedLookup(self, kind, key):
+        """
+        Queue a single record lookup to be sent along with any other lookups
+        of the same kind made during the current reactor turn.
+
+        @param kind: the kind of lookup, a key of L{_lookupMethods}
+        @type kind: C{str}
+        @param key: the key to look up
+        @type key: C{unicode}
+
+        @return: a L{Deferred} that fires with the record, or C{None}
+        """
+        pending = self._pendingLookups.get(kind)
+        if pending is None:
+            pending = self._pendingLookups[kind] = OrderedDict()
+            reactor.callLater(0, self._sendPendingLookups, kind)
+        d = Deferred()
+        pending.setdefault(key, []).append(d)
+        return d
+
+    @inlineCallbacks
+    def _sendPendingLookups(self, kind):
+        """
+        Send the lookups queued by L{_coalescedLookup} - as a single record
+        command if there is only one key, otherwise as a batch command - and
+        fire the waiting L{Deferred}s.
+        """
+        pending = self._pendingLookups.pop(kind)
+        single, batch = self._lookupMethods[kind]
+        try:
+            if len(pending) == 1:
+                key = pending.keys()[0]
+                record = yield getattr(self, single)(key)
+                records = {key: record}
+            else:
+                records = yield getattr(self, batch)(pending.keys())
+        except Exception:
+            f = Failure()
+            for waiting in pending.values():
+                for d in waiting:
+                    d.errback(f)
+        else:
+            for key, waiting in pending.items():
+                for d in waiting:
+                    d.callback(records.get(key))
+
+    @inlineCallbacks
+    def _callBatched(self, command, keys, keyArgument, **kwds):
+        """
+        Execute a batch lookup command, splitting the keys over as many calls
+        as are needed to keep each request within L{maxBatchKeys}.
+
+        @param command: the AMP command to call
+        @type command: L{twisted.protocols.amp.Command}
+        @param keys: the keys to look up
+        @type keys: iterable of C{unicode}
+        @param keyArgument: the name of the command argument carrying the keys
+        @type keyArgument: C{str}
+
+        @return: map of each key, as passed in, to its record, or C{None}
+        @rtype: C{dict}
+        """
+        # MOVE2WHO: callers may pass either str or unicode keys
+        originalKeys = {}
+        for key in keys:
+            originalKeys.setdefault(
+                key if isinstance(key, unicode) else key.decode("utf-8"), []
+            ).append(key)
+        keys = originalKeys.keys()
+
+        records = {}
+        for offset in xrange(0, len(keys), self.maxBatchKeys):
+            kwds[keyArgument] = [
+                key.encode("utf-8")
+                for key in keys[offset:offset + self.maxBatchKeys]
+            ]
+            results = yield self._call(
+                command,
+                self._processKeyedRecords,
+                **kwds
+            )
+            for key, record in results.iteritems():
+                for originalKey in originalKeys.get(key, ()):
+                    records[originalKey] = record
+        returnValue(records)
+
     def recordWithUID(self, uid, timeoutSeconds=None):
         # MOVE2WHO, REMOVE THIS:
         if not isinstance(uid, unicode):
             # log.warn("Need to change uid to unicode")
             uid = uid.decode("utf-8")
 
+        from twistedcaldav.config import config
+        if timeoutSeconds is None and config.DirectoryProxy.CoalesceLookups:
+            return self._coalescedLookup("uid", uid)
+        return self._recordWithUID(uid, timeoutSeconds=timeoutSeconds)
+
+    def _recordWithUID(self, uid, timeoutSeconds=None):
         kwds = {
             "uid": uid.encode("utf-8"),
         }
@@ -278,6 +406,46 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
             **kwds
         )
 
+    def recordsWithUIDs(self, uids, timeoutSeconds=None):
+        kwds = {}
+        if timeoutSeconds is not None:
+            kwds["timeoutSeconds"] = timeoutSeconds
+
+        return self._callBatched(
+            RecordsWithUIDsCommand,
+            uids,
+            "uids",
+            **kwds
+        )
+
+    def recordWithCalendarUserAddress(self, address, timeoutSeconds=None):
+        if not isinstance(address, unicode):
+            address = address.decode("utf-8")
+
+        from twistedcaldav.config import config
+        if timeoutSeconds is None and config.DirectoryProxy.CoalesceLookups:
+            return self._coalescedLookup("cua", address)
+        return self._recordWithCalendarUserAddress(
+            address, timeoutSeconds=timeoutSeconds
+        )
+
+    def _recordWithCalendarUserAddress(self, address, timeoutSeconds=None):
+        return CalendarDirectoryServiceMixin.recordWithCalendarUserAddress(
+            self, address, timeoutSeconds=timeoutSeconds
+        )
+
+    def recordsWithCalendarUserAddresses(self, addresses, timeoutSeconds=None):
+        kwds = {}
+        if timeoutSeconds is not None:
+            kwds["timeoutSeconds"] = timeoutSeconds
+
+        return self._callBatched(
+            RecordsWithCalendarUserAddressesCommand,
+            addresses,
+            "addresses",
+            **kwds
+        )
+
     def recordWithGUID(self, guid, timeoutSeconds=None):
         kwds = {
             "guid": str(guid),
@@ -38,6 +38,28 @@ class RecordWithUIDCommand(amp.Command):
     ]
 
 
+class RecordsWithUIDsCommand(amp.Command):
+    arguments = [
+        ('uids', amp.ListOf(amp.String())),
+        ('timeoutSeconds', amp.Integer(optional=True)),
+    ]
+    response = [
+        ('items', amp.ListOf(amp.String())),
+        ('continuation', amp.String(optional=True)),
+    ]
+
+
+class RecordsWithCalendarUserAddressesCommand(amp.Command):
+    arguments = [
+        ('addresses', amp.ListOf(amp.String())),
+        ('timeoutSeconds', amp.Integer(optional=True)),
+    ]
+    response = [
+        ('items', amp.ListOf(amp.String())),
+        ('continuation', amp.String(optional=True)),
+    ]
+
+
 class RecordWithGUIDCommand(amp.Command):
     arguments = [
         ('guid', amp.String()),
@@ -38,6 +38,7 @@ from twistedcaldav.stdconfig import DEFAULT_CONFIG, DEFAULT_CONFIG_FILE
 
 from txdav.dps.commands import (
     RecordWithShortNameCommand, RecordWithUIDCommand, RecordWithGUIDCommand,
+    RecordsWithUIDsCommand, RecordsWithCalendarUserAddressesCommand,
     RecordsWithRecordTypeCommand, RecordsWithEmailAddressCommand,
     RecordsMatchingTokensCommand, RecordsMatchingFieldsCommand,
     MembersCommand, ExpandedMembersCommand, GroupsCommand, SetMembersCommand,
@@ -209,6 +210,25 @@ class DirectoryProxyAMPProtocol(amp.AMP):
 
         return response
 
+    def _keyedRecordsToResponse(self, keys, records):
+        """
+        Craft an AMP response for a batch lookup, containing as many
+        (key, record) pairs as will fit within the size limit. Each item is a
+        pickled tuple of the key and the record's fields (empty if there is no
+        record for that key). Remaining items are stored as a "continuation".
+
+        @param keys: the keys that were looked up
+        @type keys: C{list} of C{unicode}
+        @param records: map of key to record (or C{None})
+        @type records: C{dict}
+        @return: the response dictionary
+        """
+        items = [
+            pickle.dumps((key.encode("utf-8"), self.recordToDict(records.get(key)),))
+            for key in keys
+        ]
+        return self._itemsToResponse(items)
+
     def recordToDict(self, record):
         """
         Turn a record in a dictionary of fields which can be reconstituted
@@ -270,6 +290,40 @@ class DirectoryProxyAMPProtocol(amp.AMP):
         # log.debug("Responding with: {response}", response=response)
         returnValue(response)
 
+    @RecordsWithUIDsCommand.responder
+    @inlineCallbacks
+    def recordsWithUIDs(self, uids, timeoutSeconds=None):
+        uids = [uid.decode("utf-8") for uid in uids]
+        log.debug("RecordsWithUIDs: {c} uids", c=len(uids))
+        try:
+            records = (yield self._directory.recordsWithUIDs(
+                uids, timeoutSeconds=timeoutSeconds
+            ))
+        except Exception as e:
+            # Fail the command rather than report every UID as not found
+            log.error("Failed in recordsWithUIDs", error=e)
+            raise
+        response = self._keyedRecordsToResponse(uids, records)
+        # log.debug("Responding with: {response}", response=response)
+        returnValue(response)
+
+    @RecordsWithCalendarUserAddressesCommand.responder
+    @inlineCallbacks
+    def recordsWithCalendarUserAddresses(self, addresses, timeoutSeconds=None):
+        addresses = [address.decode("utf-8") for address in addresses]
+        log.debug("RecordsWithCalendarUserAddresses: {c} addresses", c=len(addresses))
+        try:
+            records = (yield self._directory.recordsWithCalendarUserAddresses(
+                addresses, timeoutSeconds=timeoutSeconds
+            ))
+        except Exception as e:
+            # Fail the command rather than report every address as not found
+            log.error("Failed in recordsWithCalendarUserAddresses", error=e)
+            raise
+        response = self._keyedRecordsToResponse(addresses, records)
+        # log.debug("Responding with: {response}", response=response)
+        returnValue(response)
+
     @RecordWithGUIDCommand.responder
     @inlineCallbacks
     def recordWithGUID(self, guid, timeoutSeconds=None):
@@ -22,7 +22,7 @@ from twext.who.expression import (
 )
 from twext.who.idirectory import RecordType, FieldName
 from twisted.cred.credentials import calcResponse, calcHA1, calcHA2
-from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.defer import inlineCallbacks, succeed, gatherResults
 from twisted.protocols.amp import AMP
 from twisted.python.filepath import FilePath
 from twisted.test.testutils import returnConnected
@@ -30,6 +30,7 @@ from twisted.trial import unittest
 from twistedcaldav.config import config
 from twistedcaldav.test.util import StoreTestCase
 from txdav.dps.client import DirectoryService
+from txdav.dps.commands import RecordWithUIDCommand, RecordsWithUIDsCommand
 from txdav.dps.server import DirectoryProxyAMPProtocol
 from txdav.who.directory import CalendarDirectoryServiceMixin
 from txdav.who.groups import GroupCacher
@@ -114,6 +115,46 @@ class DPSClientSingleDirectoryTest(unittest.TestCase):
         record = (yield self.directory.recordWithUID(testUID))
         self.assertTrue(testShortName in record.shortNames)
 
+    @inlineCallbacks
+    def test_recordsWithUIDs(self):
+        records = (yield self.directory.recordsWithUIDs(
+            [testUID, u"__unknown__"]
+        ))
+        self.assertEquals(set(records.keys()), set([testUID, u"__unknown__"]))
+        self.assertTrue(testShortName in records[testUID].shortNames)
+        self.assertTrue(records[u"__unknown__"] is None)
+
+    @inlineCallbacks
+    def test_coalescedLookups(self):
+        """
+        Single record lookups made in the same reactor turn are sent as one
+        batch command.
+        """
+        commands = []
+        origCall = self.directory._sendCommand
+
+        def newCall(command, **kwds):
+            commands.append(command)
+            return origCall(command, **kwds)
+
+        self.patch(self.directory, "_sendCommand", newCall)
+
+        records = yield gatherResults([
+            self.directory.recordWithUID(testUID),
+            self.directory.recordWithUID(u"__unknown__"),
+            self.directory.recordWithUID(testUID),
+        ])
+        self.assertEquals(commands, [RecordsWithUIDsCommand])
+        self.assertEquals(records[0].uid, testUID)
+        self.assertTrue(records[1] is None)
+        self.assertEquals(records[2].uid, testUID)
+
+        # A lone lookup uses the single record command
+        del commands[:]
+        record = yield self.directory.recordWithUID(testUID)
+        self.assertEquals(commands, [RecordWithUIDCommand])
+        self.assertEquals(record.uid, testUID)
+
     @inlineCallbacks
     def test_shortName(self):
         record = (yield self.directory.recordWithShortName(
@@ -469,6 +510,21 @@ class DPSClientAugmentedAggregateDirectoryTest(StoreTestCase):
         self.assertEquals(len(records), 1)
         self.assertEquals(records[0].shortNames, [u"wsanchez"])
 
+    @inlineCallbacks
+    def test_recordsWithCalendarUserAddresses(self):
+        addresses = [
+            u"mailto:wsanchez@example.com",
+            u"urn:x-uid:{}".format(self.wsanchezUID),
+            "mailto:unknown@example.com",
+        ]
+        records = (yield self.client.recordsWithCalendarUserAddresses(
+            addresses
+        ))
+        self.assertEquals(set(records.keys()), set(addresses))
+        self.assertEquals(records[addresses[0]].shortNames, [u"wsanchez"])
+        self.assertEquals(records[addresses[1]].uid, self.wsanchezUID)
+        self.assertTrue(records[addresses[2]] is None)
+
     @inlineCallbacks
     def test_recordsMatchingTokens(self):
         records = (yield self.client.recordsMatchingTokens(
@@ -863,3 +919,11 @@ class DPSClientLargeResultsTest(unittest.TestCase):
         # expandedMemberUIDs
         memberUIDs = yield group.expandedMemberUIDs()
         self.assertEquals(len(memberUIDs), self.numUsers)
+
+        # recordsWithUIDs, split over several commands
+        self.patch(self.directory, "maxBatchKeys", 300)
+        uids = [u"foo{ctr:05d}".format(ctr=i) for i in xrange(self.numUsers)]
+        records = yield self.directory.recordsWithUIDs(uids)
+        self.assertEquals(len(records), self.numUsers)
+        for uid in uids:
+            self.assertEquals(records[uid].uid, uid)
@@ -23,16 +23,16 @@ __all__ = [
     "CachingDirectoryService",
 ]
 
-import base64
 import time
 import uuid
 
 from zope.interface import implementer
 
-from twistedcaldav.memcacheclient import ClientFactory, MemcacheError
 from twistedcaldav.config import config
+from twistedcaldav.memcacher import Memcacher
+from twistedcaldav.util import LRUCache
 
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed
 from twext.python.log import Logger
 from twext.who.directory import DirectoryService as BaseDirectoryService
 from twext.who.idirectory import (
@@ -74,37 +74,20 @@ class DirectoryMemcacher(object):
     Provide a cache of directory records in memcached so that worker processes
     and the DPS processes across multiple app servers can share a cache and thus
     reduce load on the directory server.
+
+    All memcache operations use the asynchronous memcache client pool. Failures
+    are logged and treated as cache misses, so they never fail a directory
+    lookup.
     """
 
-    KEY_VERSION = 1
+    KEY_VERSION = 2
 
     def __init__(self, cacheTimeout, recordService, realmName, keyModifier):
         self._cacheTimeout = cacheTimeout
         self._recordService = recordService
         self._realmName = realmName
         self._keyVersion = "%d%s" % (DirectoryMemcacher.KEY_VERSION, keyModifier,)
-
-    def _getMemcacheClient(self, refresh=False):
-        """
-        Get the memcache client instance to use for caching.
-
-        @param refresh: whether or not to create a new memcache client
-        @type refresh: L{bool}
-
-        @return: the client to use
-        @rtype: L{memcacheclient.Client}
-        """
-        if refresh or not hasattr(self, "memcacheClient"):
-
-            if config.Memcached.Pools.Default.MemcacheSocket:
-                client_addr = "unix:{}".format(config.Memcached.Pools.Default.MemcacheSocket)
-            else:
-                client_addr = "{}:{}".format(
-                    config.Memcached.Pools.Default.BindAddress,
-                    config.Memcached.Pools.Default.Port,
-                )
-            self.memcacheClient = ClientFactory.getClient([client_addr], debug=0, pickleProtocol=2)
-        return self.memcacheClient
+        self._memcacher = Memcacher("DirectoryRecords", pickle=True)
 
     def pickleRecord(self, record):
         fields = {}
@@ -157,6 +140,19 @@ class DirectoryMemcacher(object):
 
             return record_class(self._recordService, fields)
 
+    def memcacheSetRecords(self, records):
+        """
+        Store a number of records in memcache with a single request.
+
+        @param records: map of memcache key to record
+        @type records: L{dict}
+
+        @return: a L{Deferred} that fires with L{None} once the request completes
+        """
+        return self.memcacheSetMulti(dict([
+            (key, self.pickleRecord(record)) for key, record in records.iteritems()
+        ]))
+
     def memcacheSetRecord(self, key, record):
         """
         Store a record in memcache.
@@ -166,10 +162,9 @@ class DirectoryMemcacher(object):
         @param record: record to store
         @type record: L{DirectoryRecord}
 
-        @raise: L{DirectoryMemcacheError} if failure to store in memcache
+        @return: a L{Deferred} that fires with L{None} once the request completes
         """
-
-        self.memcacheSet(key, self.pickleRecord(record))
+        return self.memcacheSetRecords({key: record})
 
     def memcacheSet(self, key, value):
         """
@@ -178,21 +173,32 @@ class DirectoryMemcacher(object):
         @param key: memcache key to use
         @type key: L{str}
         @param value: value to store
-        @type value: L{str}
+        @type value: any picklable value
+
+        @return: a L{Deferred} that fires with L{None} once the request completes
+        """
+        return self.memcacheSetMulti({key: value})
 
-        @raise: L{DirectoryMemcacheError} if failure to store in memcache
+    def memcacheSetMulti(self, values):
         """
+        Store a number of values in memcache with a single request.
 
-        key = base64.b64encode(key)
-        if not self._getMemcacheClient().set(key, value, time=self._cacheTimeout):
-            log.error("Could not write to memcache, retrying")
-            if not self._getMemcacheClient(refresh=True).set(
-                key, value,
-                time=self._cacheTimeout
-            ):
-                log.error("Could not write to memcache again, giving up")
-                del self.memcacheClient
-                raise DirectoryMemcacheError("Failed to write to memcache")
+        @param values: map of memcache key to value
+        @type values: L{dict}
+
+        @return: a L{Deferred} that fires with L{None} once the request completes
+        """
+        def _stored(results):
+            failed = [key for key, result in results.iteritems() if not result]
+            if failed:
+                log.error("Memcache: failed to store {keys}", keys=failed)
+
+        def _failed(f):
+            log.error("Memcache: failed to store {keys}: {f}", keys=values.keys(), f=f)
+
+        d = self._memcacher.set_multi(values, expireTime=self._cacheTimeout)
+        d.addCallbacks(_stored, _failed)
+        return d
 
     def memcacheGetRecord(self, key):
         """
@@ -201,40 +207,45 @@ class DirectoryMemcacher(object):
         @param key: the memcache key to use
         @type key: L{str}
 
-        @return: any directory record found or L{None}
-        @rtype: L{DirectoryRecord} or L{None}
-
-        @raise: L{DirectoryMemcacheError} if failure to read from memcache
+        @return: a L{Deferred} that fires with any directory record found or
+            L{None}
         """
+        def _gotit(pickled):
+            try:
+                return self.unpickleRecord(pickled) if pickled is not None else None
+            except DirectoryMemcacheError:
+                return None
 
-        pickled = self.memcacheGet(key)
-        return self.unpickleRecord(pickled) if pickled is not None else None
+        return self.memcacheGet(key).addCallback(_gotit)
 
     def memcacheGet(self, key):
         """
-        Try to get a record from memcache.
+        Try to get a value from memcache.
 
         @param key: the memcache key to use
         @type key: L{str}
 
-        @return: any value found or L{None}
-        @rtype: L{str} or L{None}
+        @return: a L{Deferred} that fires with any value found or L{None}
+        """
+        return self.memcacheGetMulti([key]).addCallback(lambda values: values.get(key))
 
-        @raise: L{DirectoryMemcacheError} if failure to read from memcache
+    def memcacheGetMulti(self, keys):
         """
+        Try to get a number of values from memcache with a single request.
 
-        key = base64.b64encode(key)
-        try:
-            value = self._getMemcacheClient().get(key)
-        except MemcacheError:
-            log.error("Could not read from memcache, retrying")
-            try:
-                value = self._getMemcacheClient(refresh=True).get(key)
-            except MemcacheError:
-                log.error("Could not read from memcache again, giving up")
-                del self.memcacheClient
-                raise DirectoryMemcacheError("Failed to read from memcache")
-        return value
+        @param keys: the memcache keys to use
+        @type keys: L{list} of L{str}
+
+        @return: a L{Deferred} that fires with a L{dict} mapping each key to
+            the value found or L{None}
+        """
+        def _failed(f):
+            log.error("Memcache: failed to get {keys}: {f}", keys=keys, f=f)
+            return {}
+
+        d = self._memcacher.get_multi(keys)
+        d.addErrback(_failed)
+        return d
 
     def generateMemcacheKey(self, indexType, indexKey):
         """
@@ -271,7 +282,7 @@ class DirectoryMemcacher(object):
         Flush all records from memcache. Note this is only for testing and must not be
         called in a production setup because it flushes everything from memcache
         """
-        self._getMemcacheClient().flush_all()
+        return self._memcacher.flushAll()
 
 
 @implementer(IDirectoryService, IStoreDirectoryService)
@@ -282,7 +293,9 @@ class CachingDirectoryService(
     Caching directory service.
 
     This is a directory service that wraps an L{IDirectoryService} and caches
-    directory records.
+    directory records. Records are cached in process in a bounded LRU cache for
+    each index, with each entry expiring after a fixed time, and in memcache
+    (when enabled) so that they can be shared with other processes.
     """
 
     fieldName = ConstantsContainer((
@@ -290,7 +303,7 @@ class CachingDirectoryService(
         FieldName,
     ))
 
-    def __init__(self, directory, expireSeconds=30, lookupsBetweenPurges=0, negativeCaching=True):
+    def __init__(self, directory, expireSeconds=30, lookupsBetweenPurges=0, negativeCaching=True, maxRecords=None):
         BaseDirectoryService.__init__(self, directory.realmName)
         self._directory = directory
 
@@ -310,6 +323,7 @@ class CachingDirectoryService(
         directory.recordsWithEmailAddress = self.recordsWithEmailAddress
 
         self._expireSeconds = expireSeconds
+        self._maxRecords = maxRecords if maxRecords is not None else config.DirectoryCaching.MaxRecords
 
         if lookupsBetweenPurges == 0:
             self._purgingEnabled = False
@@ -340,20 +354,23 @@ class CachingDirectoryService(
         """
 
         log.debug("Resetting cache")
-        self._cache = {
-            IndexType.uid: {},
-            IndexType.guid: {},
-            IndexType.shortName: {},  # key is (recordType.name, shortName)
-            IndexType.emailAddress: {},
-        }
-        self._negativeCache = {
-            IndexType.uid: {},
-            IndexType.guid: {},
-            IndexType.shortName: {},  # key is (recordType.name, shortName)
-            IndexType.emailAddress: {},
-        }
+        self._cache = dict([
+            # shortName key is (recordType.name, shortName)
+            (indexType, LRUCache(self._maxRecords, name="directory-{}".format(indexType.value)))
+            for indexType in IndexType.iterconstants()
+        ])
+        self._negativeCache = dict([
+            (indexType, LRUCache(self._maxRecords))
+            for indexType in IndexType.iterconstants()
+        ])
         self._hitCount = 0
         self._requestCount = 0
+        self._memcacheHitCount = 0
+        self._negativeHitCount = 0
+        self._missCount = 0
+        self._memcacheTime = 0.0
+        self._queryCount = 0
+        self._queryTime = 0.0
         if self._purgingEnabled:
             self._lookupsUntilScan = self._lookupsBetweenPurges
 
@@ -371,6 +388,30 @@ class CachingDirectoryService(
         else:
             self._memcacher = None
 
+    def cacheStats(self):
+        """
+        Get the lookup statistics of this cache.
+
+        @return: the number of lookups, the number answered from the in-process
+            cache, memcache and the negative caches, the number that needed a
+            directory query, the total time spent waiting on memcache and the
+            directory, and the size of each in-process index
+        @rtype: L{dict}
+        """
+        stats = {
+            "requests": self._requestCount,
+            "hits": self._hitCount,
+            "memcache-hits": self._memcacheHitCount,
+            "negative-hits": self._negativeHitCount,
+            "misses": self._missCount,
+            "memcache-time": self._memcacheTime,
+            "queries": self._queryCount,
+            "query-time": self._queryTime,
+        }
+        for indexType, cache in self._cache.items():
+            stats["size-{}".format(indexType.value)] = len(cache)
+        return stats
+
     def setTestTime(self, timestamp):
         """
         Only used for unit tests to override the notion of "now"
@@ -380,27 +421,33 @@ class CachingDirectoryService(
         """
         self._test_time = timestamp
 
+    def _now(self):
+        if hasattr(self, "_test_time"):
+            return self._test_time
+        else:
+            return time.time()
+
     def cacheRecord(self, record, indexTypes, addToMemcache=True):
         """
         Store a record in the cache, within the specified indexes
 
         @param record: the directory record
         @param indexTypes: an iterable of L{IndexType}
+
+        @return: a L{Deferred} that fires once the record has been sent to
+            memcache, which callers need not wait for
         """
 
-        if hasattr(self, "_test_time"):
-            timestamp = self._test_time
-        else:
-            timestamp = time.time()
+        timestamp = self._now()
 
         cached = []
         if IndexType.uid in indexTypes:
-            self._cache[IndexType.uid][record.uid] = (timestamp, record)
+            self._cache[IndexType.uid].set(record.uid, (timestamp, record))
             cached.append((IndexType.uid, record.uid,))
 
         if IndexType.guid in indexTypes:
             try:
-                self._cache[IndexType.guid][record.guid] = (timestamp, record)
+                self._cache[IndexType.guid].set(record.guid, (timestamp, record))
                 cached.append((IndexType.guid, record.guid,))
             except AttributeError:
                 pass
@@ -408,27 +455,24 @@ class CachingDirectoryService(
             try:
                 typeName = record.recordType.name
                 for name in record.shortNames:
-                    self._cache[IndexType.shortName][(typeName, name)] = (timestamp, record)
+                    self._cache[IndexType.shortName].set((typeName, name), (timestamp, record))
                     cached.append((IndexType.shortName, (typeName, name),))
             except AttributeError:
                 pass
         if IndexType.emailAddress in indexTypes:
             try:
                 for emailAddress in record.emailAddresses:
-                    self._cache[IndexType.emailAddress][emailAddress] = (timestamp, record)
+                    self._cache[IndexType.emailAddress].set(emailAddress, (timestamp, record))
                     cached.append((IndexType.emailAddress, emailAddress,))
             except AttributeError:
                 pass
 
         if addToMemcache and self._memcacher is not None:
-            for indexType, key in cached:
-                memcachekey = self._memcacher.generateMemcacheKey(indexType, key)
-                log.debug("Memcache: storing %s" % (memcachekey,))
-                try:
-                    self._memcacher.memcacheSetRecord(memcachekey, record)
-                except DirectoryMemcacheError:
-                    log.error("Memcache: failed to store %s" % (memcachekey,))
-                    pass
+            memcachekeys = [self._memcacher.generateMemcacheKey(indexType, key) for indexType, key in cached]
+            log.debug("Memcache: storing {keys}", keys=memcachekeys)
+            return self._memcacher.memcacheSetRecords(dict([(memcachekey, record) for memcachekey in memcachekeys]))
+        else:
+            return succeed(None)
 
     def negativeCacheRecord(self, indexType, key):
         """
@@ -436,27 +480,12 @@ class CachingDirectoryService(
 
         @param record: the directory record
         @param indexType: an L{IndexType}
-        """
-
-        if hasattr(self, "_test_time"):
-            timestamp = self._test_time
-        else:
-            timestamp = time.time()
 
-        self._negativeCache[indexType][key] = timestamp
-
-        # Do memcache
-        if self._memcacher is not None:
+        @return: a L{Deferred} that fires once the entry has been sent to
+            memcache, which callers need not wait for
+        """
 
-            # The only time the recordType arg matters is when indexType is
-            # short-name, and in that case recordTypes will contain exactly
-            # one recordType, so using recordTypes[0] here is always safe:
-            memcachekey = self._memcacher.generateMemcacheKey(indexType, key)
-            try:
-                self._memcacher.memcacheSet("-%s" % (memcachekey,), timestamp)
-            except DirectoryMemcacheError:
-                log.error("Memcache: failed to store -%s" % (memcachekey,))
-                pass
+        self._negativeCache[indexType].set(key, self._now())
 
         log.debug(
             "Directory negative cache: {index} {key}",
@@ -464,6 +493,13 @@ class CachingDirectoryService(
             key=key
         )
 
+        # Do memcache
+        if self._memcacher is not None:
+            memcachekey = self._memcacher.generateMemcacheKey(indexType, key)
+            return self._memcacher.memcacheSet("-%s" % (memcachekey,), 1)
+        else:
+            return succeed(None)
+
     def purgeRecord(self, record):
         """
         Remove a record from all indices in the cache
@@ -471,28 +507,23 @@ class CachingDirectoryService(
         @param record: the directory record
         """
 
-        if record.uid in self._cache[IndexType.uid]:
-            del self._cache[IndexType.uid][record.uid]
+        self._cache[IndexType.uid].pop(record.uid)
 
         try:
-            if record.guid in self._cache[IndexType.guid]:
-                del self._cache[IndexType.guid][record.guid]
+            self._cache[IndexType.guid].pop(record.guid)
         except AttributeError:
             pass
 
         try:
             typeName = record.recordType.name
             for name in record.shortNames:
-                key = (typeName, name)
-                if key in self._cache[IndexType.shortName]:
-                    del self._cache[IndexType.shortName][key]
+                self._cache[IndexType.shortName].pop((typeName, name))
         except AttributeError:
             pass
 
         try:
             for emailAddress in record.emailAddresses:
-                if emailAddress in self._cache[IndexType.emailAddress]:
-                    del self._cache[IndexType.emailAddress][emailAddress]
+                self._cache[IndexType.emailAddress].pop(emailAddress)
         except AttributeError:
             pass
 
@@ -500,49 +531,25 @@ class CachingDirectoryService(
         """
         Scans the cache for expired records and deletes them
         """
-        if hasattr(self, "_test_time"):
-            now = self._test_time
-        else:
-            now = time.time()
+        now = self._now()
 
         for indexType in self._cache:
             for key, (cachedTime, _ignore_record) in self._cache[indexType].items():
                 if now - self._expireSeconds > cachedTime:
-                    del self._cache[indexType][key]
+                    self._cache[indexType].pop(key)
 
-    def lookupRecord(self, indexType, key, name):
+    def _lookupInProcess(self, indexType, key, name, now):
         """
-        Looks for a record in the specified index, under the specified key.
-        After every config.DirectoryCaching.LookupsBetweenPurges lookups are done,
-        purgeExpiredRecords() is called.
-
-        @param index: an index type
-        @type indexType: L{IndexType}
-
-        @param key: the key to look up in the specified index
-        @type key: any valid type that can be used as a dictionary key
+        Look for a record in the in-process caches.
 
         @return: tuple of (the cached L{DirectoryRecord}, or L{None}) and a L{bool}
-            indicating whether a query will be required (not required if a negative cache hit)
-        @rtype: L{tuple}
+            indicating whether a query will be required, or L{None} if the other
+            caches need to be checked
+        @rtype: L{tuple} or L{None}
         """
-
-        if self._purgingEnabled:
-            if self._lookupsUntilScan == 0:
-                self._lookupsUntilScan = self._lookupsBetweenPurges
-                self.purgeExpiredRecords()
-            else:
-                self._lookupsUntilScan -= 1
-
-        if hasattr(self, "_test_time"):
-            now = self._test_time
-        else:
-            now = time.time()
-
-        self._requestCount += 1
-        if key in self._cache[indexType]:
-
-            cachedTime, record = self._cache[indexType].get(key, (0.0, None))
+        cached = self._cache[indexType].get(key)
+        if cached is not None:
+            cachedTime, record = cached
             if now - self._expireSeconds > cachedTime:
                 log.debug(
                     "Directory cache miss (expired): {index} {key}",
@@ -568,64 +575,140 @@ class CachingDirectoryService(
 
         # Check negative cache (take cache entry timeout into account)
         if self.negativeCaching:
-            try:
-                disabledTime = self._negativeCache[indexType][key]
+            disabledTime = self._negativeCache[indexType].get(key)
+            if disabledTime is not None:
                 if now - disabledTime < self._expireSeconds:
                     log.debug(
                         "Directory negative cache hit: {index} {key}",
                         index=indexType.value,
                         key=key
                     )
+                    self._negativeHitCount += 1
                     self._addTiming("{}-neg-hit".format(name), 0)
                     return (None, False,)
                 else:
-                    del self._negativeCache[indexType][key]
-            except KeyError:
-                pass
+                    self._negativeCache[indexType].pop(key)
 
-        # Check memcache
-        if self._memcacher is not None:
+        return None
 
-            # The only time the recordType arg matters is when indexType is
-            # short-name, and in that case recordTypes will contain exactly
-            # one recordType, so using recordTypes[0] here is always safe:
-            memcachekey = self._memcacher.generateMemcacheKey(indexType, key)
+    def lookupRecord(self, indexType, key, name):
+        """
+        Looks for a record in the specified index, under the specified key.
+        After every config.DirectoryCaching.LookupsBetweenPurges lookups are done,
+        purgeExpiredRecords() is called.
 
-            log.debug("Memcache: checking %s" % (memcachekey,))
+        @param index: an index type
+        @type indexType: L{IndexType}
 
-            try:
-                record = self._memcacher.memcacheGetRecord(memcachekey)
-            except DirectoryMemcacheError:
-                log.error("Memcache: failed to get %s" % (memcachekey,))
-                record = None
+        @param key: the key to look up in the specified index
+        @type key: any valid type that can be used as a dictionary key
+
+        @return: a L{Deferred} that fires with a tuple of (the cached
+            L{DirectoryRecord}, or L{None}) and a L{bool} indicating whether a
+            query will be required (not required if a negative cache hit)
+        """
+        return self.lookupRecords(indexType, [key], name).addCallback(lambda results: results[key])
 
-            if record is None:
-                log.debug("Memcache: miss %s" % (memcachekey,))
+    @inlineCallbacks
+    def lookupRecords(self, indexType, keys, name):
+        """
+        Looks for a number of records in the specified index, checking the
+        in-process cache first and then memcache, with a single memcache request
+        for all the keys not cached in process.
+
+        @param index: an index type
+        @type indexType: L{IndexType}
+        @param keys: the keys to look up in the specified index
+        @type keys: L{list}
+        @param name: the lookup method name used for timing
+        @type name: L{str}
+
+        @return: a L{Deferred} that fires with a L{dict} mapping each key to a
+            tuple as returned by L{lookupRecord}
+        """
+
+        if self._purgingEnabled:
+            self._lookupsUntilScan -= len(keys)
+            if self._lookupsUntilScan < 0:
+                self._lookupsUntilScan = self._lookupsBetweenPurges
+                self.purgeExpiredRecords()
+
+        now = self._now()
+
+        results = {}
+        memcachekeys = {}
+        for key in keys:
+            self._requestCount += 1
+            result = self._lookupInProcess(indexType, key, name, now)
+            if result is not None:
+                results[key] = result
+            elif self._memcacher is not None:
+                memcachekeys[self._memcacher.generateMemcacheKey(indexType, key)] = key
             else:
-                log.debug("Memcache: hit %s" % (memcachekey,))
-                self.cacheRecord(record, (IndexType.uid, IndexType.guid, IndexType.shortName,), addToMemcache=False)
-                return (record, False,)
+                results[key] = None
 
-            # Check negative memcache
+        # Check memcache, including the negative entries, in one request
+        if memcachekeys:
+            fetchKeys = memcachekeys.keys()
             if self.negativeCaching:
-                try:
-                    val = self._memcacher.memcacheGet("-%s" % (memcachekey,))
-                except DirectoryMemcacheError:
-                    log.error("Memcache: failed to get -%s" % (memcachekey,))
-                    val = None
-                if val == 1:
-                    log.debug("Memcache: negative hit %s" % (memcachekey,))
-                    self._negativeCache[indexType][key] = now
-                    return (None, False,)
+                fetchKeys += ["-%s" % (memcachekey,) for memcachekey in memcachekeys]
+            log.debug("Memcache: checking {keys}", keys=fetchKeys)
+
+            startTime = time.time()
+            values = yield self._memcacher.memcacheGetMulti(fetchKeys)
+            duration = time.time() - startTime
+            self._memcacheTime += duration
+            self._addTiming("{}-memcache".format(name), duration)
+
+            for memcachekey, key in memcachekeys.items():
+                record = values.get(memcachekey)
+                if record is not None:
+                    try:
+                        record = self._memcacher.unpickleRecord(record)
+                    except DirectoryMemcacheError:
+                        record = None
+                if record is not None:
+                    log.debug("Memcache: hit {key}", key=memcachekey)
+                    self._memcacheHitCount += 1
+                    self.cacheRecord(record, (IndexType.uid, IndexType.guid, IndexType.shortName,), addToMemcache=False)
+                    results[key] = (record, False,)
+                elif self.negativeCaching and values.get("-%s" % (memcachekey,)) == 1:
+                    log.debug("Memcache: negative hit {key}", key=memcachekey)
+                    self._negativeHitCount += 1
+                    self._negativeCache[indexType].set(key, now)
+                    results[key] = (None, False,)
+                else:
+                    log.debug("Memcache: miss {key}", key=memcachekey)
+                    results[key] = None
 
-        log.debug(
-            "Directory cache miss: {index} {key}",
-            index=indexType.value,
-            key=key
-        )
+        for key, result in results.items():
+            if result is None:
+                log.debug(
+                    "Directory cache miss: {index} {key}",
+                    index=indexType.value,
+                    key=key
+                )
+                self._missCount += 1
+                self._addTiming("{}-miss".format(name), 0)
+                results[key] = (None, True,)
 
-        self._addTiming("{}-miss".format(name), 0)
-        return (None, True,)
+        returnValue(results)
+
+    @inlineCallbacks
+    def _query(self, name, lookup, *args, **kwds):
+        """
+        Run a lookup on the wrapped directory service, keeping track of how
+        long it takes.
+        """
+        startTime = time.time()
+        try:
+            result = yield lookup(*args, **kwds)
+        finally:
+            duration = time.time() - startTime
+            self._queryCount += 1
+            self._queryTime += duration
+            self._addTiming("{}-query".format(name), duration)
+        returnValue(result)
 
     # Cached methods:
 
@@ -633,9 +716,11 @@ class CachingDirectoryService(
     def recordWithUID(self, uid, timeoutSeconds=None):
 
         # First check our cache
-        record, doQuery = self.lookupRecord(IndexType.uid, uid, "recordWithUID")
+        record, doQuery = yield self.lookupRecord(IndexType.uid, uid, "recordWithUID")
         if record is None and doQuery:
-            record = yield self._directory._wrapped_recordWithUID(
+            record = yield self._query(
+                "recordWithUID",
+                self._directory._wrapped_recordWithUID,
                 uid, timeoutSeconds=timeoutSeconds
             )
             if record is not None:
@@ -649,13 +734,47 @@ class CachingDirectoryService(
 
         returnValue(record)
 
+    @inlineCallbacks
+    def recordsWithUIDs(self, uids, timeoutSeconds=None):
+
+        # First check our caches, then look up all the misses in one go
+        cached = yield self.lookupRecords(IndexType.uid, list(set(uids)), "recordWithUID")
+        records = {}
+        missing = []
+        for uid, (record, doQuery) in cached.items():
+            if record is None and doQuery:
+                missing.append(uid)
+            else:
+                records[uid] = record
+
+        if missing:
+            found = yield self._query(
+                "recordsWithUIDs",
+                self._directory.recordsWithUIDs,
+                missing, timeoutSeconds=timeoutSeconds
+            )
+            for uid in missing:
+                record = found.get(uid)
+                if record is not None:
+                    self.cacheRecord(
+                        record,
+                        (IndexType.uid, IndexType.guid, IndexType.shortName)
+                    )
+                else:
+                    self.negativeCacheRecord(IndexType.uid, uid)
+                records[uid] = record
+
+        returnValue(records)
+
     @inlineCallbacks
     def recordWithGUID(self, guid, timeoutSeconds=None):
 
         # First check our cache
-        record, doQuery = self.lookupRecord(IndexType.guid, guid, "recordWithGUID")
+        record, doQuery = yield self.lookupRecord(IndexType.guid, guid, "recordWithGUID")
         if record is None and doQuery:
-            record = yield self._directory._wrapped_recordWithGUID(
+            record = yield self._query(
+                "recordWithGUID",
+                self._directory._wrapped_recordWithGUID,
                 guid, timeoutSeconds=timeoutSeconds
             )
             if record is not None:
@@ -673,13 +792,15 @@ class CachingDirectoryService(
     def recordWithShortName(self, recordType, shortName, timeoutSeconds=None):
 
         # First check our cache
-        record, doQuery = self.lookupRecord(
+        record, doQuery = yield self.lookupRecord(
             IndexType.shortName,
             (recordType.name, shortName),
             "recordWithShortName"
         )
         if record is None and doQuery:
-            record = yield self._directory._wrapped_recordWithShortName(
+            record = yield self._query(
+                "recordWithShortName",
+                self._directory._wrapped_recordWithShortName,
                 recordType, shortName, timeoutSeconds=timeoutSeconds
             )
             if record is not None:
@@ -699,13 +820,15 @@ class CachingDirectoryService(
     ):
 
         # First check our cache
-        record, doQuery = self.lookupRecord(
+        record, doQuery = yield self.lookupRecord(
             IndexType.emailAddress,
             emailAddress,
             "recordsWithEmailAddress"
         )
         if record is None and doQuery:
-            records = yield self._directory._wrapped_recordsWithEmailAddress(
+            records = yield self._query(
+                "recordsWithEmailAddress",
+                self._directory._wrapped_recordsWithEmailAddress,
                 emailAddress,
                 limitResults=limitResults, timeoutSeconds=timeoutSeconds
             )
@@ -812,7 +935,7 @@ class CachingDirectoryService(
     @inlineCallbacks
     def flush(self):
         if self._memcacher is not None:
-            self._memcacher.flush()
+            yield self._memcacher.flush()
         self.resetCache()
         yield self._directory.flush()
 
@@ -27,7 +27,7 @@ from twext.who.expression import (
 )
 from twext.who.idirectory import RecordType as BaseRecordType, FieldName as BaseFieldName
 from twisted.cred.credentials import UsernamePassword
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, DeferredList
 from twistedcaldav.config import config
 from twistedcaldav.ical import Property
 from txdav.caldav.datastore.scheduling.utils import normalizeCUAddr
@@ -133,6 +133,74 @@ class CalendarDirectoryServiceMixin(object):
 
         returnValue(None)
 
+    @inlineCallbacks
+    def recordsWithUIDs(self, uids, timeoutSeconds=None):
+        """
+        Look up the records for a number of UIDs at once. Services that can
+        do this more efficiently than one lookup per UID override this.
+
+        @param uids: the UIDs to look up
+        @type uids: iterable of C{unicode}
+
+        @return: map of each UID to its record, or C{None} if there is no
+            record for that UID
+        @rtype: C{dict}
+        @raise: the error from any of the lookups that failed
+        """
+        results = yield self._lookupMultiple(
+            uids, self.recordWithUID, timeoutSeconds
+        )
+        returnValue(results)
+
+    @inlineCallbacks
+    def recordsWithCalendarUserAddresses(self, addresses, timeoutSeconds=None):
+        """
+        Look up the records for a number of calendar user addresses at once.
+        Services that can do this more efficiently than one lookup per address
+        override this.
+
+        @param addresses: the calendar user addresses to look up
+        @type addresses: iterable of C{unicode}
+
+        @return: map of each address to its record, or C{None} if there is no
+            (calendar enabled) record for that address
+        @rtype: C{dict}
+        @raise: the error from any of the lookups that failed
+        """
+        results = yield self._lookupMultiple(
+            addresses, self.recordWithCalendarUserAddress, timeoutSeconds
+        )
+        returnValue(results)
+
+    @inlineCallbacks
+    def _lookupMultiple(self, keys, lookup, timeoutSeconds):
+        """
+        Run a single record lookup for each of the keys concurrently. If any
+        lookup fails, the whole batch fails with that error rather than
+        reporting the key as having no record, which callers would take to
+        mean the record does not exist.
+        """
+        keys = list(set(keys))
+        results = yield DeferredList(
+            [lookup(key, timeoutSeconds=timeoutSeconds) for key in keys],
+            consumeErrors=True,
+        )
+        records = {}
+        failure = None
+        for key, (success, result) in zip(keys, results):
+            if success:
+                records[key] = result
+            else:
+                log.error(
+                    "Failed to look up directory record for {key}: {f}",
+                    key=key, f=result
+                )
+                if failure is None:
+                    failure = result
+        if failure is not None:
+            failure.raiseException()
+        returnValue(records)
+
     searchContext_location = "location"
     searchContext_resource = "resource"
     searchContext_user = "user"
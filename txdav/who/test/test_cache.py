@@ -18,14 +18,15 @@
 Caching service tests
 """
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, Deferred, succeed
 
 from twistedcaldav.config import config
+from twistedcaldav.memcacheclient import ClientFactory
 from twistedcaldav.test.util import StoreTestCase
 
 from txdav.dps.client import DirectoryService as DPSClientDirectoryService
 from txdav.who.cache import (
-    CachingDirectoryService, IndexType
+    CachingDirectoryService, DirectoryMemcacher, IndexType
 )
 from twext.who.idirectory import (
     RecordType
@@ -33,6 +34,9 @@ from twext.who.idirectory import (
 from txdav.who.idirectory import (
     RecordType as CalRecordType
 )
+from txdav.who.test.support import (
+    TestRecord, CalendarInMemoryDirectoryService
+)
 
 import uuid
 
@@ -40,6 +44,37 @@ import uuid
 LOOKUPS_BETWEEN_PURGES = 20
 
 
+class PendingMemcacheProtocol(object):
+    """
+    A memcache client protocol whose get requests only complete when the test
+    says so.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.requests = []
+        self.pending = []
+
+    def get_multi(self, keys, withIdentifier=False):
+        self.requests.append(("get", keys))
+        d = Deferred()
+        d.addCallback(lambda _ignore: dict([
+            (key, (0, self.values[key])) for key in keys if key in self.values
+        ]))
+        self.pending.append(d)
+        return d
+
+    def set_multi(self, values, expireTime=0):
+        self.requests.append(("set", values.keys()))
+        self.values.update(values)
+        return succeed(dict([(key, True) for key in values]))
+
+    def respond(self):
+        pending, self.pending = self.pending, []
+        for d in pending:
+            d.callback(None)
+
+
 class CacheTest(StoreTestCase):
 
     @inlineCallbacks
@@ -367,3 +402,101 @@ class CacheTest(StoreTestCase):
         key2 = dir._memcacher.generateMemcacheKey(IndexType.uid, "abc")
 
         self.assertNotEqual(key1, key2)
+
+    @inlineCallbacks
+    def test_boundedCache(self):
+        """
+        Verify the in-process cache for each index holds no more than the
+        maximum number of records, discarding the least recently used.
+        """
+
+        dir = self.cachingDirectory
+        dir._maxRecords = 2
+        dir.resetCache()
+
+        yield dir.recordWithUID(u"cache-uid-1")
+        yield dir.recordWithUID(u"cache-uid-2")
+        yield dir.recordWithUID(u"cache-uid-1")
+        self.assertEquals(dir._hitCount, 1)
+
+        yield dir.recordWithUID(u"cache-uid-duplicate-1")
+        self.assertEquals(len(dir._cache[IndexType.uid]), 2)
+        self.assertTrue(u"cache-uid-1" in dir._cache[IndexType.uid])
+        self.assertFalse(u"cache-uid-2" in dir._cache[IndexType.uid])
+        self.assertTrue(u"cache-uid-duplicate-1" in dir._cache[IndexType.uid])
+
+    @inlineCallbacks
+    def test_memcacheNonBlocking(self):
+        """
+        Verify memcache is only used via the asynchronous client: a lookup that
+        misses the in-process cache waits for a single memcache request for both
+        the record and negative entries, without blocking the reactor.
+        """
+
+        def _noSyncClient(*args, **kwds):
+            self.fail("Synchronous memcache client used")
+        self.patch(ClientFactory, "getClient", _noSyncClient)
+
+        directory = CalendarInMemoryDirectoryService(None)
+        yield directory.updateRecords([
+            TestRecord(
+                directory,
+                {
+                    directory.fieldName.uid: u"cache-uid-1",
+                    directory.fieldName.shortNames: (u"cache-name-1",),
+                    directory.fieldName.recordType: RecordType.user,
+                }
+            ),
+        ], create=True)
+
+        dir = CachingDirectoryService(directory, expireSeconds=10)
+        dir._memcacher = DirectoryMemcacher(10, directory, directory.realmName, "b")
+        memcache = PendingMemcacheProtocol()
+        dir._memcacher._memcacher._memcacheProtocol = memcache
+
+        # Not in memcache, so looked up in the directory and then stored in
+        # memcache under each index in one request
+        d = dir.recordWithUID(u"cache-uid-1")
+        self.assertFalse(d.called)
+        self.assertEquals(len(memcache.requests), 1)
+        self.assertEquals(memcache.requests[0][0], "get")
+        self.assertEquals(len(memcache.requests[0][1]), 2)
+        memcache.respond()
+        record = yield d
+        self.assertEquals(record.uid, u"cache-uid-1")
+        self.assertEquals(memcache.requests[-1][0], "set")
+        self.assertEquals(len(memcache.requests), 2)
+        self.assertEquals(dir.cacheStats()["misses"], 1)
+        self.assertEquals(dir.cacheStats()["queries"], 1)
+
+        # With the in-process cache empty, the record now comes from memcache
+        for cache in dir._cache.values():
+            cache.clear()
+        d = dir.recordWithUID(u"cache-uid-1")
+        self.assertFalse(d.called)
+        memcache.respond()
+        record = yield d
+        self.assertEquals(record.uid, u"cache-uid-1")
+        self.assertEquals(dir.cacheStats()["memcache-hits"], 1)
+        self.assertEquals(dir.cacheStats()["queries"], 1)
+
+        # And is cached in process again
+        record = yield dir.recordWithShortName(RecordType.user, u"cache-name-1")
+        self.assertEquals(record.uid, u"cache-uid-1")
+        self.assertEquals(dir.cacheStats()["hits"], 1)
+        self.assertEquals(len(memcache.pending), 0)
+
+        # A missing record is negatively cached in memcache too
+        d = dir.recordWithUID(u"negative-uid-1")
+        memcache.respond()
+        record = yield d
+        self.assertTrue(record is None)
+        self.assertEquals(dir.cacheStats()["queries"], 2)
+        for cache in dir._negativeCache.values():
+            cache.clear()
+        d = dir.recordWithUID(u"negative-uid-1")
+        memcache.respond()
+        record = yield d
+        self.assertTrue(record is None)
+        self.assertEquals(dir.cacheStats()["negative-hits"], 1)
+        self.assertEquals(dir.cacheStats()["queries"], 2)
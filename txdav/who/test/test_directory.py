@@ -19,12 +19,14 @@
 Directory tests
 """
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, succeed, fail
 from twistedcaldav.config import config
 from twistedcaldav.test.util import StoreTestCase
 from twext.who.directory import DirectoryRecord
 from twext.who.idirectory import FieldName, RecordType
-from txdav.who.directory import CalendarDirectoryRecordMixin, AutoScheduleMode
+from txdav.who.directory import (
+    CalendarDirectoryRecordMixin, CalendarDirectoryServiceMixin, AutoScheduleMode
+)
 from twext.who.expression import (
     MatchType, MatchFlags, MatchExpression
 )
@@ -36,6 +38,10 @@ class TestDirectoryRecord(DirectoryRecord, CalendarDirectoryRecordMixin):
     pass
 
 
+class TestDirectoryService(CalendarDirectoryServiceMixin):
+    pass
+
+
 class DirectoryTestCase(StoreTestCase):
 
     @inlineCallbacks
@@ -55,6 +61,27 @@ class DirectoryTestCase(StoreTestCase):
             set([r.displayName for r in expanded])
         )
 
+    @inlineCallbacks
+    def test_lookupMultipleFailure(self):
+        """
+        A batch lookup fails if any of its single lookups fails, rather than
+        reporting that key as having no record.
+        """
+
+        def lookup(key, timeoutSeconds=None):
+            if key == u"bad":
+                return fail(RuntimeError("Directory unavailable"))
+            return succeed(key.upper() if key != u"missing" else None)
+
+        service = TestDirectoryService()
+        records = yield service._lookupMultiple([u"a", u"missing"], lookup, None)
+        self.assertEquals(records, {u"a": u"A", u"missing": None})
+
+        yield self.assertFailure(
+            service._lookupMultiple([u"a", u"bad"], lookup, None),
+            RuntimeError
+        )
+
     def test_canonicalCalendarUserAddress(self):
 
         record = TestDirectoryRecord(
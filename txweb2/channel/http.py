@@ -31,7 +31,7 @@ from cStringIO import StringIO
 
 from zope.interface import implements
 
-from twisted.internet import interfaces, protocol, reactor
+from twisted.internet import abstract, interfaces, protocol, reactor
 from twisted.internet.defer import succeed, Deferred
 from twisted.protocols import policies, basic
 
@@ -39,6 +39,7 @@ from twext.python.log import Logger
 from txweb2 import responsecode
 from txweb2 import http_headers
 from txweb2 import http
+from txweb2 import stream
 from txweb2.auth.tls import TLSCredentials
 from txweb2.http import RedirectResponse
 from txweb2.server import Request
@@ -584,6 +585,58 @@ class HTTPChannelRequest(HTTPParser):
         else:
             self.transport.write(data)
 
+    # The parts of Twisted's FileDescriptor, some of them private, that
+    # writeSendfile relies on to share the socket with the transport's buffer
+    _sendfileTransportAttributes = (
+        "dataBuffer", "_tempDataBuffer", "producerPaused", "startWriting", "fileno",
+    )
+
+    def canSendfile(self):
+        """
+        Whether response data can be written straight from a file to the
+        connection's socket with C{sendfile}. That needs a plain TCP transport
+        that this request is writing to directly, and an unencoded body. The
+        transport must also still look the way L{writeSendfile} expects it to,
+        otherwise the normal write path is used.
+        """
+        return (
+            config.EnableSendfile and
+            stream.osSendfile is not None and
+            not self.queued and
+            not self.chunkedOut and
+            not self.channel._secure and
+            isinstance(self.transport, abstract.FileDescriptor) and
+            interfaces.ISSLTransport(self.transport, None) is None and
+            all([hasattr(self.transport, name) for name in self._sendfileTransportAttributes]) and
+            isinstance(self.transport.dataBuffer, str) and
+            isinstance(self.transport._tempDataBuffer, list)
+        )
+
+    def writeSendfile(self, sendfileBuffer):
+        """
+        Write as much of a file region to the socket as it will take.
+
+        Data written with C{write} is buffered by the transport, so nothing is
+        sent directly until that buffer has drained. In either case the
+        transport is left to resume the producer once the socket is writable,
+        just as it does when its own buffer drains.
+
+        @param sendfileBuffer: the file region to write
+        @type sendfileBuffer: L{stream.SendfileBuffer}
+
+        @return: C{True} if the whole region has been written, C{False} if
+            the producer will be resumed to write the rest
+        @rtype: C{bool}
+        """
+        transport = self.transport
+        if not (transport.dataBuffer or transport._tempDataBuffer):
+            sendfileBuffer.sendTo(transport.fileno())
+            if sendfileBuffer.remaining == 0:
+                return True
+            transport.startWriting()
+        transport.producerPaused = True
+        return False
+
     def finish(self):
         """We are finished writing data."""
         if self.finished:
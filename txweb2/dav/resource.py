@@ -829,33 +829,11 @@ class DAVResource (DAVPropertyMixIn, StaticRenderMixin):
 
         acl = self.fullAccessControlList(acl, inherited_aces)
 
-        pending = list(privileges)
-        denied = []
-
-        for ace in acl.children:
-            for privilege in tuple(pending):
-                if not self.matchPrivilege(
-                    element.Privilege(privilege), ace.privileges, privyset
-                ):
-                    continue
-
-                match = (yield self.matchPrincipal(
-                    principal, ace.principal, request
-                ))
-
-                if match:
-                    if ace.invert:
-                        continue
-                else:
-                    if not ace.invert:
-                        continue
-
-                pending.remove(privilege)
+        denied = (yield self.deniedPrivileges(
+            request, acl, privyset, principal, privileges
+        ))
 
-                if not ace.allow:
-                    denied.append(privilege)
-
-        returnValue(len(denied) + len(pending) == 0)
+        returnValue(len(denied) == 0)
 
     def fullAccessControlList(self, acl, inherited_aces):
         """
@@ -1393,42 +1371,111 @@ class DAVResource (DAVPropertyMixIn, StaticRenderMixin):
                 errors.append((uri, list(privileges)))
                 continue
 
-            pending = list(privileges)
-            denied = []
+            denied = (yield self.deniedPrivileges(
+                request, acl, supportedPrivs, principal, privileges
+            ))
 
-            for ace in acl.children:
-                for privilege in tuple(pending):
-                    if not self.matchPrivilege(
-                        element.Privilege(privilege),
-                        ace.privileges, supportedPrivs
-                    ):
-                        continue
+            if denied:
+                errors.append((uri, denied))
 
-                    match = (
-                        yield self.matchPrincipal(principal, ace.principal, request)
-                    )
+        if errors:
+            raise AccessDeniedError(errors,)
 
-                    if match:
-                        if ace.invert:
-                            continue
-                    else:
-                        if not ace.invert:
-                            continue
+        returnValue(None)
 
-                    pending.remove(privilege)
+    @inlineCallbacks
+    def deniedPrivileges(
+        self, request, acl, supportedPrivs, principal, privileges
+    ):
+        """
+        Determine which of the given privileges an ACL denies to a
+        principal.
 
-                    if not ace.allow:
-                        denied.append(privilege)
+        The result is remembered for the rest of the request, keyed by
+        the parts of each ACE that the evaluation depends on, so that
+        the many children of a collection that end up with identical
+        ACLs (for example in a multiget or query report) are only
+        evaluated once.
 
-            denied += pending  # If no matching ACE, then denied
+        @param request: the request being processed.
+        @param acl: the L{element.ACL} to evaluate.
+        @param supportedPrivs: the L{element.SupportedPrivilegeSet} of
+            the resource the ACL belongs to.
+        @param principal: the L{element.Principal} to check privileges
+            for.
+        @param privileges: an iterable of L{WebDAVElement} elements
+            denoting access control privileges.
+        @return: a L{Deferred} that callbacks with a C{list} of the
+            privileges that are denied, either explicitly or because no
+            ACE grants them.
+        """
+        if not hasattr(request, "aclEvaluations"):
+            request.aclEvaluations = {}
+
+        cache_key = (
+            tuple([self._aceCacheKey(ace) for ace in acl.children]),
+            supportedPrivs,
+            str(principal.children[0]),
+            tuple(privileges),
+        )
 
-            if denied:
-                errors.append((uri, denied))
+        denied = request.aclEvaluations.get(cache_key, None)
+        if denied is not None:
+            returnValue(list(denied))
 
-        if errors:
-            raise AccessDeniedError(errors,)
+        pending = list(privileges)
+        denied = []
 
-        returnValue(None)
+        for ace in acl.children:
+            for privilege in tuple(pending):
+                if not self.matchPrivilege(
+                    element.Privilege(privilege),
+                    ace.privileges, supportedPrivs
+                ):
+                    continue
+
+                match = (
+                    yield self.matchPrincipal(principal, ace.principal, request)
+                )
+
+                if match:
+                    if ace.invert:
+                        continue
+                else:
+                    if not ace.invert:
+                        continue
+
+                pending.remove(privilege)
+
+                if not ace.allow:
+                    denied.append(privilege)
+
+        denied += pending  # If no matching ACE, then denied
+
+        request.aclEvaluations[cache_key] = denied
+        returnValue(list(denied))
+
+    @staticmethod
+    def _aceCacheKey(ace):
+        """
+        Build a cheap key for the parts of an ACE that L{deniedPrivileges}
+        uses. Privileges and well-known principals are empty elements, which
+        are singletons and hash by name. Any other element is kept as itself:
+        it is held by the key, so its identity cannot be reused, and at worst
+        an equivalent copy misses the cache.
+        """
+        principal = ace.principal.children[0]
+        if isinstance(principal, WebDAVTextElement):
+            principal = (principal.sname(), str(principal))
+        return (
+            ace.invert,
+            ace.allow,
+            principal,
+            tuple([
+                privilege.children[0] if len(privilege.children) == 1 else privilege
+                for privilege in ace.privileges
+            ]),
+        )
 
     def supportedPrivileges(self, request):
         """
@@ -1599,8 +1646,25 @@ class DAVResource (DAVPropertyMixIn, StaticRenderMixin):
                     aces.append(element.ACE(*children))
             return aces
 
+        # Several reports and the children they find may ask for the same
+        # inherited ACEs, so remember them for the rest of the request
+        if not hasattr(request, "inheritedACEs"):
+            request.inheritedACEs = {}
+        try:
+            cache_key = request.urlForResource(self)
+        except NoURLForResourceError:
+            cache_key = None
+        if cache_key is not None and cache_key in request.inheritedACEs:
+            return succeed(request.inheritedACEs[cache_key])
+
+        def cache(aces):
+            if cache_key is not None:
+                request.inheritedACEs[cache_key] = aces
+            return aces
+
         d = self.accessControlList(request, inheritance=True, expanding=True)
         d.addCallback(gotACL)
+        d.addCallback(cache)
         return d
 
     def inheritedACLSet(self):
@@ -22,7 +22,8 @@
 # DRI: Wilfredo Sanchez, wsanchez@apple.com
 ##
 
-from twisted.internet.defer import DeferredList, waitForDeferred, deferredGenerator, succeed
+from twisted.internet.defer import DeferredList, waitForDeferred, deferredGenerator, succeed, \
+    inlineCallbacks
 from twisted.cred.portal import Portal
 from twisted.python.log import addObserver, removeObserver
 from txweb2 import responsecode
@@ -312,6 +313,50 @@ class AccessTests(TestCase):
 
         return DeferredList(ds)
 
+    @inlineCallbacks
+    def test_checkPrivilegesCached(self):
+        """
+        L{DAVResource.checkPrivileges} evaluates each distinct ACL only once per
+        request, so resources with identical ACLs share the result.
+        """
+        acl = davxml.ACL(
+            davxml.ACE(
+                davxml.Principal(davxml.HRef("/users/gooduser")),
+                davxml.Grant(davxml.Privilege(davxml.Read())),
+            ),
+            davxml.ACE(
+                davxml.Principal(davxml.HRef("/users/baduser")),
+                davxml.Grant(davxml.Privilege(davxml.Write())),
+            ),
+        )
+        resources = [TestResource("/child%d" % (i,)) for i in range(3)]
+        for resource in resources:
+            resource.setAccessControlList(acl)
+
+        matches = []
+
+        def matchPrincipal(resource, principal1, principal2, request):
+            matches.append(principal2)
+            return succeed(str(principal2.children[0]) == "/users/gooduser")
+        self.patch(TestResource, "matchPrincipal", matchPrincipal)
+
+        request = SimpleRequest(self.site, "GET", "/")
+        request.authzUser = request.authnUser = self.rootresource.principalForUser("gooduser")
+        for resource in resources:
+            yield resource.checkPrivileges(request, (davxml.Read(),))
+        self.assertEquals(len(matches), 1)
+
+        # Different privileges are evaluated separately
+        try:
+            yield resources[0].checkPrivileges(request, (davxml.Write(),))
+        except AccessDeniedError, e:
+            self.assertEquals(e.errors, [(None, [davxml.Write()])])
+        else:
+            self.fail("Write privilege was not denied")
+        self.assertEquals(len(matches), 2)
+        yield resources[1].checkPrivileges(request, (davxml.Read(),))
+        self.assertEquals(len(matches), 2)
+
     def test_authorize(self):
         """
         Authorizing a known user with the correct password will not raise an
@@ -56,6 +56,7 @@ consumer which is a stream, so that other producers can write to it.
 from __future__ import generators
 
 import copy
+import errno
 import os
 import types
 import sys
@@ -81,6 +82,36 @@ else:
     mmap = None
 
 
+def _libcSendfile():
+    """
+    Python 2 has no C{os.sendfile}, so on Linux call the C library's
+    C{sendfile64} directly.
+
+    @return: a function with the same signature as C{os.sendfile}, or C{None}
+        if C{sendfile} is not available
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        libcSendfile = libc.sendfile64
+    except (ImportError, OSError, AttributeError):
+        return None
+    libcSendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    libcSendfile.restype = ctypes.c_ssize_t
+
+    def sendfile(outFD, inFD, offset, count):
+        result = libcSendfile(outFD, inFD, ctypes.byref(ctypes.c_int64(offset)), count)
+        if result < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return result
+    return sendfile
+
+osSendfile = getattr(os, "sendfile", None) or _libcSendfile()
+
+
 #
 # Interfaces
 #
@@ -187,6 +218,49 @@ SENDFILE_LIMIT = 16777216
 SENDFILE_THRESHOLD = 256
 
 
+class SendfileBuffer(object):
+    """
+    A region of a file to be written directly to a socket with C{sendfile},
+    returned by L{ISendfileableStream.read} in place of the data itself.
+    """
+
+    def __init__(self, f, offset, length):
+        self.f = f
+        self.offset = offset
+        self.length = length
+        self.sent = 0
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def remaining(self):
+        return self.length - self.sent
+
+    def sendTo(self, fd):
+        """
+        Write as much of the remaining region as the socket will take without
+        blocking.
+
+        @param fd: the file descriptor of a non-blocking socket
+        @type fd: C{int}
+
+        @return: the number of bytes written, which is zero if the socket
+            cannot take any more at present
+        @rtype: C{int}
+        """
+        try:
+            written = osSendfile(fd, self.f.fileno(), self.offset + self.sent, self.remaining)
+        except (OSError, IOError), e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return 0
+            raise
+        if written == 0:
+            raise RuntimeError("Ran out of data sending file %r, expected %d more bytes" % (self.f, self.remaining))
+        self.sent += written
+        return written
+
+
 def mmapwrapper(*args, **kwargs):
     """
     Python's mmap call sucks and ommitted the "offset" argument for no
@@ -233,15 +307,12 @@ class FileStream(SimpleStream):
             self.f = None
             return None
 
-        # if sendfile and length > SENDFILE_THRESHOLD:
-        #    # XXX: Yay using non-existent sendfile support!
-        #    # FIXME: if we return a SendfileBuffer, and then sendfile
-        #    #        fails, then what? Or, what if file is too short?
-        #    readSize = min(length, SENDFILE_LIMIT)
-        #    res = SendfileBuffer(self.f, self.start, readSize)
-        #    self.length -= readSize
-        #    self.start += readSize
-        #    return res
+        if sendfile and length > SENDFILE_THRESHOLD and osSendfile is not None:
+            readSize = min(length, SENDFILE_LIMIT)
+            res = SendfileBuffer(self.f, self.start, readSize)
+            self.length -= readSize
+            self.start += readSize
+            return res
 
         if self.useMMap and length > MMAP_THRESHOLD:
             readSize = min(length, MMAP_LIMIT)
@@ -755,13 +826,21 @@ class ProducerStream(object):
 
 
 class StreamProducer(object):
-    """A push producer which gets its data by reading a stream."""
+    """A push producer which gets its data by reading a stream.
+
+    If the consumer has a C{writeSendfile} method, and its C{canSendfile}
+    method returns C{True}, the stream is asked for L{SendfileBuffer}s which
+    are handed to C{writeSendfile} rather than written. That returns C{True}
+    once the buffer has been written, or C{False} if it will call
+    C{resumeProducing} when the rest of the buffer can be written."""
     implements(ti_interfaces.IPushProducer)
 
     deferred = None
     finishedCallback = None
     paused = False
     consumer = None
+    sendfile = False
+    sendfileBuffer = None
 
     def __init__(self, stream, enforceStr=True):
         self.stream = stream
@@ -772,6 +851,7 @@ class StreamProducer(object):
             return defer.succeed(None)
 
         self.consumer = consumer
+        self.sendfile = ISendfileableStream.providedBy(self.stream) and getattr(consumer, "canSendfile", lambda: False)()
         finishedCallback = self.finishedCallback = Deferred()
         self.consumer.registerProducer(self, True)
         self.resumeProducing()
@@ -782,8 +862,15 @@ class StreamProducer(object):
         if self.deferred is not None:
             return
 
+        if self.sendfileBuffer is not None:
+            self._doSendfile()
+            return
+
         try:
-            data = self.stream.read()
+            if self.sendfile:
+                data = self.stream.read(sendfile=True)
+            else:
+                data = self.stream.read()
         except:
             self.stopProducing(Failure())
             return
@@ -807,6 +894,11 @@ class StreamProducer(object):
             return
 
         self.deferred = None
+        if isinstance(data, SendfileBuffer):
+            self.sendfileBuffer = data
+            self._doSendfile()
+            return
+
         if self.enforceStr:
             # XXX: sucks that we have to do this. make transport.write(buffer) work!
             data = str(buffer(data))
@@ -815,6 +907,18 @@ class StreamProducer(object):
         if not self.paused:
             self.resumeProducing()
 
+    def _doSendfile(self):
+        try:
+            done = self.consumer.writeSendfile(self.sendfileBuffer)
+        except:
+            self.stopProducing(Failure())
+            return
+
+        if done:
+            self.sendfileBuffer = None
+            if not self.paused:
+                self.resumeProducing()
+
     def pauseProducing(self):
         self.paused = True
 
@@ -831,7 +935,7 @@ class StreamProducer(object):
         if self.stream is not None:
             self.stream.close()
 
-        self.finishedCallback = self.deferred = self.consumer = self.stream = None
+        self.finishedCallback = self.deferred = self.consumer = self.stream = self.sendfileBuffer = None
 
 
 #
@@ -1191,6 +1295,6 @@ class MD5Stream(SimpleStream):
 
 
 __all__ = ['IStream', 'IByteStream', 'FileStream', 'MemoryStream', 'CompoundStream',
-           'readAndDiscard', 'fallbackSplit', 'ProducerStream', 'StreamProducer',
+           'SendfileBuffer', 'readAndDiscard', 'fallbackSplit', 'ProducerStream', 'StreamProducer',
            'BufferedStream', 'MD5Stream', 'readStream', 'ProcessStreamer', 'readIntoFile',
            'generatorToStream']
@@ -2,7 +2,9 @@
 from __future__ import nested_scopes
 
 import os
+import socket
 import sys
+import tempfile
 import time
 
 from zope.interface import implements
@@ -11,14 +13,16 @@ from twisted.trial import unittest
 from txweb2 import http, http_headers, responsecode, iweb, stream
 from txweb2 import channel
 
-from twisted.internet import reactor, protocol, address, interfaces, utils
+from twisted.internet import reactor, protocol, address, interfaces, utils, abstract
 from twisted.internet import defer
 from twisted.internet.defer import waitForDeferred, deferredGenerator
 from twisted.protocols import loopback
 from twisted.python import util, runtime
-from txweb2.channel.http import SSLRedirectRequest, HTTPFactory, HTTPChannel
+from txweb2.channel.http import SSLRedirectRequest, HTTPFactory, HTTPChannel, \
+    HTTPChannelRequest
 from twisted.internet.task import deferLater
 from twext.internet.ssl import ChainingOpenSSLContextFactory
+from twistedcaldav.config import config
 
 
 class RedirectResponseTestCase(unittest.TestCase):
@@ -1172,6 +1176,113 @@ class PipelinedErrorTestCase(ErrorTestCase):
         ErrorTestCase.checkError(self, cxn, code)
 
 
+class SocketPairTransport(abstract.FileDescriptor):
+    """
+    A transport that writes to one end of a socket pair, without being
+    added to the reactor.
+    """
+
+    def __init__(self, sock):
+        abstract.FileDescriptor.__init__(self)
+        self.sock = sock
+        self.connected = True
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def writeSomeData(self, data):
+        return self.sock.send(data)
+
+    def startWriting(self):
+        pass
+
+    def stopWriting(self):
+        pass
+
+
+class SendfileChannel(object):
+    _secure = False
+
+    def __init__(self, transport):
+        self.transport = transport
+
+
+class ResumeCounter(object):
+    resumed = 0
+
+    def resumeProducing(self):
+        self.resumed += 1
+
+    def pauseProducing(self):
+        pass
+
+    def stopProducing(self):
+        pass
+
+
+class SendfileTestCase(unittest.TestCase):
+    """
+    Tests for writing response bodies with C{sendfile}.
+    """
+    text = "1234567890" * 100
+
+    def setUp(self):
+        self.patch(config, "EnableSendfile", True)
+        f = tempfile.TemporaryFile("w+")
+        f.write(self.text)
+        f.flush()
+        self.f = f
+        self.addCleanup(f.close)
+        self.sockets = socket.socketpair()
+        self.addCleanup(self.sockets[0].close)
+        self.addCleanup(self.sockets[1].close)
+        self.transport = SocketPairTransport(self.sockets[0])
+        self.request = HTTPChannelRequest(SendfileChannel(self.transport))
+
+    def receive(self, length):
+        data = []
+        while length:
+            data.append(self.sockets[1].recv(length))
+            length -= len(data[-1])
+        return "".join(data)
+
+    def test_bufferedDataFirst(self):
+        """
+        Data already buffered by the transport is written before any of the
+        file, and the producer is resumed to send the file once the buffer has
+        drained.
+        """
+        self.assertTrue(self.request.canSendfile())
+        producer = ResumeCounter()
+        self.transport.registerProducer(producer, True)
+        self.request.write("HTTP/1.1 200 OK\r\n\r\n")
+
+        sendfileBuffer = stream.SendfileBuffer(self.f, 0, len(self.text))
+        self.assertFalse(self.request.writeSendfile(sendfileBuffer))
+        self.assertEquals(sendfileBuffer.sent, 0)
+        self.assertTrue(self.transport.producerPaused)
+
+        self.transport.doWrite()
+        self.assertEquals(producer.resumed, 1)
+        while not self.request.writeSendfile(sendfileBuffer):
+            self.transport.doWrite()
+        self.assertEquals(
+            self.receive(19 + len(self.text)),
+            "HTTP/1.1 200 OK\r\n\r\n" + self.text
+        )
+
+    def test_unexpectedTransport(self):
+        """
+        A transport without the buffer that C{writeSendfile} expects uses the
+        normal write path.
+        """
+        del self.transport._tempDataBuffer
+        self.assertFalse(self.request.canSendfile())
+
+    if stream.osSendfile is None:
+        skip = "sendfile not supported here"
+
+
 class SimpleFactory(channel.HTTPFactory):
 
     def buildProtocol(self, addr):
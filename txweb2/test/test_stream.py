@@ -7,6 +7,7 @@ Tests for the stream implementations in L{txweb2}.
 
 from hashlib import md5
 import os
+import socket
 import sys
 import tempfile
 
@@ -140,6 +141,95 @@ class MMapFileStreamTest(SimpleStreamTests, unittest.TestCase):
         test_mmapwrapper.skip = 'mmap not supported here'
 
 
+class SendfileConsumer(object):
+    """
+    A consumer that writes L{stream.SendfileBuffer}s to a socket.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.written = []
+        self.producer = None
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def write(self, data):
+        self.written.append(data)
+
+    def canSendfile(self):
+        return True
+
+    def writeSendfile(self, sendfileBuffer):
+        self.written.append(sendfileBuffer)
+        while sendfileBuffer.remaining:
+            sendfileBuffer.sendTo(self.sock.fileno())
+        return True
+
+
+class SendfileFileStreamTest(unittest.TestCase):
+    text = "1234567890" * 100
+
+    def setUp(self):
+        """
+        Create a file containing C{self.text} and a connected pair of sockets
+        to send it over.
+        """
+        f = tempfile.TemporaryFile('w+')
+        f.write(self.text)
+        f.flush()
+        f.seek(0, 0)
+        self.f = f
+        self.sockets = socket.socketpair()
+        self.addCleanup(self.sockets[0].close)
+        self.addCleanup(self.sockets[1].close)
+
+    def receive(self, length):
+        data = []
+        while length:
+            data.append(self.sockets[1].recv(length))
+            length -= len(data[-1])
+        return "".join(data)
+
+    def test_sendfileBuffer(self):
+        """
+        L{stream.FileStream.read} returns a L{stream.SendfileBuffer} when asked
+        for one, which writes the requested part of the file to a socket.
+        """
+        s = stream.FileStream(self.f, 100, 500)
+        buf = s.read(sendfile=True)
+        self.assertTrue(isinstance(buf, stream.SendfileBuffer))
+        self.assertEquals(len(buf), 500)
+        self.assertEquals(s.read(sendfile=True), None)
+
+        while buf.remaining:
+            buf.sendTo(self.sockets[0].fileno())
+        self.assertEquals(self.receive(500), self.text[100:600])
+
+    def test_sendfileProducer(self):
+        """
+        L{stream.StreamProducer} hands L{stream.SendfileBuffer}s to a consumer
+        that can send them, and ordinary data to one that cannot.
+        """
+        consumer = SendfileConsumer(self.sockets[0])
+        d = stream.StreamProducer(stream.FileStream(self.f)).beginProducing(consumer)
+        self.assertEquals(len(consumer.written), 1)
+        self.assertTrue(isinstance(consumer.written[0], stream.SendfileBuffer))
+        self.assertEquals(self.receive(len(self.text)), self.text)
+
+        consumer = SendfileConsumer(self.sockets[0])
+        consumer.canSendfile = lambda: False
+        stream.StreamProducer(stream.FileStream(self.f)).beginProducing(consumer)
+        self.assertEquals("".join(consumer.written), self.text)
+        return d
+
+    if stream.osSendfile is None:
+        skip = "sendfile not supported here"
+
+
 class MemoryStreamTest(SimpleStreamTests, unittest.TestCase):
 
     def makeStream(self, *args, **kw):